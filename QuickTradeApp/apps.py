@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class QuickTradeAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'QuickTradeApp'
+
+    def ready(self):
+        # Log records configured by settings.LOGGING are written by a background thread from here on
+        from .log_pipeline import log_pipeline
+        log_pipeline.start()
+
+        # The shared cache table is read and written by every worker process at once
+        from django.db.backends.signals import connection_created
+        from .shared_cache import enable_wal
+        connection_created.connect(enable_wal, dispatch_uid='quicktrade_enable_wal')
@@ -1,5 +1,5 @@
-# import fyersModel
-from fyers_apiv3 import fyersModel
+from ..broker_clients import fyers_model, get_fyers_client
+from ..circuit_breaker import is_upstream_unavailable
 import urllib.parse
 
 class FyersAuth:
@@ -19,12 +19,8 @@ class FyersAuth:
             if not access_token:
                 return False
                 
-            # Initialize FyersModel with the access token
-            session = fyersModel.FyersModel(
-                token=access_token,
-                is_async=False,
-                client_id=self.client_id
-            )
+            # Shared FyersModel for the token, the profile call is time boxed
+            session = get_fyers_client(self.client_id, access_token)
             
             # Try to get profile to validate token
             response = session.get_profile()
@@ -35,13 +31,15 @@ class FyersAuth:
             else:
                 return False
             
-        except Exception:
+        except Exception as e:
+            if is_upstream_unavailable(e):
+                raise
             return False
             
     def generate_auth_code(self, response_type="code"):
         """Generate Fyers auth code URL"""
         try:
-            session = fyersModel.SessionModel(
+            session = fyers_model().SessionModel(
                 client_id=self.client_id,
                 secret_key=self.client_secret,
                 redirect_uri=self.redirect_uri,
@@ -78,7 +76,7 @@ class FyersAuth:
     def generate_access_token(self, auth_code):
         """Generate access token using auth code"""
         try:
-            session = fyersModel.SessionModel(
+            session = fyers_model().SessionModel(
                 client_id=self.client_id,
                 secret_key=self.client_secret,
                 redirect_uri=self.redirect_uri,
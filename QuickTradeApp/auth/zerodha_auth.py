@@ -1,4 +1,5 @@
-from kiteconnect import KiteConnect
+from ..broker_clients import GuardedClient, kite_connect
+from ..circuit_breaker import is_upstream_unavailable, kite_breaker
 
 class ZerodhaAuth:
     def __init__(self, api_key, api_secret):
@@ -7,7 +8,8 @@ class ZerodhaAuth:
             
         self.api_key = api_key
         self.api_secret = api_secret
-        self.kite = KiteConnect(api_key=api_key)
+        # Profile checks go through the Kite circuit breaker
+        self.kite = GuardedClient(kite_connect()(api_key=api_key), kite_breaker)
         
     def is_token_valid(self, access_token):
         """Check if the token is valid"""
@@ -22,7 +24,9 @@ class ZerodhaAuth:
             profile = self.kite.profile()
             return bool(profile)
             
-        except Exception:
+        except Exception as e:
+            if is_upstream_unavailable(e):
+                raise
             return False
             
     def get_login_url(self):
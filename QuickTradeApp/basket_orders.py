@@ -0,0 +1,125 @@
+"""
+Multi-leg basket orders for QuickTradeApp
+Legs are given as strike offsets from ATM, so a straddle, strangle or spread
+is resolved against a single underlying quote. Buy legs (the hedges) go out
+before sell legs so the short legs get the margin benefit, legs of the same
+side go out concurrently, and the timing skew between legs is reported
+"""
+from typing import Dict, List, Optional
+
+from .metrics import metrics
+
+MAX_LEGS = 6
+MAX_STRIKE_OFFSET = 20  # strikes away from ATM
+MAX_LEG_LOTS = 100
+
+SIDES = ('BUY', 'SELL')
+DIRECTIONS = ('CE', 'PE')
+
+# Strategy presets as (side, direction, strike offset in widths)
+STRATEGIES = {
+    'straddle': (('BUY', 'CE', 0), ('BUY', 'PE', 0)),
+    'strangle': (('BUY', 'CE', 1), ('BUY', 'PE', -1)),
+    'bull_call_spread': (('BUY', 'CE', 0), ('SELL', 'CE', 1)),
+    'bear_put_spread': (('BUY', 'PE', 0), ('SELL', 'PE', -1)),
+    'iron_condor': (('BUY', 'CE', 2), ('BUY', 'PE', -2), ('SELL', 'CE', 1), ('SELL', 'PE', -1)),
+}
+
+metrics.describe('quicktrade_basket_leg_skew_seconds', 'summary',
+                 "Time between the first and the last leg of a basket (ack or fill)")
+metrics.describe('quicktrade_basket_orders_total', 'counter', "Basket orders by outcome")
+
+
+def strategy_legs(strategy: str, lots: int, width: int = 1, side: str = 'BUY') -> List[Dict]:
+    """
+    Legs of a preset strategy
+
+    Args:
+        strategy: Key of STRATEGIES
+        lots: Lots per leg
+        width: Strikes between the legs of strangles, spreads and condors
+        side: SELL turns a straddle or strangle short, spreads and condors
+            keep their own sides
+
+    Raises:
+        ValueError: For an unknown strategy
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy: {strategy}. Use one of {', '.join(STRATEGIES)}")
+    flip = side == 'SELL' and strategy in ('straddle', 'strangle')
+    return [
+        {
+            'side': ('SELL' if leg_side == 'BUY' else 'BUY') if flip else leg_side,
+            'direction': direction,
+            'offset': offset * width,
+            'lots': lots,
+        }
+        for leg_side, direction, offset in STRATEGIES[strategy]
+    ]
+
+
+def normalize_legs(legs: List[Dict]) -> List[Dict]:
+    """
+    Validate leg definitions ({'side', 'direction', 'offset', 'lots'})
+
+    Raises:
+        ValueError: With the first problem found
+    """
+    if not legs:
+        raise ValueError("At least one leg is required")
+    if len(legs) > MAX_LEGS:
+        raise ValueError(f"A basket can have at most {MAX_LEGS} legs")
+
+    normalized = []
+    for position, leg in enumerate(legs, start=1):
+        side = str(leg.get('side', 'BUY')).upper()
+        direction = str(leg.get('direction', '')).upper()
+        try:
+            offset = int(leg.get('offset', 0))
+            lots = int(leg.get('lots', 1))
+        except (TypeError, ValueError):
+            raise ValueError(f"Leg {position}: offset and lots must be whole numbers")
+
+        if side not in SIDES:
+            raise ValueError(f"Leg {position}: side must be BUY or SELL")
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Leg {position}: direction must be CE or PE")
+        if abs(offset) > MAX_STRIKE_OFFSET:
+            raise ValueError(f"Leg {position}: offset must be within {MAX_STRIKE_OFFSET} strikes of ATM")
+        if not 1 <= lots <= MAX_LEG_LOTS:
+            raise ValueError(f"Leg {position}: lots must be between 1 and {MAX_LEG_LOTS}")
+        normalized.append({'side': side, 'direction': direction, 'offset': offset, 'lots': lots})
+    return normalized
+
+
+def submission_waves(legs: List[Dict], hedge_first: bool = True) -> List[List[int]]:
+    """
+    Leg positions grouped into concurrent waves, buys before sells
+
+    Returns:
+        list: One list of leg positions per wave
+    """
+    buys = [position for position, leg in enumerate(legs) if leg['side'] == 'BUY']
+    sells = [position for position, leg in enumerate(legs) if leg['side'] == 'SELL']
+    if not hedge_first or not buys or not sells:
+        return [list(range(len(legs)))]
+    return [buys, sells]
+
+
+def _skew_ms(timestamps: List[float]) -> Optional[float]:
+    if len(timestamps) < 2:
+        return None
+    return round((max(timestamps) - min(timestamps)) * 1000, 1)
+
+
+def leg_skew(legs: List[Dict]) -> Dict:
+    """Ack and fill skew across the legs that were placed"""
+    placed = [leg for leg in legs if leg.get('status') == 'success']
+    skew = {
+        'ack_skew_ms': _skew_ms([leg['acked_at'] for leg in placed if leg.get('acked_at')]),
+        'fill_skew_ms': _skew_ms([leg['filled_at'] for leg in placed if leg.get('filled_at')]),
+    }
+    for stage in ('ack', 'fill'):
+        if skew[f'{stage}_skew_ms'] is not None:
+            metrics.observe('quicktrade_basket_leg_skew_seconds', skew[f'{stage}_skew_ms'] / 1000, {'stage': stage})
+    return skew
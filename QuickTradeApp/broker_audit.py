@@ -0,0 +1,291 @@
+"""
+Broker audit log for QuickTradeApp
+Every call to a broker API through a pooled or auth client (GuardedClient)
+is recorded: upstream, endpoint, account, parameters with credentials
+redacted, latency, outcome, and the order id it concerns. Records go to the
+'quicktrade.audit' logger, so the request thread only queues them (see
+log_pipeline.py).
+
+Layout: data/audit/broker-<pid>.jsonl, one JSON record per line and one file
+per process. A file is rotated at AUDIT_MAX_BYTES into
+broker-<pid>.jsonl.<n>.gz and the newest AUDIT_BACKUPS are kept.
+search() (and `python manage.py search_audit`) finds records by order id and
+time across all of them
+"""
+import gzip
+import inspect
+import json
+import logging
+import os
+import shutil
+import time
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from .single_flight import account_key
+
+AUDIT_DIR = "data/audit"
+
+# Size of a file before it is compressed away, and compressed files kept per process
+AUDIT_MAX_BYTES = 20 * 1024 * 1024
+AUDIT_BACKUPS = 20
+
+# SDK methods that call the broker, per upstream (set_access_token, login_url and the like are local)
+AUDITED_ENDPOINTS = {
+    'kite': {
+        'place_order', 'modify_order', 'cancel_order', 'exit_order', 'orders', 'order_history', 'order_trades',
+        'trades', 'positions', 'holdings', 'margins', 'order_margins', 'basket_order_margins', 'profile',
+        'ltp', 'quote', 'ohlc', 'historical_data', 'instruments', 'generate_session', 'invalidate_access_token',
+    },
+    'fyers': {
+        'quotes', 'optionchain', 'get_profile', 'history', 'funds', 'place_order', 'modify_order',
+        'cancel_order', 'orderbook', 'positions', 'tradebook', 'holdings', 'exit_positions',
+    },
+}
+
+# Endpoints whose full response is kept, reads only record how many items they returned
+RESPONSE_ENDPOINTS = {'place_order', 'modify_order', 'cancel_order', 'exit_order', 'exit_positions',
+                      'generate_session'}
+
+# Parameter and response keys never written to the log
+REDACTED_KEYS = {
+    'access_token', 'api_key', 'api_secret', 'request_token', 'refresh_token', 'public_token', 'enctoken',
+    'secret_key', 'token', 'auth_code', 'password', 'pin', 'totp', 'appIdHash',
+}
+REDACTED = '***'
+
+AUDIT_LOGGER = 'quicktrade.audit'
+
+logger = logging.getLogger(AUDIT_LOGGER)
+
+
+def redact(value):
+    """Copy of a parameter or response with credential fields masked"""
+    if isinstance(value, dict):
+        return {key: REDACTED if key in REDACTED_KEYS else redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+@lru_cache(maxsize=256)
+def _signature(fn: Callable) -> Optional[inspect.Signature]:
+    try:
+        return inspect.signature(fn)
+    except (TypeError, ValueError):
+        return None
+
+
+def _params(method: Callable, args: tuple, kwargs: dict) -> Dict:
+    """Arguments of a call by parameter name"""
+    signature = _signature(getattr(method, '__func__', method))
+    if signature is not None:
+        try:
+            bound = signature.bind_partial(*((None,) + args if hasattr(method, '__func__') else args), **kwargs)
+            params = dict(bound.arguments)
+            params.pop('self', None)
+            return params
+        except TypeError:
+            pass
+    params = dict(kwargs)
+    if args:
+        params['args'] = list(args)
+    return params
+
+
+def _order_id(params: Dict, result) -> Optional[str]:
+    """Order a call concerns: its order_id argument, or the id a placed order got"""
+    order_id = params.get('order_id')
+    if order_id is None and isinstance(params.get('data'), dict):
+        order_id = params['data'].get('id')
+    if order_id is None:
+        if isinstance(result, (str, int)):
+            order_id = result
+        elif isinstance(result, dict):
+            order_id = result.get('order_id') or result.get('id')
+    return None if order_id is None else str(order_id)
+
+
+def _items(result) -> int:
+    """Items a read returned: a list, or the list in a Kite ('net') or Fyers ('d', 'data') response"""
+    if isinstance(result, dict):
+        for key in ('net', 'd', 'data'):
+            if isinstance(result.get(key), (list, dict)):
+                return len(result[key])
+    return len(result)
+
+
+def _outcome(error: Exception) -> str:
+    code = getattr(error, 'error_code', None)
+    return 'unavailable' if code in ('CIRCUIT_OPEN', 'UPSTREAM_TIMEOUT') else 'error'
+
+
+def audited_call(upstream: str, endpoint: str, client, method: Callable, call: Callable, *args, **kwargs):
+    """
+    Run a broker call and queue its audit record
+
+    Args:
+        upstream: 'kite' or 'fyers'
+        endpoint: SDK method name
+        client: SDK client, identifies the account
+        method: The SDK method itself, for parameter names
+        call: What to run (the method or its circuit breaker wrapper)
+    """
+    started = time.perf_counter()
+    result = error = None
+    try:
+        result = call(*args, **kwargs)
+        return result
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        latency = time.perf_counter() - started
+        try:
+            params = _params(method, args, kwargs)
+            entry = {
+                'upstream': upstream,
+                'endpoint': endpoint,
+                'account': account_key(getattr(client, 'api_key', None) or getattr(client, 'client_id', ''),
+                                       getattr(client, 'access_token', None) or getattr(client, 'token', '')),
+                'params': redact(params),
+                'latency_ms': round(latency * 1000, 2),
+            }
+            order_id = _order_id(params, None if error else result)
+            if order_id is not None:
+                entry['order_id'] = order_id
+            if error is not None:
+                entry['outcome'] = _outcome(error)
+                entry['error'] = f"{type(error).__name__}: {error}"
+            elif isinstance(result, dict) and result.get('s') not in (None, 'ok'):
+                # Fyers answers errors as a dict instead of raising
+                entry['outcome'] = 'error'
+                entry['error'] = result.get('message')
+                entry['response'] = redact(result)
+            else:
+                entry['outcome'] = 'ok'
+                if endpoint in RESPONSE_ENDPOINTS:
+                    entry['response'] = redact(result)
+                elif isinstance(result, (list, dict)):
+                    entry['items'] = _items(result)
+            logger.info("%s %s", upstream, endpoint, extra=entry)
+        except Exception:
+            # Never fail a broker call because its record could not be made
+            pass
+
+
+class AuditFileHandler(RotatingFileHandler):
+    """Rotating file per process, rotated files are gzip compressed (by the log writer thread)"""
+
+    def __init__(self, directory: str = AUDIT_DIR, maxBytes: int = AUDIT_MAX_BYTES,
+                 backupCount: int = AUDIT_BACKUPS):
+        self.directory = Path(directory)
+        self._pid = os.getpid()
+        super().__init__(self._path(), maxBytes=maxBytes, backupCount=backupCount, encoding='utf-8', delay=True)
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = _compress
+
+    def _path(self) -> str:
+        return str((self.directory / f"broker-{self._pid}.jsonl").resolve())
+
+    def _open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
+    def emit(self, record: logging.LogRecord):
+        if self._pid != os.getpid():
+            # Forked worker: never share (or rotate) the parent's file
+            self.stream = None
+            self._pid = os.getpid()
+            self.baseFilename = self._path()
+        super().emit(record)
+
+
+def _compress(source: str, destination: str):
+    with open(source, 'rb') as raw, gzip.open(destination, 'wb') as compressed:
+        shutil.copyfileobj(raw, compressed)
+    os.remove(source)
+
+
+def _open_text(path: Path):
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def audit_files(directory: str = AUDIT_DIR) -> List[Path]:
+    """Current and rotated audit files"""
+    root = Path(directory)
+    if not root.is_dir():
+        return []
+    return sorted(root.glob('broker-*.jsonl')) + sorted(root.glob('broker-*.jsonl.*.gz'))
+
+
+def _first_ts(path: Path) -> Optional[float]:
+    try:
+        with _open_text(path) as handle:
+            return json.loads(handle.readline()).get('ts')
+    except (OSError, ValueError, EOFError):
+        return None
+
+
+def _records(path: Path, needle: Optional[str]) -> Iterator[Dict]:
+    try:
+        with _open_text(path) as handle:
+            for line in handle:
+                # Cheap substring test before parsing the line
+                if needle and needle not in line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    except (OSError, EOFError):
+        # A file rotated away while it was read, or a gzip still being written
+        return
+
+
+def search(order_id: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None,
+           endpoint: Optional[str] = None, outcome: Optional[str] = None, limit: int = 1000,
+           directory: str = AUDIT_DIR) -> List[Dict]:
+    """
+    Audit records of every process, oldest first
+
+    Args:
+        order_id: Only records about this order
+        since, until: Epoch seconds bounding the record time
+        endpoint: Only calls of this SDK method
+        outcome: Only calls with this outcome ('ok', 'error', 'unavailable')
+        limit: Most recent records returned at most, 0 for all
+
+    Returns:
+        list: Matching records
+    """
+    order_id = str(order_id) if order_id is not None else None
+    found = []
+    for path in audit_files(directory):
+        try:
+            if since is not None and path.stat().st_mtime < since:
+                # Last written before the window opened
+                continue
+        except OSError:
+            continue
+        if until is not None:
+            first = _first_ts(path)
+            if first is not None and first > until:
+                continue
+        for record in _records(path, f'"{order_id}"' if order_id else None):
+            ts = record.get('ts', 0)
+            if since is not None and ts < since or until is not None and ts > until:
+                continue
+            if order_id is not None and record.get('order_id') != order_id:
+                continue
+            if endpoint is not None and record.get('endpoint') != endpoint:
+                continue
+            if outcome is not None and record.get('outcome') != outcome:
+                continue
+            found.append(record)
+    found.sort(key=lambda record: record.get('ts', 0))
+    return found[-limit:] if limit else found
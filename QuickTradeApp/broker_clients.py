@@ -0,0 +1,219 @@
+"""
+Broker SDK clients for QuickTradeApp
+kiteconnect and fyers_apiv3 take a few hundred milliseconds each to import,
+so they are loaded on first use (or once in the gunicorn master, see
+gunicorn.conf.py). Authenticated clients are pooled per credentials so their
+HTTP connections are reused across requests, their read endpoints go
+through the circuit breaker of their upstream, and every broker call is
+recorded in the audit log (broker_audit.py). The Fyers SDK sends its
+requests without a timeout, so it gets one here: a breaker deadline alone
+can not free the thread of a call stuck on a dead socket
+"""
+import importlib
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Callable, Dict
+
+import requests
+
+from .broker_audit import AUDITED_ENDPOINTS, audited_call
+from .circuit_breaker import ENDPOINT_TIMEOUTS, CircuitBreaker, fyers_breaker, kite_breaker
+from .config import BROKER_AUDIT
+from .paper_broker import is_paper_token, paper_broker
+
+# Authenticated clients kept per pool, least recently used dropped first
+POOL_SIZE = 64
+
+# SDK modules loaded on first use
+SDK_MODULES = ('kiteconnect', 'kiteconnect.exceptions', 'fyers_apiv3.fyersModel')
+
+# (connect, read) socket timeouts of Fyers SDK requests, the read one covers
+# the slowest guarded endpoint
+FYERS_SOCKET_TIMEOUT = (3.05, max(ENDPOINT_TIMEOUTS['fyers'].values()))
+
+_modules: Dict[str, object] = {}
+_modules_lock = threading.Lock()
+
+
+class TimeoutRequests:
+    """The requests module with a default timeout, for SDKs that call requests.get() and the like without one"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return requests.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('put', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('patch', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+
+def _bound_fyers_requests(module):
+    # FyersServiceSync looks up the module global on every call
+    module.requests = TimeoutRequests(FYERS_SOCKET_TIMEOUT)
+
+
+# Run once on the module when it is first loaded
+_ON_LOAD = {'fyers_apiv3.fyersModel': _bound_fyers_requests}
+
+
+def _load(module_name: str):
+    module = _modules.get(module_name)
+    if module is None:
+        with _modules_lock:
+            module = _modules.get(module_name)
+            if module is None:
+                module = importlib.import_module(module_name)
+                if module_name in _ON_LOAD:
+                    _ON_LOAD[module_name](module)
+                _modules[module_name] = module
+    return module
+
+
+def kite_connect():
+    """KiteConnect class"""
+    return _load('kiteconnect').KiteConnect
+
+
+def kite_exceptions():
+    """kiteconnect.exceptions module"""
+    return _load('kiteconnect.exceptions')
+
+
+def fyers_model():
+    """fyers_apiv3.fyersModel module"""
+    return _load('fyers_apiv3.fyersModel')
+
+
+def preload_sdks():
+    """Import every broker SDK now instead of on the first request"""
+    for module_name in SDK_MODULES:
+        _load(module_name)
+
+
+class GuardedClient:
+    """SDK client whose guarded endpoints run through a circuit breaker, and whose broker calls are audited"""
+
+    def __init__(self, client, breaker: CircuitBreaker, audit: bool = BROKER_AUDIT):
+        self._client = client
+        self._breaker = breaker
+        self._audited = AUDITED_ENDPOINTS.get(breaker.upstream, ()) if audit else ()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        call = partial(self._breaker.call, name, attr) if name in self._breaker.timeouts else attr
+        if name in self._audited:
+            return partial(audited_call, self._breaker.upstream, name, self._client, attr, call)
+        return call
+
+
+class ClientPool:
+    """Guarded clients keyed by credentials, built by a replaceable factory"""
+
+    def __init__(self, factory: Callable, breaker: CircuitBreaker, size: int = POOL_SIZE):
+        self.factory = factory
+        self.breaker = breaker
+        self.size = size
+        self._clients: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, *key):
+        """
+        Get the client for a set of credentials, creating it if needed
+
+        Args:
+            *key: Arguments of the factory, also the pool key
+        """
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+
+        client = GuardedClient(self.factory(*key), self.breaker)
+        with self._lock:
+            client = self._clients.setdefault(key, client)
+            while len(self._clients) > self.size:
+                self._clients.popitem(last=False)
+        return client
+
+    def set_factory(self, factory: Callable):
+        """Switch to another factory (e.g. stand-in clients) and drop pooled clients"""
+        with self._lock:
+            self.factory = factory
+            self._clients.clear()
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+def _new_kite_client(api_key: str, access_token: str, timeout=None):
+    kite = kite_connect()(api_key=api_key, timeout=timeout)
+    kite.set_access_token(access_token)
+    return kite
+
+
+def _new_fyers_client(client_id: str, access_token: str):
+    return fyers_model().FyersModel(
+        client_id=client_id,
+        token=access_token,
+        is_async=False,
+        log_path=""
+    )
+
+
+# Global instances
+kite_clients = ClientPool(_new_kite_client, kite_breaker)
+fyers_clients = ClientPool(_new_fyers_client, fyers_breaker)
+
+
+def get_kite_client(api_key: str, access_token: str, timeout=None):
+    """
+    Get an authenticated KiteConnect client
+
+    Args:
+        api_key: Kite API key
+        access_token: Kite access token, or a paper account token
+        timeout: Request timeout in seconds, SDK default if None
+
+    Returns:
+        KiteConnect: Shared client for these credentials, the paper broker
+            client of a paper account token
+    """
+    if is_paper_token(access_token):
+        return paper_broker.client(api_key, access_token)
+    return kite_clients.get(api_key, access_token, timeout)
+
+
+def get_fyers_client(client_id: str, access_token: str):
+    """
+    Get an authenticated FyersModel client
+
+    Args:
+        client_id: Fyers client id (XXXXX-100)
+        access_token: Fyers access token
+
+    Returns:
+        FyersModel: Shared client for these credentials
+    """
+    return fyers_clients.get(client_id, access_token)
@@ -0,0 +1,312 @@
+"""
+Historical candle cache for QuickTradeApp
+OHLCV candles from the Fyers history API are stored per instrument and
+interval as one raw column file per field and read back as memory-mapped
+NumPy arrays. A series only asks the broker for the candles completed since
+it was last checked, so a repeat chart load is a disk read, and range
+queries slice the mapped columns without copying them.
+
+Only completed candles are stored, the candle still forming is left out.
+Worker processes share the files: a series is checked and extended under a
+file lock, after re-reading what the other processes wrote
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .broker_clients import get_fyers_client
+from .instruments import INDEX_SPECS
+from .metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows, a series is then only locked within the process
+    fcntl = None
+
+# Fyers resolution -> candle length in seconds
+INTERVALS = {'1': 60, '5': 300, '15': 900, '60': 3600, 'D': 86400}
+
+# Default and longest lookback of a query per resolution
+DEFAULT_LOOKBACK_DAYS = {'1': 5, '5': 30, '15': 60, '60': 180, 'D': 730}
+MAX_LOOKBACK_DAYS = {'1': 30, '5': 100, '15': 200, '60': 400, 'D': 3650}
+
+# Longest range the history API serves in one call
+MAX_DAYS_PER_CALL = {'D': 366}
+MAX_INTRADAY_DAYS_PER_CALL = 100
+
+# Stored fields, candle start time (epoch seconds) last: a row only counts
+# once every column has it, so a write cut short never misaligns the columns
+COLUMNS = (
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.int64),
+    ('time', np.int64),
+)
+
+# Daily candles start at midnight IST
+IST_OFFSET = 19800  # seconds
+
+metrics.describe('quicktrade_candle_loads_total', 'counter', "Candle queries by where the candles came from")
+metrics.describe('quicktrade_candle_rows_fetched_total', 'counter', "Candles fetched from the broker history API")
+
+
+def fyers_symbol(symbol: str) -> str:
+    """
+    Fyers symbol of an index name or an option trading symbol
+
+    Raises:
+        ValueError: If the symbol does not belong to a supported index
+    """
+    symbol = symbol.strip().upper()
+    if symbol in INDEX_SPECS:
+        return INDEX_SPECS[symbol]['fyers_index_symbol']
+    # Longest name first, so BANKNIFTY options are not taken for NIFTY ones
+    for index in sorted(INDEX_SPECS, key=len, reverse=True):
+        if symbol.startswith(index) and re.fullmatch(r'[A-Z0-9]+', symbol):
+            exchange = 'BSE' if INDEX_SPECS[index]['exchange'] == 'BFO' else 'NSE'
+            return f"{exchange}:{symbol}"
+    raise ValueError(f"Unsupported symbol: {symbol}")
+
+
+def fetch_fyers_candles(client_id: str, access_token: str, symbol: str, interval: str,
+                        range_from: int, range_to: int) -> List[List]:
+    """
+    Candles of a Fyers symbol between two epoch times, in as many calls as the API needs
+
+    Returns:
+        list: [time, open, high, low, close, volume] rows, oldest first
+    """
+    fyers = get_fyers_client(client_id, access_token)
+    span = MAX_DAYS_PER_CALL.get(interval, MAX_INTRADAY_DAYS_PER_CALL) * 86400
+    candles = []
+    start = range_from
+    while start <= range_to:
+        end = min(start + span - 1, range_to)
+        response = fyers.history(data={
+            'symbol': symbol,
+            'resolution': interval,
+            'date_format': '0',
+            'range_from': str(start),
+            'range_to': str(end),
+            'cont_flag': '1',
+        })
+        if response.get('s') == 'ok':
+            candles.extend(response.get('candles') or [])
+        elif response.get('s') != 'no_data':
+            raise Exception(f"Failed to get candles. Response: {response}")
+        start = end + 1
+    return candles
+
+
+def forming_candle_start(now: float, interval: str) -> int:
+    """Start time of the candle still forming at now"""
+    length = INTERVALS[interval]
+    if interval == 'D':
+        return int((now + IST_OFFSET) // length * length - IST_OFFSET)
+    return int(now // length * length)
+
+
+class _Series:
+    """Column files of one instrument and interval"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        # Next to the series, not in it: a rewrite replaces the directory
+        self.lock_path = directory.with_name(directory.name + ".lock")
+        self.lock = threading.Lock()
+        self._columns = None
+        self.meta = self._read_meta()
+
+    @contextmanager
+    def locked(self):
+        """Hold the series against other threads and worker processes, with what they wrote loaded"""
+        with self.lock:
+            self.directory.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                self.refresh()
+                yield
+
+    def refresh(self):
+        """Drop the cached meta and mapping if another process extended or rewrote the series"""
+        meta = self._read_meta()
+        if meta != self.meta or (self._columns is not None and len(self._columns['time']) != self.rows()):
+            self.meta = meta
+            self._columns = None
+
+    def _path(self, name: str) -> Path:
+        return self.directory / f"{name}.bin"
+
+    def _read_meta(self) -> Dict:
+        try:
+            with open(self.directory / "meta.json", 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, directory: Optional[Path] = None):
+        with open((directory or self.directory) / "meta.json", 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+
+    def rows(self) -> int:
+        path = self._path('time')
+        return path.stat().st_size // 8 if path.exists() else 0
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Read-only memory-mapped columns, remapped after every write"""
+        if self._columns is None:
+            rows = self.rows()
+            self._columns = {
+                name: np.memmap(self._path(name), dtype=dtype, mode='r', shape=(rows,))
+                if rows else np.empty(0, dtype=dtype)
+                for name, dtype in COLUMNS
+            }
+        return self._columns
+
+    def append(self, candles: np.ndarray, meta: Dict):
+        """Append candle rows (time, o, h, l, c, v) newer than the stored ones"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        rows = self.rows()
+        for position, (name, dtype) in zip((1, 2, 3, 4, 5, 0), COLUMNS):
+            with open(self._path(name), 'ab') as f:
+                # Drop whatever a write cut short left past the last full row
+                f.truncate(rows * np.dtype(dtype).itemsize)
+                f.write(np.ascontiguousarray(candles[:, position], dtype=dtype).tobytes())
+        self.meta = meta
+        self._write_meta()
+        self._columns = None
+
+    def rewrite(self, candles: np.ndarray, meta: Dict):
+        """Replace the whole series, for a backfill before the first stored candle"""
+        staging = self.directory.with_name(self.directory.name + ".new")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        for position, (name, dtype) in zip((1, 2, 3, 4, 5, 0), COLUMNS):
+            np.ascontiguousarray(candles[:, position], dtype=dtype).tofile(staging / f"{name}.bin")
+        self.meta = meta
+        self._write_meta(staging)
+
+        # Mapped columns handed out earlier keep reading the old files
+        retired = self.directory.with_name(self.directory.name + ".old")
+        shutil.rmtree(retired, ignore_errors=True)
+        if self.directory.exists():
+            os.replace(self.directory, retired)
+        os.replace(staging, self.directory)
+        shutil.rmtree(retired, ignore_errors=True)
+        self._columns = None
+
+
+class CandleStore:
+    """Candle series on disk, topped up from the broker on demand"""
+
+    def __init__(self, storage_dir: str = "data/candles"):
+        self.storage_dir = Path(storage_dir)
+        self._series: Dict[tuple, _Series] = {}
+        self._lock = threading.Lock()
+
+    def _get_series(self, symbol: str, interval: str) -> _Series:
+        key = (symbol, interval)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                safe_name = re.sub(r'[^A-Za-z0-9_-]+', '_', symbol)
+                series = self._series[key] = _Series(self.storage_dir / safe_name / interval)
+            return series
+
+    def get(self, request, symbol: str, interval: str, start: float,
+            end: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        Completed candles of a symbol between two times
+
+        Missing candles are fetched with the Fyers credentials of the session
+        first: the ones before the earliest fetch and the ones completed since
+        the last one. Concurrent loads of the same series, in any worker, wait
+        for one fetch.
+
+        Args:
+            request: Django request (session with Fyers credentials)
+            symbol: Index name (NIFTY) or option trading symbol
+            interval: Key of INTERVALS
+            start: Epoch seconds of the first candle
+            end: Epoch seconds of the last candle, defaults to now
+
+        Returns:
+            dict: Column name -> read-only array view of the range
+
+        Raises:
+            ValueError: For an unsupported symbol or interval
+        """
+        if interval not in INTERVALS:
+            raise ValueError(f"Unsupported interval: {interval}. Use one of {', '.join(INTERVALS)}")
+        name = fyers_symbol(symbol)
+        start = int(start)
+        end = int(end if end is not None else time.time())
+
+        series = self._get_series(name, interval)
+        with series.locked():
+            forming = forming_candle_start(time.time(), interval)
+            columns = series.columns()
+            covered_from = series.meta.get('covered_from')
+            checked_until = series.meta.get('checked_until')
+            fetched = False
+
+            if covered_from is None:
+                candles = self._fetch(request, name, interval, start, forming - 1, forming)
+                series.append(candles, {'covered_from': start, 'checked_until': forming})
+                fetched = True
+            else:
+                times = columns['time']
+                if start < covered_from:
+                    head = self._fetch(request, name, interval, start, covered_from - 1, forming)
+                    if len(times):
+                        head = head[head[:, 0] < times[0]]
+                    stored = np.column_stack([times] + [columns[field] for field, _ in COLUMNS[:5]])
+                    series.rewrite(np.vstack([head, stored]), dict(series.meta, covered_from=start))
+                    fetched = True
+                if forming > checked_until and end >= checked_until:
+                    tail = self._fetch(request, name, interval, checked_until, forming - 1, forming)
+                    times = series.columns()['time']
+                    if len(times):
+                        tail = tail[tail[:, 0] > times[-1]]
+                    series.append(tail, dict(series.meta, checked_until=forming))
+                    fetched = True
+            columns = series.columns()
+
+        metrics.inc('quicktrade_candle_loads_total', {'source': 'broker' if fetched else 'disk'})
+        times = columns['time']
+        lo = int(np.searchsorted(times, start, side='left'))
+        hi = int(np.searchsorted(times, end, side='right'))
+        return {field: columns[field][lo:hi] for field, _ in COLUMNS}
+
+    def _fetch(self, request, symbol: str, interval: str, range_from: int, range_to: int,
+               forming: int) -> np.ndarray:
+        """Completed candles from the history API as a (rows, 6) array, oldest first"""
+        client_id = request.session.get('fyers_client_id')
+        access_token = request.session.get('fyers_access_token')
+        if not client_id or not access_token:
+            raise Exception("Fyers credentials not found in session")
+
+        candles = fetch_fyers_candles(client_id, access_token, symbol, interval, range_from, range_to)
+        rows = np.array(candles, dtype=np.float64).reshape(-1, 6)
+        if len(rows):
+            # Complete candles only, sorted and without repeats
+            rows = rows[rows[:, 0] + INTERVALS[interval] <= forming]
+            _, first = np.unique(rows[:, 0], return_index=True)
+            rows = rows[first]
+        metrics.inc('quicktrade_candle_rows_fetched_total', value=len(rows))
+        return rows
+
+
+# Global instance
+candle_store = CandleStore()
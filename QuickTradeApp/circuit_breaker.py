@@ -0,0 +1,284 @@
+"""
+Circuit breakers and call deadlines for the broker APIs
+Every guarded call to an upstream (Fyers, Kite) runs with a per-endpoint
+deadline. When the failure rate over a sliding window crosses the
+threshold the circuit opens and calls fail fast with CIRCUIT_OPEN, so a
+degraded broker can not tie up every gunicorn worker. After a cool-off a
+single trial call decides between closing and re-opening the circuit.
+
+A missed deadline can not stop the call, its thread stays busy until the
+socket times out (see broker_clients.py for the Fyers SDK). Should every
+thread of the call pool end up held that way, the pool is replaced so
+guarded calls do not queue behind the stuck ones
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import partial
+from typing import Callable, Dict
+
+import requests
+
+from .metrics import metrics
+
+# Deadline per guarded endpoint in seconds, methods not listed are not guarded
+ENDPOINT_TIMEOUTS = {
+    'fyers': {
+        'quotes': 2,
+        'optionchain': 4,
+        'get_profile': 3,
+        'history': 5,
+        'funds': 3,
+    },
+    'kite': {
+        'positions': 3,
+        'orders': 3,
+        'order_history': 3,
+        'ltp': 2,
+        'quote': 2,
+        'margins': 3,
+        'order_margins': 3,
+        'basket_order_margins': 3,
+        'profile': 3,
+        'historical_data': 5,
+    },
+}
+
+# Open when at least MIN_CALLS calls in the window failed at this rate
+FAILURE_RATE_THRESHOLD = 0.5
+FAILURE_WINDOW = 30  # seconds
+MIN_CALLS = 5
+
+# How long an open circuit fails fast before letting a trial call through
+OPEN_DURATION = 15  # seconds
+
+# Calls in flight per upstream, a hung upstream can not hold more threads
+MAX_CONCURRENT_CALLS = 8
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+metrics.describe('quicktrade_upstream_calls_total', 'counter', "Guarded broker calls by outcome")
+metrics.describe('quicktrade_upstream_call_seconds', 'summary', "Latency of completed guarded broker calls")
+metrics.describe('quicktrade_circuit_state', 'gauge', "Circuit state per upstream (0 closed, 1 half open, 2 open)")
+metrics.describe('quicktrade_circuit_opened_total', 'counter', "Times a circuit opened")
+metrics.describe('quicktrade_call_pool_replaced_total', 'counter', "Call pools replaced because every thread was stuck")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+    error_code = 'CIRCUIT_OPEN'
+
+    def __init__(self, upstream: str, retry_after: float):
+        self.upstream = upstream
+        self.retry_after = retry_after
+        super().__init__(f"{upstream} is unavailable (circuit open), retry in {retry_after:.0f}s")
+
+
+class UpstreamTimeout(Exception):
+    """Raised when a guarded call misses its deadline"""
+
+    error_code = 'UPSTREAM_TIMEOUT'
+
+    def __init__(self, upstream: str, endpoint: str, timeout: float):
+        self.upstream = upstream
+        super().__init__(f"{upstream} {endpoint} timed out after {timeout}s")
+
+
+def is_upstream_unavailable(error: Exception) -> bool:
+    """True for errors raised by a breaker rather than by the broker"""
+    return isinstance(error, (CircuitOpenError, UpstreamTimeout))
+
+
+def _network_failure(error: Exception) -> bool:
+    return isinstance(error, requests.exceptions.RequestException)
+
+
+def _kite_failure(error: Exception) -> bool:
+    """Network errors, 5xx and garbled responses count, API errors (token, input, margin) do not"""
+    from .broker_clients import kite_exceptions
+    exceptions = kite_exceptions()
+    if _network_failure(error) or isinstance(error, (exceptions.NetworkException, exceptions.DataException)):
+        return True
+    return isinstance(error, exceptions.KiteException) and (getattr(error, 'code', 0) or 0) >= 500
+
+
+def _fyers_result_failure(result) -> bool:
+    """The Fyers SDK returns errors as dicts, code -99 means the request itself failed"""
+    if not isinstance(result, dict):
+        return False
+    code = result.get('code')
+    return isinstance(code, int) and (code == -99 or code >= 500)
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a sliding failure-rate window"""
+
+    def __init__(self, upstream: str, timeouts: Dict[str, float],
+                 is_failure: Callable[[Exception], bool] = _network_failure,
+                 is_result_failure: Callable[[object], bool] = lambda result: False):
+        self.upstream = upstream
+        self.timeouts = timeouts
+        self.is_failure = is_failure
+        self.is_result_failure = is_result_failure
+        self._calls = deque()  # (timestamp, failed)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._stuck = 0  # threads of the current pool still running a timed out call
+
+    def _new_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CALLS, thread_name_prefix=f"{self.upstream}-calls")
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= OPEN_DURATION:
+            self._state = HALF_OPEN
+        return self._state
+
+    def _open(self, now: float):
+        self._state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        metrics.inc('quicktrade_circuit_opened_total', {'upstream': self.upstream})
+
+    def _admit(self) -> bool:
+        """Let a call through or raise CircuitOpenError, True if it is the trial call"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            retry_after = max(OPEN_DURATION - (now - self._opened_at), 0)
+        raise CircuitOpenError(self.upstream, retry_after)
+
+    def _record(self, failed: bool, trial: bool):
+        with self._lock:
+            now = time.monotonic()
+            if trial:
+                self._trial_in_flight = False
+                if failed:
+                    self._open(now)
+                else:
+                    self._state = CLOSED
+                    self._calls.clear()
+                return
+
+            self._calls.append((now, failed))
+            while self._calls and now - self._calls[0][0] > FAILURE_WINDOW:
+                self._calls.popleft()
+            if self._state == CLOSED and len(self._calls) >= MIN_CALLS:
+                failures = sum(1 for _, call_failed in self._calls if call_failed)
+                if failures / len(self._calls) >= FAILURE_RATE_THRESHOLD:
+                    self._open(now)
+
+    def call(self, endpoint: str, fn: Callable, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs) through the breaker with the endpoint deadline
+
+        Raises:
+            CircuitOpenError: If the circuit is open (nothing was sent)
+            UpstreamTimeout: If the call missed its deadline
+            Exception: Anything fn raised, unchanged
+        """
+        trial = self._admit()
+        labels = {'upstream': self.upstream, 'endpoint': endpoint}
+        timeout = self.timeouts.get(endpoint)
+        started = time.perf_counter()
+        try:
+            if timeout:
+                executor = self._executor
+                future = executor.submit(fn, *args, **kwargs)
+                try:
+                    result = future.result(timeout=timeout)
+                except FutureTimeout:
+                    if not future.cancel():
+                        self._abandon(executor, future)
+                    raise UpstreamTimeout(self.upstream, endpoint, timeout)
+            else:
+                result = fn(*args, **kwargs)
+        except UpstreamTimeout:
+            self._record(True, trial)
+            metrics.inc('quicktrade_upstream_calls_total', dict(labels, outcome='timeout'))
+            raise
+        except Exception as e:
+            failed = self.is_failure(e)
+            self._record(failed, trial)
+            metrics.inc('quicktrade_upstream_calls_total', dict(labels, outcome='failure' if failed else 'error'))
+            raise
+
+        failed = self.is_result_failure(result)
+        self._record(failed, trial)
+        metrics.inc('quicktrade_upstream_calls_total', dict(labels, outcome='failure' if failed else 'success'))
+        metrics.observe('quicktrade_upstream_call_seconds', time.perf_counter() - started, labels)
+        return result
+
+    def _abandon(self, executor: ThreadPoolExecutor, future):
+        """Count the thread a timed out call still holds, replace the pool once all of them are held"""
+        with self._lock:
+            if executor is not self._executor:
+                return
+            self._stuck += 1
+            replace = self._stuck >= MAX_CONCURRENT_CALLS
+            if replace:
+                # The stuck threads end with their sockets and the old pool with them
+                self._executor = self._new_executor()
+                self._stuck = 0
+        if not replace:
+            # Runs at once (taking the lock) if the call finished meanwhile
+            future.add_done_callback(partial(self._released, executor))
+            return
+        executor.shutdown(wait=False)
+        metrics.inc('quicktrade_call_pool_replaced_total', {'upstream': self.upstream})
+
+    def _released(self, executor: ThreadPoolExecutor, future):
+        with self._lock:
+            if executor is self._executor:
+                self._stuck -= 1
+
+    def reset(self):
+        """Close the circuit and forget recorded calls"""
+        with self._lock:
+            self._state = CLOSED
+            self._trial_in_flight = False
+            self._calls.clear()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            failures = sum(1 for _, failed in self._calls if failed)
+            return {
+                'upstream': self.upstream,
+                'state': state,
+                'calls_in_window': len(self._calls),
+                'failures_in_window': failures,
+                'retry_after': max(OPEN_DURATION - (now - self._opened_at), 0) if state == OPEN else 0,
+            }
+
+
+# Global instances
+fyers_breaker = CircuitBreaker('fyers', ENDPOINT_TIMEOUTS['fyers'], is_result_failure=_fyers_result_failure)
+kite_breaker = CircuitBreaker('kite', ENDPOINT_TIMEOUTS['kite'], is_failure=_kite_failure)
+breakers = {'fyers': fyers_breaker, 'kite': kite_breaker}
+
+
+def _collect_states():
+    for name, breaker in breakers.items():
+        metrics.set('quicktrade_circuit_state', STATE_VALUES[breaker.state], {'upstream': name})
+
+
+metrics.add_collector(_collect_states)
@@ -10,4 +10,43 @@ BASE_URL = os.environ.get('BASE_URL', 'https://quicktrade-9zj5.onrender.com')
 FYERS_REDIRECT_URL = f"{BASE_URL}/fyers/auth/"
 ZERODHA_REDIRECT_URL = f"{BASE_URL}/zerodha/callback/"
 
+# Kite app secret that verifies postback checksums, for deployments where every
+# account logs in through one Kite app. Empty: each account's secret is read from
+# the session it logged in with
+KITE_API_SECRET = os.environ.get('KITE_API_SECRET', '')
+
+# Index LTP on the order path: ask Kite too when Fyers is slower than usual
+HEDGED_QUOTES = os.environ.get('HEDGED_QUOTES', 'True') == 'True'
+
+# Append every fetched quote to the tick files under data/ticks/
+TICK_RECORDER = os.environ.get('TICK_RECORDER', 'True') == 'True'
+
+# Paper trading: market orders fill this many seconds after submission, this many
+# basis points worse than the LTP, against a notional capital per account
+PAPER_FILL_LATENCY = float(os.environ.get('PAPER_FILL_LATENCY', '0.2'))
+PAPER_SLIPPAGE_BPS = float(os.environ.get('PAPER_SLIPPAGE_BPS', '5'))
+PAPER_CAPITAL = float(os.environ.get('PAPER_CAPITAL', '500000'))
+
+# Armed stop-loss / target symbols are quoted from Kite at this interval (seconds)
+# when no request fetched their price in the meantime, 0 disables the poller
+SL_QUOTE_POLL_INTERVAL = float(os.environ.get('SL_QUOTE_POLL_INTERVAL', '1'))
+
+# Request lanes: threads per gunicorn worker, and how many of them read-only and
+# other requests may hold (running + queued) so order requests always find one free
+REQUEST_LANES = os.environ.get('REQUEST_LANES', 'True') == 'True'
+WORKER_THREADS = int(os.environ.get('GUNICORN_THREADS', '12'))
+READ_LANE_CONCURRENCY = int(os.environ.get('READ_LANE_CONCURRENCY', '4'))
+READ_LANE_QUEUE = int(os.environ.get('READ_LANE_QUEUE', '2'))
+OTHER_LANE_CONCURRENCY = int(os.environ.get('OTHER_LANE_CONCURRENCY', '2'))
+OTHER_LANE_QUEUE = int(os.environ.get('OTHER_LANE_QUEUE', '1'))
+EXPORT_LANE_CONCURRENCY = int(os.environ.get('EXPORT_LANE_CONCURRENCY', '1'))
+EXPORT_LANE_QUEUE = int(os.environ.get('EXPORT_LANE_QUEUE', '0'))
+
+# Record every broker call (endpoint, redacted params, latency, outcome) under data/audit/
+BROKER_AUDIT = os.environ.get('BROKER_AUDIT', 'True') == 'True'
+
+# Bearer token a Prometheus scraper sends to read /metrics/, staff users need none.
+# Empty: only staff users can read it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 # Google Analytics Config # ProductionE_ANALYTICS_ID = os.environ.get('GA_MEASUREMENT_ID', '')  # Empty string if no GA ID provided 
\ No newline at end of file
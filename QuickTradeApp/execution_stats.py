@@ -0,0 +1,255 @@
+"""
+Execution quality tracking for QuickTradeApp
+Records the timeline of every order (click, quote, submit, ack, fill)
+together with the option premium at decision time, and rolls them up
+into per-day latency and slippage percentiles of each account
+
+Layout: data/execution/<account>/<YYYY-MM-DD>.jsonl, one JSON array per
+line (RECORD_FIELDS), days in IST
+"""
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pytz
+from django.core.cache import cache
+
+# Pending orders wait this long for a fill before they are dropped
+PENDING_TTL = 86400  # seconds
+
+# How long tracking waits for the decision time premium quote
+PREMIUM_QUOTE_TIMEOUT = 2  # seconds
+
+# Columns of a finalized record, stored as one JSON array per line
+RECORD_FIELDS = (
+    'order_id', 'tradingsymbol', 'transaction_type', 'quantity',
+    'clicked_at', 'quoted_at', 'submitted_at', 'acked_at', 'filled_at',
+    'decision_premium', 'fill_price',
+)
+
+IST = pytz.timezone('Asia/Kolkata')
+
+_PENDING_KEY = "execution_pending:{order_id}"
+
+# Premium quotes and bookkeeping run here, never on the order path
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="execution-stats")
+
+
+class OrderTimeline:
+    """Timestamps and prices collected while an order is placed"""
+
+    FIELDS = ('clicked_at', 'quoted_at', 'submitted_at', 'acked_at',
+              'tradingsymbol', 'transaction_type', 'decision_premium')
+
+    __slots__ = FIELDS + ('premium_future',)
+
+    def __init__(self, clicked_at: Optional[float] = None):
+        self.clicked_at = clicked_at or time.time()
+        self.quoted_at = None
+        self.submitted_at = None
+        self.acked_at = None
+        self.tradingsymbol = None
+        self.transaction_type = 'BUY'
+        self.decision_premium = None
+        self.premium_future = None
+
+    def mark(self, stage: str):
+        """Stamp a stage ('quoted', 'submitted' or 'acked') with the current time"""
+        setattr(self, f"{stage}_at", time.time())
+
+    def fetch_premium(self, fetch):
+        """
+        Quote the option premium in the background while the order is placed
+
+        Args:
+            fetch: Callable returning the premium of self.tradingsymbol
+        """
+        if self.decision_premium is None:
+            self.premium_future = _executor.submit(fetch)
+
+    def copy(self) -> 'OrderTimeline':
+        """Independent timeline for a child order sharing the same decision"""
+        other = OrderTimeline(self.clicked_at)
+        for field in self.__slots__:
+            setattr(other, field, getattr(self, field))
+        return other
+
+    def as_dict(self) -> Dict:
+        """Plain fields, waiting briefly for a premium quote still in flight"""
+        if self.decision_premium is None and self.premium_future is not None:
+            try:
+                self.decision_premium = self.premium_future.result(timeout=PREMIUM_QUOTE_TIMEOUT)
+            except Exception:
+                pass
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+def _safe_name(account: str) -> str:
+    return re.sub(r'[^A-Za-z0-9-]', '_', str(account))
+
+
+class ExecutionTracker:
+    """Matches acknowledged orders with their fills and stores the result per account"""
+
+    def __init__(self, storage_dir: str = "data/execution"):
+        self.storage_dir = Path(storage_dir)
+        self._lock = threading.Lock()
+
+    def track(self, account: str, order_id: str, quantity: int, timeline: OrderTimeline):
+        """
+        Remember an acknowledged order until its fill arrives
+
+        Args:
+            account: Kite user id of the account that placed the order
+            order_id: Kite order id
+            quantity: Order quantity
+            timeline: Timeline collected while placing the order
+        """
+        if not order_id or not account:
+            return
+        _executor.submit(self._store_pending, account, str(order_id), quantity, timeline)
+
+    def _store_pending(self, account: str, order_id: str, quantity: int, timeline: OrderTimeline):
+        pending = timeline.as_dict()
+        pending['quantity'] = quantity
+        pending['account'] = account
+        key = _PENDING_KEY.format(order_id=order_id)
+        # A fast postback may have been parked before we got here
+        early_fill = cache.get(f"{key}:fill")
+        cache.set(key, pending, PENDING_TTL)
+        if early_fill:
+            cache.delete(f"{key}:fill")
+            self.on_order_update(early_fill['order'], early_fill['filled_at'])
+
+    def on_order_update(self, order: Dict, filled_at: Optional[float] = None):
+        """
+        Finalize the record of an order once it is completely filled
+
+        Args:
+            order: Postback payload or order history row
+            filled_at: Fill time in epoch seconds, defaults to now (postback receipt)
+        """
+        if order.get('status') != 'COMPLETE':
+            return
+        order_id = str(order.get('order_id'))
+        key = _PENDING_KEY.format(order_id=order_id)
+        filled_at = filled_at or time.time()
+        pending = cache.get(key)
+        if not pending:
+            # The fill can beat the bookkeeping of the ack, park it briefly
+            cache.set(f"{key}:fill", {'order': dict(order), 'filled_at': filled_at}, 60)
+            return
+        cache.delete(key)
+
+        record = [
+            order_id,
+            pending.get('tradingsymbol') or order.get('tradingsymbol'),
+            pending.get('transaction_type') or order.get('transaction_type'),
+            pending.get('quantity') or order.get('quantity'),
+            pending.get('clicked_at'),
+            pending.get('quoted_at'),
+            pending.get('submitted_at'),
+            pending.get('acked_at'),
+            filled_at,
+            pending.get('decision_premium'),
+            float(order.get('average_price') or 0) or None,
+        ]
+        self._append(pending['account'], record)
+
+    def resolve_from_history(self, kite, order_ids: List[str]):
+        """
+        Look up fills of still pending orders in the order history
+
+        Args:
+            kite: KiteConnect client of the account
+            order_ids: Order ids to check
+        """
+        for order_id in order_ids:
+            if not cache.get(_PENDING_KEY.format(order_id=order_id)):
+                continue
+            try:
+                history = kite.order_history(order_id)
+            except Exception:
+                continue
+            complete = next((row for row in history if row.get('status') == 'COMPLETE'), None)
+            if complete:
+                stamp = complete.get('exchange_timestamp') or complete.get('order_timestamp')
+                filled_at = IST.localize(stamp).timestamp() if isinstance(stamp, datetime) else None
+                self.on_order_update(complete, filled_at)
+
+    def _day_file(self, account: str, day: str) -> Path:
+        return self.storage_dir / _safe_name(account) / f"{day}.jsonl"
+
+    def _append(self, account: str, record: List):
+        day = datetime.fromtimestamp(record[RECORD_FIELDS.index('clicked_at')] or time.time(), IST).strftime('%Y-%m-%d')
+        with self._lock:
+            (self.storage_dir / _safe_name(account)).mkdir(parents=True, exist_ok=True)
+            with open(self._day_file(account, day), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, separators=(',', ':')) + "\n")
+
+    def records(self, account: str, day: str) -> List[Dict]:
+        """All finalized records of an account's day as dicts"""
+        path = self._day_file(account, day)
+        if not path.exists():
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return [dict(zip(RECORD_FIELDS, json.loads(line))) for line in f if line.strip()]
+
+    def daily_rollup(self, account: str, day: str) -> Dict:
+        """
+        Latency and slippage percentiles of an account's day
+
+        Args:
+            account: Kite user id
+            day: Date as YYYY-MM-DD (IST)
+
+        Returns:
+            dict: Percentiles in milliseconds (latency) and points / rupees (slippage)
+        """
+        rows = self.records(account, day)
+        if not rows:
+            return {'date': day, 'orders': 0}
+
+        def column(name):
+            return np.array([row[name] if row[name] is not None else np.nan for row in rows], dtype=np.float64)
+
+        clicked, quoted, submitted = column('clicked_at'), column('quoted_at'), column('submitted_at')
+        acked, filled = column('acked_at'), column('filled_at')
+        quantity = column('quantity')
+
+        # Positive slippage is always against us: paid more on buys, got less on sells
+        side = np.array([1.0 if row['transaction_type'] == 'BUY' else -1.0 for row in rows])
+        slippage_points = (column('fill_price') - column('decision_premium')) * side
+
+        def percentiles(values, scale=1.0):
+            values = values[np.isfinite(values)] * scale
+            if not values.size:
+                return None
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            return {'p50': round(float(p50), 2), 'p95': round(float(p95), 2),
+                    'p99': round(float(p99), 2), 'mean': round(float(values.mean()), 2),
+                    'count': int(values.size)}
+
+        return {
+            'date': day,
+            'orders': len(rows),
+            'latency_ms': {
+                'click_to_quote': percentiles(quoted - clicked, 1000),
+                'quote_to_submit': percentiles(submitted - quoted, 1000),
+                'submit_to_ack': percentiles(acked - submitted, 1000),
+                'click_to_ack': percentiles(acked - clicked, 1000),
+                'click_to_fill': percentiles(filled - clicked, 1000),
+            },
+            'slippage_points': percentiles(slippage_points),
+            'slippage_rupees': percentiles(slippage_points * quantity),
+        }
+
+
+# Global instance
+execution_tracker = ExecutionTracker()
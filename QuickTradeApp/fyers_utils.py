@@ -1,7 +1,48 @@
-from fyers_apiv3 import fyersModel
 from django.http import HttpRequest
+from .broker_clients import get_fyers_client
+from .circuit_breaker import is_upstream_unavailable
 from .auth.fyers_auth import FyersAuth
-from datetime import date, datetime, timedelta
+from .instruments import INDEX_SPECS, get_index_spec
+from .ltp_cache import ltp_cache
+from .single_flight import account_key, single_flight
+from .symbol_codec import is_monthly_expiry
+from .tick_recorder import record_ticks
+from datetime import datetime
+from functools import partial
+
+
+def _fetch_index_quote(fyers, script_name: str, index: str) -> dict:
+    """Quote of one index from Fyers, recorded to the tick files"""
+    response = fyers.quotes(data={"symbols": script_name})
+    if response.get("s") == "ok" and response.get("code") == 200:
+        quote = response["d"][0]["v"]
+        record_ticks((index,), (quote["lp"],), quote.get("volume") or 0,
+                     quote.get("bid") or float("nan"), quote.get("ask") or float("nan"))
+        return quote
+    raise Exception(f"Failed to get LTP. Response: {response}")
+
+
+def _fetch_option_quotes(fyers, fyers_symbols: dict) -> dict:
+    """LTPs of option contracts from one Fyers quotes call, recorded to the tick files"""
+    response = fyers.quotes(data={"symbols": ",".join(fyers_symbols)})
+
+    if response.get("s") != "ok":
+        raise Exception(f"Failed to get option quotes. Response: {response}")
+
+    prices = {}
+    volumes, bids, asks = [], [], []
+    for quote in response.get("d", []):
+        symbol = fyers_symbols.get(quote.get("n"))
+        values = quote.get("v", {})
+        ltp = values.get("lp")
+        if symbol and ltp is not None:
+            prices[symbol] = float(ltp)
+            volumes.append(values.get("volume") or 0)
+            bids.append(values.get("bid") or float("nan"))
+            asks.append(values.get("ask") or float("nan"))
+
+    record_ticks(list(prices), list(prices.values()), volumes, bids, asks)
+    return prices
 
 
 def get_ltp(request: HttpRequest, index: str) -> float:
@@ -17,11 +58,7 @@ def get_ltp(request: HttpRequest, index: str) -> float:
     """
     try:
         # Get the LTP for the index using Fyers API
-        script_name = f"NSE:{index.upper()}-INDEX"
-        if index.upper() == 'BANKNIFTY':
-            script_name = "NSE:NIFTYBANK-INDEX"
-        elif index.upper() == 'NIFTY':
-            script_name = "NSE:NIFTY50-INDEX"
+        script_name = get_index_spec(index)['fyers_index_symbol']
         
         # Get credentials from session
         client_id = request.session.get('fyers_client_id')
@@ -30,40 +67,59 @@ def get_ltp(request: HttpRequest, index: str) -> float:
         if not client_id or not access_token:
             raise Exception("Fyers credentials not found in session")
         
-        # Initialize the FyersModel instance
-        fyers = fyersModel.FyersModel(
-            client_id=client_id,
-            token=access_token,
-            is_async=False,
-            log_path=""
-        )
+        # Shared FyersModel instance for these credentials
+        fyers = get_fyers_client(client_id, access_token)
         
-        # Prepare the data for quotes request
-        data = {
-            "symbols": script_name
-        }
-        
-        # Get quotes from Fyers
-        response = fyers.quotes(data=data)
-        
-        # Check if the response is successful
-        if response.get("s") == "ok" and response.get("code") == 200:
-            # Extract LTP from the response
-            # The response structure is different for indices
-            if "INDEX" in script_name:
-                # For indices, the LTP is in a different location
-                ltp = response["d"][0]["v"]["lp"]
-            else:
-                ltp = response["d"][0]["v"]["lp"]
-            return float(ltp)
-        else:
-            error_msg = f"Failed to get LTP. Response: {response}"
-            raise Exception(error_msg)
+        # Concurrent lookups of the same index share one quotes request
+        quote = single_flight.do('quotes', account_key(client_id, access_token),
+                                 partial(_fetch_index_quote, fyers, script_name, index.upper()),
+                                 detail=script_name)
+        ltp = quote["lp"]
+        ltp_cache.update(index.upper(), ltp)
+        return float(ltp)
             
     except Exception as e:
+        if is_upstream_unavailable(e):
+            raise
         raise Exception(f"Error getting LTP: {str(e)}")
 
 
+def get_option_quotes(request: HttpRequest, positions: list) -> dict:
+    """
+    Get LTPs of option contracts in a single Fyers quotes call and store them in the LTP cache
+
+    Args:
+        request (HttpRequest): Django request object containing session data
+        positions (list): Kite position rows (tradingsymbol and exchange are used)
+
+    Returns:
+        dict: Kite tradingsymbol -> LTP for the contracts Fyers returned
+    """
+    client_id = request.session.get('fyers_client_id')
+    access_token = request.session.get('fyers_access_token')
+
+    if not client_id or not access_token:
+        raise Exception("Fyers credentials not found in session")
+
+    # Fyers uses the underlying exchange as prefix, Kite the derivatives segment
+    exchange_map = {"NFO": "NSE", "BFO": "BSE"}
+    fyers_symbols = {
+        f"{exchange_map.get(pos.get('exchange'), 'NSE')}:{pos['tradingsymbol']}": pos['tradingsymbol']
+        for pos in positions
+    }
+    if not fyers_symbols:
+        return {}
+
+    fyers = get_fyers_client(client_id, access_token)
+    # Concurrent requests for the same contracts (dashboard tabs, P&L polls) share one quotes call
+    prices = single_flight.do('quotes', account_key(client_id, access_token),
+                              partial(_fetch_option_quotes, fyers, fyers_symbols),
+                              detail=",".join(sorted(fyers_symbols)))
+
+    ltp_cache.update_many(prices)
+    return prices
+
+
 class FyersService:
     """Service class for Fyers API operations"""
     
@@ -91,17 +147,11 @@ class FyersService:
             raise Exception("Fyers not initialized")
         
         try:
-            symbol_map = {
-                "NIFTY": "NSE:NIFTY50-INDEX",
-                "BANKNIFTY": "NSE:NIFTYBANK-INDEX"
-            }
-            
-            symbol = symbol_map.get(index.upper())
-            if not symbol:
-                raise ValueError(f"Invalid index: {index}")
-            
+            get_index_spec(index)
             return get_ltp(self.request, index)
         except Exception as e:
+            if is_upstream_unavailable(e):
+                raise
             raise Exception(f"Failed to get {index} price: {str(e)}")
     
     def get_market_data(self):
@@ -109,12 +159,14 @@ class FyersService:
         try:
             market_data = {'prices': {}, 'expiry_dates': {}}
             
-            # Get prices
+            # Get prices, falling back to the last known price while Fyers is unavailable
             for index in ['NIFTY', 'BANKNIFTY']:
                 try:
                     market_data['prices'][index] = self.get_index_price(index)
                 except Exception as e:
-                    market_data['prices'][index] = None
+                    market_data['prices'][index] = ltp_cache.get(index) if is_upstream_unavailable(e) else None
+                    if is_upstream_unavailable(e):
+                        market_data['stale'] = True
             
             # Get expiry dates using the new function
             try:
@@ -153,7 +205,7 @@ def get_next_expiry_sdk(request, index="NIFTY"):
     
     Args:
         request: Django request object
-        index: Index name ('NIFTY' or 'BANKNIFTY')
+        index: Index name ('NIFTY', 'BANKNIFTY', 'SENSEX' or 'BANKEX')
     
     Returns:
         str: Next expiry date or None if failed
@@ -167,22 +219,13 @@ def get_next_expiry_sdk(request, index="NIFTY"):
             return None
         
         # Map index to symbol
-        symbol_map = {
-            "NIFTY": "NSE:NIFTY50-INDEX",
-            "BANKNIFTY": "NSE:NIFTYBANK-INDEX"
-        }
-        
-        symbol = symbol_map.get(index.upper())
-        if not symbol:
+        spec = INDEX_SPECS.get(index.upper())
+        if not spec:
             return None
+        symbol = spec['fyers_index_symbol']
         
-        # Initialize FyersModel instance
-        fyers = fyersModel.FyersModel(
-            client_id=client_id,
-            token=access_token,
-            is_async=False,
-            log_path=""
-        )
+        # Shared FyersModel instance for these credentials
+        fyers = get_fyers_client(client_id, access_token)
         
         # Get option chain data which includes expiry dates
         data = {
@@ -203,12 +246,8 @@ def get_next_expiry_sdk(request, index="NIFTY"):
                     # Convert date string to date object
                     expiry_date = datetime.strptime(expiry_date_str, '%d-%m-%Y').date()
                     
-                    # Determine if it's monthly or weekly expiry
-                    # Monthly expiry is typically the last Thursday of the month
-                    last_day_of_month = (expiry_date.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
-                    last_thursday = last_day_of_month - timedelta(days=((last_day_of_month.weekday() - 3) % 7))
-                    
-                    is_monthly = expiry_date == last_thursday
+                    # Determine if it's monthly or weekly expiry (the index's last expiry weekday of the month)
+                    is_monthly = is_monthly_expiry(index, expiry_date)
                     expiry_type = "MONTHLY" if is_monthly else "WEEKLY"
                     
                     # Save in session with index-specific keys
@@ -0,0 +1,182 @@
+"""
+Hedged index LTP lookups for QuickTradeApp
+The order path asks Fyers (primary) for the index LTP. If no answer arrives
+within the primary's recent p95 latency, the same price is also asked from
+Kite (secondary) and whichever answers first is used. The slower call is
+cancelled if it has not started yet, otherwise its answer is only used to
+cross-check the two vendors for divergence
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from django.http import HttpRequest
+
+from .broker_clients import get_kite_client
+from .config import HEDGED_QUOTES
+from .fyers_utils import get_ltp
+from .instruments import get_index_spec
+from .ltp_cache import ltp_cache
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Latency samples kept per source for the hedge delay
+LATENCY_SAMPLES = 200
+MIN_SAMPLES = 20
+
+# Hedge delay bounds (seconds), DEFAULT_HEDGE_DELAY until enough samples
+DEFAULT_HEDGE_DELAY = 0.3
+MIN_HEDGE_DELAY = 0.05
+MAX_HEDGE_DELAY = 1.0
+
+# Vendors disagreeing by more than this are logged
+DIVERGENCE_ALERT_BPS = 20
+
+# Lookups in flight across both sources
+MAX_WORKERS = 16
+
+metrics.describe('quicktrade_hedged_quotes_total', 'counter', "Hedged index LTP lookups by answering source")
+metrics.describe('quicktrade_hedge_delay_seconds', 'gauge', "Wait before asking the secondary source")
+metrics.describe('quicktrade_quote_divergence_bps', 'gauge', "Last Fyers / Kite index LTP difference in basis points")
+metrics.describe('quicktrade_quote_divergence_alerts_total', 'counter',
+                 "Index LTPs where Fyers and Kite differed beyond the alert threshold")
+
+
+class LatencyWindow:
+    """Recent call latencies of one source"""
+
+    def __init__(self, size: int = LATENCY_SAMPLES):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(int(len(samples) * pct / 100), len(samples) - 1)]
+
+
+def _fyers_ltp(session: Dict, index: str) -> float:
+    return get_ltp(SimpleNamespace(session=session), index)
+
+
+def _kite_ltp(session: Dict, index: str) -> float:
+    if not session.get('api_key') or not session.get('access_token'):
+        raise Exception("Kite credentials not found in session")
+    symbol = get_index_spec(index)['kite_index_symbol']
+    kite = get_kite_client(session['api_key'], session['access_token'])
+    return float(kite.ltp(symbol)[symbol]['last_price'])
+
+
+class HedgedQuoter:
+    """First-response-wins index LTP across a primary and a secondary source"""
+
+    SESSION_KEYS = ('fyers_client_id', 'fyers_access_token', 'api_key', 'access_token')
+
+    def __init__(self):
+        self.sources = {'fyers': _fyers_ltp, 'kite': _kite_ltp}
+        self.primary, self.secondary = 'fyers', 'kite'
+        self.latency = {name: LatencyWindow() for name in self.sources}
+        self._executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="hedged-quotes")
+
+    def hedge_delay(self) -> float:
+        """Primary p95 latency, clamped to the hedge delay bounds"""
+        p95 = self.latency[self.primary].percentile(95)
+        if p95 is None:
+            return DEFAULT_HEDGE_DELAY
+        return min(max(p95, MIN_HEDGE_DELAY), MAX_HEDGE_DELAY)
+
+    def _timed(self, source: str, session: Dict, index: str) -> float:
+        started = time.perf_counter()
+        ltp = self.sources[source](session, index)
+        self.latency[source].add(time.perf_counter() - started)
+        return ltp
+
+    def _submit(self, source: str, session: Dict, index: str):
+        future = self._executor.submit(self._timed, source, session, index)
+        future.source = source
+        return future
+
+    def get(self, request: HttpRequest, index: str) -> float:
+        """
+        Get the index LTP from whichever source answers first
+
+        Args:
+            request (HttpRequest): Django request object containing session data
+            index (str): Index name (NIFTY, BANKNIFTY, ...)
+
+        Returns:
+            float: Last Traded Price of the index
+
+        Raises:
+            Exception: The primary's error if both sources failed
+        """
+        index = index.upper()
+        # Sessions are not thread safe, the workers only get the credentials
+        session = {key: request.session.get(key) for key in self.SESSION_KEYS}
+        delay = self.hedge_delay()
+        metrics.set('quicktrade_hedge_delay_seconds', delay)
+
+        primary = self._submit(self.primary, session, index)
+        done, _ = wait([primary], timeout=delay)
+        if done and primary.exception() is None:
+            metrics.inc('quicktrade_hedged_quotes_total', {'source': self.primary, 'hedged': 'no'})
+            return primary.result()
+
+        pending = {primary} if not done else set()
+        secondary = self._submit(self.secondary, session, index)
+        pending.add(secondary)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    continue
+                loser = secondary if future is primary else primary
+                self._finish(future, loser, index)
+                return future.result()
+
+        metrics.inc('quicktrade_hedged_quotes_total', {'source': 'none', 'hedged': 'yes'})
+        raise primary.exception()
+
+    def _finish(self, winner, loser, index: str):
+        metrics.inc('quicktrade_hedged_quotes_total', {'source': winner.source, 'hedged': 'yes'})
+        if winner.source != self.primary:
+            # get_ltp stores Fyers prices itself
+            ltp_cache.update(index, winner.result())
+        if not loser.cancel():
+            loser.add_done_callback(lambda late: self._cross_check(index, winner, late))
+
+    def _cross_check(self, index: str, first, late):
+        if late.exception() is not None:
+            return
+        prices = {first.source: first.result(), late.source: late.result()}
+        divergence_bps = abs(prices['fyers'] - prices['kite']) / prices['fyers'] * 10000
+        metrics.set('quicktrade_quote_divergence_bps', divergence_bps, {'index': index})
+        if divergence_bps > DIVERGENCE_ALERT_BPS:
+            metrics.inc('quicktrade_quote_divergence_alerts_total', {'index': index})
+            logger.warning("%s LTP diverges by %.1fbp: fyers %s, kite %s",
+                           index, divergence_bps, prices['fyers'], prices['kite'])
+
+
+# Global instance
+hedged_quoter = HedgedQuoter()
+
+
+def get_index_ltp(request: HttpRequest, index: str) -> float:
+    """
+    Get the index LTP for the order path, hedged across Fyers and Kite
+    when HEDGED_QUOTES is on, from Fyers alone otherwise
+    """
+    if HEDGED_QUOTES:
+        return hedged_quoter.get(request, index)
+    return get_ltp(request, index=index)
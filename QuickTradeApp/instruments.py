@@ -0,0 +1,90 @@
+"""
+Index option contract specifications for QuickTradeApp
+"""
+from datetime import date
+
+MONDAY, TUESDAY, WEDNESDAY, THURSDAY, FRIDAY = range(5)
+
+# Derivative segment, strike interval, lot size, exchange freeze quantity
+# (largest quantity accepted in a single order), the Kite and Fyers quote
+# symbols of the index, and the expiry weekday per underlying. Expiry weekdays
+# are (first day, weekday) pairs, oldest first, as the exchanges moved them:
+# the monthly contract expires on the last such weekday of its month (the
+# trading day before it if that is a holiday)
+INDEX_SPECS = {
+    'NIFTY': {
+        'exchange': 'NFO',
+        'strike_interval': 50,
+        'lot_size': 75,
+        'freeze_quantity': 1800,
+        'kite_index_symbol': 'NSE:NIFTY 50',
+        'fyers_index_symbol': 'NSE:NIFTY50-INDEX',
+        'expiry_weekdays': ((date.min, THURSDAY), (date(2025, 9, 1), TUESDAY)),
+    },
+    'BANKNIFTY': {
+        'exchange': 'NFO',
+        'strike_interval': 100,
+        'lot_size': 30,
+        'freeze_quantity': 900,
+        'kite_index_symbol': 'NSE:NIFTY BANK',
+        'fyers_index_symbol': 'NSE:NIFTYBANK-INDEX',
+        'expiry_weekdays': ((date.min, THURSDAY), (date(2024, 3, 1), WEDNESDAY), (date(2025, 1, 1), THURSDAY),
+                            (date(2025, 9, 1), TUESDAY)),
+    },
+    'SENSEX': {
+        'exchange': 'BFO',
+        'strike_interval': 100,
+        'lot_size': 20,
+        'freeze_quantity': 1000,
+        'kite_index_symbol': 'BSE:SENSEX',
+        'fyers_index_symbol': 'BSE:SENSEX-INDEX',
+        'expiry_weekdays': ((date.min, FRIDAY), (date(2025, 1, 1), TUESDAY), (date(2025, 9, 1), THURSDAY)),
+    },
+    'BANKEX': {
+        'exchange': 'BFO',
+        'strike_interval': 100,
+        'lot_size': 30,
+        'freeze_quantity': 900,
+        'kite_index_symbol': 'BSE:BANKEX',
+        'fyers_index_symbol': 'BSE:BANKEX-INDEX',
+        'expiry_weekdays': ((date.min, FRIDAY), (date(2025, 1, 1), TUESDAY), (date(2025, 9, 1), THURSDAY)),
+    },
+}
+
+
+def get_index_spec(index: str) -> dict:
+    """
+    Get the contract specification of an index
+
+    Args:
+        index: Index name (e.g., 'NIFTY', 'SENSEX')
+
+    Returns:
+        dict: Contract specification
+
+    Raises:
+        ValueError: If the index is not supported
+    """
+    spec = INDEX_SPECS.get(index.upper())
+    if not spec:
+        raise ValueError(f"Invalid index: {index}")
+    return spec
+
+
+def expiry_weekday(index: str, day: date) -> int:
+    """
+    Weekday contracts of an index expire on around a day (Monday is 0)
+
+    Args:
+        index: Index name
+        day: Any day of the expiry week or month
+
+    Returns:
+        int: Weekday number
+    """
+    weekday = None
+    for first_day, number in get_index_spec(index)['expiry_weekdays']:
+        if first_day > day:
+            break
+        weekday = number
+    return weekday
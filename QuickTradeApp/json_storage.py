@@ -3,11 +3,14 @@ JSON Storage Utility for QuickTradeApp
 Handles data persistence using JSON files instead of database
 """
 import json
+import logging
 import os
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, List, Any, Optional
 
+logger = logging.getLogger(__name__)
+
 class JSONStorage:
     """JSON-based storage system for QuickTradeApp"""
     
@@ -53,7 +56,7 @@ class JSONStorage:
             with open(file_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, indent=2, ensure_ascii=False)
         except Exception as e:
-            print(f"Error writing to {file_path}: {e}")
+            logger.error("Error writing to %s: %s", file_path, e)
     
     # User Management
     def save_user_session(self, user_id: str, session_data: Dict):
@@ -137,7 +140,7 @@ class JSONStorage:
         
         if expired_sessions:
             self._write_json(self.sessions_file, data)
-            print(f"Cleared {len(expired_sessions)} expired sessions")
+            logger.info("Cleared %d expired sessions", len(expired_sessions))
     
     def backup_data(self, backup_dir: str = "backups"):
         """Create a backup of all data"""
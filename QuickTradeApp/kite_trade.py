@@ -1,7 +1,31 @@
-from kiteconnect import KiteConnect
+import hashlib
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from .fyers_utils import get_ltp
-from .symbol_generator import generate_trading_symbol
+from functools import partial
+from django.core.cache import cache
+from .broker_clients import get_kite_client
+from .circuit_breaker import is_upstream_unavailable
+from .fyers_utils import get_option_quotes
+from .hedged_quotes import get_index_ltp
+from .symbol_generator import generate_trading_symbol, generate_strike_symbol, get_strike_price
+from .order_state import order_state
+from .instruments import get_index_spec
+from .order_slicer import FAILED_STATUSES, not_placed_message, slice_quantity, place_sliced_order
+from .rate_limiter import kite_order_limits
+from .ltp_cache import ltp_cache
+from .execution_stats import execution_tracker
+from .order_idempotency import ORDER_TIMEOUT, OrderStatusUnknown, make_order_tag, submit_with_tag
+from .linked_accounts import error_message, fan_out
+from .basket_orders import leg_skew, normalize_legs, submission_waves
+from .metrics import metrics
+from .paper_broker import is_paper_token, trading_access_token
+from .margin_cache import InsufficientMargin, is_insufficient_funds, margin_cache
+from .single_flight import kite_read
+from .symbol_codec import try_decode
+
+logger = logging.getLogger(__name__)
 
 
 class KiteApp:
@@ -26,6 +50,9 @@ class KiteApp:
     TRANSACTION_TYPE_BUY = "BUY"
     TRANSACTION_TYPE_SELL = "SELL"
 
+    # Last successful portfolio reads are served for this long while the broker is unavailable
+    LAST_GOOD_TTL = 86400  # seconds
+
     # Validity
     VALIDITY_DAY = "DAY"
     VALIDITY_IOC = "IOC"
@@ -38,31 +65,36 @@ class KiteApp:
     EXCHANGE_BFO = "BFO"
     EXCHANGE_MCX = "MCX"
 
-    def __init__(self, request=None, api_key=None, access_token=None):
+    def __init__(self, request=None, api_key=None, access_token=None, user_id=None):
         """Initialize with either request object or direct credentials"""
         if request:
             # Initialize with request object to get credentials from session
             api_key = request.session.get('api_key')
-            access_token = request.session.get('access_token')
+            access_token = trading_access_token(request.session)
+            user_id = user_id or request.session.get('zerodha_user_id')
             
             if not api_key or not access_token:
                 raise Exception("Kite credentials not found in session")
             
-            self.kite = KiteConnect(api_key=api_key)
-            self.kite.set_access_token(access_token)
+            self.kite = get_kite_client(api_key, access_token)
             self.request = request  # Store request for later use
         elif api_key and access_token:
             # Initialize with direct credentials
-            self.kite = KiteConnect(api_key=api_key)
-            self.kite.set_access_token(access_token)
+            self.kite = get_kite_client(api_key, access_token)
             self.request = None
         else:
             raise Exception("Either request object or api_key and access_token must be provided")
 
+        # Kite user id keys the postback driven order state, None disables it
+        # (paper accounts have no postbacks, their book is always current)
+        self.user_id = None if is_paper_token(access_token) else user_id
+        # Set when a read fell back to the last known data
+        self.stale = False
+
     def get_profile(self):
         return self.kite.get_profile()
 
-    def place_order(self, request, index, direction, quantity):
+    def place_order(self, request, index, direction, quantity, timeline=None, idempotency_key=None):
         """
         Place an order for the given index and direction
         
@@ -71,6 +103,8 @@ class KiteApp:
             index (str): Index name (e.g., 'NIFTY', 'BANKNIFTY')
             direction (str): Option direction ('CE' or 'PE')
             quantity (int): Number of lots to trade
+            timeline (OrderTimeline): Optional execution timeline to fill in
+            idempotency_key (str): Client key, sent to Kite as the order tag
             
         Returns:
             dict: Order response from Kite
@@ -80,124 +114,531 @@ class KiteApp:
             Exception: For API or other errors with detailed error info
         """
         try:
-            # Validate inputs
-            if not index or not direction or not quantity:
-                raise ValueError("Index, direction and quantity are required")
-                
-            if direction not in ['CE', 'PE']:
-                raise ValueError("Direction must be either 'CE' or 'PE'")
-                
-            if quantity <= 0:
-                raise ValueError("Quantity must be greater than 0")
+            kite, ltp, trading_symbol = self._prepare_order(request, index, direction, quantity, timeline)
+            return self._submit_entry(kite, trading_symbol, quantity, {
+                'index': index,
+                'direction': direction,
+                'quantity': quantity,
+                'trading_symbol': trading_symbol,
+                'ltp': ltp
+            }, timeline, make_order_tag(idempotency_key) if idempotency_key else None,
+                exchange=get_index_spec(index)['exchange'])
                 
-            # Validate session
-            api_key = request.session.get('api_key')
-            access_token = request.session.get('access_token')
+        except Exception as e:
+            # Re-raise the exception with all the context
+            raise
+
+    def place_sliced_order(self, request, index, direction, quantity, timeline=None, idempotency_key=None):
+        """
+        Place an order above the exchange freeze quantity as concurrent child orders
+        
+        Args:
+            request: Django request object containing session data
+            index (str): Index name (e.g., 'NIFTY', 'BANKNIFTY')
+            direction (str): Option direction ('CE' or 'PE')
+            quantity (int): Total quantity to trade
+            timeline (OrderTimeline): Optional execution timeline, copied per child
+            idempotency_key (str): Client key, each child gets its own tag from it
             
-            if not api_key or not access_token:
-                raise ValueError("Kite credentials not found in session")
-                
-            # Get LTP for the index
-            try:
-                ltp = get_ltp(request, index=index)
-                if not ltp:
-                    raise Exception(f"Unable to get LTP for {index}")
-            except Exception as e:
-                raise Exception(f"Error getting LTP for {index}: {str(e)}")
-                
-            # Generate trading symbol
+        Returns:
+            dict: Parent result with child order ids, fills and failures
+        """
+        kite, ltp, trading_symbol = self._prepare_order(request, index, direction, quantity, timeline)
+        return self.submit_prepared_order(kite, index, direction, quantity, ltp, trading_symbol,
+                                          timeline, idempotency_key)
+
+    def submit_prepared_order(self, kite, index, direction, quantity, ltp, trading_symbol,
+                              timeline=None, idempotency_key=None, transaction_type=TRANSACTION_TYPE_BUY,
+                              reduces_position=False):
+        """
+        Submit an entry whose LTP and trading symbol are already resolved,
+        as child orders at or below the exchange freeze quantity
+
+        Args:
+            kite: Kite client of the account, from get_kite_client
+            index (str): Index name (e.g., 'NIFTY', 'BANKNIFTY')
+            direction (str): Option direction ('CE' or 'PE')
+            quantity (int): Total quantity to trade
+            ltp (float): Index LTP the trading symbol was picked from
+            trading_symbol (str): Option contract to buy
+            timeline (OrderTimeline): Optional execution timeline, copied per child
+            idempotency_key (str): Client key, each child gets its own tag from it
+            transaction_type (str): BUY or SELL
+            reduces_position (bool): The order closes (part of) an open position,
+                it frees margin and skips the pre-trade margin check
+
+        Returns:
+            dict: Parent result with child order ids, fills and failures
+        """
+        spec = get_index_spec(index)
+        children = slice_quantity(quantity, spec['freeze_quantity'], spec['lot_size'])
+        tags = [make_order_tag(f"{idempotency_key}:{position}") if idempotency_key else None
+                for position in range(len(children))]
+
+        def submit(position, child_quantity):
+            tag = tags[position]
+            return self._submit_entry(kite, trading_symbol, child_quantity, {
+                'index': index,
+                'direction': direction,
+                'quantity': child_quantity,
+                'trading_symbol': trading_symbol,
+                'ltp': ltp
+            }, timeline.copy() if timeline else None, tag, transaction_type, spec['exchange'], reduces_position)
+
+        result = place_sliced_order(
+            submit,
+            children,
+            kite_order_limits.get(kite.api_key),
+            fetch_orders=kite.orders
+        )
+        # Duplicates of a request whose outcome is unknown look its orders up by these
+        for child, tag in zip(result['children'], tags):
+            if tag:
+                child['tag'] = tag
+        result.update({'trading_symbol': trading_symbol, 'ltp': ltp})
+        return result
+
+    def place_linked_order(self, request, accounts, index, direction, lots, timeline=None, idempotency_key=None):
+        """
+        Buy the same option in every account at once, each account trading
+        the clicked lots times its own multiplier
+
+        Args:
+            request: Django request object containing session data
+            accounts (list): Accounts from linked_accounts.fan_out_accounts
+            index (str): Index name (e.g., 'NIFTY', 'BANKNIFTY')
+            direction (str): Option direction ('CE' or 'PE')
+            lots (int): Lots clicked, multiplied per account
+            timeline (OrderTimeline): Optional execution timeline, copied per account
+            idempotency_key (str): Client key, each account gets its own tags from it
+
+        Returns:
+            dict: Per account results with ack and fill time spreads
+        """
+        spec = get_index_spec(index)
+        # One quote and one contract for every account
+        _, ltp, trading_symbol = self._prepare_order(request, index, direction, lots * spec['lot_size'], timeline)
+
+        def prepare(account):
+            if not account.get('api_key') or not account.get('access_token'):
+                raise Exception("Kite credentials not found for this account")
+            return get_kite_client(account['api_key'], account['access_token'], ORDER_TIMEOUT)
+
+        def execute(account, kite):
+            quantity = lots * account['multiplier'] * spec['lot_size']
+            key = f"{idempotency_key}:{account['user_id']}" if idempotency_key else None
+            result = self.submit_prepared_order(kite, index, direction, quantity, ltp, trading_symbol,
+                                                timeline.copy() if timeline else None, key)
+            outcome = {
+                'status': 'success' if result['success'] else 'failed',
+                'quantity': quantity,
+                'order_ids': result['order_ids'],
+                'tags': [child['tag'] for child in result['children'] if child.get('tag')],
+                'unknown_quantity': result['unknown_quantity'],
+                'filled_quantity': result['filled_quantity'],
+                'average_price': result['average_price'],
+                'acked_at': max(child['acked_at'] for child in result['children']),
+                'filled_at': result['filled_at'],
+            }
+            errors = [child['error'] for child in result['children'] if child.get('error')]
+            if errors:
+                outcome['error'] = errors[0]
+            return outcome
+
+        result = fan_out(accounts, 'order', prepare, execute)
+        result.update({'trading_symbol': trading_symbol, 'ltp': ltp})
+        return result
+
+    def exit_all_linked(self, accounts):
+        """
+        Exit all open positions in every account at once
+
+        Args:
+            accounts (list): Accounts from linked_accounts.fan_out_accounts
+
+        Returns:
+            dict: Per account results with the ack time spread
+        """
+        def execute(account, kite):
+            result = kite.exit_all_positions()
+            if not result['details']:
+                return {'status': 'skipped', 'message': result['message']}
+            return {
+                'status': 'success' if result['success'] else 'failed',
+                'message': result['message'],
+                'details': result['details'],
+            }
+
+        return fan_out(accounts, 'exit_all', self._linked_app, execute)
+
+    def exit_position_linked(self, accounts, symbol):
+        """
+        Exit a position in every account that holds it
+
+        Args:
+            accounts (list): Accounts from linked_accounts.fan_out_accounts
+            symbol (str): Trading symbol to exit
+
+        Returns:
+            dict: Per account results, accounts without the position are skipped
+        """
+        def execute(account, kite):
             try:
-                trading_symbol = generate_trading_symbol(request, index, direction, ltp)
-                if not trading_symbol:
-                    raise Exception(f"Unable to generate trading symbol for {index} {direction}")
+                return {'status': 'success', 'order_ids': kite.exit_position(symbol)}
             except Exception as e:
-                raise Exception(f"Error generating trading symbol for {index} {direction}: {str(e)}")
-                
-            # Initialize Kite Connect
+                if f"No open position found for {symbol}" in str(e):
+                    return {'status': 'skipped', 'message': f"No open position in {symbol}"}
+                raise
+
+        return fan_out(accounts, 'exit_position', self._linked_app, execute)
+
+    def _linked_app(self, account):
+        """KiteApp of an account taking part in a fan-out"""
+        if account.get('primary'):
+            return self
+        return KiteApp(api_key=account.get('api_key'), access_token=account.get('access_token'),
+                       user_id=account.get('user_id'))
+
+    def place_basket_order(self, request, index, legs, rollback=False, hedge_first=True,
+                           timeline=None, idempotency_key=None):
+        """
+        Place a multi-leg basket resolved against one underlying quote
+        
+        Args:
+            request: Django request object containing session data
+            index (str): Index name (e.g., 'NIFTY', 'BANKNIFTY')
+            legs (list): Leg dicts with side, direction, offset (strikes from ATM) and lots
+            rollback (bool): Unwind the placed legs if any leg fails
+            hedge_first (bool): Submit buy legs before sell legs
+            timeline (OrderTimeline): Optional execution timeline, copied per leg
+            idempotency_key (str): Client key, each leg gets its own tags from it
+            
+        Returns:
+            dict: Per leg results, leg skew and rollback outcome
+            
+        Raises:
+            ValueError: If the legs are invalid
+        """
+        spec = get_index_spec(index)
+        legs = normalize_legs(legs)
+
+        api_key = request.session.get('api_key')
+        access_token = trading_access_token(request.session)
+        if not api_key or not access_token:
+            raise ValueError("Kite credentials not found in session")
+
+        # Every leg is priced off the same quote
+        ltp = self._index_ltp(request, index)
+        if timeline:
+            timeline.mark('quoted')
+        atm_strike = get_strike_price(ltp, index)
+        for leg in legs:
+            leg['strike'] = atm_strike + leg['offset'] * spec['strike_interval']
+            leg['trading_symbol'] = generate_strike_symbol(request, index, leg['direction'], leg['strike'])
+            leg['quantity'] = leg['lots'] * spec['lot_size']
+
+        kite = get_kite_client(api_key, access_token, ORDER_TIMEOUT)
+
+        def submit(position):
+            leg = legs[position]
+            leg_timeline = None
+            if timeline:
+                leg_timeline = timeline.copy()
+                leg_timeline.tradingsymbol = leg['trading_symbol']
+                leg_timeline.transaction_type = leg['side']
+                leg_timeline.decision_premium = ltp_cache.get(leg['trading_symbol'], max_age=2)
+            key = f"{idempotency_key}:leg{position}" if idempotency_key else None
             try:
-                kite = KiteConnect(api_key=api_key)
-                kite.set_access_token(access_token)
+                result = self.submit_prepared_order(kite, index, leg['direction'], leg['quantity'], ltp,
+                                                    leg['trading_symbol'], leg_timeline, key, leg['side'])
             except Exception as e:
-                raise Exception(f"Error initializing Kite Connect: {str(e)}")
-                
-            # Place order
+                leg.update({'status': 'failed', 'error': error_message(e)})
+                return
+            leg.update({
+                'status': 'success' if result['success'] else 'failed',
+                'order_ids': result['order_ids'],
+                'tags': [child['tag'] for child in result['children'] if child.get('tag')],
+                'unknown_quantity': result['unknown_quantity'],
+                'filled_quantity': result['filled_quantity'],
+                'average_price': result['average_price'],
+                'acked_at': max(child['acked_at'] for child in result['children']),
+                'filled_at': result['filled_at'],
+                'children': result['children'],
+            })
+            errors = [child['error'] for child in result['children'] if child.get('error')]
+            if errors:
+                leg['error'] = error_message(errors[0])
+
+        waves = submission_waves(legs, hedge_first)
+        for wave_number, wave in enumerate(waves):
+            with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+                list(executor.map(submit, wave))
+            # Never leave short legs without the hedges they were sized against
+            if any(legs[position]['status'] == 'failed' for position in wave):
+                for later in waves[wave_number + 1:]:
+                    for position in later:
+                        legs[position]['status'] = 'not_submitted'
+                break
+
+        success = all(leg['status'] == 'success' for leg in legs)
+        result = {
+            'success': success,
+            'ltp': ltp,
+            'atm_strike': atm_strike,
+            'legs': legs,
+            **leg_skew(legs),
+            'rolled_back': False,
+        }
+        if not success and rollback:
+            # Unwind in reverse wave order, shorts before their hedges
+            placed = [position for wave in reversed(waves) for position in wave if legs[position].get('order_ids')]
+            result['rollback'] = [self._rollback_leg(kite, index, ltp, legs[position]) for position in placed]
+            result['rolled_back'] = all(entry['status'] == 'success' for entry in result['rollback'])
+
+        for leg in legs:
+            leg.pop('children', None)
+        metrics.inc('quicktrade_basket_orders_total', {
+            'outcome': 'success' if success else ('rolled_back' if result['rolled_back'] else 'failed')
+        })
+        return result
+
+    def _rollback_leg(self, kite, index, ltp, leg):
+        """Cancel the open orders of a leg and reverse what it filled"""
+        entry = {'trading_symbol': leg['trading_symbol'], 'cancelled': [], 'status': 'success'}
+        for child in leg.get('children', []):
+            if child.get('order_id') and child['status'] not in FAILED_STATUSES and child['status'] != 'COMPLETE':
+                try:
+                    kite.cancel_order(variety=self.VARIETY_REGULAR, order_id=child['order_id'])
+                    entry['cancelled'].append(child['order_id'])
+                except Exception as e:
+                    entry.update({'status': 'failed', 'error': f"Cancel {child['order_id']}: {str(e)}"})
+
+        filled = sum(child.get('filled_quantity', 0) for child in leg.get('children', []))
+        entry['reversed_quantity'] = filled
+        if filled:
+            opposite = self.TRANSACTION_TYPE_SELL if leg['side'] == self.TRANSACTION_TYPE_BUY else self.TRANSACTION_TYPE_BUY
             try:
-                order_response = kite.place_order(
-                    variety=self.VARIETY_REGULAR,
-                    exchange=self.EXCHANGE_NFO,
-                    tradingsymbol=trading_symbol,
-                    transaction_type=self.TRANSACTION_TYPE_BUY,
-                    quantity=quantity,
-                    product=self.PRODUCT_MIS,
-                    order_type=self.ORDER_TYPE_MARKET,
-                    price=None,
-                    validity=self.VALIDITY_DAY
-                )
-                
-                return order_response
-                
+                # Buying back a filled short leg closes it, no margin check may block that
+                reversal = self.submit_prepared_order(kite, index, leg['direction'], filled, ltp,
+                                                      leg['trading_symbol'], transaction_type=opposite,
+                                                      reduces_position=True)
+                entry['order_ids'] = reversal['order_ids']
+                if reversal['order_ids']:
+                    margin_cache.exited(kite)
+                if not reversal['success']:
+                    entry.update({'status': 'failed', 'error': f"{reversal['failed_quantity']} quantity not reversed"})
             except Exception as e:
-                # Use the new error parsing method
-                additional_info = {
-                    'index': index,
-                    'direction': direction,
-                    'quantity': quantity,
-                    'trading_symbol': trading_symbol,
-                    'ltp': ltp
-                }
-                raise Exception(self._parse_kite_error(e, 'place_order', additional_info))
-                
+                entry.update({'status': 'failed', 'error': str(e)})
+        return entry
+
+    def _prepare_order(self, request, index, direction, quantity, timeline=None):
+        """Validate an entry order and resolve its LTP and trading symbol"""
+        # Validate inputs
+        if not index or not direction or not quantity:
+            raise ValueError("Index, direction and quantity are required")
+            
+        if direction not in ['CE', 'PE']:
+            raise ValueError("Direction must be either 'CE' or 'PE'")
+            
+        if quantity <= 0:
+            raise ValueError("Quantity must be greater than 0")
+            
+        # Validate session
+        api_key = request.session.get('api_key')
+        access_token = trading_access_token(request.session)
+        
+        if not api_key or not access_token:
+            raise ValueError("Kite credentials not found in session")
+            
+        # Get LTP for the index
+        ltp = self._index_ltp(request, index)
+        if timeline:
+            timeline.mark('quoted')
+            
+        # Generate trading symbol
+        try:
+            trading_symbol = generate_trading_symbol(request, index, direction, ltp)
+            if not trading_symbol:
+                raise Exception(f"Unable to generate trading symbol for {index} {direction}")
         except Exception as e:
-            # Re-raise the exception with all the context
-            raise
+            raise Exception(f"Error generating trading symbol for {index} {direction}: {str(e)}")
+
+        # Premium at decision time, quoted alongside the order when not cached
+        if timeline:
+            timeline.tradingsymbol = trading_symbol
+            timeline.decision_premium = ltp_cache.get(trading_symbol, max_age=2)
+            exchange = get_index_spec(index)['exchange']
+            timeline.fetch_premium(lambda: get_option_quotes(
+                request, [{'tradingsymbol': trading_symbol, 'exchange': exchange}]
+            ).get(trading_symbol))
+            
+        # Initialize Kite Connect with a short timeout, timeouts are resolved by tag
+        try:
+            kite = get_kite_client(api_key, access_token, ORDER_TIMEOUT)
+        except Exception as e:
+            raise Exception(f"Error initializing Kite Connect: {str(e)}")
+
+        return kite, ltp, trading_symbol
+
+    def _index_ltp(self, request, index):
+        """Index LTP for order decisions, upstream outages are passed on unchanged"""
+        try:
+            ltp = get_index_ltp(request, index=index)
+            if not ltp:
+                raise Exception(f"Unable to get LTP for {index}")
+            return ltp
+        except Exception as e:
+            if is_upstream_unavailable(e):
+                raise
+            raise Exception(f"Error getting LTP for {index}: {str(e)}")
+
+    def _submit_entry(self, kite, trading_symbol, quantity, additional_info, timeline=None, tag=None,
+                      transaction_type=TRANSACTION_TYPE_BUY, exchange=EXCHANGE_NFO, reduces_position=False):
+        """Submit a MIS market order (a buy unless told otherwise) and translate Kite errors"""
+        held = 0.0
+        try:
+            # Orders the cached margin can not cover never reach Kite
+            held = margin_cache.hold(kite, exchange, trading_symbol, transaction_type, quantity,
+                                     self.PRODUCT_MIS, self.user_id, reduces_position)
+            if timeline:
+                timeline.mark('submitted')
+            # Tagged orders survive timeouts without being placed twice
+            submit = partial(submit_with_tag, kite, tag) if tag else kite.place_order
+            order_response = submit(
+                variety=self.VARIETY_REGULAR,
+                exchange=exchange,
+                tradingsymbol=trading_symbol,
+                transaction_type=transaction_type,
+                quantity=quantity,
+                product=self.PRODUCT_MIS,
+                order_type=self.ORDER_TYPE_MARKET,
+                price=None,
+                validity=self.VALIDITY_DAY
+            )
+            if timeline:
+                timeline.mark('acked')
+                # Paper fills would skew the execution stats of real orders
+                if not is_paper_token(kite.access_token):
+                    execution_tracker.track(self.user_id or kite.api_key, order_response, quantity, timeline)
+            
+            return order_response
+            
+        except Exception as e:
+            if not isinstance(e, OrderStatusUnknown):
+                margin_cache.release(kite, held)
+            if is_insufficient_funds(e) and not isinstance(e, InsufficientMargin):
+                # Kite disagrees with the cached margin
+                margin_cache.broker_rejected(kite, str(e))
+            # Use the new error parsing method
+            message = self._parse_kite_error(e, 'place_order', additional_info)
+            if isinstance(e, OrderStatusUnknown):
+                # The order may exist, slicing must not count it as failed
+                raise OrderStatusUnknown(message)
+            raise Exception(message)
+
+    def account_state(self, fresh=False):
+        """
+        Get the postback driven order state of this account, reconciling it
+        against the order book API when it is missing or stale
+
+        Args:
+            fresh: Reconcile with reads of its own, not one already in flight
+
+        Returns:
+            AccountState: Account state, or None if it can not be used
+        """
+        if not self.user_id:
+            return None
+        state = None
+        try:
+            state = order_state.get(self.user_id)
+            if not state.is_fresh():
+                state = order_state.reconcile(self.user_id, self.kite, fresh)
+            return state
+        except Exception as e:
+            # A stale state beats an empty page while Kite is unavailable
+            if state is not None and state.reconciled_at and is_upstream_unavailable(e):
+                self.stale = True
+                return state
+            logger.warning("Order state of %s unavailable, reading Kite directly: %s", self.user_id, e)
+            return None
+
+    def _last_good_key(self, name):
+        token = hashlib.sha1(str(self.kite.access_token).encode('utf-8')).hexdigest()[:16]
+        return f"kite_last_good:{token}:{name}"
+
+    def _remember(self, name, value):
+        """Keep a successful read to fall back on"""
+        cache.set(self._last_good_key(name), value, self.LAST_GOOD_TTL)
+        return value
+
+    def _last_good(self, name, default):
+        """Last successful read of this account, marking the result as stale"""
+        self.stale = True
+        value = cache.get(self._last_good_key(name))
+        return default if value is None else value
 
     def positions(self):
         """Get current positions"""
+        state = self.account_state()
+        if state:
+            return state.position_list()
         try:
-            positions = self.kite.positions()
-            return positions
+            positions = kite_read(self.kite, 'positions')
+            return self._remember('positions', positions)
         except Exception as e:
-            return {"net": []}
+            logger.warning("Kite positions read failed, serving the last known positions: %s", e)
+            return self._last_good('positions', {"net": []})
 
     def orders(self):
         """Get current orders"""
+        state = self.account_state()
+        if state:
+            return state.order_list()
         try:
-            orders = self.kite.orders()
-            return orders
+            orders = kite_read(self.kite, 'orders')
+            return self._remember('orders', orders)
         except Exception as e:
-            return []
+            logger.warning("Kite orders read failed, serving the last known orders: %s", e)
+            return self._last_good('orders', [])
 
-    def order_history(self):
+    def order_history(self, orders=None):
         """Get today's order history sorted by latest first"""
         try:
             # Get all orders
-            orders = self.kite.orders()
+            if orders is None:
+                orders = self.orders()
             # Filter orders from today
             today = datetime.now().date()
             filtered_orders = [
                 order for order in orders 
-                if order.get('order_timestamp').date() == today
+                if hasattr(order.get('order_timestamp'), 'date') and order.get('order_timestamp').date() == today
             ]
             # Sort by timestamp in descending order (latest first)
             sorted_orders = sorted(filtered_orders, key=lambda x: x.get('order_timestamp'), reverse=True)
             return sorted_orders
         except Exception as e:
+            logger.warning("Order history unavailable: %s", e)
             return []
 
     def get_portfolio(self):
         """Get complete portfolio data including positions, orders and history"""
         try:
+            orders = self.orders()
             portfolio = {
                 "positions": self.positions(),
-                "orders": self.orders(),
-                "history": self.order_history()
+                "orders": orders,
+                "history": self.order_history(orders),
+                "stale": self.stale
             }
             return portfolio
         except Exception as e:
+            logger.exception("Portfolio read failed")
             return {
                 "positions": {"net": []},
                 "orders": [],
-                "history": []
+                "history": [],
+                "stale": True
             }
 
     def exit_all_positions(self):
@@ -211,7 +652,7 @@ class KiteApp:
             Exception: If there are critical errors during the process
         """
         try:
-            positions = self.kite.positions()["net"]
+            positions = self._net_positions()
             if not positions:
                 return {
                     'success': True,
@@ -224,25 +665,23 @@ class KiteApp:
             exit_results = []
             successful_exits = 0
             failed_exits = 0
+            orders_placed = False
 
             for pos in positions:
+                result = None
                 try:
-                    if pos["product"] == "MIS" and pos["exchange"] == "NFO" and pos["quantity"] != 0:
-                        order_id = self.kite.place_order(
-                            variety="regular",
-                            exchange=pos["exchange"],
-                            tradingsymbol=pos["tradingsymbol"],
-                            transaction_type="SELL" if pos["quantity"] > 0 else "BUY",
-                            quantity=abs(pos["quantity"]),
-                            product=pos["product"],
-                            order_type="MARKET",
-                            validity="DAY"
-                        )
+                    if (pos["product"] == "MIS" and pos["exchange"] in (self.EXCHANGE_NFO, self.EXCHANGE_BFO)
+                            and pos["quantity"] != 0):
+                        result = self._place_exit(pos)
+                        orders_placed = orders_placed or bool(result['order_ids'])
+                        if not result['success']:
+                            raise Exception(self._exit_failure(result))
                         
                         exit_results.append({
                             'symbol': pos["tradingsymbol"],
                             'status': 'success',
-                            'order_id': order_id,
+                            'order_id': result['order_ids'][0],
+                            'order_ids': result['order_ids'],
                             'quantity': abs(pos["quantity"]),
                             'transaction_type': "SELL" if pos["quantity"] > 0 else "BUY"
                         })
@@ -250,6 +689,7 @@ class KiteApp:
                         
                 except Exception as e:
                     error_message = str(e)
+                    logger.warning("Exit of %s failed: %s", pos["tradingsymbol"], error_message)
                     error_details = {
                         'symbol': pos["tradingsymbol"],
                         'status': 'failed',
@@ -257,6 +697,9 @@ class KiteApp:
                         'quantity': abs(pos["quantity"]),
                         'transaction_type': "SELL" if pos["quantity"] > 0 else "BUY"
                     }
+                    if result and result['order_ids']:
+                        # Slices that went through still closed part of the position
+                        error_details['order_ids'] = result['order_ids']
                     
                     # Parse common exit errors
                     if 'insufficient holdings' in error_message.lower():
@@ -278,6 +721,9 @@ class KiteApp:
                     exit_results.append(error_details)
                     failed_exits += 1
 
+            if orders_placed:
+                margin_cache.exited(self.kite)
+
             return {
                 'success': failed_exits == 0,
                 'message': f'Exited {successful_exits} positions successfully, {failed_exits} failed',
@@ -290,6 +736,60 @@ class KiteApp:
             error_message = str(e)
             raise Exception(f"EXIT_ALL_ERROR:CRITICAL_ERROR:Failed to process exit all positions:{error_message}")
 
+    def _place_exit(self, pos):
+        """
+        Close a net position with market orders at or below the exchange freeze
+        quantity, submitted concurrently within the account's order rate limit
+
+        Args:
+            pos (dict): Net position row (tradingsymbol, exchange, product, quantity)
+
+        Returns:
+            dict: Parent result of the exit orders, see place_sliced_order
+        """
+        quantity = abs(pos["quantity"])
+        transaction_type = self.TRANSACTION_TYPE_SELL if pos["quantity"] > 0 else self.TRANSACTION_TYPE_BUY
+        contract = try_decode(pos["tradingsymbol"])
+        if contract:
+            spec = get_index_spec(contract.index)
+            children = slice_quantity(quantity, spec['freeze_quantity'], spec['lot_size'])
+        else:
+            children = [quantity]
+
+        # Tagged slices survive timeouts without being placed twice
+        exit_id = uuid.uuid4().hex
+
+        def submit(position, child_quantity):
+            return submit_with_tag(
+                self.kite,
+                make_order_tag(f"exit:{exit_id}:{position}"),
+                variety=self.VARIETY_REGULAR,
+                exchange=pos["exchange"],
+                tradingsymbol=pos["tradingsymbol"],
+                transaction_type=transaction_type,
+                quantity=child_quantity,
+                product=pos["product"],
+                order_type=self.ORDER_TYPE_MARKET,
+                validity=self.VALIDITY_DAY
+            )
+
+        return place_sliced_order(submit, children, kite_order_limits.get(self.kite.api_key))
+
+    @staticmethod
+    def _exit_failure(result):
+        """Error of an exit some slices of which were not placed"""
+        message = not_placed_message(result, 'exited')
+        if result['order_ids']:
+            message += f" (placed {', '.join(str(order_id) for order_id in result['order_ids'])})"
+        return message
+
+    def _net_positions(self):
+        """Net positions for exit logic, from the order state when it is fresh"""
+        state = self.account_state(fresh=True)
+        if state:
+            return state.position_list()["net"]
+        return self.kite.positions()["net"]
+
     def _parse_kite_error(self, error, operation_type, additional_info=None):
         """
         Parse Kite API errors and return detailed error information
@@ -313,7 +813,11 @@ class KiteApp:
             error_details.update(additional_info)
         
         # Parse common Kite error patterns
-        if 'insufficient funds' in error_message.lower():
+        if isinstance(error, OrderStatusUnknown):
+            error_details['error_code'] = 'ORDER_STATUS_UNKNOWN'
+            error_details['user_message'] = 'Order status could not be confirmed'
+            error_details['suggestion'] = 'Check your orders before placing it again, retrying this request is safe'
+        elif 'insufficient funds' in error_message.lower():
             error_details['error_code'] = 'INSUFFICIENT_FUNDS'
             error_details['user_message'] = 'Insufficient funds in your account'
             error_details['suggestion'] = 'Please check your account balance and margin requirements'
@@ -369,14 +873,14 @@ class KiteApp:
             symbol (str): Trading symbol to exit
             
         Returns:
-            str: Order ID of the exit order
+            list: Order ids of the exit orders, one per freeze quantity slice
             
         Raises:
             Exception: If there are errors during the process
         """
         try:
             # Get current positions
-            positions = self.kite.positions()["net"]
+            positions = self._net_positions()
             target_position = None
             
             # Find the position with the given symbol
@@ -388,19 +892,14 @@ class KiteApp:
             if not target_position:
                 raise Exception(f"No open position found for {symbol}")
                 
-            # Place exit order
-            order_id = self.kite.place_order(
-                variety="regular",
-                exchange=target_position["exchange"],
-                tradingsymbol=target_position["tradingsymbol"],
-                transaction_type="SELL" if target_position["quantity"] > 0 else "BUY",
-                quantity=abs(target_position["quantity"]),
-                product=target_position["product"],
-                order_type="MARKET",
-                validity="DAY"
-            )
+            # Place exit orders
+            result = self._place_exit(target_position)
+            if result['order_ids']:
+                margin_cache.exited(self.kite)
+            if not result['success']:
+                raise Exception(self._exit_failure(result))
             
-            return order_id
+            return result['order_ids']
             
         except Exception as e:
             # Parse and raise detailed error
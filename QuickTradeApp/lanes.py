@@ -0,0 +1,285 @@
+"""
+Request lanes for QuickTradeApp
+Every request of a gunicorn worker shares the same few threads. The
+middleware sorts requests into lanes by route: order and exit requests, and
+the login and broker auth callbacks (a shed callback loses its one-time
+request token), are never held back. Read-only requests (dashboard polls,
+P&L, risk, chains), history exports (a streamed export keeps its thread
+until the download ends) and everything else may only hold a bounded number
+of threads, running or queued. The threads left over are reserved for
+orders, so a backlog of dashboard polls can not delay a place_order or
+exit_all.
+
+A read that finds its lane and queue full is shed: it gets the last
+response served to the same session for the same URL if that is recent
+enough, otherwise a 503 with Retry-After
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from django.http import HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+
+from .config import (EXPORT_LANE_CONCURRENCY, EXPORT_LANE_QUEUE, OTHER_LANE_CONCURRENCY, OTHER_LANE_QUEUE,
+                     READ_LANE_CONCURRENCY, READ_LANE_QUEUE, REQUEST_LANES, WORKER_THREADS)
+from .metrics import metrics
+
+ORDER = 'order'
+AUTH = 'auth'
+READ = 'read'
+EXPORT = 'export'
+OTHER = 'other'
+
+# Routes (URL names) by lane, anything else is OTHER
+ORDER_ROUTES = {'place_order', 'basket_order', 'exit_all', 'exit_position', 'sl_monitor_cancel', 'kite_postback'}
+AUTH_ROUTES = {'login', 'zerodha_login', 'zerodha_callback', 'fyers_login', 'fyers_auth_redirect', 'fyers_callback',
+               'logout'}
+READ_ROUTES = {'dashboard', 'portfolio_mtm', 'portfolio_risk', 'option_chain', 'candles', 'execution_stats',
+               'get_index_price'}
+EXPORT_ROUTES = {'history_export'}
+
+# Setting a stop-loss protects a position like an order does, reading it is a poll
+_ROUTES_BY_METHOD = {'sl_monitor': {'POST': ORDER, 'GET': READ}}
+
+# Reads running at once while an order request is in flight: threads are not the only
+# thing they share, every request of a worker takes turns on the same interpreter lock
+YIELD_CONCURRENCY = 1
+
+# How long a queued request waits for a thread of its lane before it is shed
+QUEUE_WAIT = {READ: 0.5, EXPORT: 2.0, OTHER: 2.0}  # seconds
+
+# Shed reads are answered with the session's last response for the URL up to this old
+SNAPSHOT_MAX_AGE = 60  # seconds
+SNAPSHOT_ENTRIES = 1024
+
+# Retry-After of a shed request with no snapshot
+RETRY_AFTER = 2  # seconds
+
+metrics.describe('quicktrade_lane_requests_total', 'counter', "Requests per lane by outcome")
+metrics.describe('quicktrade_lane_wait_seconds', 'summary', "Time queued requests waited for a thread of their lane")
+metrics.describe('quicktrade_lane_in_flight', 'gauge', "Requests running per lane")
+
+
+class Lane:
+    """Bounded number of running requests plus a bounded queue of waiting ones"""
+
+    def __init__(self, name: str, concurrency: Optional[int] = None, queue: int = 0, wait: float = 0.0,
+                 yields_to: Optional['Lane'] = None):
+        self.name = name
+        self.concurrency = concurrency  # None: unbounded
+        self.queue = queue
+        self.wait = wait
+        # While a request of that lane is in flight, this one only runs YIELD_CONCURRENCY at once
+        self.yields_to = yields_to
+        self.yielding: List['Lane'] = []
+        self.in_flight = 0
+        self.waiting = 0
+        self._ready = threading.Condition()
+        if yields_to is not None:
+            yields_to.yielding.append(self)
+
+    @property
+    def capacity(self) -> Optional[int]:
+        """Threads the lane can hold at most, running or queued"""
+        return None if self.concurrency is None else self.concurrency + self.queue
+
+    def _limit(self) -> Optional[int]:
+        if self.yields_to is not None and self.yields_to.in_flight:
+            return min(self.concurrency, YIELD_CONCURRENCY)
+        return self.concurrency
+
+    def acquire(self) -> Optional[float]:
+        """
+        Take a slot, queueing for up to the lane's wait
+
+        Returns:
+            float: Seconds waited, None if the request is shed
+        """
+        with self._ready:
+            if self.concurrency is None or self.in_flight < self._limit():
+                self.in_flight += 1
+                return 0.0
+            if self.waiting >= self.queue:
+                return None
+            self.waiting += 1
+            started = time.perf_counter()
+            try:
+                deadline = started + self.wait
+                while self.in_flight >= self._limit():
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        return None
+                    self._ready.wait(remaining)
+                self.in_flight += 1
+                return time.perf_counter() - started
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._ready:
+            self.in_flight -= 1
+            self._ready.notify()
+        # Lanes held back while this one was busy may run again
+        for lane in self.yielding:
+            with lane._ready:
+                lane._ready.notify_all()
+
+
+class RequestLanes:
+    """Lanes of one worker and the snapshots of shed reads"""
+
+    def __init__(self, threads: int = WORKER_THREADS, enabled: bool = REQUEST_LANES):
+        self.threads = threads
+        self.enabled = enabled
+        self.lanes: Dict[str, Lane] = {
+            ORDER: Lane(ORDER),
+            AUTH: Lane(AUTH),
+        }
+        self.lanes[READ] = Lane(READ, READ_LANE_CONCURRENCY, READ_LANE_QUEUE, QUEUE_WAIT[READ],
+                                yields_to=self.lanes[ORDER])
+        self.lanes[EXPORT] = Lane(EXPORT, EXPORT_LANE_CONCURRENCY, EXPORT_LANE_QUEUE, QUEUE_WAIT[EXPORT])
+        self.lanes[OTHER] = Lane(OTHER, OTHER_LANE_CONCURRENCY, OTHER_LANE_QUEUE, QUEUE_WAIT[OTHER])
+        self._snapshots: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def reserved(self) -> int:
+        """Threads only order requests can use"""
+        return self.threads - sum(lane.capacity for lane in self.lanes.values() if lane.capacity is not None)
+
+    def remember(self, key: tuple, response):
+        """Keep a successful read to answer the same session with when shedding"""
+        if response.status_code != 200 or response.streaming:
+            return
+        entry = (time.time(), response.content, response.get('Content-Type'))
+        with self._lock:
+            self._snapshots[key] = entry
+            self._snapshots.move_to_end(key)
+            while len(self._snapshots) > SNAPSHOT_ENTRIES:
+                self._snapshots.popitem(last=False)
+
+    def snapshot(self, key: tuple) -> Optional[HttpResponse]:
+        """Last read response for a session and URL, if recent enough"""
+        with self._lock:
+            entry = self._snapshots.get(key)
+        if entry is None or time.time() - entry[0] > SNAPSHOT_MAX_AGE:
+            return None
+        stored_at, content, content_type = entry
+        response = HttpResponse(content, content_type=content_type)
+        response['X-QuickTrade-Snapshot'] = f"{time.time() - stored_at:.1f}"
+        return response
+
+
+@lru_cache(maxsize=512)
+def _route(path: str) -> Optional[str]:
+    try:
+        return resolve(path).url_name
+    except Resolver404:
+        return None
+
+
+def classify(request) -> str:
+    """Lane of a request, from its route and method"""
+    route = _route(request.path_info)
+    if route in ORDER_ROUTES:
+        return ORDER
+    if route in AUTH_ROUTES:
+        return AUTH
+    if route in READ_ROUTES:
+        return READ
+    if route in EXPORT_ROUTES:
+        return EXPORT
+    by_method = _ROUTES_BY_METHOD.get(route)
+    if by_method:
+        return by_method.get(request.method, OTHER)
+    return OTHER
+
+
+def overloaded_response() -> JsonResponse:
+    response = JsonResponse({
+        'success': False,
+        'error': 'Server is busy',
+        'error_code': 'OVERLOADED',
+        'suggestion': f'Please retry in {RETRY_AFTER} seconds',
+    }, status=503)
+    response['Retry-After'] = str(RETRY_AFTER)
+    return response
+
+
+class ReleasingContent:
+    """Streaming content that gives its lane back once the last chunk is sent or the response is closed"""
+
+    def __init__(self, content, release):
+        self._content = iter(content)
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._content)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        # The server closes the response even when it never sent the body
+        if not self._released:
+            self._released = True
+            self._release()
+
+
+class RequestLaneMiddleware:
+    """Admit each request through the lane of its route"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request_lanes.enabled:
+            return self.get_response(request)
+
+        name = classify(request)
+        lane = request_lanes.lanes[name]
+        session = getattr(request, 'session', None)
+        session_key = session.session_key if session is not None else None
+        snapshot_key = (session_key, request.get_full_path()) if name == READ and session_key else None
+
+        waited = lane.acquire()
+        if waited is None:
+            response = request_lanes.snapshot(snapshot_key) if snapshot_key and request.method == 'GET' else None
+            metrics.inc('quicktrade_lane_requests_total', {'lane': name, 'outcome': 'snapshot' if response else 'shed'})
+            return response or overloaded_response()
+
+        metrics.inc('quicktrade_lane_requests_total', {'lane': name, 'outcome': 'queued' if waited else 'admitted'})
+        if waited:
+            metrics.observe('quicktrade_lane_wait_seconds', waited, {'lane': name})
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            lane.release()
+            raise
+        if response.streaming:
+            # A streamed body (history export) holds its thread until the last chunk is sent
+            response.streaming_content = ReleasingContent(response.streaming_content, lane.release)
+        else:
+            lane.release()
+        if snapshot_key and request.method == 'GET':
+            request_lanes.remember(snapshot_key, response)
+        return response
+
+
+def _collect_in_flight():
+    for name, lane in request_lanes.lanes.items():
+        metrics.set('quicktrade_lane_in_flight', lane.in_flight, {'lane': name})
+
+
+# Global instance
+request_lanes = RequestLanes()
+
+metrics.add_collector(_collect_in_flight)
@@ -0,0 +1,173 @@
+"""
+Linked accounts for QuickTradeApp
+Extra Kite accounts (family, prop) logged in next to the primary one, so a
+single CALL/PUT or exit fans out to every account at once. Each account
+trades its own multiple of the clicked lots, orders go out within the order
+rate limit of its own API key, and all accounts submit together so their
+fills land as close to each other as possible
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from .metrics import metrics
+from .paper_broker import is_paper_session, paper_token, trading_access_token
+
+# Session keys
+LINKED_ACCOUNTS_KEY = 'linked_accounts'
+PENDING_LINK_KEY = 'pending_link'
+
+MAX_LINKED_ACCOUNTS = 10
+MAX_LOT_MULTIPLIER = 20
+
+# How long an account waits for the others before submitting alone
+START_BARRIER_TIMEOUT = 5  # seconds
+
+metrics.describe('quicktrade_fanout_orders_total', 'counter', "Linked account fan-out results per account by action and outcome")
+metrics.describe('quicktrade_fanout_spread_seconds', 'summary',
+                 "Time between the first and the last account of a fan-out (ack or fill)")
+
+
+def get_linked_accounts(session) -> List[Dict]:
+    """Linked accounts stored in the session (user_id, api_key, access_token, multiplier)"""
+    return list(session.get(LINKED_ACCOUNTS_KEY) or [])
+
+
+def link_account(session, user_id: str, api_key: str, access_token: str, multiplier: int):
+    """
+    Add or replace a linked account in the session
+
+    Raises:
+        ValueError: If the account is the primary one, the multiplier is out
+            of range or too many accounts are linked
+    """
+    if user_id and user_id == session.get('zerodha_user_id'):
+        raise ValueError("This is the account you are logged in with")
+    if not 1 <= multiplier <= MAX_LOT_MULTIPLIER:
+        raise ValueError(f"Lot multiplier must be between 1 and {MAX_LOT_MULTIPLIER}")
+
+    accounts = [account for account in get_linked_accounts(session) if account['user_id'] != user_id]
+    if len(accounts) >= MAX_LINKED_ACCOUNTS:
+        raise ValueError(f"At most {MAX_LINKED_ACCOUNTS} accounts can be linked")
+    accounts.append({
+        'user_id': user_id,
+        'api_key': api_key,
+        'access_token': access_token,
+        'multiplier': multiplier,
+    })
+    session[LINKED_ACCOUNTS_KEY] = accounts
+
+
+def unlink_account(session, user_id: str) -> bool:
+    """Remove a linked account, True if it was linked"""
+    accounts = get_linked_accounts(session)
+    remaining = [account for account in accounts if account['user_id'] != user_id]
+    session[LINKED_ACCOUNTS_KEY] = remaining
+    return len(remaining) != len(accounts)
+
+
+def fan_out_accounts(session) -> List[Dict]:
+    """
+    The primary account (multiplier 1) followed by every linked account,
+    each trading on its own paper account when the session is in paper mode
+    """
+    primary = {
+        'user_id': session.get('zerodha_user_id'),
+        'api_key': session.get('api_key'),
+        'access_token': trading_access_token(session),
+        'multiplier': 1,
+        'primary': True,
+    }
+    linked = get_linked_accounts(session)
+    if is_paper_session(session):
+        linked = [dict(account, access_token=paper_token(account['user_id'])) for account in linked]
+    return [primary] + linked
+
+
+def _spread_ms(timestamps: List[float]) -> Optional[float]:
+    if len(timestamps) < 2:
+        return None
+    return round((max(timestamps) - min(timestamps)) * 1000, 1)
+
+
+def error_message(error) -> str:
+    """User message of a KITE_ERROR / EXIT_ALL_ERROR string, the message itself otherwise"""
+    message = str(error)
+    if message.startswith(('KITE_ERROR:', 'EXIT_ALL_ERROR:')):
+        parts = message.split(':', 4)
+        if len(parts) >= 3:
+            return parts[2]
+    return message
+
+
+def fan_out(accounts: List[Dict], action: str, prepare: Callable[[Dict], object],
+            execute: Callable[[Dict, object], Dict]) -> Dict:
+    """
+    Run one action on every account concurrently and aggregate the results
+
+    Each account is prepared on its own thread (client, rate limit token),
+    then all accounts wait on a barrier and execute together, so the spread
+    between their orders is not the sum of their preparation times.
+
+    Args:
+        accounts: Accounts from fan_out_accounts
+        action: Action name for results and metrics ('order', 'exit_all', 'exit_position')
+        prepare: prepare(account) -> context, may raise to fail the account
+        execute: execute(account, context) -> dict with 'status' ('success',
+            'failed' or 'skipped'), optional 'filled_at' (epoch seconds of
+            the last fill) and details
+
+    Returns:
+        dict: Per account results with ack and fill time spreads
+    """
+    barrier = threading.Barrier(len(accounts), timeout=START_BARRIER_TIMEOUT)
+
+    def run(account):
+        result = {'user_id': account['user_id'], 'multiplier': account['multiplier']}
+        context, error = None, None
+        try:
+            context = prepare(account)
+        except Exception as e:
+            error = e
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            pass  # Another account is stuck, do not hold this one back
+
+        if error is not None:
+            result.update({'status': 'failed', 'error': error_message(error)})
+        else:
+            try:
+                result.update(execute(account, context))
+            except Exception as e:
+                result.update({'status': 'failed', 'error': error_message(e)})
+        if result.get('error'):
+            result['error'] = error_message(result['error'])
+        result.setdefault('acked_at', time.time())
+        return result
+
+    with ThreadPoolExecutor(max_workers=len(accounts)) as executor:
+        results = list(executor.map(run, accounts))
+
+    for result in results:
+        metrics.inc('quicktrade_fanout_orders_total', {'action': action, 'outcome': result['status']})
+
+    acted = [result for result in results if result['status'] == 'success']
+    ack_spread = _spread_ms([result['acked_at'] for result in acted])
+    fill_spread = _spread_ms([result['filled_at'] for result in acted if result.get('filled_at')])
+    if ack_spread is not None:
+        metrics.observe('quicktrade_fanout_spread_seconds', ack_spread / 1000, {'stage': 'ack'})
+    if fill_spread is not None:
+        metrics.observe('quicktrade_fanout_spread_seconds', fill_spread / 1000, {'stage': 'fill'})
+
+    failed = [result for result in results if result['status'] == 'failed']
+    return {
+        'success': not failed,
+        'accounts': results,
+        'succeeded_accounts': len(acted),
+        'failed_accounts': len(failed),
+        'skipped_accounts': len(results) - len(acted) - len(failed),
+        'ack_spread_ms': ack_spread,
+        'fill_spread_ms': fill_spread,
+    }
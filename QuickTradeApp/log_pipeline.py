@@ -0,0 +1,159 @@
+"""
+Structured logging pipeline for QuickTradeApp
+Request threads never write logs themselves: the handlers configured in
+settings.LOGGING are moved behind a queue when the app is ready, and one
+background thread per process formats the records as JSON lines and does
+the I/O. A full queue drops records (counted in quicktrade_log_dropped_total)
+rather than making a request wait.
+
+Under gunicorn the pipeline starts in the master; every forked worker starts
+its own queue and writer thread
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, Sequence
+
+from .metrics import metrics
+
+# Records waiting for the writer thread at most, later ones are dropped
+QUEUE_SIZE = 10000
+
+# Loggers whose handlers are moved behind the queue ('' is the root logger)
+QUEUED_LOGGERS = ('', 'quicktrade.audit')
+
+metrics.describe('quicktrade_log_dropped_total', 'counter', "Log records dropped because the log queue was full")
+metrics.describe('quicktrade_log_queue_depth', 'gauge', "Log records waiting for the writer thread")
+
+# Attributes every LogRecord has, anything else was passed as extra
+_RECORD_ATTRS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime', 'log_route'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and the extra fields of the record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queues records for the writer thread without blocking, tagged with the logger it serves"""
+
+    def __init__(self, log_queue: queue.Queue, route: str):
+        super().__init__(log_queue)
+        self.route = route
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments here, the writer thread does the formatting
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.log_route = self.route
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc('quicktrade_log_dropped_total', {'logger': record.name})
+
+
+class _RoutingListener(QueueListener):
+    """Hands every record to the handlers of the logger it was queued by"""
+
+    def __init__(self, log_queue: queue.Queue, routes: Dict[str, List[logging.Handler]]):
+        super().__init__(log_queue, respect_handler_level=True)
+        self.routes = routes
+
+    def handle(self, record: logging.LogRecord):
+        for handler in self.routes.get(record.log_route, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class LogPipeline:
+    """Queue handlers in front of the configured handlers, and the writer thread behind them"""
+
+    def __init__(self, size: int = QUEUE_SIZE):
+        self.size = size
+        self.queue: Optional[queue.Queue] = None
+        self.listener: Optional[_RoutingListener] = None
+        self._routes: Dict[str, List[logging.Handler]] = {}
+        self._queue_handlers: List[DroppingQueueHandler] = []
+        self._lock = threading.Lock()
+
+    def start(self, logger_names: Sequence[str] = QUEUED_LOGGERS):
+        """Move the handlers of these loggers behind the queue and start the writer thread"""
+        with self._lock:
+            if self.listener is not None:
+                return
+            self.queue = queue.Queue(self.size)
+            for name in logger_names:
+                logger = logging.getLogger(name)
+                handlers = [handler for handler in logger.handlers if not isinstance(handler, QueueHandler)]
+                if not handlers:
+                    continue
+                queue_handler = DroppingQueueHandler(self.queue, name)
+                self._routes[name] = handlers
+                self._queue_handlers.append(queue_handler)
+                logger.handlers = [queue_handler]
+            self._start_listener()
+        atexit.register(self.stop)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_listener(self):
+        self.listener = _RoutingListener(self.queue, self._routes)
+        self.listener.start()
+
+    def _after_fork(self):
+        # The writer thread did not survive the fork, and records queued before it belong to the parent
+        self._lock = threading.Lock()
+        if self.listener is None:
+            return
+        self.queue = queue.Queue(self.size)
+        for queue_handler in self._queue_handlers:
+            queue_handler.queue = self.queue
+        self._start_listener()
+
+    def stop(self):
+        """Write out the queued records and stop the writer thread"""
+        with self._lock:
+            listener, self.listener = self.listener, None
+        if listener is not None and listener._thread is not None:
+            listener.stop()
+        for handlers in self._routes.values():
+            for handler in handlers:
+                handler.flush()
+
+    def depth(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+
+def _collect_depth():
+    metrics.set('quicktrade_log_queue_depth', log_pipeline.depth())
+
+
+# Global instance
+log_pipeline = LogPipeline()
+
+metrics.add_collector(_collect_depth)
@@ -0,0 +1,82 @@
+"""
+Last traded price cache for QuickTradeApp
+Every quote we fetch is stored here and pushed to the listeners that
+reprice off it (MTM, triggers, recorders)
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class LTPCache:
+    """Process wide LTP cache with tick listeners"""
+
+    def __init__(self):
+        self._prices: Dict[str, Tuple[float, float]] = {}
+        self._listeners: List[Callable[[str, float, float], None]] = []
+        self._lock = threading.Lock()
+
+    def update(self, symbol: str, ltp: float, timestamp: Optional[float] = None):
+        """
+        Store a new price and notify listeners
+
+        Args:
+            symbol: Kite tradingsymbol for options, index name for indices
+            ltp: Last traded price
+            timestamp: Epoch seconds of the tick, defaults to now
+        """
+        if ltp is None:
+            return
+        timestamp = timestamp or time.time()
+        ltp = float(ltp)
+        with self._lock:
+            self._prices[symbol] = (ltp, timestamp)
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                listener(symbol, ltp, timestamp)
+            except Exception:
+                # A broken listener must never stop prices from flowing
+                pass
+
+    def update_many(self, prices: Dict[str, float], timestamp: Optional[float] = None):
+        """Store a batch of prices fetched together"""
+        timestamp = timestamp or time.time()
+        for symbol, ltp in prices.items():
+            self.update(symbol, ltp, timestamp)
+
+    def get(self, symbol: str, max_age: Optional[float] = None) -> Optional[float]:
+        """
+        Get the cached price of a symbol
+
+        Args:
+            symbol: Symbol as passed to update
+            max_age: Ignore prices older than this many seconds
+
+        Returns:
+            float: Cached LTP, or None if missing or too old
+        """
+        entry = self._prices.get(symbol)
+        if not entry:
+            return None
+        ltp, timestamp = entry
+        if max_age is not None and time.time() - timestamp > max_age:
+            return None
+        return ltp
+
+    def subscribe(self, listener: Callable[[str, float, float], None]):
+        """Register a callback invoked as listener(symbol, ltp, timestamp) on every tick"""
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[str, float, float], None]):
+        """Remove a previously registered callback"""
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+
+# Global instance
+ltp_cache = LTPCache()
@@ -0,0 +1,76 @@
+"""
+Bytes sent per dashboard load and per portfolio poll, with inline assets
+(before) and with fingerprinted static bundles (after)
+"""
+import gzip
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+try:
+    import brotli
+except ImportError:  # WhiteNoise only writes .br files when Brotli is installed
+    brotli = None
+
+# Bundles the dashboard page loads from /static/
+DASHBOARD_ASSETS = ('css/base.css', 'js/base.js', 'css/dashboard.css', 'js/dashboard.js')
+
+
+def _sample_portfolio(positions: int, orders: int) -> dict:
+    now = datetime.now()
+    net = [{
+        'tradingsymbol': f'NIFTY24JAN{19000 + 50 * i}CE', 'expiry': now.date(), 'product': 'MIS',
+        'quantity': 75, 'average_price': 120.5, 'last_price': 125.25, 'pnl': 356.25,
+    } for i in range(positions)]
+    order_rows = [{
+        'order_timestamp': now - timedelta(minutes=i), 'tradingsymbol': f'NIFTY24JAN{19000 + 50 * i}PE',
+        'product': 'MIS', 'transaction_type': 'BUY' if i % 2 else 'SELL', 'quantity': 75,
+        'price': 98.4, 'status': 'COMPLETE',
+    } for i in range(orders)]
+    return {'positions': {'net': net}, 'orders': order_rows, 'history': []}
+
+
+class Command(BaseCommand):
+    help = "Compare dashboard bytes per load and per poll with inline assets vs static bundles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--positions', type=int, default=5, help="Open positions in the sample page")
+        parser.add_argument('--orders', type=int, default=20, help="Orders in the sample page")
+
+    def _sizes(self, *responses: bytes):
+        """Raw and compressed bytes, each response compressed on its own"""
+        sizes = [sum(len(data) for data in responses),
+                 sum(len(gzip.compress(data, 9)) for data in responses)]
+        if brotli:
+            sizes.append(sum(len(brotli.compress(data)) for data in responses))
+        return sizes
+
+    def _row(self, label, *responses):
+        self.stdout.write(f"{label:42}" + "".join(f"{size:>12,}" for size in self._sizes(*responses)))
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/dashboard/', HTTP_HOST='localhost')
+        request.session = {'api_key': 'sample', 'user_id': 'AB1234'}
+        context = dict(_sample_portfolio(options['positions'], options['orders']),
+                       expiry_dates={}, index_prices={})
+
+        page = render_to_string('dashboard.html', context, request=request).encode('utf-8')
+        poll = render_to_string('partials/portfolio_tables.html', context, request=request).encode('utf-8')
+        bundles = {name: Path(finders.find(name)).read_bytes() for name in DASHBOARD_ASSETS}
+
+        # Before: the same styles and scripts inline, the poll refetched the page
+        inline_page = page + b"".join(bundles.values())
+
+        header = ['raw', 'gzip'] + (['brotli'] if brotli else [])
+        self.stdout.write(f"{'bytes':42}" + "".join(f"{name:>12}" for name in header))
+        self._row("before: every load (inline assets)", inline_page)
+        self._row("before: every poll (full page)", inline_page)
+        self._row("after: first load (HTML + bundles)", page, *bundles.values())
+        self._row("after: repeat load (bundles cached)", page)
+        self._row("after: every poll (portfolio partial)", poll)
+        for name, data in bundles.items():
+            self._row(f"  {name}", data)
@@ -0,0 +1,56 @@
+"""
+Cold and warm chart loads through the candle cache
+Serves the Fyers history API from a local stand-in with a fixed latency and
+compares the first load of a series (broker fetch) with repeat loads (disk
+read of the mapped columns), counting the broker calls of each
+"""
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from QuickTradeApp.candle_store import CandleStore
+from QuickTradeApp.standins import BrokerStandIn, FaultPlan
+
+
+class Command(BaseCommand):
+    help = "Compare cold (broker) and warm (memory-mapped disk) candle loads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loads', type=int, default=50, help="Warm loads per series")
+        parser.add_argument('--latency', type=float, default=0.15, help="History API latency (seconds)")
+        parser.add_argument('--days', type=int, default=30, help="Lookback of each load")
+
+    def handle(self, *args, **options):
+        request = SimpleNamespace(session={'fyers_client_id': 'XY1234-100', 'fyers_access_token': 'standin'})
+        standin = BrokerStandIn(faults=FaultPlan(latency=options['latency'], upstream='fyers')).start()
+        try:
+            with standin.installed(), tempfile.TemporaryDirectory() as storage_dir:
+                store = CandleStore(storage_dir)
+                for symbol, interval in (('NIFTY', '1'), ('NIFTY', '5'), ('BANKNIFTY', 'D')):
+                    start = time.time() - options['days'] * 86400
+                    calls = standin.requests
+                    started = time.perf_counter()
+                    columns = store.get(request, symbol, interval, start)
+                    cold = (time.perf_counter() - started) * 1000
+                    cold_calls = standin.requests - calls
+
+                    calls = standin.requests
+                    timings = []
+                    for _ in range(options['loads']):
+                        started = time.perf_counter()
+                        warm = store.get(request, symbol, interval, start)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    warm_calls = standin.requests - calls
+
+                    self.stdout.write(
+                        f"{symbol:>9} {interval:>2}: {len(columns['time']):6} candles  "
+                        f"cold {cold:7.1f}ms ({cold_calls} calls)  "
+                        f"warm p50 {statistics.median(timings):6.3f}ms max {max(timings):6.3f}ms "
+                        f"({warm_calls} calls in {options['loads']} loads, "
+                        f"{'mapped' if warm['close'].base is not None else 'copied'})"
+                    )
+        finally:
+            standin.stop()
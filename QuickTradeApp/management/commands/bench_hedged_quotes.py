@@ -0,0 +1,59 @@
+"""
+Tail latency benchmark for hedged index LTP lookups
+Serves Fyers with occasional latency spikes from a local stand-in and
+compares p50/p95/p99 of the order path's index LTP with and without the
+Kite hedge
+"""
+import statistics
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from QuickTradeApp.fyers_utils import get_ltp
+from QuickTradeApp.hedged_quotes import hedged_quoter
+from QuickTradeApp.metrics import metrics
+from QuickTradeApp.standins import BrokerStandIn, FaultPlan
+
+
+class Command(BaseCommand):
+    help = "Compare index LTP latency percentiles with and without hedging on Kite"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200, help="Lookups per mode")
+        parser.add_argument('--latency', type=float, default=0.02, help="Normal Fyers latency (seconds)")
+        parser.add_argument('--spike-rate', type=float, default=0.05, help="Share of Fyers responses that spike")
+        parser.add_argument('--spike-latency', type=float, default=1.0, help="Fyers spike latency (seconds)")
+
+    def _run(self, label, fn, calls):
+        timings = []
+        for _ in range(calls):
+            started = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        pct = lambda p: timings[min(int(len(timings) * p / 100), len(timings) - 1)]
+        self.stdout.write(f"{label:>10}: p50 {statistics.median(timings):7.1f}ms  "
+                          f"p95 {pct(95):7.1f}ms  p99 {pct(99):7.1f}ms  max {timings[-1]:7.1f}ms")
+
+    def handle(self, *args, **options):
+        request = SimpleNamespace(session={
+            'fyers_client_id': 'XY1234-100', 'fyers_access_token': 'standin',
+            'api_key': 'standin', 'access_token': 'standin',
+        })
+        faults = FaultPlan(latency=options['latency'], spike_rate=options['spike_rate'],
+                           spike_latency=options['spike_latency'], upstream='fyers', seed=7)
+        standin = BrokerStandIn(faults=faults).start()
+        try:
+            with standin.installed():
+                self.stdout.write(f"{options['calls']} NIFTY lookups, Fyers {options['latency'] * 1000:.0f}ms "
+                                  f"with {options['spike_rate']:.0%} spikes to {options['spike_latency'] * 1000:.0f}ms")
+                self._run("fyers only", lambda: get_ltp(request, 'NIFTY'), options['calls'])
+                self._run("hedged", lambda: hedged_quoter.get(request, 'NIFTY'), options['calls'])
+                self.stdout.write(f"hedge delay now {hedged_quoter.hedge_delay() * 1000:.0f}ms")
+        finally:
+            standin.stop()
+
+        self.stdout.write("\n" + "\n".join(
+            line for line in metrics.render().splitlines() if 'hedge' in line or 'divergence' in line
+        ))
@@ -0,0 +1,97 @@
+"""
+Startup benchmark: time from launching gunicorn to the first served request
+"""
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Startup modes compared, as QUICKTRADE_PRELOAD values (see gunicorn.conf.py)
+MODES = (
+    ('per-worker load (old)', '0'),
+    ('preload + warm-up', '1'),
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _get(url: str, timeout: float) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code  # Still a served request
+
+
+class Command(BaseCommand):
+    help = "Measure time to first served request of a fresh gunicorn, per startup mode"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Cold starts per mode")
+        parser.add_argument('--path', default='/zerodha/login/', help="Path requested once the server is up")
+        parser.add_argument('--timeout', type=float, default=60, help="Give up on a start after this many seconds")
+
+    def _start_once(self, preload: str, path: str, timeout: float):
+        port = _free_port()
+        env = dict(os.environ, QUICKTRADE_PRELOAD=preload)
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'QuickTradePortal.wsgi:application',
+             '--bind', f'127.0.0.1:{port}', '--workers', '1'],
+            cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            # The socket accepts as soon as the master binds, so every attempt
+            # is a full request that waits for the worker
+            while True:
+                if process.poll() is not None:
+                    raise CommandError(f"gunicorn exited with code {process.returncode}")
+                if time.perf_counter() - started > timeout:
+                    raise CommandError(f"No response within {timeout}s")
+                try:
+                    request_started = time.perf_counter()
+                    status = _get(f'http://127.0.0.1:{port}{path}', timeout)
+                    break
+                except (urllib.error.URLError, ConnectionError):
+                    time.sleep(0.01)
+            first_request = time.perf_counter() - request_started
+            first_served = time.perf_counter() - started
+
+            second_started = time.perf_counter()
+            _get(f'http://127.0.0.1:{port}{path}', timeout)
+            second_request = time.perf_counter() - second_started
+            return first_served, first_request, second_request, status
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def handle(self, *args, **options):
+        runs = options['runs']
+        self.stdout.write(f"{runs} cold starts per mode, GET {options['path']}")
+        for label, preload in MODES:
+            samples = [self._start_once(preload, options['path'], options['timeout']) for _ in range(runs)]
+            first_served = statistics.median(s[0] for s in samples) * 1000
+            first_request = statistics.median(s[1] for s in samples) * 1000
+            second_request = statistics.median(s[2] for s in samples) * 1000
+            statuses = sorted({s[3] for s in samples})
+            self.stdout.write(
+                f"{label:24} start to first response {first_served:8.1f} ms | "
+                f"first request {first_request:7.1f} ms | next request {second_request:6.1f} ms | "
+                f"HTTP {statuses}"
+            )
@@ -0,0 +1,47 @@
+"""
+Throughput benchmark for the option symbol codec, its round-trip property is
+checked in QuickTradeApp/tests.py
+"""
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from QuickTradeApp.symbol_codec import decode, encode, expiry_prefix
+
+
+class Command(BaseCommand):
+    help = "Measure option symbol encode/decode throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200000, help="Calls per throughput measurement")
+
+    def handle(self, *args, **options):
+        # Throughput on the hot path: same expiry, changing strikes
+        iterations = options['iterations']
+        strikes = [19000 + 50 * (i % 200) for i in range(iterations)]
+
+        start = time.perf_counter()
+        for strike in strikes:
+            encode('NIFTY', '2024-01-25', strike, 'CE')
+        encode_rate = iterations / (time.perf_counter() - start)
+
+        symbols = [encode('NIFTY', '2024-01-25', strike, 'PE') for strike in strikes[:200]]
+        decode.cache_clear()
+        start = time.perf_counter()
+        for i in range(iterations):
+            decode(symbols[i % 200])
+        decode_rate = iterations / (time.perf_counter() - start)
+
+        # Cold decodes: every symbol parsed by the regex
+        cold = [encode('BANKNIFTY', date(2024, 1, 4) + timedelta(days=i % 700), 40000 + 100 * (i % 50), 'CE')
+                for i in range(iterations)]
+        decode.cache_clear()
+        start = time.perf_counter()
+        for symbol in cold:
+            decode.__wrapped__(symbol)
+        cold_rate = iterations / (time.perf_counter() - start)
+
+        self.stdout.write(f"encode:        {encode_rate:,.0f} symbols/s (prefix cache: {expiry_prefix.cache_info()})")
+        self.stdout.write(f"decode (warm): {decode_rate:,.0f} symbols/s")
+        self.stdout.write(f"decode (cold): {cold_rate:,.0f} symbols/s")
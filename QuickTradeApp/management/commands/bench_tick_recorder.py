@@ -0,0 +1,96 @@
+"""
+Throughput of the tick recorder
+Appends batches of synthetic ticks to a temporary tick directory while a
+reader in another process tails the segments, then checks the reader saw
+every tick and that the sealed index serves per-instrument reads
+"""
+import multiprocessing
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from QuickTradeApp.tick_recorder import TickReader, TickRecorder, tick_day
+
+
+def _tail(storage_dir, day, expected, results):
+    """Reader process: count ticks as they are published"""
+    seen, started = 0, time.perf_counter()
+    stop = threading.Event()
+    for block in TickReader(storage_dir).tail(day, poll_interval=0.001, stop=stop):
+        seen += len(block)
+        if seen >= expected:
+            stop.set()
+    results.put((seen, time.perf_counter() - started))
+
+
+class Command(BaseCommand):
+    help = "Measure tick recorder write throughput with a tailing reader in another process"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ticks', type=int, default=5_000_000)
+        parser.add_argument('--batch', type=int, default=500, help="Ticks per append (one quote response)")
+        parser.add_argument('--instruments', type=int, default=200)
+        parser.add_argument('--segment-records', type=int, default=1 << 20)
+
+    def handle(self, *args, **options):
+        total, batch = options['ticks'], options['batch']
+        rng = np.random.default_rng(1)
+        with tempfile.TemporaryDirectory() as storage_dir:
+            recorder = TickRecorder(storage_dir, segment_records=options['segment_records'], writer='bench')
+            now = time.time()
+            symbols = [f"NIFTY26OCT{20000 + 50 * n}CE" for n in range(options['instruments'])]
+            ids = recorder.instrument_ids(symbols, now)
+
+            # Batches are prepared up front, only the appends are timed
+            picks = rng.integers(0, len(ids), size=batch * 64)
+            instruments = ids[picks]
+            ltp = rng.uniform(50, 500, size=batch * 64)
+            bid, ask = ltp - 0.05, ltp + 0.05
+            volume = rng.integers(0, 10_000, size=batch * 64)
+
+            day = tick_day(now)
+            results = multiprocessing.get_context('fork').Queue()
+            reader = multiprocessing.get_context('fork').Process(
+                target=_tail, args=(storage_dir, day, total, results), daemon=True)
+            reader.start()
+
+            written = 0
+            started = time.perf_counter()
+            while written < total:
+                size = min(batch, total - written)
+                offset = (written // batch % 64) * batch
+                window = slice(offset, offset + size)
+                recorder.append(instruments[window], ltp[window], volume[window], bid[window], ask[window], now)
+                written += size
+            elapsed = time.perf_counter() - started
+            recorder.close()
+
+            seen, _ = results.get(timeout=60)
+            reader.join(timeout=5)
+            self.stdout.write(f"{written:,} ticks in batches of {batch}: {elapsed:.2f}s, "
+                              f"{written / elapsed:,.0f} ticks/s, {elapsed / written * 1e9:.0f}ns per tick")
+            self.stdout.write(f"reader process tailed {seen:,} ticks")
+
+            started = time.perf_counter()
+            for _ in range(10_000):
+                recorder.record((symbols[0],), (101.5,), timestamp=now)
+            single = (time.perf_counter() - started) / 10_000
+            recorder.close()
+            self.stdout.write(f"single tick record(): {single * 1e6:.1f}us per call")
+
+            reader_side = TickReader(storage_dir)
+            started = time.perf_counter()
+            ticks = reader_side.read(day, symbols[0])
+            self.stdout.write(f"read {len(ticks):,} ticks of {symbols[0]} through the index "
+                              f"in {(time.perf_counter() - started) * 1000:.1f}ms "
+                              f"across {len(reader_side.segments(day))} segments")
+
+            if seen != written:
+                raise CommandError(f"Reader saw {seen} of {written} ticks")
+            everything = reader_side.read(day)
+            if ticks.tobytes() != everything[everything['instrument'] == ids[0]].tobytes():
+                raise CommandError("Indexed read differs from a full scan")
+            self.stdout.write(self.style.SUCCESS("Tailed and indexed reads match what was written"))
@@ -0,0 +1,120 @@
+"""
+Fault drill for the broker circuit breakers
+Runs the app's broker reads against a local stand-in while injecting hangs
+and 5xx errors, and checks that calls time out, circuits open and fail
+fast, reads degrade to cached data and circuits close again on recovery
+"""
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+
+from QuickTradeApp import circuit_breaker
+from QuickTradeApp.circuit_breaker import CircuitOpenError, UpstreamTimeout, breakers
+from QuickTradeApp.fyers_utils import get_ltp
+from QuickTradeApp.kite_trade import KiteApp
+from QuickTradeApp.metrics import metrics
+from QuickTradeApp.standins import BrokerStandIn
+
+
+class Command(BaseCommand):
+    help = "Inject broker faults through a local stand-in and verify timeouts, breakers and fallbacks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--deadline', type=float, default=0.5,
+                            help="Deadline applied to every guarded endpoint during the drill (seconds)")
+        parser.add_argument('--open-duration', type=float, default=2,
+                            help="Open circuit cool-off during the drill (seconds)")
+
+    def _timed(self, fn):
+        started = time.perf_counter()
+        try:
+            fn()
+            outcome = 'ok'
+        except CircuitOpenError:
+            outcome = 'circuit open'
+        except UpstreamTimeout:
+            outcome = 'timeout'
+        except Exception as e:
+            outcome = f'error ({type(e).__name__})'
+        return outcome, (time.perf_counter() - started) * 1000
+
+    def _expect(self, condition, message):
+        if not condition:
+            raise CommandError(message)
+        self.stdout.write(self.style.SUCCESS(f"  ok: {message}"))
+
+    def _calls(self, label, fn, count):
+        outcomes = [self._timed(fn) for _ in range(count)]
+        summary = ", ".join(f"{outcome} {elapsed:.0f}ms" for outcome, elapsed in outcomes)
+        self.stdout.write(f"{label}: {summary}")
+        return outcomes
+
+    def handle(self, *args, **options):
+        saved_timeouts = {name: dict(breaker.timeouts) for name, breaker in breakers.items()}
+        saved_open_duration = circuit_breaker.OPEN_DURATION
+        for breaker in breakers.values():
+            for endpoint in breaker.timeouts:
+                breaker.timeouts[endpoint] = options['deadline']
+            breaker.reset()
+        circuit_breaker.OPEN_DURATION = options['open_duration']
+
+        standin = BrokerStandIn().start()
+        try:
+            with standin.installed():
+                self._drill(standin, options)
+        finally:
+            standin.stop()
+            circuit_breaker.OPEN_DURATION = saved_open_duration
+            for name, breaker in breakers.items():
+                breaker.timeouts.update(saved_timeouts[name])
+                breaker.reset()
+
+        self.stdout.write("\n" + "\n".join(
+            line for line in metrics.render().splitlines() if 'circuit' in line or 'upstream_calls' in line
+        ))
+
+    def _drill(self, standin, options):
+        request = SimpleNamespace(session={
+            'fyers_client_id': 'XY1234-100', 'fyers_access_token': 'standin',
+            'api_key': 'standin', 'access_token': 'standin',
+        })
+        fyers, kite_breaker = breakers['fyers'], breakers['kite']
+        kite = KiteApp(request=request)
+        standin.positions = [{'tradingsymbol': 'NIFTY24JAN22000CE', 'exchange': 'NFO', 'product': 'MIS',
+                              'quantity': 75, 'average_price': 100.0, 'last_price': 110.0, 'pnl': 750.0}]
+
+        self.stdout.write("Healthy stand-in")
+        outcomes = self._calls("  fyers quotes", lambda: get_ltp(request, 'NIFTY'), 3)
+        self._expect(all(outcome == 'ok' for outcome, _ in outcomes), "healthy calls succeed")
+        portfolio = kite.get_portfolio()
+        self._expect(not portfolio['stale'] and portfolio['positions']['net'], "portfolio read is live")
+
+        self.stdout.write("Fyers hangs")
+        standin.faults.update(hang=True)
+        outcomes = self._calls("  fyers quotes", lambda: get_ltp(request, 'NIFTY'), circuit_breaker.MIN_CALLS + 3)
+        timeouts = [elapsed for outcome, elapsed in outcomes if outcome == 'timeout']
+        fast = [elapsed for outcome, elapsed in outcomes if outcome == 'circuit open']
+        self._expect(timeouts and max(timeouts) < options['deadline'] * 1000 + 250,
+                     f"hung calls give up at the {options['deadline']}s deadline")
+        self._expect(fyers.state == circuit_breaker.OPEN, "fyers circuit opened")
+        self._expect(fast and max(fast) < 5, "open circuit fails fast (<5ms)")
+        self._expect(kite_breaker.state == circuit_breaker.CLOSED, "kite circuit is unaffected")
+
+        self.stdout.write("Kite returns 503")
+        standin.faults.update(hang=False, error_rate=1.0)
+        self._calls("  kite positions", kite.kite.positions, circuit_breaker.MIN_CALLS + 1)
+        self._expect(kite_breaker.state == circuit_breaker.OPEN, "kite circuit opened")
+        portfolio = KiteApp(request=request).get_portfolio()
+        self._expect(portfolio['stale'] and portfolio['positions']['net'],
+                     "portfolio degrades to the last known positions")
+
+        self.stdout.write("Recovery")
+        standin.faults.update(error_rate=0.0)
+        time.sleep(options['open_duration'])
+        self._expect(fyers.state == circuit_breaker.HALF_OPEN, "fyers circuit half open after cool-off")
+        outcome, _ = self._timed(lambda: get_ltp(request, 'NIFTY'))
+        self._expect(outcome == 'ok' and fyers.state == circuit_breaker.CLOSED, "trial call closes the fyers circuit")
+        portfolio = KiteApp(request=request).get_portfolio()
+        self._expect(not portfolio['stale'] and kite_breaker.state == circuit_breaker.CLOSED,
+                     "kite circuit closes and reads are live again")
@@ -0,0 +1,54 @@
+"""
+Lane load test: does order latency stay flat while polls saturate a worker?
+Runs order traffic alone, then with dashboard polls saturating a simulated
+gthread worker with the request lanes off, then on, and prints order and
+poll latency per phase:
+
+    python manage.py load_test_lanes --duration 10 --pollers 48
+"""
+import json
+
+from django.core.management.base import BaseCommand
+
+from QuickTradeApp.config import WORKER_THREADS
+from QuickTradeApp.replay_harness import run_lane_load
+
+
+class Command(BaseCommand):
+    help = "Measure order latency under saturating dashboard polls, with the request lanes off and on"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per phase")
+        parser.add_argument('--threads', type=int, default=WORKER_THREADS, help="Threads of the simulated worker")
+        parser.add_argument('--order-users', type=int, default=4)
+        parser.add_argument('--pollers', type=int, default=48, help="Polls in flight at all times")
+        parser.add_argument('--think', type=float, default=0.25, help="Seconds each order user waits between clicks")
+        parser.add_argument('--latency', type=float, default=0.03, help="Stand-in broker latency (seconds)")
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--output', help="Write the JSON report here")
+
+    def handle(self, *args, **options):
+        report = run_lane_load(duration=options['duration'], threads=options['threads'],
+                               order_users=options['order_users'], pollers=options['pollers'],
+                               order_think=options['think'], latency=options['latency'], seed=options['seed'])
+        config = report['config']
+        self.stdout.write(f"{config['threads']} threads ({config['reserved_threads']} reserved for orders), "
+                          f"{config['order_users']} order users, {config['pollers']} pollers, "
+                          f"{config['duration']:g}s per phase")
+        for name, phase in report['phases'].items():
+            orders = phase['orders']
+            latency = orders['latency_ms']
+            self.stdout.write(f"{name:28} orders {orders['requests']:5} | p50 {latency.get('p50', 0):7.1f} ms "
+                              f"p95 {latency.get('p95', 0):7.1f} ms p99 {latency.get('p99', 0):7.1f} ms | "
+                              f"errors {orders['error_rate']:.2%}")
+            polls = phase['polls']
+            if polls:
+                latency = polls['latency_ms']
+                outcomes = ', '.join(f"{outcome} {count}" for outcome, count in sorted(polls['outcomes'].items()))
+                self.stdout.write(f"{'':28} polls  {polls['requests']:5} | p50 {latency.get('p50', 0):7.1f} ms "
+                                  f"p95 {latency.get('p95', 0):7.1f} ms p99 {latency.get('p99', 0):7.1f} ms | "
+                                  f"{outcomes}")
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2, sort_keys=True)
+            self.stdout.write(f"Report written to {options['output']}")
@@ -0,0 +1,100 @@
+"""
+Replay a market session against the order path
+Drives a synthetic (seeded) or recorded tick stream through the broker
+stand-in while simulated users place and exit orders, then prints and
+optionally saves a per-endpoint report, e.g. to compare two releases:
+
+    python manage.py replay_market --speed 10 --users 20 --output before.json
+    python manage.py replay_market --speed 10 --users 20 --baseline before.json
+    python manage.py replay_market --paper --users 300
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from QuickTradeApp.replay_harness import (DEFAULT_MIX, compare_reports, recorded_ticks, run_replay,
+                                          synthetic_ticks)
+from QuickTradeApp.standins import FaultPlan
+
+
+class Command(BaseCommand):
+    help = "Replay ticks and fire concurrent order traffic, reporting latency and errors per endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--day', help="Replay this recorded day (YYYY-MM-DD) instead of synthetic ticks")
+        parser.add_argument('--tick-dir', default='data/ticks', help="Tick recorder directory for --day")
+        parser.add_argument('--duration', type=float, default=60.0, help="Synthetic market seconds")
+        parser.add_argument('--tick-rate', type=float, default=200.0, help="Synthetic ticks per market second")
+        parser.add_argument('--speed', type=float, default=10.0, help="Replay speed, 1 is real time, 0 as fast as possible")
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--think', type=float, default=0.0, help="Seconds each user waits between clicks")
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--mix', default=None,
+                            help="Endpoint shares, e.g. place_order=0.6,exit_position=0.3,exit_all=0.1")
+        parser.add_argument('--latency', type=float, default=0.03, help="Stand-in broker latency (seconds)")
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--spike-rate', type=float, default=0.0)
+        parser.add_argument('--spike-latency', type=float, default=0.0)
+        parser.add_argument('--upstream', choices=('fyers', 'kite'), help="Inject faults on one broker only")
+        parser.add_argument('--paper', action='store_true', help="Users trade on paper accounts")
+        parser.add_argument('--output', help="Write the JSON report here")
+        parser.add_argument('--baseline', help="Compare with a saved JSON report")
+
+    def handle(self, *args, **options):
+        mix = DEFAULT_MIX
+        if options['mix']:
+            try:
+                mix = {name: float(share) for name, share in (part.split('=') for part in options['mix'].split(','))}
+            except ValueError:
+                raise CommandError("--mix must look like place_order=0.6,exit_position=0.3,exit_all=0.1")
+            unknown = set(mix) - set(DEFAULT_MIX)
+            if unknown:
+                raise CommandError(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+
+        if options['day']:
+            ticks = recorded_ticks(options['day'], options['tick_dir'])
+            source = f"recorded {options['day']}"
+        else:
+            ticks = synthetic_ticks(options['seed'], options['duration'], options['tick_rate'])
+            source = f"synthetic {options['duration']:g}s at {options['tick_rate']:g} ticks/s"
+
+        faults = FaultPlan(latency=options['latency'], error_rate=options['error_rate'],
+                           spike_rate=options['spike_rate'], spike_latency=options['spike_latency'],
+                           upstream=options['upstream'], seed=options['seed'])
+        config = {
+            'ticks': source,
+            'faults': {name: options[name] for name in ('latency', 'error_rate', 'spike_rate', 'spike_latency', 'upstream')},
+        }
+        report = run_replay(ticks, speed=options['speed'], users=options['users'], seed=options['seed'],
+                            faults=faults, mix=mix, think_time=options['think'], config=config,
+                            paper=options['paper'])
+
+        ticks = report['ticks']
+        self.stdout.write(f"Ticks: {ticks['replayed']} over {ticks['stream_seconds']}s of market time in "
+                          f"{ticks['wall_seconds']}s ({ticks['ticks_per_second']}/s), "
+                          f"lag p99 {ticks['lag_ms']['p99']}ms")
+        self.stdout.write(f"{'endpoint':<14}{'requests':>9}{'rps':>8}{'errors':>8}"
+                          + "".join(f"{name:>9}" for name in ('p50', 'p90', 'p95', 'p99', 'max')))
+        for endpoint, summary in sorted(report['endpoints'].items()) + [('total', report['total'])]:
+            latency = summary['latency_ms']
+            self.stdout.write(f"{endpoint:<14}{summary['requests']:>9}{summary['throughput_rps']:>8}"
+                              f"{summary['error_rate']:>8.1%}"
+                              + "".join(f"{latency.get(name, 0):>9}" for name in ('p50', 'p90', 'p95', 'p99', 'max')))
+
+        if 'paper' in report:
+            paper = report['paper']
+            self.stdout.write(f"Paper accounts: {paper['orders']} orders, {paper['rejected']} rejected, "
+                              f"P&L {paper['pnl']:+,.2f}")
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write("\n")
+            self.stdout.write(f"Report written to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline'], 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            self.stdout.write("\nAgainst " + options['baseline'])
+            for line in compare_reports(baseline, report):
+                self.stdout.write(line)
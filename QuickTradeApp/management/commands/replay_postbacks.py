@@ -0,0 +1,60 @@
+"""
+Replay recorded Kite postbacks against the local postback receiver
+"""
+import json
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from QuickTradeApp.order_state import (
+    compute_postback_checksum,
+    order_state,
+    register_postback_account,
+)
+
+
+class Command(BaseCommand):
+    help = "Replay recorded Kite postback payloads (one JSON object per line) through /kite/postback/"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSONL file with one recorded postback per line")
+        parser.add_argument('--api-secret', help="Log the payload accounts in with this secret and re-sign each payload")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'r', encoding='utf-8') as f:
+                payloads = [json.loads(line) for line in f if line.strip()]
+        except (OSError, json.JSONDecodeError) as e:
+            raise CommandError(f"Unable to read postbacks: {e}")
+
+        api_secret = options.get('api_secret')
+        client = Client(HTTP_HOST='localhost')
+        # Stands in for the session the accounts logged in with
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        accounts = set()
+
+        for payload in payloads:
+            if api_secret:
+                register_postback_account(payload.get('user_id'), session, api_secret)
+                session.save()
+                payload['checksum'] = compute_postback_checksum(
+                    str(payload.get('order_id', '')),
+                    str(payload.get('order_timestamp', '')),
+                    api_secret
+                )
+
+            response = client.post('/kite/postback/', data=json.dumps(payload), content_type='application/json', secure=True)
+            accounts.add(payload.get('user_id'))
+            self.stdout.write(f"{payload.get('order_id')} {payload.get('status')}: HTTP {response.status_code}")
+
+        # Show the resulting state of every account we touched
+        for user_id in sorted(a for a in accounts if a):
+            state = order_state.get(user_id)
+            self.stdout.write(self.style.SUCCESS(f"{user_id}: {len(state.orders)} orders"))
+            for position in state.position_list()['net']:
+                self.stdout.write(
+                    f"  {position['tradingsymbol']} qty={position['quantity']} "
+                    f"avg={position['average_price']:.2f} pnl={position['pnl']:.2f}"
+                )
@@ -0,0 +1,72 @@
+"""
+Search the broker audit log of every worker process, e.g. everything sent
+and received for one order, or the failed Kite calls of the last hour:
+
+    python manage.py search_audit --order-id 250101000000123
+    python manage.py search_audit --since 1h --outcome error
+    python manage.py search_audit --since 2025-01-01T09:15 --until 2025-01-01T09:20 --json
+"""
+import json
+import re
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from QuickTradeApp.broker_audit import AUDIT_DIR, search
+from QuickTradeApp.execution_stats import IST
+
+_AGO_RE = re.compile(r'^(\d+(?:\.\d+)?)([smhd])$')
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_time(value: str) -> float:
+    """Epoch seconds from an epoch, an ISO time (IST unless it has an offset) or an age like 15m"""
+    match = _AGO_RE.match(value)
+    if match:
+        return time.time() - float(match.group(1)) * _UNITS[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Unrecognised time {value!r}, use an epoch, an ISO time or an age like 15m")
+    if moment.tzinfo is None:
+        moment = IST.localize(moment)
+    return moment.timestamp()
+
+
+class Command(BaseCommand):
+    help = "Find broker audit records by order id, time window, endpoint and outcome"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order-id', help="Only calls about this order")
+        parser.add_argument('--since', help="Epoch, ISO time (IST) or age such as 30m, 2h")
+        parser.add_argument('--until', help="Epoch, ISO time (IST) or age")
+        parser.add_argument('--endpoint', help="SDK method, e.g. place_order")
+        parser.add_argument('--outcome', choices=('ok', 'error', 'unavailable'))
+        parser.add_argument('--limit', type=int, default=200, help="Most recent records shown")
+        parser.add_argument('--dir', default=AUDIT_DIR, help="Audit log directory")
+        parser.add_argument('--json', action='store_true', help="Print the raw JSON records")
+
+    def handle(self, *args, **options):
+        since = parse_time(options['since']) if options['since'] else None
+        until = parse_time(options['until']) if options['until'] else None
+        records = search(order_id=options['order_id'], since=since, until=until, endpoint=options['endpoint'],
+                         outcome=options['outcome'], limit=options['limit'], directory=options['dir'])
+
+        for record in records:
+            if options['json']:
+                self.stdout.write(json.dumps(record, ensure_ascii=False))
+                continue
+            moment = datetime.fromtimestamp(record.get('ts', 0), IST).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            line = (f"{moment}  {record.get('upstream', ''):5} {record.get('endpoint', ''):20} "
+                    f"{record.get('outcome', ''):11} {record.get('latency_ms', 0):8.1f}ms")
+            if record.get('order_id'):
+                line += f"  order {record['order_id']}"
+            if record.get('error'):
+                line += f"  {record['error']}"
+            self.stdout.write(line)
+        self.stdout.write(f"{len(records)} record(s)")
@@ -0,0 +1,110 @@
+"""
+Replay drill for the stop-loss / target monitor
+Arms thousands of protections, replays a seeded tick stream through the
+monitor and checks every firing against a brute-force evaluation of the
+same rules, then reports the per-tick evaluation time
+"""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from QuickTradeApp.sl_monitor import StopLossMonitor
+
+
+class Command(BaseCommand):
+    help = "Replay a deterministic tick stream through the SL monitor and verify it against brute force"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--protections', type=int, default=5000)
+        parser.add_argument('--symbols', type=int, default=4)
+        parser.add_argument('--ticks', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        symbols = [f"NIFTY26OCT{22000 + 50 * n}CE" for n in range(options['symbols'])]
+        prices = {symbol: 100.0 for symbol in symbols}
+
+        exits = []
+        monitor = StopLossMonitor(submit_exit=lambda protection: exits.append(protection.protection_id) or ['drill'],
+                                  subscribe=False)
+
+        # Brute-force reference: [protection id, symbol, side, stop, target, trail, best price]
+        rules = []
+        for number in range(options['protections']):
+            symbol = rng.choice(symbols)
+            quantity = rng.choice((75, -75))
+            against = 1 if quantity > 0 else -1
+            stop = target = trail = None
+            kinds = rng.choice(('stop', 'target', 'both', 'trail', 'all'))
+            if kinds in ('stop', 'both', 'all'):
+                stop = round(100 - against * rng.uniform(1, 30), 2)
+            if kinds in ('target', 'both', 'all'):
+                target = round(100 + against * rng.uniform(1, 30), 2)
+            if kinds in ('trail', 'all'):
+                trail = round(rng.uniform(1, 20), 2)
+            protection = monitor.protect(
+                {'user_id': f"U{number}", 'api_key': 'drill', 'access_token': 'drill'},
+                {'tradingsymbol': symbol, 'exchange': 'NFO', 'product': 'MIS', 'quantity': quantity},
+                stop_loss=stop, target=target, trail=trail, price=100.0
+            )
+            rules.append([protection.protection_id, symbol, against, stop, target, trail, 100.0])
+
+        self.stdout.write(f"Armed {monitor.armed_count()} triggers on {len(rules)} positions across {len(symbols)} symbols")
+
+        timings, brute_timings, mismatches, fired_total = [], [], 0, 0
+        for tick in range(options['ticks']):
+            symbol = rng.choice(symbols)
+            prices[symbol] = round(max(prices[symbol] * (1 + rng.gauss(0, 0.004)), 0.05), 2)
+            price = prices[symbol]
+
+            started = time.perf_counter()
+            fired = monitor.on_tick(symbol, price, tick)
+            timings.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            expected, remaining = set(), []
+            for rule in rules:
+                protection_id, rule_symbol, against, stop, target, trail, best = rule
+                if rule_symbol != symbol:
+                    remaining.append(rule)
+                    continue
+                if against > 0:
+                    best = rule[6] = max(best, price)
+                else:
+                    best = rule[6] = min(best, price)
+                hit = (
+                    (stop is not None and against * (price - stop) <= 0)
+                    or (target is not None and against * (target - price) <= 0)
+                    or (trail is not None and against * (price - (best - against * trail)) <= 0)
+                )
+                if hit:
+                    expected.add(protection_id)
+                else:
+                    remaining.append(rule)
+            rules = remaining
+            brute_timings.append(time.perf_counter() - started)
+
+            got = {protection.protection_id for protection in fired}
+            fired_total += len(got)
+            if got != expected:
+                mismatches += 1
+                if mismatches <= 5:
+                    self.stderr.write(f"tick {tick} {symbol} @ {price}: missing {sorted(expected - got)}, "
+                                      f"unexpected {sorted(got - expected)}")
+
+        def describe(label, values):
+            values = sorted(values)
+            pct = lambda p: values[min(int(len(values) * p / 100), len(values) - 1)] * 1e6
+            self.stdout.write(f"{label:>12}: p50 {statistics.median(values) * 1e6:8.1f}us  "
+                              f"p99 {pct(99):8.1f}us  max {values[-1] * 1e6:8.1f}us")
+
+        self.stdout.write(f"{options['ticks']} ticks, {fired_total} protections fired, "
+                          f"{len(rules)} still armed, {monitor.armed_count()} triggers left in the monitor")
+        describe("heaps", timings)
+        describe("brute force", brute_timings)
+        if mismatches:
+            raise CommandError(f"{mismatches} ticks fired differently from the brute-force evaluation")
+        self.stdout.write(self.style.SUCCESS("All firings match the brute-force evaluation"))
@@ -0,0 +1,326 @@
+"""
+Margin cache for QuickTradeApp
+Keeps the available equity margin of each account from kite.margins(),
+refreshed in the background and adjusted locally for every order we send,
+so a BUY that can not be paid for is rejected here in microseconds instead
+of costing a broker round trip and a rejected order on the account's record.
+
+The local estimate is the option premium already in the LTP cache times
+the quantity, a lower bound of what Kite blocks for a market buy. Only an
+estimate too close to the available margin to call is confirmed with the
+order margin API. Whenever the broker disagrees (an insufficient funds
+rejection we let through), the cache takes the broker's figures and is
+refreshed. Exits free margin we can not estimate, so they suspend local
+rejections in every worker (the exit time is shared through the cache)
+until a refresh lands. Orders from other workers, and broker outcomes this
+worker never hears of, only lower what a worker may trust, so it also
+rejects only on a snapshot taken after its own last order
+"""
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from .ltp_cache import ltp_cache
+from .market_clock import market_clock
+from .metrics import metrics
+from .shared_cache import atomic_cache
+
+# Snapshots older than this are refreshed in the background on the next order,
+# outside the sessions only once after the last one ended
+MARGIN_REFRESH_INTERVAL = 30  # seconds
+
+# Local rejections need a snapshot at most this old
+MARGIN_MAX_AGE = 120  # seconds
+
+# Premium used for the estimate must be at most this old
+PREMIUM_MAX_AGE = 10  # seconds
+
+# Estimates within this share below the free margin are confirmed with the order margin API
+BORDERLINE = 0.1
+
+# "Insufficient funds. Required margin is 95417.84 but available margin is 74251.80."
+_FUNDS_RE = re.compile(r'required margin is\s*(\d+(?:\.\d+)?).*?available margin is\s*(\d+(?:\.\d+)?)', re.IGNORECASE | re.DOTALL)
+
+_EXITED_KEY = "margin_exited:{account}"
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="margin-refresh")
+
+metrics.describe('quicktrade_margin_checks_total', 'counter', "Pre-trade margin checks by outcome")
+metrics.describe('quicktrade_margin_refreshes_total', 'counter', "Margin snapshot refreshes by reason and outcome")
+metrics.describe('quicktrade_margin_drift', 'summary',
+                 "Difference between the locally adjusted and the refreshed available margin (rupees)")
+
+
+class InsufficientMargin(Exception):
+    """Raised before submission for an order the available margin can not cover"""
+
+    def __init__(self, required: float, available: float):
+        self.required = required
+        self.available = available
+        super().__init__(f"Insufficient funds. Required margin is {required:.2f} "
+                         f"but available margin is {available:.2f}. (pre-trade check)")
+
+
+class AccountMargin:
+    """Available margin of one account and our orders since it was fetched"""
+
+    def __init__(self, exited_key: str = None):
+        self.available: Optional[float] = None  # equity net of the last snapshot
+        self.fetched_at = 0.0
+        self.held = 0.0  # margin our orders took since the snapshot
+        self.holds: List[tuple] = []  # (time, amount), to drop the ones a refresh already includes
+        self.last_order_at = 0.0
+        self.exited_at = 0.0  # an exit freed margin the snapshot does not show yet
+        self.exited_key = exited_key  # where exits in any worker are recorded
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def free(self) -> Optional[float]:
+        if self.available is None:
+            return None
+        return self.available - self.held
+
+    def can_reject(self, now: float) -> bool:
+        """
+        A local rejection is only trusted on a recent snapshot taken after
+        this worker's last order and after the last exit in any worker
+        """
+        if (self.available is None or now - self.fetched_at > MARGIN_MAX_AGE
+                or self.last_order_at > self.fetched_at or self.exited_at > self.fetched_at):
+            return False
+        exited_at = atomic_cache.get(self.exited_key) if self.exited_key else None
+        return (exited_at or 0.0) <= self.fetched_at
+
+    def as_dict(self) -> Dict:
+        free = self.free()
+        return {
+            'available': self.available,
+            'held': round(self.held, 2),
+            'free': round(free, 2) if free is not None else None,
+            'fetched_at': self.fetched_at or None,
+            'exited_at': self.exited_at or None,
+        }
+
+
+class MarginCache:
+    """Margin snapshots per account (API key and access token)"""
+
+    def __init__(self, refresh_interval: float = MARGIN_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._accounts: Dict[tuple, AccountMargin] = {}
+        self._users: Dict[str, tuple] = {}  # Kite user id -> account key, for postbacks
+        self._lock = threading.Lock()
+
+    def _account(self, kite, user_id: Optional[str] = None) -> AccountMargin:
+        key = (kite.api_key, kite.access_token)
+        account = self._accounts.get(key)
+        if account is None:
+            digest = hashlib.sha1(f"{kite.api_key}:{kite.access_token}".encode('utf-8')).hexdigest()[:16]
+            with self._lock:
+                account = self._accounts.setdefault(key, AccountMargin(_EXITED_KEY.format(account=digest)))
+        if user_id:
+            self._users[user_id] = key
+        return account
+
+    def snapshot(self, kite) -> Dict:
+        """Cached margin of an account, refreshing it in the background when old"""
+        account = self._account(kite)
+        self._refresh_if_old(kite, account)
+        return account.as_dict()
+
+    def refresh(self, kite, reason: str = 'scheduled', wait: bool = False):
+        """
+        Fetch kite.margins() for an account, in the background unless wait is set
+
+        Only one refresh per account runs at a time.
+        """
+        account = self._account(kite)
+        with account.lock:
+            if account.refreshing:
+                return
+            account.refreshing = True
+        if wait:
+            self._refresh(kite, account, reason)
+        else:
+            _executor.submit(self._refresh, kite, account, reason)
+
+    def _refresh_if_old(self, kite, account: AccountMargin):
+        if not market_clock.is_fresh(account.fetched_at, self.refresh_interval):
+            self.refresh(kite, 'stale' if account.fetched_at else 'first')
+
+    def _refresh(self, kite, account: AccountMargin, reason: str):
+        started = time.time()
+        try:
+            equity = kite.margins('equity')
+            available = float(equity['net'])
+        except Exception:
+            metrics.inc('quicktrade_margin_refreshes_total', {'reason': reason, 'outcome': 'error'})
+            with account.lock:
+                account.refreshing = False
+            return
+
+        with account.lock:
+            if account.available is not None:
+                metrics.observe('quicktrade_margin_drift', abs(account.free() - available))
+            # Holds from before the fetch started are in the new figure already
+            account.holds = [(at, amount) for at, amount in account.holds if at >= started]
+            account.held = sum(amount for _, amount in account.holds)
+            account.available = available
+            account.fetched_at = started
+            account.refreshing = False
+        metrics.inc('quicktrade_margin_refreshes_total', {'reason': reason, 'outcome': 'ok'})
+
+    def hold(self, kite, exchange: str, tradingsymbol: str, transaction_type: str, quantity: int,
+             product: str = 'MIS', user_id: Optional[str] = None, reduces_position: bool = False) -> float:
+        """
+        Check an entry against the cached margin and hold its estimated cost
+
+        Args:
+            kite: Kite client of the account
+            exchange: Exchange of the contract (NFO, BFO)
+            tradingsymbol: Option contract
+            transaction_type: BUY or SELL, only buys are checked (the margin of
+                a short leg depends on the hedges around it)
+            quantity: Order quantity
+            product: Kite product
+            user_id: Kite user id, to match insufficient funds postbacks
+            reduces_position: The order closes (part of) an open position, like
+                buying back a short leg; it frees margin and is never checked
+
+        Returns:
+            float: Amount held, 0 when it could not be estimated; pass it to
+                release if the order is not placed
+
+        Raises:
+            InsufficientMargin: If the order can not be covered
+        """
+        if transaction_type != 'BUY' or reduces_position:
+            return 0.0
+        account = self._account(kite, user_id)
+        self._refresh_if_old(kite, account)
+
+        premium = ltp_cache.get(tradingsymbol, max_age=PREMIUM_MAX_AGE)
+        if premium is None or account.available is None:
+            metrics.inc('quicktrade_margin_checks_total', {'outcome': 'unknown'})
+            return 0.0
+        required = premium * quantity
+
+        now = time.time()
+        with account.lock:
+            free = account.free()
+            doomed = required > free
+            borderline = not doomed and required > free * (1 - BORDERLINE)
+            passed = not doomed and not borderline
+            if passed:
+                self._hold(account, now, required)
+        if passed:
+            metrics.inc('quicktrade_margin_checks_total', {'outcome': 'passed'})
+            return required
+        trusted = account.can_reject(now)
+
+        if not trusted:
+            metrics.inc('quicktrade_margin_checks_total', {'outcome': 'unknown'})
+            return 0.0
+
+        if borderline:
+            # Too close to call from the LTP, ask for the exact requirement
+            try:
+                required = self._order_margin(kite, exchange, tradingsymbol, transaction_type, quantity, product)
+            except Exception:
+                metrics.inc('quicktrade_margin_checks_total', {'outcome': 'unknown'})
+                return 0.0
+
+        with account.lock:
+            free = account.free()
+            passed = required <= free
+            if passed:
+                self._hold(account, now, required)
+        if passed:
+            metrics.inc('quicktrade_margin_checks_total', {'outcome': 'passed'})
+            return required
+        metrics.inc('quicktrade_margin_checks_total', {'outcome': 'rejected'})
+        raise InsufficientMargin(required, free)
+
+    @staticmethod
+    def _hold(account: AccountMargin, now: float, amount: float):
+        account.holds.append((now, amount))
+        account.held += amount
+        account.last_order_at = now
+
+    @staticmethod
+    def _order_margin(kite, exchange, tradingsymbol, transaction_type, quantity, product) -> float:
+        """Total margin of one market order from the order margin API"""
+        response = kite.order_margins([{
+            'exchange': exchange,
+            'tradingsymbol': tradingsymbol,
+            'transaction_type': transaction_type,
+            'variety': 'regular',
+            'product': product,
+            'order_type': 'MARKET',
+            'quantity': quantity,
+            'price': 0,
+            'trigger_price': 0,
+        }])
+        return float(response[0]['total'])
+
+    def release(self, kite, amount: float):
+        """Give back a hold whose order was not placed"""
+        if not amount:
+            return
+        account = self._account(kite)
+        with account.lock:
+            for position, (at, held) in enumerate(account.holds):
+                if held == amount:
+                    del account.holds[position]
+                    account.held -= amount
+                    break
+
+    def exited(self, kite):
+        """An exit freed margin: no worker trusts a local rejection until a refresh shows it"""
+        account = self._account(kite)
+        now = time.time()
+        with account.lock:
+            account.exited_at = now
+        # Exits older than MARGIN_MAX_AGE predate every snapshot still trusted
+        atomic_cache.set(account.exited_key, now, MARGIN_MAX_AGE)
+        self.refresh(kite, 'exit')
+
+    def broker_rejected(self, kite, message: str):
+        """
+        Kite rejected an order for funds the cache thought were there: take
+        Kite's available figure at once and refresh the snapshot
+        """
+        self._correct(self._account(kite), message)
+        self.refresh(kite, 'disagreement')
+
+    def broker_rejected_user(self, user_id: str, message: str):
+        """Same as broker_rejected for an insufficient funds postback of a Kite user id"""
+        key = self._users.get(user_id)
+        account = self._accounts.get(key) if key else None
+        if account is not None:
+            self._correct(account, message)
+            # The snapshot is wrong and no client is at hand, the next order refreshes it
+            with account.lock:
+                account.fetched_at = 0.0
+
+    @staticmethod
+    def _correct(account: AccountMargin, message: str):
+        match = _FUNDS_RE.search(message or '')
+        with account.lock:
+            if match:
+                account.available = float(match.group(2))
+                account.holds, account.held = [], 0.0
+                account.fetched_at = time.time()
+        metrics.inc('quicktrade_margin_refreshes_total', {'reason': 'disagreement', 'outcome': 'corrected' if match else 'unparsed'})
+
+
+def is_insufficient_funds(message) -> bool:
+    """True for a Kite insufficient funds message (order error or rejection reason)"""
+    return 'insufficient funds' in str(message or '').lower()
+
+
+# Global instance
+margin_cache = MarginCache()
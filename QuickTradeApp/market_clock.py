@@ -0,0 +1,174 @@
+"""
+Market session clock for QuickTradeApp
+Tells from the bundled exchange calendar (exchange_calendar.json) whether
+the market is in pre-open, open, post-close, closed for the night or shut
+for a weekend or holiday. Nothing a broker read returns can change while no
+session is running, so cached reads stay fresh from the end of one session
+to the start of the next, and the dashboard is told to poll slowly then.
+
+Years missing from the calendar count every weekday as a trading day, which
+errs on the side of fresher data. Update the calendar when the exchange
+publishes next year's holidays
+"""
+import json
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+
+CALENDAR_FILE = Path(__file__).resolve().parent / 'exchange_calendar.json'
+
+# Session phases
+PRE_OPEN = 'PRE_OPEN'
+OPEN = 'OPEN'
+POST_CLOSE = 'POST_CLOSE'
+CLOSED = 'CLOSED'  # Trading day, outside its sessions
+HOLIDAY = 'HOLIDAY'  # Weekend or exchange holiday
+
+ACTIVE_PHASES = (PRE_OPEN, OPEN, POST_CLOSE)
+
+# Reads cached while no session runs are still refetched this often, in case the calendar is wrong
+MAX_QUIET_TTL = 6 * 3600  # seconds
+
+# Dashboard poll intervals per phase: (portfolio tables, live P&L and risk) in seconds
+POLL_INTERVALS = {
+    PRE_OPEN: (30, 2),
+    OPEN: (30, 2),
+    POST_CLOSE: (60, 10),
+}
+
+# Outside the sessions the dashboard polls once the next session starts, at most this far apart
+MAX_QUIET_POLL = 3600  # seconds
+
+# How far to look for the next or previous session
+SEARCH_DAYS = 15
+
+
+def _parse_time(value: str) -> dt_time:
+    hours, minutes = value.split(':')
+    return dt_time(int(hours), int(minutes))
+
+
+class MarketClock:
+    """Sessions of one exchange from its calendar file"""
+
+    def __init__(self, calendar_file: Path = CALENDAR_FILE):
+        with open(calendar_file, encoding='utf-8') as handle:
+            calendar = json.load(handle)
+        self.timezone = pytz.timezone(calendar.get('timezone', 'Asia/Kolkata'))
+        times = calendar['session']
+        self.pre_open = _parse_time(times['pre_open'])
+        self.open = _parse_time(times['open'])
+        self.close = _parse_time(times['close'])
+        self.post_close_end = _parse_time(times['post_close_end'])
+        self.holidays: Dict[date, str] = {
+            date.fromisoformat(day): name for day, name in calendar.get('holidays', {}).items()
+        }
+        self.special_sessions: Dict[date, Dict] = {
+            date.fromisoformat(day): session for day, session in calendar.get('special_sessions', {}).items()
+        }
+
+    def _at(self, day: date, clock: dt_time) -> float:
+        return self.timezone.localize(datetime.combine(day, clock)).timestamp()
+
+    def sessions(self, day: date) -> List[Tuple[str, float, float]]:
+        """(phase, start, end) of every session on a day, empty on holidays and weekends"""
+        special = self.special_sessions.get(day)
+        if special:
+            return [(OPEN, self._at(day, _parse_time(special['open'])),
+                     self._at(day, _parse_time(special['close'])))]
+        if day.weekday() >= 5 or day in self.holidays:
+            return []
+        return [
+            (PRE_OPEN, self._at(day, self.pre_open), self._at(day, self.open)),
+            (OPEN, self._at(day, self.open), self._at(day, self.close)),
+            (POST_CLOSE, self._at(day, self.close), self._at(day, self.post_close_end)),
+        ]
+
+    def _today(self, now: float) -> date:
+        return datetime.fromtimestamp(now, self.timezone).date()
+
+    def phase(self, now: Optional[float] = None) -> Tuple[str, float]:
+        """
+        Current session phase and when it ends
+
+        Returns:
+            tuple: (phase, epoch seconds of the next phase change)
+        """
+        now = time.time() if now is None else now
+        today = self._today(now)
+        sessions = self.sessions(today)
+        for phase, start, end in sessions:
+            if start <= now < end:
+                return phase, end
+        quiet = CLOSED if sessions else HOLIDAY
+        return quiet, self.next_session_start(now)
+
+    def is_active(self, now: Optional[float] = None) -> bool:
+        """True while a session (pre-open, open or post-close) is running"""
+        return self.phase(now)[0] in ACTIVE_PHASES
+
+    def next_session_start(self, now: float) -> float:
+        """Start of the first session after now"""
+        day = self._today(now)
+        for offset in range(SEARCH_DAYS):
+            for _, start, _ in self.sessions(day + timedelta(days=offset)):
+                if start > now:
+                    return start
+        return now + MAX_QUIET_TTL
+
+    def quiet_since(self, now: Optional[float] = None) -> Optional[float]:
+        """End of the last session if none is running now, else None"""
+        now = time.time() if now is None else now
+        day = self._today(now)
+        for offset in range(SEARCH_DAYS):
+            for _, start, end in reversed(self.sessions(day - timedelta(days=offset))):
+                if start <= now < end:
+                    return None
+                if end <= now:
+                    return end
+        return now - MAX_QUIET_TTL
+
+    def is_fresh(self, fetched_at: float, ttl: float, now: Optional[float] = None) -> bool:
+        """
+        True if a read made at fetched_at can still be served
+
+        It is fresh within its TTL, and for as long as no session started
+        since it was made (up to MAX_QUIET_TTL).
+        """
+        now = time.time() if now is None else now
+        age = now - fetched_at
+        if age < ttl:
+            return True
+        quiet_since = self.quiet_since(now)
+        return quiet_since is not None and fetched_at >= quiet_since and age < MAX_QUIET_TTL
+
+    def ttl(self, ttl: int, now: Optional[float] = None) -> int:
+        """Cache timeout for a read: ttl during a session, until the next session outside them"""
+        now = time.time() if now is None else now
+        phase, until = self.phase(now)
+        if phase in ACTIVE_PHASES:
+            return ttl
+        return int(max(ttl, min(until - now, MAX_QUIET_TTL)))
+
+    def poll_hint(self, now: Optional[float] = None) -> Dict:
+        """Phase and poll intervals (seconds) for the dashboard"""
+        now = time.time() if now is None else now
+        phase, until = self.phase(now)
+        if phase in POLL_INTERVALS:
+            portfolio, live = POLL_INTERVALS[phase]
+        else:
+            # Nothing moves until the next session: wake up when it starts
+            portfolio = live = int(max(POLL_INTERVALS[PRE_OPEN][0], min(until - now, MAX_QUIET_POLL)))
+        return {
+            'session': phase,
+            'next_change': until,
+            'portfolio_interval': portfolio,
+            'live_interval': live,
+        }
+
+
+# Global instance
+market_clock = MarketClock()
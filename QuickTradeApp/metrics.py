@@ -0,0 +1,93 @@
+"""
+Process metrics for QuickTradeApp
+Counters, gauges and summaries rendered in the Prometheus text format by
+the /metrics/ endpoint. Values are per worker process, like every other
+in-memory structure of the app
+"""
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict]) -> LabelKey:
+    return tuple(sorted((str(k), str(v)) for k, v in (labels or {}).items()))
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in key)
+    return "{" + body + "}"
+
+
+class MetricsRegistry:
+    """Thread safe metric store"""
+
+    def __init__(self):
+        self._types: Dict[str, str] = {}
+        self._help: Dict[str, str] = {}
+        self._values: Dict[str, Dict[LabelKey, List[float]]] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, metric_type: str, help_text: str):
+        """Declare a metric ('counter', 'gauge' or 'summary') and its help text"""
+        with self._lock:
+            self._types[name] = metric_type
+            self._help[name] = help_text
+            self._values.setdefault(name, {})
+
+    def inc(self, name: str, labels: Optional[Dict] = None, value: float = 1):
+        """Increase a counter"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series.setdefault(key, [0.0])[0] += value
+
+    def set(self, name: str, value: float, labels: Optional[Dict] = None):
+        """Set a gauge"""
+        with self._lock:
+            self._values.setdefault(name, {})[_label_key(labels)] = [float(value)]
+
+    def observe(self, name: str, value: float, labels: Optional[Dict] = None):
+        """Add an observation to a summary (sum and count)"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            total = series.setdefault(key, [0.0, 0.0])
+            total[0] += value
+            total[1] += 1
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Register a callback that refreshes gauges right before rendering"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception:
+                pass
+
+        lines = []
+        with self._lock:
+            for name in sorted(self._values):
+                metric_type = self._types.get(name, 'untyped')
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for key, value in sorted(self._values[name].items()):
+                    labels = _format_labels(key)
+                    if metric_type == 'summary':
+                        lines.append(f"{name}_sum{labels} {value[0]:g}")
+                        lines.append(f"{name}_count{labels} {value[1]:g}")
+                    else:
+                        lines.append(f"{name}{labels} {value[0]:g}")
+        return "\n".join(lines) + "\n"
+
+
+# Global instance
+metrics = MetricsRegistry()
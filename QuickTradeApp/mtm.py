@@ -0,0 +1,188 @@
+"""
+Mark-to-market P&L engine for QuickTradeApp
+Takes quantity and traded value from the last positions snapshot and
+reprices open legs incrementally as ticks arrive in the LTP cache. A tick
+only reaches the engines with an open leg in its symbol, and engines of
+accounts that logged out or stopped polling are dropped
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .ltp_cache import ltp_cache
+
+# Engines not read for this long are dropped, the next P&L poll reloads them
+ENGINE_IDLE_TTL = 900  # seconds
+
+# How often get() looks for idle engines
+SWEEP_INTERVAL = 60  # seconds
+
+
+class PositionMTM:
+    """Running P&L of a single position"""
+
+    __slots__ = ('symbol', 'exchange', 'quantity', 'multiplier', 'average_price', 'last_price', 'pnl')
+
+    def __init__(self, position: Dict):
+        self.symbol = position['tradingsymbol']
+        self.exchange = position.get('exchange')
+        self.quantity = int(position.get('quantity') or 0)
+        self.multiplier = float(position.get('multiplier') or 1)
+        self.average_price = float(position.get('average_price') or 0)
+        self.last_price = float(position.get('last_price') or 0)
+        if 'sell_value' in position:
+            # Kite definition: realised cash flow plus open quantity at the last price
+            realised = float(position['sell_value']) - float(position.get('buy_value') or 0)
+            self.pnl = realised + self.quantity * self.last_price * self.multiplier
+        else:
+            self.pnl = float(position.get('pnl') or 0)
+
+    def reprice(self, ltp: float) -> float:
+        """Move to a new price and return the change in P&L"""
+        delta = self.quantity * self.multiplier * (ltp - self.last_price)
+        self.last_price = ltp
+        self.pnl += delta
+        return delta
+
+
+class MTMEngine:
+    """Per-account P&L kept current by incremental updates"""
+
+    def __init__(self, user_id: str, on_load: Optional[Callable[['MTMEngine'], None]] = None):
+        self.user_id = user_id
+        self.positions: Dict[str, PositionMTM] = {}
+        self.total_pnl = 0.0
+        self.source_version = None
+        self.updated_at = 0.0
+        self.read_at = time.monotonic()
+        self.on_load = on_load  # told about every snapshot, to route ticks by symbol
+        self._lock = threading.Lock()
+
+    def load_snapshot(self, positions: List[Dict], version=None):
+        """
+        Reset the engine from a positions snapshot
+
+        Args:
+            positions: kite.positions()["net"]
+            version: Version of the snapshot, used to skip reloading the same one
+        """
+        with self._lock:
+            self.positions = {}
+            for position in positions:
+                mtm = PositionMTM(position)
+                # Prefer a fresher cached price than the one in the snapshot
+                cached = ltp_cache.get(mtm.symbol)
+                if cached is not None:
+                    mtm.reprice(cached)
+                self.positions[mtm.symbol] = mtm
+            self.total_pnl = sum(p.pnl for p in self.positions.values())
+            self.source_version = version
+            self.updated_at = time.time()
+        if self.on_load:
+            self.on_load(self)
+
+    def on_tick(self, symbol: str, ltp: float, timestamp: Optional[float] = None):
+        """Reprice one leg and adjust the total by its change only"""
+        mtm = self.positions.get(symbol)
+        if mtm is None or mtm.quantity == 0:
+            return
+        with self._lock:
+            self.total_pnl += mtm.reprice(ltp)
+            self.updated_at = timestamp or time.time()
+
+    def open_symbols(self) -> List[str]:
+        return [mtm.symbol for mtm in self.positions.values() if mtm.quantity != 0]
+
+    def open_legs(self) -> List[Dict]:
+        """Legs that still carry quantity, in the shape of a Kite position row"""
+        return [
+            {'tradingsymbol': mtm.symbol, 'exchange': mtm.exchange}
+            for mtm in self.positions.values() if mtm.quantity != 0
+        ]
+
+    def snapshot(self) -> Dict:
+        """Current P&L for the dashboard"""
+        with self._lock:
+            return {
+                'total_pnl': round(self.total_pnl, 2),
+                'updated_at': self.updated_at,
+                'positions': {
+                    symbol: {
+                        'quantity': mtm.quantity,
+                        'average_price': mtm.average_price,
+                        'last_price': mtm.last_price,
+                        'pnl': round(mtm.pnl, 2),
+                    }
+                    for symbol, mtm in self.positions.items()
+                }
+            }
+
+
+class MTMRegistry:
+    """Routes ticks from the LTP cache to the engines holding the symbol"""
+
+    def __init__(self, idle_ttl: float = ENGINE_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._engines: Dict[str, MTMEngine] = {}
+        # Engines with an open leg per symbol, replaced rather than changed so ticks read them unlocked
+        self._by_symbol: Dict[str, Tuple[MTMEngine, ...]] = {}
+        self._symbols: Dict[str, List[str]] = {}  # user id -> symbols it is routed under
+        self._swept_at = time.monotonic()
+        self._lock = threading.Lock()
+        ltp_cache.subscribe(self._on_tick)
+
+    def get(self, user_id: str) -> MTMEngine:
+        """Get (or create) the engine of an account"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._swept_at >= SWEEP_INTERVAL:
+                self._sweep(now)
+            engine = self._engines.get(user_id)
+            if engine is None:
+                engine = MTMEngine(user_id, on_load=self._route)
+                self._engines[user_id] = engine
+            engine.read_at = now
+            return engine
+
+    def drop(self, user_id: str):
+        """Forget the engine of an account, e.g. on logout"""
+        with self._lock:
+            engine = self._engines.pop(user_id, None)
+            if engine is not None:
+                self._unroute(engine)
+
+    def _sweep(self, now: float):
+        """Drop engines nobody read for idle_ttl (lock held)"""
+        self._swept_at = now
+        for user_id, engine in list(self._engines.items()):
+            if now - engine.read_at >= self.idle_ttl:
+                del self._engines[user_id]
+                self._unroute(engine)
+
+    def _route(self, engine: MTMEngine):
+        """Route ticks of the open legs of a freshly loaded engine to it"""
+        with self._lock:
+            if self._engines.get(engine.user_id) is not engine:
+                return  # dropped meanwhile
+            self._unroute(engine)
+            symbols = engine.open_symbols()
+            for symbol in symbols:
+                self._by_symbol[symbol] = self._by_symbol.get(symbol, ()) + (engine,)
+            self._symbols[engine.user_id] = symbols
+
+    def _unroute(self, engine: MTMEngine):
+        """Stop routing ticks to an engine (lock held)"""
+        for symbol in self._symbols.pop(engine.user_id, ()):
+            engines = tuple(other for other in self._by_symbol.get(symbol, ()) if other is not engine)
+            if engines:
+                self._by_symbol[symbol] = engines
+            else:
+                self._by_symbol.pop(symbol, None)
+
+    def _on_tick(self, symbol: str, ltp: float, timestamp: float):
+        for engine in self._by_symbol.get(symbol, ()):
+            engine.on_tick(symbol, ltp, timestamp)
+
+
+# Global instance
+mtm_engines = MTMRegistry()
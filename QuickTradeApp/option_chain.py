@@ -0,0 +1,153 @@
+"""
+Option chain snapshot for QuickTradeApp
+Fetches the Fyers option chain once into arrays, solves IV and Greeks for
+every strike in one vectorized pass and shares the result across users
+"""
+import time
+from datetime import datetime
+
+import numpy as np
+import pytz
+from django.core.cache import cache
+from django.http import HttpRequest
+
+from .broker_clients import get_fyers_client
+from .instruments import get_index_spec
+from .market_clock import market_clock
+from .option_greeks import greeks, implied_volatility
+from .tick_recorder import record_ticks
+
+# Chains are shared by every user for this long during a session, until the next one outside them
+CHAIN_CACHE_TTL = 5  # seconds
+
+# Expiry list changes at most once a day
+EXPIRY_CACHE_TTL = 3600  # seconds
+
+IST = pytz.timezone('Asia/Kolkata')
+SECONDS_PER_YEAR = 365.0 * 86400
+
+
+def _get_fyers(request: HttpRequest):
+    client_id = request.session.get('fyers_client_id')
+    access_token = request.session.get('fyers_access_token')
+    if not client_id or not access_token:
+        raise Exception("Fyers credentials not found in session")
+    return get_fyers_client(client_id, access_token)
+
+
+def _fetch_chain(fyers, symbol: str, strikecount: int, timestamp: str = "") -> dict:
+    response = fyers.optionchain(data={
+        "symbol": symbol,
+        "strikecount": strikecount,
+        "timestamp": timestamp
+    })
+    if not response or response.get('code') != 200:
+        raise Exception(f"Failed to get option chain. Response: {response}")
+    return response.get('data', {})
+
+
+def _years_to_expiry(expiry_date) -> float:
+    """Time left until 15:30 IST on the expiry date, in years"""
+    expiry_close = IST.localize(datetime.combine(expiry_date, datetime.min.time()).replace(hour=15, minute=30))
+    return max((expiry_close.timestamp() - time.time()) / SECONDS_PER_YEAR, 1e-6)
+
+
+def get_option_chain(request: HttpRequest, index: str, expiry: str = None, strikecount: int = 25) -> dict:
+    """
+    Get the option chain of an index with IV and Greeks for every strike
+
+    Args:
+        request (HttpRequest): Django request object containing Fyers session data
+        index (str): Index name ('NIFTY', 'BANKNIFTY', 'SENSEX' or 'BANKEX')
+        expiry (str): Expiry date as YYYY-MM-DD, nearest expiry if omitted
+        strikecount (int): Strikes on each side of ATM
+
+    Returns:
+        dict: Spot, expiry and per-strike columns for CE and PE
+    """
+    index = index.upper()
+    symbol = get_index_spec(index)['fyers_index_symbol']
+
+    cache_key = f"option_chain:{index}:{expiry or 'nearest'}:{strikecount}"
+    cached = cache.get(cache_key)
+    if cached:
+        return cached
+
+    fyers = _get_fyers(request)
+
+    # Resolve the requested expiry to the Fyers timestamp, one extra call at most per hour
+    timestamp = ""
+    if expiry:
+        expiries = cache.get(f"option_expiries:{index}")
+        if expiries is None:
+            data = _fetch_chain(fyers, symbol, 1)
+            expiries = {
+                datetime.strptime(item['date'], '%d-%m-%Y').strftime('%Y-%m-%d'): str(item.get('expiry', ''))
+                for item in data.get('expiryData', [])
+            }
+            cache.set(f"option_expiries:{index}", expiries, market_clock.ttl(EXPIRY_CACHE_TTL))
+        if expiry not in expiries:
+            raise ValueError(f"Unknown expiry {expiry} for {index}")
+        timestamp = expiries[expiry]
+
+    data = _fetch_chain(fyers, symbol, strikecount, timestamp)
+    rows = data.get('optionsChain', [])
+
+    if not expiry:
+        expiry_data = data.get('expiryData', [])
+        if not expiry_data:
+            raise Exception(f"No expiry data in option chain for {index}")
+        expiry = datetime.strptime(expiry_data[0]['date'], '%d-%m-%Y').strftime('%Y-%m-%d')
+
+    # Underlying row has no option type
+    spot = next((float(row['ltp']) for row in rows if not row.get('option_type')), None)
+    if spot is None:
+        raise Exception(f"Underlying price missing from option chain for {index}")
+
+    options = [row for row in rows if row.get('option_type') in ('CE', 'PE')]
+    strike = np.fromiter((row['strike_price'] for row in options), dtype=np.float64, count=len(options))
+    ltp = np.fromiter((row.get('ltp') or np.nan for row in options), dtype=np.float64, count=len(options))
+
+    # Snapshot of the whole chain for the tick files, Kite style symbols
+    record_ticks(
+        [index] + [row.get('symbol', '').partition(':')[2] for row in options],
+        np.concatenate(([spot], ltp)),
+        np.fromiter((row.get('volume') or 0 for row in [{}] + options), dtype=np.int64, count=len(options) + 1),
+        np.fromiter((row.get('bid') or np.nan for row in [{}] + options), dtype=np.float64, count=len(options) + 1),
+        np.fromiter((row.get('ask') or np.nan for row in [{}] + options), dtype=np.float64, count=len(options) + 1),
+    )
+    oi = np.fromiter((row.get('oi') or 0 for row in options), dtype=np.float64, count=len(options))
+    is_call = np.fromiter((row['option_type'] == 'CE' for row in options), dtype=bool, count=len(options))
+
+    # One pass over every contract in the chain
+    years = _years_to_expiry(datetime.strptime(expiry, '%Y-%m-%d').date())
+    iv = implied_volatility(ltp, spot, strike, years, is_call)
+    chain_greeks = greeks(spot, strike, years, iv, is_call)
+
+    # Scatter contracts into per-strike CE / PE columns
+    strikes = np.unique(strike)
+    position = np.searchsorted(strikes, strike)
+
+    def column(values, mask):
+        out = np.full(strikes.shape, np.nan)
+        out[position[mask]] = values[mask]
+        return [None if np.isnan(v) else round(float(v), 6) for v in out]
+
+    result = {
+        'index': index,
+        'expiry': expiry,
+        'spot': spot,
+        'years_to_expiry': years,
+        'strikes': strikes.tolist(),
+        'generated_at': time.time(),
+    }
+    for side, mask in (('CE', is_call), ('PE', ~is_call)):
+        result[side] = {
+            'ltp': column(ltp, mask),
+            'oi': column(oi, mask),
+            'iv': column(iv, mask),
+            **{name: column(values, mask) for name, values in chain_greeks.items()},
+        }
+
+    cache.set(cache_key, result, market_clock.ttl(CHAIN_CACHE_TTL))
+    return result
@@ -0,0 +1,134 @@
+"""
+Vectorized Black-Scholes pricing, implied volatility and Greeks
+All functions take NumPy arrays (or scalars that broadcast) so a whole
+option chain is priced in one pass
+"""
+import numpy as np
+
+# Annualised risk-free rate used for index options
+RISK_FREE_RATE = 0.065
+
+# Implied volatility search bounds and tolerance
+IV_LOWER = 1e-4
+IV_UPPER = 5.0
+IV_TOLERANCE = 1e-6
+IV_MAX_ITERATIONS = 50
+
+_SQRT_2PI = np.sqrt(2.0 * np.pi)
+
+
+def _norm_pdf(x):
+    return np.exp(-0.5 * x * x) / _SQRT_2PI
+
+
+def _norm_cdf(x):
+    """Standard normal CDF (Abramowitz & Stegun 7.1.26, |error| < 1.5e-7)"""
+    z = np.abs(x) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poly * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * erf)
+
+
+def _d1_d2(spot, strike, years, rate, sigma):
+    sqrt_t = np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * sigma * sigma) * years) / (sigma * sqrt_t)
+    return d1, d1 - sigma * sqrt_t
+
+
+def bs_price(spot, strike, years, sigma, is_call, rate=RISK_FREE_RATE):
+    """
+    Black-Scholes price of European options
+
+    Args:
+        spot: Underlying price
+        strike: Strike prices
+        years: Time to expiry in years
+        sigma: Volatility
+        is_call: Boolean array, True for CE and False for PE
+        rate: Risk-free rate
+
+    Returns:
+        np.ndarray: Option prices
+    """
+    d1, d2 = _d1_d2(spot, strike, years, rate, sigma)
+    discount = strike * np.exp(-rate * years)
+    call = spot * _norm_cdf(d1) - discount * _norm_cdf(d2)
+    put = discount * _norm_cdf(-d2) - spot * _norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def implied_volatility(price, spot, strike, years, is_call, rate=RISK_FREE_RATE):
+    """
+    Solve implied volatility for every option at once
+
+    Newton steps are taken while they stay inside a per-option bracket
+    that shrinks on every iteration; when a step leaves the bracket (or
+    vega is too small to trust) that option bisects instead.
+
+    Returns:
+        np.ndarray: Implied volatility, NaN where the price is below
+        intrinsic value or otherwise has no solution
+    """
+    price, strike, is_call = np.broadcast_arrays(
+        np.asarray(price, dtype=np.float64),
+        np.asarray(strike, dtype=np.float64),
+        np.asarray(is_call, dtype=bool),
+    )
+    years = np.maximum(np.asarray(years, dtype=np.float64), 1e-6)
+
+    intrinsic = np.where(is_call, np.maximum(spot - strike * np.exp(-rate * years), 0.0),
+                         np.maximum(strike * np.exp(-rate * years) - spot, 0.0))
+    valid = np.isfinite(price) & (price > intrinsic) & (price > 0)
+
+    lo = np.full(price.shape, IV_LOWER)
+    hi = np.full(price.shape, IV_UPPER)
+    sigma = np.full(price.shape, 0.2)
+    active = valid.copy()
+
+    for _ in range(IV_MAX_ITERATIONS):
+        if not active.any():
+            break
+
+        d1, _d2 = _d1_d2(spot, strike, years, rate, sigma)
+        diff = bs_price(spot, strike, years, sigma, is_call, rate) - price
+        vega = spot * _norm_pdf(d1) * np.sqrt(years)
+
+        converged = np.abs(diff) < IV_TOLERANCE
+        active &= ~converged
+
+        # Tighten the bracket around the root
+        hi = np.where(active & (diff > 0), sigma, hi)
+        lo = np.where(active & (diff < 0), sigma, lo)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = sigma - diff / vega
+        use_newton = (vega > 1e-8) & (newton > lo) & (newton < hi)
+        step = np.where(use_newton, newton, 0.5 * (lo + hi))
+        sigma = np.where(active, step, sigma)
+
+    return np.where(valid, sigma, np.nan)
+
+
+def greeks(spot, strike, years, sigma, is_call, rate=RISK_FREE_RATE):
+    """
+    Delta, gamma, theta (per day) and vega (per 1% volatility) for every option
+
+    Returns:
+        dict: Arrays keyed by greek name
+    """
+    years = np.maximum(np.asarray(years, dtype=np.float64), 1e-6)
+    sqrt_t = np.sqrt(years)
+    d1, d2 = _d1_d2(spot, strike, years, rate, sigma)
+    pdf_d1 = _norm_pdf(d1)
+    discount = strike * np.exp(-rate * years)
+
+    delta = np.where(is_call, _norm_cdf(d1), _norm_cdf(d1) - 1.0)
+    gamma = pdf_d1 / (spot * sigma * sqrt_t)
+    decay = -spot * pdf_d1 * sigma / (2.0 * sqrt_t)
+    theta = np.where(is_call,
+                     decay - rate * discount * _norm_cdf(d2),
+                     decay + rate * discount * _norm_cdf(-d2)) / 365.0
+    vega = spot * pdf_d1 * sqrt_t / 100.0
+
+    return {'delta': delta, 'gamma': gamma, 'theta': theta, 'vega': vega}
@@ -0,0 +1,312 @@
+"""
+Order and trade history for QuickTradeApp
+Kite only returns today's order book. Every order that reaches a final
+status (seen in a postback, a reconciliation or the paper broker) is
+appended to day files of its account, so history can be exported for any
+date range afterwards.
+
+Layout: data/history/<account>/<YYYY-MM-DD>.orders.jsonl and
+.trades.jsonl, one JSON array per line (ORDER_FIELDS, TRADE_FIELDS), days
+in IST. A trade row is the fill of one order: its filled quantity at its
+average price.
+
+Exports read one day file at a time and hand out EXPORT_CHUNK_ROWS rows at
+a time, streamed as CSV or Parquet (pyarrow, optional), so memory stays
+bounded whatever the range
+"""
+import csv
+import importlib
+import io
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pytz
+
+from .shared_cache import atomic_cache
+
+ORDERS = 'orders'
+TRADES = 'trades'
+
+# Statuses an order never leaves
+FINAL_STATUSES = ('COMPLETE', 'CANCELLED', 'REJECTED')
+
+ORDER_FIELDS = (
+    'order_id', 'exchange_order_id', 'parent_order_id', 'order_timestamp', 'exchange_update_timestamp',
+    'exchange', 'tradingsymbol', 'transaction_type', 'product', 'order_type', 'variety', 'validity',
+    'quantity', 'price', 'trigger_price', 'filled_quantity', 'cancelled_quantity', 'average_price',
+    'status', 'status_message', 'tag',
+)
+TRADE_FIELDS = (
+    'order_id', 'exchange_order_id', 'fill_timestamp', 'exchange', 'tradingsymbol', 'transaction_type',
+    'product', 'quantity', 'average_price', 'value',
+)
+FIELDS = {ORDERS: ORDER_FIELDS, TRADES: TRADE_FIELDS}
+
+_INT_FIELDS = {'quantity', 'filled_quantity', 'cancelled_quantity'}
+_FLOAT_FIELDS = {'price', 'trigger_price', 'average_price', 'value'}
+_TIME_FIELDS = {'order_timestamp', 'exchange_update_timestamp', 'fill_timestamp'}
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+IST = pytz.timezone('Asia/Kolkata')
+
+# Rows per CSV write / Parquet row group of an export
+EXPORT_CHUNK_ROWS = 5000
+
+# Longest range one export may cover
+MAX_EXPORT_DAYS = 3 * 366
+
+# An order is recorded once per account, across workers sharing the cache
+RECORDED_TTL = 2 * 86400  # seconds
+_RECORDED_KEY = "order_history:{account}:{order_id}"
+
+logger = logging.getLogger(__name__)
+
+# Appends run here, never on the request or order path
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="order-history")
+
+
+class ParquetUnavailable(Exception):
+    """Raised for a Parquet export when pyarrow is not installed"""
+
+    error_code = 'FORMAT_UNAVAILABLE'
+
+
+def _safe_name(account: str) -> str:
+    return re.sub(r'[^A-Za-z0-9-]', '_', str(account))
+
+
+def _stamp(value) -> Optional[str]:
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(IST).replace(tzinfo=None)
+        return value.strftime(TIME_FORMAT)
+    return str(value) if value else None
+
+
+def _field(order: Dict, field: str):
+    value = order.get(field)
+    if value in (None, ''):
+        return None
+    if field in _TIME_FIELDS:
+        return _stamp(value)
+    try:
+        if field in _INT_FIELDS:
+            return int(value)
+        if field in _FLOAT_FIELDS:
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def order_row(order: Dict) -> List:
+    """Order history row of a Kite order dict"""
+    return [_field(order, field) for field in ORDER_FIELDS]
+
+
+def trade_row(order: Dict) -> Optional[List]:
+    """Trade history row of a Kite order dict, None if nothing was filled"""
+    quantity = _field(order, 'filled_quantity')
+    if not quantity:
+        return None
+    average = _field(order, 'average_price') or 0.0
+    filled_at = (_field(order, 'exchange_update_timestamp') or _stamp(order.get('exchange_timestamp'))
+                 or _field(order, 'order_timestamp'))
+    return [
+        _field(order, 'order_id'), _field(order, 'exchange_order_id'), filled_at, _field(order, 'exchange'),
+        _field(order, 'tradingsymbol'), _field(order, 'transaction_type'), _field(order, 'product'),
+        quantity, average, round(quantity * average, 2),
+    ]
+
+
+class OrderHistory:
+    """Day files of final orders and their fills, per account"""
+
+    def __init__(self, storage_dir: str = "data/history"):
+        self.storage_dir = Path(storage_dir)
+
+    def _day_file(self, account: str, day: str, kind: str) -> Path:
+        return self.storage_dir / _safe_name(account) / f"{day}.{kind}.jsonl"
+
+    def record(self, account: str, orders: Iterable[Dict]):
+        """
+        Queue the final orders among these for appending, each order once
+
+        Args:
+            account: Kite user id, or the paper token of a paper account
+            orders: Order dicts as Kite returns them (postback, order book row)
+        """
+        if not account:
+            return
+        rows = []
+        for order in orders:
+            order_id = order.get('order_id')
+            if order.get('status') not in FINAL_STATUSES or not order_id:
+                continue
+            if atomic_cache.add(_RECORDED_KEY.format(account=account, order_id=order_id), True, RECORDED_TTL):
+                rows.append((order_row(order), trade_row(order)))
+        if rows:
+            _executor.submit(self._append, account, rows)
+
+    def _append(self, account: str, rows: List[Tuple[List, Optional[List]]]):
+        today = datetime.now(IST).strftime('%Y-%m-%d')
+        by_day: Dict[Tuple[str, str], List[str]] = {}
+        for order, trade in rows:
+            day = (order[ORDER_FIELDS.index('order_timestamp')] or today)[:10]
+            by_day.setdefault((day, ORDERS), []).append(json.dumps(order, separators=(',', ':')))
+            if trade is not None:
+                by_day.setdefault((day, TRADES), []).append(json.dumps(trade, separators=(',', ':')))
+        try:
+            (self.storage_dir / _safe_name(account)).mkdir(parents=True, exist_ok=True)
+            for (day, kind), lines in by_day.items():
+                with open(self._day_file(account, day, kind), 'a', encoding='utf-8') as f:
+                    f.write("\n".join(lines) + "\n")
+        except OSError:
+            logger.exception("Could not append %d orders to the history of %s", len(rows), account)
+
+    def flush(self, timeout: float = 2.0):
+        """Wait for the appends queued so far"""
+        try:
+            _executor.submit(lambda: None).result(timeout=timeout)
+        except Exception:
+            pass
+
+    def rows(self, account: str, kind: str, start: date, end: date) -> Iterator[List]:
+        """Rows of an account between two days (inclusive), oldest day first, each order once"""
+        day = start
+        while day <= end:
+            path = self._day_file(account, day.isoformat(), kind)
+            day += timedelta(days=1)
+            if not path.exists():
+                continue
+            # A dedupe key culled from the cache lets an order be recorded twice
+            seen = set()
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue
+                    if row[0] in seen:
+                        continue
+                    seen.add(row[0])
+                    yield row
+
+    def chunks(self, account: str, kind: str, start: date, end: date,
+               size: int = EXPORT_CHUNK_ROWS) -> Iterator[List[List]]:
+        """Rows in lists of up to size"""
+        chunk = []
+        for row in self.rows(account, kind, start, end):
+            chunk.append(row)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def stream_csv(kind: str, chunks: Iterable[List[List]]) -> Iterator[bytes]:
+    """CSV with a header row, one piece per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS[kind])
+    yield buffer.getvalue().encode('utf-8')
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _pyarrow():
+    """pyarrow and pyarrow.parquet, loaded on first use"""
+    try:
+        return importlib.import_module('pyarrow'), importlib.import_module('pyarrow.parquet')
+    except ImportError:
+        raise ParquetUnavailable("Parquet export needs pyarrow, install it or export as CSV")
+
+
+def parquet_available() -> bool:
+    """True if Parquet exports can be made here"""
+    try:
+        _pyarrow()
+        return True
+    except ParquetUnavailable:
+        return False
+
+
+class _ChunkSink:
+    """Write-only file the Parquet writer fills and the response drains"""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def parquet_schema(kind: str):
+    """Column types of a history kind, times as naive IST timestamps"""
+    pa, _ = _pyarrow()
+    types = []
+    for field in FIELDS[kind]:
+        if field in _INT_FIELDS:
+            types.append((field, pa.int64()))
+        elif field in _FLOAT_FIELDS:
+            types.append((field, pa.float64()))
+        elif field in _TIME_FIELDS:
+            types.append((field, pa.timestamp('s')))
+        else:
+            types.append((field, pa.string()))
+    return pa.schema(types)
+
+
+def stream_parquet(kind: str, chunks: Iterable[List[List]]) -> Iterator[bytes]:
+    """Parquet file with one row group per chunk, streamed as each group is written"""
+    pa, pq = _pyarrow()
+    compute = importlib.import_module('pyarrow.compute')
+    schema = parquet_schema(kind)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    try:
+        for chunk in chunks:
+            columns = []
+            for position, column in enumerate(schema):
+                values = [row[position] for row in chunk]
+                if column.name in _TIME_FIELDS:
+                    columns.append(compute.strptime(pa.array(values, pa.string()), format=TIME_FORMAT,
+                                                    unit='s', error_is_null=True))
+                else:
+                    columns.append(pa.array(values, column.type))
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+# Global instance
+order_history = OrderHistory()
@@ -0,0 +1,153 @@
+"""
+Idempotent order submission for QuickTradeApp
+Every order request carries a client idempotency key that is mapped to the
+Kite order tag. A short-lived dedupe table in the cache every worker
+shares (see shared_cache.py) stops the same request from placing twice, on
+whichever worker the retry lands, and ambiguous failures (timeouts, dropped
+connections) are resolved by looking the order up by tag before retrying.
+"""
+import hashlib
+import time
+
+import requests
+
+from .broker_clients import kite_exceptions
+from .shared_cache import atomic_cache
+
+# Aggressive timeout for order placement, ambiguous outcomes are resolved by tag
+ORDER_TIMEOUT = 3  # seconds
+
+# Attempts per order, including the first one
+MAX_SUBMIT_ATTEMPTS = 3
+
+# Give the order book a moment to show an order that timed out in flight
+TAG_LOOKUP_DELAY = 0.25  # seconds
+
+# How long a key keeps its outcome for duplicate requests
+IDEMPOTENCY_TTL = 600  # seconds
+
+_TABLE_KEY = "order_idempotency:{account}:{key}"
+
+
+class OrderStatusUnknown(Exception):
+    """Raised when neither the order call nor the tag lookup gave a definite answer"""
+
+
+def make_order_tag(idempotency_key: str) -> str:
+    """Kite tags are alphanumeric and at most 20 characters"""
+    return "qt" + hashlib.sha1(idempotency_key.encode('utf-8')).hexdigest()[:18]
+
+
+def is_ambiguous_failure(error: Exception) -> bool:
+    """True if the order may or may not have reached the exchange"""
+    return isinstance(error, (requests.exceptions.Timeout,
+                              requests.exceptions.ConnectionError,
+                              kite_exceptions().NetworkException))
+
+
+def find_order_by_tag(kite, tag: str):
+    """
+    Find an order placed today with the given tag
+
+    Returns:
+        str: Order id, or None if no such order exists
+    """
+    return find_orders_by_tags(kite, [tag]).get(tag)
+
+
+def find_orders_by_tags(kite, tags) -> dict:
+    """
+    Find the orders placed today with any of the given tags, in one order book read
+
+    Returns:
+        dict: Order id by tag, tags without an order are left out
+    """
+    wanted = set(tags)
+    found = {}
+    for order in kite.orders():
+        for tag in wanted.intersection([order.get('tag')] + list(order.get('tags') or [])):
+            found.setdefault(tag, order.get('order_id'))
+    return found
+
+
+def submit_with_tag(kite, tag: str, **order_params) -> str:
+    """
+    Place an order, retrying ambiguous failures only after checking by tag
+
+    Args:
+        kite: KiteConnect client (with a short timeout)
+        tag: Kite order tag derived from the idempotency key
+        **order_params: Arguments of kite.place_order
+
+    Returns:
+        str: Order id
+
+    Raises:
+        OrderStatusUnknown: If the outcome could not be determined
+        Exception: Any non ambiguous Kite error, unchanged
+    """
+    last_error = None
+    for attempt in range(MAX_SUBMIT_ATTEMPTS):
+        try:
+            return kite.place_order(tag=tag, **order_params)
+        except Exception as e:
+            if not is_ambiguous_failure(e):
+                raise
+            last_error = e
+
+        # The order may have been accepted, only resubmit if it is not there
+        time.sleep(TAG_LOOKUP_DELAY * (attempt + 1))
+        try:
+            order_id = find_order_by_tag(kite, tag)
+        except Exception as e:
+            raise OrderStatusUnknown(f"Order status unknown after {last_error}; lookup failed: {e}")
+        if order_id:
+            return order_id
+
+    raise OrderStatusUnknown(f"Order not placed after {MAX_SUBMIT_ATTEMPTS} attempts: {last_error}")
+
+
+class IdempotencyTable:
+    """Outcome of each order request, shared by all workers through the cache (cache.add is atomic across them)"""
+
+    PENDING = 'pending'
+    DONE = 'done'
+    UNKNOWN = 'unknown'
+
+    def begin(self, account: str, key: str):
+        """
+        Claim a key for a new request
+
+        Returns:
+            tuple: (True, None) if the key is new, otherwise (False, entry)
+                   with the state and stored response of the earlier request
+        """
+        table_key = _TABLE_KEY.format(account=account, key=key)
+        if atomic_cache.add(table_key, {'state': self.PENDING}, IDEMPOTENCY_TTL):
+            return True, None
+        return False, atomic_cache.get(table_key) or {'state': self.PENDING}
+
+    def complete(self, account: str, key: str, response: dict):
+        """Store the response so duplicates get the same answer"""
+        atomic_cache.set(_TABLE_KEY.format(account=account, key=key),
+                         {'state': self.DONE, 'response': response}, IDEMPOTENCY_TTL)
+
+    def mark_unknown(self, account: str, key: str, tags=None):
+        """
+        Block blind retries of a request whose orders may exist
+
+        Args:
+            tags: [user_id, tag] pairs of every order the request sent, user_id
+                None for the account itself; the request's own tag by default
+        """
+        atomic_cache.set(_TABLE_KEY.format(account=account, key=key),
+                         {'state': self.UNKNOWN, 'tags': tags or [[None, make_order_tag(key)]]},
+                         IDEMPOTENCY_TTL)
+
+    def release(self, account: str, key: str):
+        """Forget a request that definitely failed so it can be retried"""
+        atomic_cache.delete(_TABLE_KEY.format(account=account, key=key))
+
+
+# Global instance
+idempotency_table = IdempotencyTable()
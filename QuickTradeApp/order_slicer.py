@@ -0,0 +1,139 @@
+"""
+Freeze quantity slicing for QuickTradeApp
+Splits orders above the exchange freeze limit into child orders, submits
+them concurrently within the per-key order rate limit and folds the
+children back into one parent result
+"""
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from .order_idempotency import OrderStatusUnknown
+
+# Upper bound on children in flight at once
+MAX_SLICE_WORKERS = 5
+
+# How long a child may wait for a rate limit token
+RATE_LIMIT_TIMEOUT = 5  # seconds
+
+# Child outcomes that count against the parent
+FAILED_STATUSES = ('failed', 'REJECTED', 'CANCELLED')
+
+# Child whose submission could not be confirmed either way: neither placed nor
+# failed, and never to be retried blindly
+UNKNOWN_STATUS = 'unknown'
+
+logger = logging.getLogger(__name__)
+
+
+def slice_quantity(quantity: int, freeze_quantity: int, lot_size: int) -> List[int]:
+    """
+    Split a quantity into children at or below the freeze quantity
+
+    Args:
+        quantity: Total quantity (units, not lots)
+        freeze_quantity: Largest quantity the exchange accepts in one order
+        lot_size: Contract lot size, every child stays a multiple of it
+
+    Returns:
+        list: Child quantities, largest first
+    """
+    if quantity <= 0:
+        raise ValueError("Quantity must be greater than 0")
+
+    # Largest whole number of lots that stays within the freeze limit
+    max_child = (freeze_quantity // lot_size) * lot_size
+    if max_child <= 0:
+        raise ValueError(f"Freeze quantity {freeze_quantity} is below lot size {lot_size}")
+
+    full, remainder = divmod(quantity, max_child)
+    children = [max_child] * full
+    if remainder:
+        children.append(remainder)
+    return children
+
+
+def place_sliced_order(submit: Callable[[int, int], str], quantities: List[int], bucket,
+                       fetch_orders: Callable[[], List[Dict]] = None) -> Dict:
+    """
+    Submit child orders concurrently and aggregate them into a parent result
+
+    Args:
+        submit: Places child number i of the given quantity as submit(i, quantity)
+            and returns its order id
+        quantities: Child quantities from slice_quantity
+        bucket: TokenBucket of the account, one token per child
+        fetch_orders: Optional order book reader used to aggregate fills
+
+    Returns:
+        dict: Parent result with per-child outcome and aggregated fills
+    """
+    parent_id = uuid.uuid4().hex[:12]
+    started = time.time()
+
+    def run_child(position, quantity):
+        child = {'quantity': quantity}
+        try:
+            if not bucket.acquire(timeout=RATE_LIMIT_TIMEOUT):
+                raise Exception("Order rate limit reached, child not submitted")
+            child['order_id'] = submit(position, quantity)
+            child['status'] = 'submitted'
+        except OrderStatusUnknown as e:
+            child['status'] = UNKNOWN_STATUS
+            child['error'] = str(e)
+        except Exception as e:
+            child['status'] = 'failed'
+            child['error'] = str(e)
+        child['acked_at'] = time.time()
+        return child
+
+    with ThreadPoolExecutor(max_workers=min(MAX_SLICE_WORKERS, len(quantities))) as executor:
+        children = list(executor.map(run_child, range(len(quantities)), quantities))
+
+    # One order book read covers every child
+    if fetch_orders:
+        try:
+            book = {str(order.get('order_id')): order for order in fetch_orders()}
+            for child in children:
+                order = book.get(str(child.get('order_id')))
+                if order:
+                    child['status'] = order.get('status', child['status'])
+                    child['filled_quantity'] = int(order.get('filled_quantity') or 0)
+                    child['average_price'] = float(order.get('average_price') or 0)
+                    filled_at = order.get('exchange_timestamp')
+                    if child['status'] == 'COMPLETE' and hasattr(filled_at, 'timestamp'):
+                        child['filled_at'] = filled_at.timestamp()
+        except Exception as e:
+            # Children were placed, fills will show up on the next refresh
+            logger.warning("Order book read after slices of %s failed: %s", parent_id, e)
+
+    submitted = [child for child in children
+                 if child['status'] not in FAILED_STATUSES and child['status'] != UNKNOWN_STATUS]
+    failed = [child for child in children if child['status'] in FAILED_STATUSES]
+    unknown = [child for child in children if child['status'] == UNKNOWN_STATUS]
+    filled_quantity = sum(child.get('filled_quantity', 0) for child in submitted)
+    filled_value = sum(child.get('filled_quantity', 0) * child.get('average_price', 0) for child in submitted)
+
+    return {
+        'parent_id': parent_id,
+        'success': not failed and not unknown,
+        'total_quantity': sum(quantities),
+        'submitted_quantity': sum(child['quantity'] for child in submitted),
+        'failed_quantity': sum(child['quantity'] for child in failed),
+        'unknown_quantity': sum(child['quantity'] for child in unknown),
+        'filled_quantity': filled_quantity,
+        'average_price': filled_value / filled_quantity if filled_quantity else None,
+        'order_ids': [child['order_id'] for child in children if child.get('order_id')],
+        'children': children,
+        'filled_at': max((child['filled_at'] for child in children if 'filled_at' in child), default=None),
+        'elapsed_ms': round((time.time() - started) * 1000, 1),
+    }
+
+
+def not_placed_message(result: Dict, action: str) -> str:
+    """'<quantity> of <total> not <action>: <first error>' for a parent result that did not fully succeed"""
+    error = next(child.get('error') for child in result['children']
+                 if child['status'] in FAILED_STATUSES or child['status'] == UNKNOWN_STATUS)
+    return f"{result['failed_quantity'] + result['unknown_quantity']} of {result['total_quantity']} not {action}: {error}"
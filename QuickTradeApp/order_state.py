@@ -0,0 +1,332 @@
+"""
+Order state store for QuickTradeApp
+Keeps a per-account view of orders and net positions that is updated from
+Kite postbacks and periodically reconciled against the order book API.
+Orders seen reaching a final status are added to the order history.
+
+Kite posts every order update to one URL, so any worker may receive a
+postback: the api_secret that verifies it is read from the session of the
+account, and the resulting snapshot is kept in the cache all workers share
+(see shared_cache.py), updated under a lock every worker takes
+"""
+import hashlib
+import hmac
+import logging
+import threading
+import time
+from datetime import datetime
+from importlib import import_module
+from typing import Dict, List
+
+from django.conf import settings
+
+from .config import KITE_API_SECRET
+from .market_clock import market_clock
+from .order_history import order_history
+from .shared_cache import atomic_cache, shared_lock
+from .single_flight import kite_read
+
+# How long a reconciled snapshot is trusted before the next full fetch while a
+# session runs, outside them it is trusted until the next session starts
+RECONCILE_INTERVAL = 60  # seconds
+
+# How long the session of a logged in account is looked up for checksum checks
+POSTBACK_SECRET_TTL = 86400  # 24 hours, same as SESSION_COOKIE_AGE
+
+# Session entry holding the api_secret of every account that logged in through it
+POSTBACK_SECRETS_SESSION_KEY = 'postback_secrets'
+
+_SESSION_KEY = "postback_session:{user_id}"
+_SNAPSHOT_KEY = "order_state:{user_id}"
+
+logger = logging.getLogger(__name__)
+
+
+def register_postback_account(user_id: str, session, api_secret: str):
+    """
+    Let any worker verify the postbacks of a logged in account: the
+    api_secret stays in the account's session, the shared cache only maps
+    the user id to that session
+
+    Args:
+        user_id: Kite user id returned by generate_session
+        session: Session the account logged in with
+        api_secret: Kite app secret used to compute the postback checksum
+    """
+    if not user_id or not api_secret:
+        return
+    secrets = dict(session.get(POSTBACK_SECRETS_SESSION_KEY) or {})
+    secrets[user_id] = api_secret
+    session[POSTBACK_SECRETS_SESSION_KEY] = secrets
+    if not session.session_key:
+        session.save()
+    atomic_cache.set(_SESSION_KEY.format(user_id=user_id), session.session_key, POSTBACK_SECRET_TTL)
+
+
+def _postback_secret(user_id: str):
+    """api_secret of an account, from settings or from the session it logged in with"""
+    if KITE_API_SECRET:
+        return KITE_API_SECRET
+    session_key = atomic_cache.get(_SESSION_KEY.format(user_id=user_id))
+    if not session_key:
+        return None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key=session_key)
+    return (session.get(POSTBACK_SECRETS_SESSION_KEY) or {}).get(user_id)
+
+
+def compute_postback_checksum(order_id: str, order_timestamp: str, api_secret: str) -> str:
+    """Kite postback checksum: SHA-256 of order_id + order_timestamp + api_secret"""
+    payload = f"{order_id}{order_timestamp}{api_secret}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def verify_postback(payload: Dict) -> bool:
+    """
+    Verify the checksum of a Kite postback payload
+
+    Args:
+        payload: Decoded postback JSON
+
+    Returns:
+        bool: True if the account is known and the checksum matches
+    """
+    api_secret = _postback_secret(payload.get('user_id'))
+    checksum = payload.get('checksum')
+    if not api_secret:
+        logger.warning("Postback for order %s of unknown account %s", payload.get('order_id'),
+                       payload.get('user_id'))
+        return False
+    if not checksum:
+        return False
+
+    expected = compute_postback_checksum(
+        str(payload.get('order_id', '')),
+        str(payload.get('order_timestamp', '')),
+        api_secret
+    )
+    return hmac.compare_digest(expected, str(checksum))
+
+
+def _parse_timestamp(value):
+    """Postbacks carry timestamps as strings, the order book API as datetimes"""
+    if isinstance(value, str) and value:
+        try:
+            return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return value
+    return value
+
+
+class AccountState:
+    """Orders and net positions of a single Kite account"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.orders: Dict[str, Dict] = {}
+        self.positions: Dict[tuple, Dict] = {}
+        # Filled quantity and average price already applied to positions, per order
+        self.applied_fills: Dict[str, tuple] = {}
+        self.reconciled_at = 0.0
+        # Wall clock time of the last change, comparable across workers
+        self.version = 0.0
+
+    def is_fresh(self) -> bool:
+        """True if the last reconciliation is recent enough to serve reads"""
+        return market_clock.is_fresh(self.reconciled_at, RECONCILE_INTERVAL)
+
+    def order_list(self) -> List[Dict]:
+        """Orders in the same shape as kite.orders()"""
+        return list(self.orders.values())
+
+    def position_list(self) -> Dict:
+        """Positions in the same shape as kite.positions(), copies a postback can not change under the caller"""
+        return {"net": [dict(position) for position in self.positions.values()]}
+
+    def apply_order_update(self, update: Dict):
+        """
+        Apply a single order update (postback or order book row)
+
+        Args:
+            update: Order fields as sent by Kite
+        """
+        order_id = str(update.get('order_id'))
+        order = dict(self.orders.get(order_id, {}))
+        order.update(update)
+        order['order_id'] = order_id
+        for key in ('order_timestamp', 'exchange_timestamp', 'exchange_update_timestamp'):
+            order[key] = _parse_timestamp(order.get(key))
+        self.orders[order_id] = order
+
+        self._apply_fill(order)
+        self.version = time.time()
+
+    def _apply_fill(self, order: Dict):
+        """Move the incremental fill of an order into its position"""
+        order_id = order['order_id']
+        filled = int(order.get('filled_quantity') or 0)
+        average = float(order.get('average_price') or 0)
+        prev_filled, prev_average = self.applied_fills.get(order_id, (0, 0.0))
+
+        delta = filled - prev_filled
+        if delta <= 0:
+            return
+
+        # Price of just the newly filled quantity
+        fill_price = (average * filled - prev_average * prev_filled) / delta
+        self.applied_fills[order_id] = (filled, average)
+
+        key = (order.get('tradingsymbol'), order.get('exchange'), order.get('product'))
+        position = self.positions.get(key)
+        if position is None:
+            position = {
+                'tradingsymbol': key[0],
+                'exchange': key[1],
+                'product': key[2],
+                'instrument_token': order.get('instrument_token'),
+                'quantity': 0,
+                'average_price': 0.0,
+                'last_price': fill_price,
+                'pnl': 0.0,
+                'buy_quantity': 0,
+                'buy_value': 0.0,
+                'sell_quantity': 0,
+                'sell_value': 0.0,
+                'multiplier': 1,
+            }
+            self.positions[key] = position
+
+        if order.get('transaction_type') == 'BUY':
+            position['buy_quantity'] += delta
+            position['buy_value'] += delta * fill_price
+        else:
+            position['sell_quantity'] += delta
+            position['sell_value'] += delta * fill_price
+
+        quantity = position['buy_quantity'] - position['sell_quantity']
+        position['quantity'] = quantity
+        if quantity > 0:
+            position['average_price'] = position['buy_value'] / position['buy_quantity']
+        elif quantity < 0:
+            position['average_price'] = position['sell_value'] / position['sell_quantity']
+        else:
+            position['average_price'] = 0.0
+        position['last_price'] = fill_price
+        position['pnl'] = (position['sell_value'] - position['buy_value']) + quantity * fill_price
+
+    def reconcile(self, orders: List[Dict], positions: Dict):
+        """
+        Replace local state with a fresh snapshot from the order book API
+
+        Args:
+            orders: Result of kite.orders()
+            positions: Result of kite.positions()
+        """
+        self.orders = {str(order.get('order_id')): dict(order) for order in orders}
+        # The snapshot already contains every fill we know of
+        self.applied_fills = {
+            order_id: (int(order.get('filled_quantity') or 0), float(order.get('average_price') or 0))
+            for order_id, order in self.orders.items()
+        }
+        self.positions = {
+            (pos.get('tradingsymbol'), pos.get('exchange'), pos.get('product')): dict(pos)
+            for pos in positions.get('net', [])
+        }
+        self.reconciled_at = time.time()
+        self.version = self.reconciled_at
+
+
+class OrderStateStore:
+    """Per-account order and position state shared by the views of this process"""
+
+    def __init__(self):
+        self._accounts: Dict[str, AccountState] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> AccountState:
+        """Get (or create) the state of an account"""
+        with self._lock:
+            state = self._accounts.get(user_id)
+            if state is None:
+                state = AccountState(user_id)
+                self._accounts[user_id] = state
+            self._load_newer_snapshot(state)
+            return state
+
+    def apply_postback(self, payload: Dict) -> AccountState:
+        """
+        Apply a verified postback payload to its account
+
+        Args:
+            payload: Decoded postback JSON
+
+        Returns:
+            AccountState: Updated account state
+        """
+        user_id = payload.get('user_id')
+        if not user_id or not payload.get('order_id'):
+            raise ValueError("Postback is missing user_id or order_id")
+
+        # Read, apply and publish as one step, or two workers applying
+        # postbacks at once would each publish without the other's update
+        with shared_lock(_SNAPSHOT_KEY.format(user_id=user_id)):
+            state = self.get(user_id)
+            with self._lock:
+                update = {k: v for k, v in payload.items() if k not in ('checksum', 'app_id')}
+                state.apply_order_update(update)
+                self._publish(state)
+                order = state.orders.get(str(update['order_id']))
+        order_history.record(user_id, [order])
+        return state
+
+    def reconcile(self, user_id: str, kite, fresh: bool = False) -> AccountState:
+        """
+        Fetch orders and positions from Kite and replace the local state
+
+        Args:
+            user_id: Kite user id
+            kite: KiteConnect client of the account
+            fresh: Read Kite now instead of sharing a read in flight (exits)
+
+        Returns:
+            AccountState: Reconciled account state
+        """
+        # Positions first: a fill landing between the two reads is then in the
+        # orders only, and missed until the next reconcile, instead of being in
+        # the positions but not applied_fills, and counted again by its postback
+        positions = kite_read(kite, 'positions', fresh)
+        orders = kite_read(kite, 'orders', fresh)
+        with shared_lock(_SNAPSHOT_KEY.format(user_id=user_id)):
+            state = self.get(user_id)
+            with self._lock:
+                state.reconcile(orders, positions)
+                self._publish(state)
+        order_history.record(user_id, orders)
+        return state
+
+    def _publish(self, state: AccountState):
+        """Share the snapshot with the other workers through the cache"""
+        atomic_cache.set(_SNAPSHOT_KEY.format(user_id=state.user_id), {
+            'version': state.version,
+            'reconciled_at': state.reconciled_at,
+            'orders': state.orders,
+            'positions': list(state.positions.values()),
+            'applied_fills': state.applied_fills,
+        }, market_clock.ttl(RECONCILE_INTERVAL * 2))
+
+    def _load_newer_snapshot(self, state: AccountState):
+        """Pick up updates another worker received, if they are newer than ours"""
+        snapshot = atomic_cache.get(_SNAPSHOT_KEY.format(user_id=state.user_id))
+        if not snapshot or snapshot['version'] <= state.version:
+            return
+        state.orders = snapshot['orders']
+        state.positions = {
+            (pos.get('tradingsymbol'), pos.get('exchange'), pos.get('product')): pos
+            for pos in snapshot['positions']
+        }
+        state.applied_fills = snapshot['applied_fills']
+        state.reconciled_at = snapshot['reconciled_at']
+        state.version = snapshot['version']
+
+
+# Global instance
+order_state = OrderStateStore()
@@ -0,0 +1,487 @@
+"""
+Paper trading for QuickTradeApp
+An in-process broker answering the KiteConnect calls the app makes
+(place_order, cancel_order, orders, order_history, positions, margins), so
+a session can rehearse strategies without real orders. Market orders are
+matched against the LTP cache (live or replayed quotes) after a configurable
+latency and with slippage against the order, and positions carry MIS P&L
+the way Kite computes it.
+
+A session in paper mode trades through an access token starting with
+PAPER_TOKEN_PREFIX, which get_kite_client hands to this broker instead of
+Kite, so every order path (single, sliced, basket, linked, stop-loss exits)
+stays inside the paper book. Books live in the worker process and are gone
+when it restarts
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+
+from .config import PAPER_CAPITAL, PAPER_FILL_LATENCY, PAPER_SLIPPAGE_BPS
+from .ltp_cache import LTPCache, ltp_cache
+from .metrics import metrics
+from .order_history import order_history
+
+# Access tokens of paper accounts
+PAPER_TOKEN_PREFIX = "paper:"
+
+# Session flag of paper mode
+PAPER_SESSION_KEY = 'paper_trading'
+
+# Fills need a price at most this old
+PRICE_MAX_AGE = 60  # seconds
+
+# A market order without a price yet (its premium quote still in flight)
+# is retried this often, and rejected once it waited this long
+PRICE_RETRY_INTERVAL = 0.05  # seconds
+PRICE_WAIT = 2.0  # seconds
+
+# Exchange price step of options
+TICK_SIZE = 0.05
+
+# Kite order ids are 15 digit numbers, paper ones stay clear of real ones
+ORDER_ID_BASE = 900000000000000
+
+IST = pytz.timezone('Asia/Kolkata')
+
+metrics.describe('quicktrade_paper_orders_total', 'counter', "Paper trading orders by final status")
+
+
+def is_paper_token(access_token) -> bool:
+    """True for the access token of a paper account"""
+    return isinstance(access_token, str) and access_token.startswith(PAPER_TOKEN_PREFIX)
+
+
+def paper_token(account_id: str) -> str:
+    """Access token of the paper account of a Kite user id (or API key)"""
+    return f"{PAPER_TOKEN_PREFIX}{account_id}"
+
+
+def is_paper_session(session) -> bool:
+    """True when the session trades on paper"""
+    return bool(session.get(PAPER_SESSION_KEY))
+
+
+def session_account_id(session) -> Optional[str]:
+    """Kite user id of the session, the API key when the user id is unknown"""
+    return session.get('zerodha_user_id') or session.get('api_key')
+
+
+def trading_access_token(session) -> Optional[str]:
+    """
+    Access token orders of the session go out with: the Kite token, or the
+    paper account token in paper mode. None when not logged in with Kite
+    """
+    access_token = session.get('access_token')
+    if access_token and is_paper_session(session):
+        return paper_token(session_account_id(session))
+    return access_token
+
+
+def _now() -> datetime:
+    """Naive IST time, as the Kite API returns timestamps"""
+    return datetime.now(IST).replace(tzinfo=None)
+
+
+class _PaperOrder:
+    """One order of a paper book"""
+
+    __slots__ = ('order_id', 'variety', 'exchange', 'tradingsymbol', 'transaction_type', 'quantity',
+                 'product', 'order_type', 'validity', 'tag', 'status', 'status_message',
+                 'filled_quantity', 'average_price', 'placed_at', 'updated_at', 'accepted_at', 'history')
+
+    def __init__(self, order_id: str, params: Dict):
+        self.order_id = order_id
+        self.variety = params.get('variety') or 'regular'
+        self.exchange = params['exchange']
+        self.tradingsymbol = params['tradingsymbol']
+        self.transaction_type = params['transaction_type']
+        self.quantity = params['quantity']
+        self.product = params['product']
+        self.order_type = params['order_type']
+        self.validity = params.get('validity') or 'DAY'
+        self.tag = params.get('tag')
+        self.filled_quantity = 0
+        self.average_price = 0.0
+        self.status_message = None
+        self.placed_at = self.updated_at = _now()
+        self.accepted_at = time.monotonic()
+        self.history: List[Tuple[str, datetime]] = []
+        self.set_status('OPEN')
+
+    def set_status(self, status: str, message: Optional[str] = None):
+        self.status = status
+        self.status_message = message
+        self.updated_at = _now()
+        self.history.append((status, self.updated_at))
+
+    def as_dict(self, status: Optional[str] = None, timestamp: Optional[datetime] = None) -> Dict:
+        """Kite order row, of an earlier status when given"""
+        status = status or self.status
+        done = status == 'COMPLETE'
+        return {
+            'order_id': self.order_id,
+            'parent_order_id': None,
+            'exchange_order_id': None,
+            'placed_by': 'PAPER',
+            'variety': self.variety,
+            'status': status,
+            'status_message': self.status_message if status == self.status else None,
+            'tradingsymbol': self.tradingsymbol,
+            'exchange': self.exchange,
+            'instrument_token': 0,
+            'transaction_type': self.transaction_type,
+            'order_type': self.order_type,
+            'product': self.product,
+            'validity': self.validity,
+            'price': 0,
+            'trigger_price': 0,
+            'quantity': self.quantity,
+            'average_price': self.average_price if done else 0,
+            'filled_quantity': self.filled_quantity if done else 0,
+            'pending_quantity': self.quantity if status == 'OPEN' else 0,
+            'cancelled_quantity': self.quantity if status == 'CANCELLED' else 0,
+            'disclosed_quantity': 0,
+            'tag': self.tag,
+            'order_timestamp': timestamp or self.updated_at,
+            'exchange_timestamp': (timestamp or self.updated_at) if done else None,
+        }
+
+
+class _PaperPosition:
+    """Day totals of one instrument and product"""
+
+    __slots__ = ('tradingsymbol', 'exchange', 'product', 'buy_quantity', 'buy_value', 'sell_quantity', 'sell_value')
+
+    def __init__(self, tradingsymbol: str, exchange: str, product: str):
+        self.tradingsymbol = tradingsymbol
+        self.exchange = exchange
+        self.product = product
+        self.buy_quantity = 0
+        self.buy_value = 0.0
+        self.sell_quantity = 0
+        self.sell_value = 0.0
+
+    @property
+    def quantity(self) -> int:
+        return self.buy_quantity - self.sell_quantity
+
+    def as_dict(self, last_price: Optional[float]) -> Dict:
+        """Kite net position row, marked at last_price"""
+        quantity = self.quantity
+        buy_price = self.buy_value / self.buy_quantity if self.buy_quantity else 0.0
+        sell_price = self.sell_value / self.sell_quantity if self.sell_quantity else 0.0
+        average_price = buy_price if quantity > 0 else sell_price if quantity < 0 else 0.0
+        if last_price is None:
+            last_price = average_price
+        # Kite MIS P&L: realised cash flow plus the open quantity at the last price
+        pnl = self.sell_value - self.buy_value + quantity * last_price
+        unrealised = quantity * (last_price - average_price)
+        return {
+            'tradingsymbol': self.tradingsymbol,
+            'exchange': self.exchange,
+            'instrument_token': 0,
+            'product': self.product,
+            'quantity': quantity,
+            'overnight_quantity': 0,
+            'multiplier': 1,
+            'average_price': round(average_price, 4),
+            'close_price': 0,
+            'last_price': last_price,
+            'value': round(self.sell_value - self.buy_value, 2),
+            'pnl': round(pnl, 2),
+            'm2m': round(pnl, 2),
+            'unrealised': round(unrealised, 2),
+            'realised': round(pnl - unrealised, 2),
+            'buy_quantity': self.buy_quantity,
+            'buy_price': round(buy_price, 4),
+            'buy_value': round(self.buy_value, 2),
+            'sell_quantity': self.sell_quantity,
+            'sell_price': round(sell_price, 4),
+            'sell_value': round(self.sell_value, 2),
+            'day_buy_quantity': self.buy_quantity,
+            'day_buy_value': round(self.buy_value, 2),
+            'day_sell_quantity': self.sell_quantity,
+            'day_sell_value': round(self.sell_value, 2),
+        }
+
+
+class PaperAccount:
+    """Order book, positions and cash of one paper account"""
+
+    def __init__(self, account_id: str, capital: float):
+        self.account_id = account_id
+        self.capital = capital
+        self.cash = capital  # capital less premium paid plus premium received
+        self.orders: Dict[str, _PaperOrder] = {}
+        self.positions: Dict[tuple, _PaperPosition] = {}
+        self.lock = threading.Lock()
+
+    def fill(self, order: _PaperOrder, price: float):
+        key = (order.tradingsymbol, order.product)
+        position = self.positions.get(key)
+        if position is None:
+            position = self.positions[key] = _PaperPosition(order.tradingsymbol, order.exchange, order.product)
+        value = price * order.quantity
+        if order.transaction_type == 'BUY':
+            position.buy_quantity += order.quantity
+            position.buy_value += value
+            self.cash -= value
+        else:
+            position.sell_quantity += order.quantity
+            position.sell_value += value
+            self.cash += value
+        order.filled_quantity = order.quantity
+        order.average_price = price
+        order.set_status('COMPLETE')
+
+
+class PaperKiteClient:
+    """KiteConnect stand-in of one paper account"""
+
+    def __init__(self, broker: 'PaperBroker', api_key: str, access_token: str):
+        self.broker = broker
+        self.api_key = api_key
+        self.access_token = access_token
+        self.account = broker.account(access_token[len(PAPER_TOKEN_PREFIX):])
+
+    def set_access_token(self, access_token: str):
+        pass  # The token picks the account, see PaperBroker.client
+
+    def place_order(self, variety, exchange, tradingsymbol, transaction_type, quantity, product,
+                    order_type, price=None, validity=None, tag=None, **kwargs) -> str:
+        """Accept an order, market orders fill after the broker latency"""
+        return self.broker.place_order(self.account, {
+            'variety': variety,
+            'exchange': exchange,
+            'tradingsymbol': tradingsymbol,
+            'transaction_type': transaction_type,
+            'quantity': quantity,
+            'product': product,
+            'order_type': order_type,
+            'validity': validity,
+            'tag': tag,
+        })
+
+    def cancel_order(self, variety, order_id, parent_order_id=None) -> str:
+        return self.broker.cancel_order(self.account, order_id)
+
+    def orders(self) -> List[Dict]:
+        with self.account.lock:
+            return [order.as_dict() for order in self.account.orders.values()]
+
+    def order_history(self, order_id) -> List[Dict]:
+        with self.account.lock:
+            order = self.account.orders.get(str(order_id))
+            if order is None:
+                raise Exception("Couldn't find that `order_id`.")
+            return [order.as_dict(status, timestamp) for status, timestamp in order.history]
+
+    def positions(self) -> Dict[str, List[Dict]]:
+        with self.account.lock:
+            positions = list(self.account.positions.values())
+        net = [position.as_dict(self.broker.prices.get(position.tradingsymbol)) for position in positions]
+        return {'net': net, 'day': [dict(row) for row in net]}
+
+    def margins(self, segment=None) -> Dict:
+        """Equity margins from the paper cash, open premium marked to the LTP cache"""
+        net = self.positions()['net']
+        with self.account.lock:
+            cash, capital = self.account.cash, self.account.capital
+        unrealised = sum(row['unrealised'] for row in net)
+        realised = sum(row['realised'] for row in net)
+        premium = sum(row['buy_value'] - row['sell_value'] for row in net)
+        equity = {
+            'enabled': True,
+            'net': round(cash, 2),
+            'available': {
+                'adhoc_margin': 0, 'cash': capital, 'opening_balance': capital,
+                'live_balance': round(cash, 2), 'collateral': 0, 'intraday_payin': 0,
+            },
+            'utilised': {
+                'debits': round(capital - cash, 2), 'exposure': 0, 'span': 0,
+                'option_premium': round(premium, 2),
+                'm2m_realised': round(-realised, 2), 'm2m_unrealised': round(-unrealised, 2),
+                'payout': 0, 'holding_sales': 0, 'turnover': 0, 'liquid_collateral': 0,
+                'stock_collateral': 0, 'delivery': 0,
+            },
+        }
+        margins = {'equity': equity, 'commodity': {'enabled': False, 'net': 0, 'available': {}, 'utilised': {}}}
+        return margins[segment] if segment else margins
+
+    def order_margins(self, params: List[Dict]) -> List[Dict]:
+        """Premium each order would pay (or receive) at the current fill price"""
+        rows = []
+        for order in params:
+            ltp = self.broker.prices.get(order['tradingsymbol'], max_age=PRICE_MAX_AGE)
+            if ltp is None:
+                raise Exception(f"No market price for {order['tradingsymbol']}")
+            premium = self.broker.fill_price(ltp, order['transaction_type']) * order['quantity']
+            total = round(premium, 2) if order['transaction_type'] == 'BUY' else 0
+            rows.append({
+                'type': 'equity', 'tradingsymbol': order['tradingsymbol'], 'exchange': order['exchange'],
+                'span': 0, 'exposure': 0, 'option_premium': total, 'additional': 0, 'bo': 0,
+                'cash': 0, 'var': 0, 'pnl': {'realised': 0, 'unrealised': 0}, 'total': total,
+            })
+        return rows
+
+    def profile(self) -> Dict:
+        return {'user_id': self.account.account_id, 'user_name': 'Paper trading', 'broker': 'PAPER'}
+
+
+class PaperBroker:
+    """Paper accounts of this process and the matcher that fills their orders"""
+
+    def __init__(self, latency: float = PAPER_FILL_LATENCY, slippage_bps: float = PAPER_SLIPPAGE_BPS,
+                 capital: float = PAPER_CAPITAL, prices: LTPCache = ltp_cache):
+        self.latency = latency
+        self.slippage_bps = slippage_bps
+        self.capital = capital
+        self.prices = prices
+        self._accounts: Dict[str, PaperAccount] = {}
+        self._order_ids = itertools.count(1)
+        self._pending: List[tuple] = []  # (due, seq, account, order)
+        self._filling = 0
+        self._seq = itertools.count()
+        self._wakeup = threading.Condition()
+        self._matcher: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def account(self, account_id: str) -> PaperAccount:
+        """Paper account of a Kite user id, opened with the notional capital on first use"""
+        account = self._accounts.get(account_id)
+        if account is None:
+            with self._lock:
+                account = self._accounts.setdefault(account_id, PaperAccount(account_id, self.capital))
+        return account
+
+    def client(self, api_key: str, access_token: str) -> PaperKiteClient:
+        """KiteConnect stand-in for a paper access token"""
+        return PaperKiteClient(self, api_key, access_token)
+
+    def reset(self, account_id: str):
+        """Start an account over: no orders, no positions, full capital"""
+        with self._lock:
+            self._accounts.pop(account_id, None)
+
+    def summary(self, account_id: str) -> Dict:
+        """Cash, P&L and book size of an account"""
+        client = PaperKiteClient(self, account_id, paper_token(account_id))
+        net = client.positions()['net']
+        account = client.account
+        with account.lock:
+            orders = list(account.orders.values())
+        return {
+            'account_id': account_id,
+            'capital': account.capital,
+            'cash': round(account.cash, 2),
+            'pnl': round(sum(row['pnl'] for row in net), 2),
+            'open_positions': sum(1 for row in net if row['quantity']),
+            'orders': len(orders),
+            'rejected': sum(1 for order in orders if order.status == 'REJECTED'),
+            'latency': self.latency,
+            'slippage_bps': self.slippage_bps,
+        }
+
+    def place_order(self, account: PaperAccount, params: Dict) -> str:
+        quantity = params['quantity']
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            raise ValueError("Invalid `quantity`.")
+        if params['transaction_type'] not in ('BUY', 'SELL'):
+            raise ValueError("Invalid `transaction_type`.")
+        if params['order_type'] != 'MARKET':
+            raise ValueError("Paper trading fills MARKET orders only")
+
+        order = _PaperOrder(str(ORDER_ID_BASE + next(self._order_ids)), params)
+        with account.lock:
+            account.orders[order.order_id] = order
+        if self.latency > 0:
+            self._schedule(time.monotonic() + self.latency, account, order)
+        else:
+            self._fill(account, order)
+        return order.order_id
+
+    def cancel_order(self, account: PaperAccount, order_id) -> str:
+        with account.lock:
+            order = account.orders.get(str(order_id))
+            if order is None:
+                raise Exception("Couldn't find that `order_id`.")
+            if order.status != 'OPEN':
+                raise Exception(f"Order cannot be cancelled as it is {order.status.lower()}.")
+            order.set_status('CANCELLED')
+        metrics.inc('quicktrade_paper_orders_total', {'status': 'CANCELLED'})
+        order_history.record(paper_token(account.account_id), [order.as_dict()])
+        return order.order_id
+
+    def fill_price(self, ltp: float, transaction_type: str) -> float:
+        """LTP moved against the order by the slippage, on the exchange price step"""
+        if transaction_type == 'BUY':
+            price = math.ceil(round(ltp * (1 + self.slippage_bps / 10000) / TICK_SIZE, 6)) * TICK_SIZE
+        else:
+            price = math.floor(round(ltp * (1 - self.slippage_bps / 10000) / TICK_SIZE, 6)) * TICK_SIZE
+        return round(max(price, TICK_SIZE), 2)
+
+    def _fill(self, account: PaperAccount, order: _PaperOrder):
+        """Match an open market order against the LTP cache"""
+        ltp = self.prices.get(order.tradingsymbol, max_age=PRICE_MAX_AGE)
+        if ltp is None and time.monotonic() - order.accepted_at < PRICE_WAIT:
+            self._schedule(time.monotonic() + PRICE_RETRY_INTERVAL, account, order)
+            return
+        with account.lock:
+            if order.status != 'OPEN':
+                return  # Cancelled while waiting
+            if ltp is None:
+                order.set_status('REJECTED', f"No market price for {order.tradingsymbol} in the last {PRICE_MAX_AGE}s")
+            else:
+                price = self.fill_price(ltp, order.transaction_type)
+                if order.transaction_type == 'BUY' and price * order.quantity > account.cash:
+                    order.set_status('REJECTED', f"Insufficient funds. Required margin is "
+                                                 f"{price * order.quantity:.2f} but available margin is {account.cash:.2f}.")
+                else:
+                    account.fill(order, price)
+        metrics.inc('quicktrade_paper_orders_total', {'status': order.status})
+        order_history.record(paper_token(account.account_id), [order.as_dict()])
+
+    def _schedule(self, due: float, account: PaperAccount, order: _PaperOrder):
+        with self._wakeup:
+            heapq.heappush(self._pending, (due, next(self._seq), account, order))
+            if self._matcher is None:
+                self._matcher = threading.Thread(target=self._match, name="paper-matcher", daemon=True)
+                self._matcher.start()
+            self._wakeup.notify()
+
+    def _match(self):
+        """Fill orders as their latency runs out, earliest first"""
+        while True:
+            with self._wakeup:
+                while not self._pending or self._pending[0][0] > time.monotonic():
+                    self._wakeup.wait(self._pending[0][0] - time.monotonic() if self._pending else None)
+                _, _, account, order = heapq.heappop(self._pending)
+                self._filling += 1
+            try:
+                self._fill(account, order)
+            except Exception:
+                pass  # One bad order must never stop the others from filling
+            finally:
+                with self._wakeup:
+                    self._filling -= 1
+
+    def drain(self, timeout: float = 5.0) -> bool:
+        """Wait until every accepted order is filled or rejected, True if none is left"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._wakeup:
+                if not self._pending and not self._filling:
+                    return True
+            time.sleep(0.01)
+        return False
+
+
+# Global instance
+paper_broker = PaperBroker()
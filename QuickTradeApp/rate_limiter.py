@@ -0,0 +1,81 @@
+"""
+Token bucket rate limiting for broker calls
+"""
+import threading
+import time
+from typing import Dict
+
+# Kite allows 10 order requests per second per API key
+KITE_ORDER_RATE = 10
+KITE_ORDER_BURST = 10
+
+
+class TokenBucket:
+    """Thread safe token bucket"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take tokens if available right now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+        """
+        Wait until tokens are available
+
+        Args:
+            tokens: Tokens to take
+            timeout: Give up after this many seconds, wait forever if None
+
+        Returns:
+            bool: True if the tokens were taken
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class RateLimiterRegistry:
+    """One bucket per key (e.g. per Kite API key)"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity)
+                self._buckets[key] = bucket
+            return bucket
+
+
+# Global instance, keyed by Kite API key
+kite_order_limits = RateLimiterRegistry(KITE_ORDER_RATE, KITE_ORDER_BURST)
@@ -0,0 +1,457 @@
+"""
+Market replay harness for QuickTradeApp
+Replays a recorded or synthetic tick stream into the broker stand-in and the
+LTP cache at 1x or accelerated speed while simulated users fire CALL / PUT /
+exit traffic at the order views through the full Django stack. The stand-in
+answers with configurable latency and errors, and the run ends in a report
+of throughput, latency percentiles and error rates per endpoint, written as
+sorted JSON so reports of two releases can be diffed. In paper mode the
+users trade on paper accounts filled by the in-process paper broker.
+
+The lane load test runs order traffic and saturating dashboard polls
+through a pool of threads shaped like one gunicorn gthread worker, with the
+request lanes off and on
+"""
+import json
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.test import Client, override_settings
+
+from .config import WORKER_THREADS
+from .instruments import INDEX_SPECS
+from .lanes import request_lanes
+from .ltp_cache import ltp_cache
+from .market_clock import market_clock
+from .order_state import order_state
+from .paper_broker import PAPER_SESSION_KEY, paper_broker
+from .standins import BrokerStandIn, FaultPlan
+from .symbol_codec import is_monthly_expiry, next_expiry
+from .tick_recorder import TickReader, tick_recorder
+
+# Endpoint -> share of the simulated clicks
+DEFAULT_MIX = {'place_order': 0.6, 'exit_position': 0.3, 'exit_all': 0.1}
+
+# Percentiles in the report
+PERCENTILES = (50, 90, 95, 99)
+
+# Read-only requests of an open dashboard, fired by the pollers of the lane load test
+POLL_PATHS = ('/dashboard/', '/dashboard/?partial=portfolio', '/portfolio/mtm/', '/portfolio/risk/')
+
+# Phases of the lane load test: (name, pollers running, lanes enabled)
+LANE_PHASES = (
+    ('orders only', False, True),
+    ('orders + polls, lanes off', True, False),
+    ('orders + polls, lanes on', True, True),
+)
+
+# A tick is (seconds since the start of the stream, symbol, price)
+Tick = Tuple[float, str, float]
+
+
+def synthetic_ticks(seed: int = 7, duration: float = 60.0, rate: float = 200.0,
+                    indices: Tuple[str, ...] = ('NIFTY', 'BANKNIFTY')) -> Iterator[Tick]:
+    """
+    Seeded random walk of index prices, the same stream for the same arguments
+
+    Args:
+        seed: Random seed
+        duration: Seconds of market time
+        rate: Ticks per second of market time across all indices
+        indices: Index names to tick
+    """
+    rng = random.Random(seed)
+    prices = {index: 22000.0 if index == 'NIFTY' else 48000.0 for index in indices}
+    elapsed = 0.0
+    while True:
+        elapsed += rng.expovariate(rate)
+        if elapsed > duration:
+            return
+        index = rng.choice(indices)
+        # Expiry day: fat tailed moves
+        move = rng.gauss(0, 0.0002) * (8 if rng.random() < 0.01 else 1)
+        prices[index] = round(prices[index] * (1 + move), 2)
+        yield elapsed, index, prices[index]
+
+
+def recorded_ticks(day: str, storage_dir: str = "data/ticks") -> Iterator[Tick]:
+    """Ticks of a recorded day (see tick_recorder), in time order"""
+    reader = TickReader(storage_dir)
+    symbols = reader.symbols()
+    ticks = reader.read(day)
+    if not len(ticks):
+        return
+    start = float(ticks['ts'][0])
+    for ts, instrument, ltp in zip(ticks['ts'].tolist(), ticks['instrument'].tolist(), ticks['ltp'].tolist()):
+        yield ts - start, symbols.get(instrument, str(instrument)), ltp
+
+
+def _quote_keys(symbol: str) -> List[str]:
+    """Keys of a symbol in the stand-in price table (Fyers and Kite)"""
+    spec = INDEX_SPECS.get(symbol)
+    if spec:
+        return [spec['fyers_index_symbol'], spec['kite_index_symbol']]
+    for index in sorted(INDEX_SPECS, key=len, reverse=True):
+        if symbol.startswith(index):
+            exchange = INDEX_SPECS[index]['exchange']
+            return [f"{'BSE' if exchange == 'BFO' else 'NSE'}:{symbol}", f"{exchange}:{symbol}"]
+    return [symbol]
+
+
+def replay_expiries() -> Dict[str, str]:
+    """Session expiry keys of the nearest NIFTY and monthly BANKNIFTY contracts, as the expiry lookup stores them"""
+    today = datetime.now(market_clock.timezone).date()
+    expiries = {'NIFTY': next_expiry('NIFTY', today), 'BANKNIFTY': next_expiry('BANKNIFTY', today, monthly=True)}
+    session = {}
+    for index, expiry in expiries.items():
+        session[f"{index.lower()}_expiry_date"] = expiry.isoformat()
+        session[f"{index.lower()}_expiry_type"] = 'MONTHLY' if is_monthly_expiry(index, expiry) else 'WEEKLY'
+    return session
+
+
+class TickReplayer(threading.Thread):
+    """Feeds a tick stream into the stand-in prices and the LTP cache on its own clock"""
+
+    def __init__(self, standin: BrokerStandIn, ticks: Iterator[Tick], speed: float = 1.0):
+        super().__init__(name="tick-replay", daemon=True)
+        self.standin = standin
+        self.ticks = ticks
+        self.speed = speed
+        self.replayed = 0
+        self.lags: List[float] = []
+        self.elapsed = 0.0
+        self.stream_seconds = 0.0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        started = time.perf_counter()
+        keys: Dict[str, List[str]] = {}
+        for offset, symbol, ltp in self.ticks:
+            if self.stop_event.is_set():
+                break
+            if self.speed > 0:
+                due = started + offset / self.speed
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                self.lags.append(max(0.0, time.perf_counter() - due))
+            for key in keys.setdefault(symbol, _quote_keys(symbol)):
+                self.standin.prices[key] = ltp
+            ltp_cache.update(symbol, ltp)
+            self.replayed += 1
+            self.stream_seconds = offset
+        self.elapsed = time.perf_counter() - started
+
+
+class SimulatedUser:
+    """One logged in account clicking CALL / PUT / exit through the Django test client"""
+
+    def __init__(self, number: int, standin: BrokerStandIn, seed: int, mix: Dict[str, float], lots: int = 1,
+                 paper: bool = False):
+        self.standin = standin
+        self.rng = random.Random(seed * 1000 + number)
+        self.mix = mix
+        self.lots = lots
+        self.paper = paper
+        self.access_token = f"replay-token-{number}"
+        self.user_id = f"RP{number:04d}"
+        self.client = Client(HTTP_HOST='localhost')
+        session = self.client.session
+        session.update({
+            'api_key': f"replay-key-{number}",
+            'access_token': self.access_token,
+            'zerodha_user_id': self.user_id,
+            'fyers_client_id': 'XY1234-100',
+            'fyers_access_token': 'replay',
+            PAPER_SESSION_KEY: paper,
+            **replay_expiries(),
+        })
+        session.save()
+        if paper:
+            paper_broker.reset(self.user_id)
+
+    def _open_symbols(self) -> List[str]:
+        if self.paper:
+            account = paper_broker.account(self.user_id)
+            with account.lock:
+                return sorted({position.tradingsymbol for position in account.positions.values() if position.quantity})
+        with self.standin._orders_lock:
+            positions = self.standin._account_positions.get(self.access_token, {})
+            return sorted(symbol for symbol, position in positions.items() if position['quantity'])
+
+    def click(self) -> Tuple[str, int, float, bool]:
+        """
+        Fire one request
+
+        Returns:
+            tuple: (endpoint, HTTP status, seconds, success)
+        """
+        endpoint = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        open_symbols = self._open_symbols()
+        if endpoint != 'place_order' and not open_symbols:
+            endpoint = 'place_order'
+
+        if endpoint == 'place_order':
+            body = {'index': self.rng.choice(('NIFTY', 'BANKNIFTY')), 'direction': self.rng.choice(('CE', 'PE')),
+                    'quantity': self.lots}
+        elif endpoint == 'exit_position':
+            body = {'symbol': self.rng.choice(open_symbols)}
+        else:
+            body = {}
+
+        started = time.perf_counter()
+        response = self.client.post(f"/{endpoint}/", data=json.dumps(body), content_type='application/json')
+        elapsed = time.perf_counter() - started
+        try:
+            success = bool(json.loads(response.content).get('success', response.status_code == 200))
+        except ValueError:
+            success = False
+        return endpoint, response.status_code, elapsed, success and response.status_code < 400
+
+
+def _summary(samples: List[Tuple[int, float, bool]], wall_seconds: float) -> Dict:
+    latencies = np.array([seconds for _, seconds, _ in samples]) * 1000
+    failures = sum(1 for _, _, success in samples if not success)
+    statuses: Dict[str, int] = {}
+    for status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    summary = {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / wall_seconds, 1) if wall_seconds else 0.0,
+        'error_rate': round(failures / len(samples), 4) if samples else 0.0,
+        'statuses': statuses,
+        'latency_ms': {},
+    }
+    if len(latencies):
+        summary['latency_ms'] = {f"p{p}": round(float(v), 1) for p, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))}
+        summary['latency_ms']['max'] = round(float(latencies.max()), 1)
+    return summary
+
+
+@contextmanager
+def _isolated_run(standin: BrokerStandIn, users: int):
+    """Point the app at the stand-in, with scratch tick files and room in the cache for every session"""
+    # Quotes fetched during the run go to a scratch tick directory
+    tick_recorder.close()
+    tick_storage = tick_recorder.storage_dir
+    scratch = tempfile.TemporaryDirectory()
+    tick_recorder.storage_dir = Path(scratch.name)
+    # The run is one process: its sessions and idempotency keys stay in memory, with
+    # room for every simulated user, instead of in the cache the deployed workers share
+    caches = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'replay',
+        'OPTIONS': {'MAX_ENTRIES': max(300, users * 100)},
+    }}
+    try:
+        with standin.installed(), override_settings(CACHES=caches):
+            yield
+    finally:
+        tick_recorder.close()
+        tick_recorder.storage_dir = tick_storage
+        scratch.cleanup()
+
+
+def run_replay(ticks: Iterator[Tick], speed: float = 10.0, users: int = 20, seed: int = 7,
+               faults: Optional[FaultPlan] = None, mix: Optional[Dict[str, float]] = None,
+               think_time: float = 0.0, config: Optional[Dict] = None, paper: bool = False) -> Dict:
+    """
+    Replay a tick stream while users trade, until the stream ends
+
+    Args:
+        ticks: Stream from synthetic_ticks or recorded_ticks
+        speed: Market seconds per wall second, 0 replays as fast as possible
+        users: Concurrent simulated accounts (each has its own order rate limit)
+        seed: Seed of the users' clicks
+        faults: Latency and errors of the broker stand-in
+        mix: Endpoint -> share of clicks, DEFAULT_MIX if omitted
+        think_time: Seconds each user waits between clicks
+        config: Run settings echoed in the report
+        paper: Trade on paper accounts instead of the stand-in order API
+
+    Returns:
+        dict: Report with per endpoint throughput, latency percentiles and error rates
+    """
+    mix = mix or DEFAULT_MIX
+    user_ids: Dict[str, str] = {}  # access token -> user id
+
+    def postback(access_token: str, order: Dict):
+        # Fills reach the order state the way Kite postbacks do
+        order_state.apply_postback(dict(order, user_id=user_ids[access_token]))
+
+    standin = BrokerStandIn(faults=faults or FaultPlan(), track_positions=True, postback=postback).start()
+    samples: Dict[str, List[Tuple[int, float, bool]]] = {endpoint: [] for endpoint in mix}
+    samples_lock = threading.Lock()
+
+    try:
+        with _isolated_run(standin, users):
+            simulated = [SimulatedUser(number, standin, seed, mix, paper=paper) for number in range(users)]
+            user_ids.update({user.access_token: user.user_id for user in simulated})
+            replayer = TickReplayer(standin, ticks, speed)
+
+            def trade(user: SimulatedUser):
+                while replayer.is_alive():
+                    endpoint, status, seconds, success = user.click()
+                    with samples_lock:
+                        samples.setdefault(endpoint, []).append((status, seconds, success))
+                    if think_time:
+                        time.sleep(think_time)
+
+            started = time.perf_counter()
+            replayer.start()
+            with ThreadPoolExecutor(max_workers=users, thread_name_prefix="replay-user") as executor:
+                list(executor.map(trade, simulated))
+            replayer.join()
+            if paper:
+                paper_broker.drain()
+            wall_seconds = time.perf_counter() - started
+    finally:
+        standin.stop()
+
+    lags = np.array(replayer.lags) * 1000 if replayer.lags else np.zeros(1)
+    every = [sample for endpoint_samples in samples.values() for sample in endpoint_samples]
+    report = {
+        'config': dict(config or {}, speed=speed, users=users, seed=seed, think_time=think_time, mix=mix,
+                       paper=paper),
+        'ticks': {
+            'replayed': replayer.replayed,
+            'stream_seconds': round(replayer.stream_seconds, 1),
+            'wall_seconds': round(replayer.elapsed, 2),
+            'ticks_per_second': round(replayer.replayed / replayer.elapsed, 1) if replayer.elapsed else 0.0,
+            'lag_ms': {'p50': round(float(np.percentile(lags, 50)), 2),
+                       'p99': round(float(np.percentile(lags, 99)), 2),
+                       'max': round(float(lags.max()), 2)},
+        },
+        'endpoints': {endpoint: _summary(endpoint_samples, wall_seconds) for endpoint, endpoint_samples in samples.items()},
+        'total': _summary(every, wall_seconds),
+        'broker_requests': standin.requests,
+    }
+    if paper:
+        accounts = [paper_broker.summary(user.user_id) for user in simulated]
+        report['paper'] = {
+            'orders': sum(account['orders'] for account in accounts),
+            'rejected': sum(account['rejected'] for account in accounts),
+            'pnl': round(sum(account['pnl'] for account in accounts), 2),
+        }
+    return report
+
+
+def compare_reports(baseline: Dict, current: Dict) -> List[str]:
+    """Lines comparing the latency and error rate of each endpoint with a baseline report"""
+    lines = []
+    for endpoint, now in sorted(current['endpoints'].items()):
+        before = baseline.get('endpoints', {}).get(endpoint)
+        if not before:
+            lines.append(f"{endpoint}: not in baseline")
+            continue
+        parts = []
+        for key, value in now['latency_ms'].items():
+            old = before['latency_ms'].get(key)
+            if old:
+                parts.append(f"{key} {old}->{value}ms ({(value - old) / old:+.0%})")
+        parts.append(f"errors {before['error_rate']:.2%}->{now['error_rate']:.2%}")
+        parts.append(f"rps {before['throughput_rps']}->{now['throughput_rps']}")
+        lines.append(f"{endpoint}: " + ", ".join(parts))
+    return lines
+
+
+def run_lane_load(duration: float = 10.0, threads: int = WORKER_THREADS, order_users: int = 4,
+                  pollers: int = 48, order_think: float = 0.25, latency: float = 0.03, seed: int = 7) -> Dict:
+    """
+    Order latency while dashboard polls saturate one worker, with the request lanes off and on
+
+    Requests are queued first in, first out for a pool of `threads` threads,
+    the way a gunicorn gthread worker hands accepted connections to its
+    threads. Latency is measured from submission, so it includes the time a
+    request waited for a thread.
+
+    Args:
+        duration: Seconds per phase (see LANE_PHASES)
+        threads: Threads of the simulated worker
+        order_users: Accounts placing and exiting orders, each waiting order_think between clicks
+        pollers: Dashboard polls in flight at all times (closed loop, no think time
+            unless shed)
+        order_think: Seconds each order user waits between clicks
+        latency: Stand-in broker latency (seconds)
+        seed: Seed of the users' clicks
+
+    Returns:
+        dict: Per phase order and poll summaries, polls split by outcome
+    """
+    user_ids: Dict[str, str] = {}
+
+    def postback(access_token: str, order: Dict):
+        order_state.apply_postback(dict(order, user_id=user_ids[access_token]))
+
+    standin = BrokerStandIn(faults=FaultPlan(latency=latency), track_positions=True, postback=postback).start()
+    enabled = request_lanes.enabled
+    phases = {}
+    try:
+        with _isolated_run(standin, order_users + pollers), \
+                ThreadPoolExecutor(max_workers=threads, thread_name_prefix="gthread") as worker:
+            traders = [SimulatedUser(number, standin, seed, DEFAULT_MIX) for number in range(order_users)]
+            watchers = [SimulatedUser(order_users + number, standin, seed, DEFAULT_MIX) for number in range(pollers)]
+            user_ids.update({user.access_token: user.user_id for user in traders + watchers})
+
+            for name, polling, lanes in LANE_PHASES:
+                request_lanes.enabled = lanes
+                deadline = time.perf_counter() + duration
+                orders: List[Tuple[int, float, bool]] = []
+                polls: List[Tuple[int, float, bool]] = []
+                outcomes: Dict[str, int] = {}
+                lock = threading.Lock()
+
+                def trade(user: SimulatedUser):
+                    while time.perf_counter() < deadline:
+                        started = time.perf_counter()
+                        _, status, _, success = worker.submit(user.click).result()
+                        with lock:
+                            orders.append((status, time.perf_counter() - started, success))
+                        time.sleep(order_think)
+
+                def poll(user: SimulatedUser):
+                    while time.perf_counter() < deadline:
+                        started = time.perf_counter()
+                        response = worker.submit(user.client.get, user.rng.choice(POLL_PATHS)).result()
+                        outcome = ('snapshot' if response.has_header('X-QuickTrade-Snapshot')
+                                   else 'shed' if response.status_code == 503 else 'served')
+                        with lock:
+                            polls.append((response.status_code, time.perf_counter() - started,
+                                          response.status_code == 200))
+                            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                        if outcome == 'shed':
+                            # Like the dashboard, a shed poll comes back after Retry-After
+                            time.sleep(min(float(response['Retry-After']), max(0.0, deadline - time.perf_counter())))
+
+                started = time.perf_counter()
+                clients = traders + (watchers if polling else [])
+                with ThreadPoolExecutor(max_workers=len(clients), thread_name_prefix="lane-client") as executor:
+                    futures = [executor.submit(trade, user) for user in traders]
+                    if polling:
+                        futures += [executor.submit(poll, user) for user in watchers]
+                    for future in futures:
+                        future.result()
+                wall_seconds = time.perf_counter() - started
+                phases[name] = {
+                    'lanes': lanes,
+                    'orders': _summary(orders, wall_seconds),
+                    'polls': dict(_summary(polls, wall_seconds), outcomes=outcomes) if polling else None,
+                }
+    finally:
+        request_lanes.enabled = enabled
+        standin.stop()
+
+    return {
+        'config': {'duration': duration, 'threads': threads, 'order_users': order_users, 'pollers': pollers,
+                   'order_think': order_think, 'latency': latency, 'seed': seed,
+                   'reserved_threads': request_lanes.reserved},
+        'phases': phases,
+    }
@@ -0,0 +1,279 @@
+"""
+Portfolio risk summary for QuickTradeApp
+Decodes every option position into (underlying, strike, expiry, type) and
+keeps the book as arrays per account. Ticks from the LTP cache only move
+the price of their leg (or the spot of their underlying); the summary is
+recomputed in one vectorized pass when something moved: IV and Greeks of
+every leg at once, then net quantity, premium at risk, delta exposure,
+expiry breakevens and max loss per underlying.
+
+Expiry figures value every leg at its intrinsic value, as if all legs
+expired together
+"""
+import calendar
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .instruments import INDEX_SPECS
+from .ltp_cache import ltp_cache
+from .option_greeks import greeks, implied_volatility
+from .symbol_codec import try_decode
+
+# Underlyings in array order
+UNDERLYINGS = tuple(INDEX_SPECS)
+_UNDERLYING_CODES = {name: code for code, name in enumerate(UNDERLYINGS)}
+
+# Options stop trading at 15:30 IST on the expiry day
+EXPIRY_CLOSE_SECONDS = 15 * 3600 + 1800
+IST_OFFSET = 19800  # seconds
+SECONDS_PER_YEAR = 365.0 * 86400
+
+# Legs whose price gives no implied volatility (below intrinsic, no quote yet) use this one
+FALLBACK_VOLATILITY = 0.15
+
+# A book within this many lots of delta of zero is flat
+DELTA_FLAT_LOTS = 0.1
+
+# The summary is recomputed at least this often for time decay, even without ticks
+SUMMARY_MAX_AGE = 1.0  # seconds
+
+
+def _expiry_close(expiry) -> float:
+    """Epoch seconds of 15:30 IST on an expiry date"""
+    return calendar.timegm(expiry.timetuple()) + EXPIRY_CLOSE_SECONDS - IST_OFFSET
+
+
+class RiskBook:
+    """Option legs of one account as arrays, marked by LTP ticks"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.source_version = None
+        self.symbols: List[str] = []
+        self.unclassified: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self.underlying = np.zeros(0, dtype=np.int16)
+        self.strike = np.zeros(0)
+        self.expiry = np.zeros(0)  # epoch seconds of the expiry close
+        self.is_call = np.zeros(0, dtype=bool)
+        self.quantity = np.zeros(0)
+        self.cash = np.zeros(0)  # sell value less buy value
+        self.last_price = np.zeros(0)
+        self.spot = np.full(len(UNDERLYINGS), np.nan)
+        self.version = 0
+        self.updated_at = 0.0
+        self._summary: Optional[Dict] = None
+        self._summary_key = None
+        self._lock = threading.Lock()
+
+    def load_snapshot(self, positions: List[Dict], version=None):
+        """
+        Rebuild the arrays from a positions snapshot
+
+        Args:
+            positions: kite.positions()["net"]
+            version: Version of the snapshot, used to skip reloading the same one
+        """
+        legs, unclassified = [], []
+        for position in positions:
+            contract = try_decode(position['tradingsymbol'])
+            if contract is None or contract.index not in _UNDERLYING_CODES:
+                if position.get('quantity'):
+                    unclassified.append(position['tradingsymbol'])
+                continue
+            multiplier = float(position.get('multiplier') or 1)
+            last_price = ltp_cache.get(position['tradingsymbol'])
+            legs.append((
+                position['tradingsymbol'],
+                _UNDERLYING_CODES[contract.index],
+                contract.strike,
+                _expiry_close(contract.expiry),
+                contract.option_type == 'CE',
+                int(position.get('quantity') or 0) * multiplier,
+                (float(position.get('sell_value') or 0) - float(position.get('buy_value') or 0)) * multiplier,
+                float(position.get('last_price') or 0) if last_price is None else last_price,
+            ))
+
+        columns = list(zip(*legs)) or [()] * 8
+        with self._lock:
+            self.symbols = list(columns[0])
+            self._rows = {symbol: row for row, symbol in enumerate(self.symbols)}
+            self.underlying = np.array(columns[1], dtype=np.int16)
+            self.strike = np.array(columns[2], dtype=np.float64)
+            self.expiry = np.array(columns[3], dtype=np.float64)
+            self.is_call = np.array(columns[4], dtype=bool)
+            self.quantity = np.array(columns[5], dtype=np.float64)
+            self.cash = np.array(columns[6], dtype=np.float64)
+            self.last_price = np.array(columns[7], dtype=np.float64)
+            self.unclassified = unclassified
+            for code, name in enumerate(UNDERLYINGS):
+                spot = ltp_cache.get(name)
+                if spot is not None:
+                    self.spot[code] = spot
+            self.source_version = version
+            self.version += 1
+            self.updated_at = time.time()
+
+    def on_tick(self, symbol: str, ltp: float, timestamp: Optional[float] = None):
+        """Move the price of one leg or the spot of one underlying"""
+        row = self._rows.get(symbol)
+        code = _UNDERLYING_CODES.get(symbol)
+        if row is None and code is None:
+            return
+        with self._lock:
+            if row is not None and row < len(self.last_price):
+                self.last_price[row] = ltp
+            if code is not None:
+                self.spot[code] = ltp
+            self.version += 1
+            self.updated_at = timestamp or time.time()
+
+    def missing_spots(self) -> List[str]:
+        """Underlyings with open legs but no spot price yet"""
+        held = np.unique(self.underlying[self.quantity != 0])
+        return [UNDERLYINGS[code] for code in held if np.isnan(self.spot[code])]
+
+    def summary(self, now: Optional[float] = None) -> Dict:
+        """Risk per underlying and for the whole book, recomputed only when prices moved"""
+        now = now or time.time()
+        key = (self.version, int(now // SUMMARY_MAX_AGE))
+        if self._summary is not None and self._summary_key == key:
+            return self._summary
+        with self._lock:
+            summary = self._compute(now)
+        self._summary, self._summary_key = summary, key
+        return summary
+
+    def _compute(self, now: float) -> Dict:
+        codes = self.underlying
+        quantity, strike, is_call, price = self.quantity, self.strike, self.is_call, self.last_price
+        spot = self.spot[codes]
+        size = len(UNDERLYINGS)
+
+        def per_underlying(values):
+            return np.bincount(codes, weights=values, minlength=size)
+
+        # Greeks of every leg in one pass
+        years = np.maximum((self.expiry - now) / SECONDS_PER_YEAR, 1e-6)
+        with np.errstate(all='ignore'):
+            sigma = implied_volatility(price, spot, strike, years, is_call)
+            sigma = np.where(np.isfinite(sigma), sigma, FALLBACK_VOLATILITY)
+            leg_greeks = greeks(spot, strike, years, sigma, is_call)
+
+        traded = np.bincount(codes, minlength=size) > 0
+        open_legs = per_underlying((quantity != 0).astype(np.float64))
+        net_quantity = per_underlying(quantity)
+        long_premium = per_underlying(np.where(quantity > 0, quantity * price, 0.0))
+        short_premium = per_underlying(np.where(quantity < 0, -quantity * price, 0.0))
+        call_quantity = per_underlying(np.where(is_call, quantity, 0.0))
+        put_quantity = per_underlying(np.where(is_call, 0.0, quantity))
+        pnl = per_underlying(self.cash + quantity * price)
+        exposure = {name: per_underlying(quantity * values) for name, values in leg_greeks.items()}
+
+        # Expiry P&L is piecewise linear with kinks at the strikes, so it is
+        # exact at zero, the spot and every strike of the same underlying
+        point_codes = np.concatenate([codes, np.arange(size), np.arange(size)])
+        points = np.concatenate([strike, np.zeros(size), np.nan_to_num(self.spot)])
+        same = point_codes[:, None] == codes[None, :]
+        intrinsic = np.where(is_call, np.maximum(points[:, None] - strike, 0.0),
+                             np.maximum(strike - points[:, None], 0.0))
+        payoff = np.where(same, self.cash + quantity * intrinsic, 0.0).sum(axis=1)
+
+        underlyings = {}
+        for code in np.nonzero(traded)[0]:
+            name = UNDERLYINGS[code]
+            lot_size = INDEX_SPECS[name]['lot_size']
+            known = not np.isnan(self.spot[code])
+            delta = float(exposure['delta'][code]) if known else None
+            if delta is None:
+                bias = 'UNKNOWN'
+            elif abs(delta) < DELTA_FLAT_LOTS * lot_size:
+                bias = 'FLAT'
+            else:
+                bias = 'LONG' if delta > 0 else 'SHORT'
+
+            mask = point_codes == code
+            order = np.argsort(points[mask], kind='stable')
+            xs, ys = points[mask][order], payoff[mask][order]
+            # Beyond the last strike only calls still move the payoff
+            slope = float(call_quantity[code])
+            underlyings[name] = {
+                'spot': float(self.spot[code]) if known else None,
+                'legs': int(open_legs[code]),
+                'net_quantity': int(net_quantity[code]),
+                'net_lots': round(float(net_quantity[code]) / lot_size, 2),
+                'call_quantity': int(call_quantity[code]),
+                'put_quantity': int(put_quantity[code]),
+                'premium_at_risk': round(float(long_premium[code]), 2),
+                'premium_short': round(float(short_premium[code]), 2),
+                'pnl': round(float(pnl[code]), 2),
+                'delta': round(delta, 2) if delta is not None else None,
+                'delta_lots': round(delta / lot_size, 2) if delta is not None else None,
+                'delta_notional': round(delta * float(self.spot[code]), 2) if delta is not None else None,
+                'gamma': round(float(exposure['gamma'][code]), 4) if known else None,
+                'theta': round(float(exposure['theta'][code]), 2) if known else None,
+                'vega': round(float(exposure['vega'][code]), 2) if known else None,
+                'bias': bias,
+                'breakevens': _breakevens(xs, ys, slope),
+                'max_profit': None if slope > 0 else round(float(ys.max()), 2),
+                'max_loss': None if slope < 0 else round(float(min(ys.min(), 0.0)), 2),
+                'unlimited_profit': slope > 0,
+                'unlimited_loss': slope < 0,
+                'open': bool(open_legs[code]),
+            }
+
+        notional = [row['delta_notional'] for row in underlyings.values() if row['delta_notional'] is not None]
+        return {
+            'underlyings': underlyings,
+            'totals': {
+                'premium_at_risk': round(float(long_premium.sum()), 2),
+                'premium_short': round(float(short_premium.sum()), 2),
+                'pnl': round(float(pnl.sum()), 2),
+                'delta_notional': round(sum(notional), 2),
+                'unlimited_loss': any(row['unlimited_loss'] for row in underlyings.values() if row['open']),
+            },
+            'unclassified': list(self.unclassified),
+            'updated_at': self.updated_at,
+        }
+
+
+def _breakevens(xs: np.ndarray, ys: np.ndarray, slope: float) -> List[float]:
+    """Underlying prices where the piecewise linear expiry P&L crosses zero"""
+    if not len(xs):
+        return []
+    signs = np.sign(ys)
+    crossing = np.nonzero((signs[:-1] * signs[1:] < 0) & (xs[1:] > xs[:-1]))[0]
+    levels = xs[crossing] - ys[crossing] * (xs[crossing + 1] - xs[crossing]) / (ys[crossing + 1] - ys[crossing])
+    levels = np.concatenate([levels, xs[(ys == 0) & (xs > 0)]])
+    if slope and np.sign(ys[-1]) == -np.sign(slope):
+        levels = np.append(levels, xs[-1] - ys[-1] / slope)
+    return [round(float(level), 2) for level in np.unique(levels)]
+
+
+class RiskRegistry:
+    """Routes ticks from the LTP cache to the risk books holding the symbol"""
+
+    def __init__(self):
+        self._books: Dict[str, RiskBook] = {}
+        self._lock = threading.Lock()
+        ltp_cache.subscribe(self._on_tick)
+
+    def get(self, user_id: str) -> RiskBook:
+        """Get (or create) the risk book of an account"""
+        with self._lock:
+            book = self._books.get(user_id)
+            if book is None:
+                book = RiskBook(user_id)
+                self._books[user_id] = book
+            return book
+
+    def _on_tick(self, symbol: str, ltp: float, timestamp: float):
+        for book in list(self._books.values()):
+            book.on_tick(symbol, ltp, timestamp)
+
+
+# Global instance
+risk_books = RiskRegistry()
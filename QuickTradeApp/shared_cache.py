@@ -0,0 +1,92 @@
+"""
+Caches shared by every worker process of QuickTradeApp
+Both are tables in the SQLite database (settings.CACHES) rather than
+per-process memory, so whichever worker serves the next request sees them.
+
+The 'default' cache holds what is only worth reusing (single-flight reads,
+chains, last-good responses): SQLite fails a write that races another
+process's write with 'database is locked', and Django's database cache then
+drops it, which costs a later miss and nothing more.
+
+The 'atomic' cache holds what must be exact across workers: sessions, the
+order idempotency table, history dedupe keys, order state snapshots and the
+shared_lock() below. A dropped write there would mean a lost login, or a
+cache.add() answering False as if another worker had won. Its writes take
+SQLite's write lock before they read anything, so they queue for up to the
+database timeout instead of failing. Reads never wait: the database runs in
+WAL mode
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connections, router, transaction
+from django.utils.connection import ConnectionProxy
+
+# Polling interval (seconds) while waiting for a shared_lock held by another worker
+LOCK_POLL_INTERVAL = 0.01
+
+# The 'atomic' cache, as django.core.cache.cache is the default one
+atomic_cache = ConnectionProxy(caches, 'atomic')
+
+
+class SharedLockTimeout(TimeoutError):
+    """Another worker held a shared_lock for longer than the caller would wait"""
+
+
+class SharedDatabaseCache(DatabaseCache):
+    """DatabaseCache whose writes wait for each other across processes instead of failing"""
+
+    @contextmanager
+    def _write_transaction(self):
+        db = router.db_for_write(self.cache_model_class)
+        connection = connections[db]
+        with transaction.atomic(using=db):
+            if connection.vendor == 'sqlite':
+                # A write statement takes the write lock (waiting out the busy
+                # timeout); reading first would pin a snapshot that a racing
+                # commit makes stale, which SQLite fails without waiting
+                table = connection.ops.quote_name(self._table)
+                with connection.cursor() as cursor:
+                    cursor.execute(f"UPDATE {table} SET expires = expires WHERE 1 = 0")
+            yield
+
+    def _base_set(self, mode, key, value, timeout=DEFAULT_TIMEOUT):
+        with self._write_transaction():
+            return super()._base_set(mode, key, value, timeout)
+
+    def _base_delete_many(self, keys):
+        with self._write_transaction():
+            return super()._base_delete_many(keys)
+
+
+@contextmanager
+def shared_lock(name: str, wait: float = 5.0, hold: int = 30):
+    """
+    Mutual exclusion across every worker process, for read-modify-writes of
+    a shared cache entry. `hold` bounds how long a crashed holder blocks
+    others; raises SharedLockTimeout after `wait` seconds
+    """
+    key = f"shared_lock:{name}"
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while not atomic_cache.add(key, token, hold):
+        if time.monotonic() >= deadline:
+            raise SharedLockTimeout(f"{name} held by another worker")
+        time.sleep(LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        if atomic_cache.get(key) == token:
+            atomic_cache.delete(key)
+
+
+def enable_wal(sender, connection, **kwargs):
+    """connection_created receiver: SQLite connections read while another process writes"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
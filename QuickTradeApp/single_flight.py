@@ -0,0 +1,184 @@
+"""
+Single-flight broker reads for QuickTradeApp
+Identical reads of one account (its positions, its orders, a quote for the
+same symbols) that overlap in time are coalesced into one upstream request:
+the first caller fetches, every caller arriving while it is in flight waits
+for it and gets a copy of its result or its error.
+
+Across worker processes the first caller also claims the read in the cache
+every worker shares (see shared_cache.py). Workers that find it claimed wait
+for the result slot the fetching worker fills instead of asking the broker
+again. A slot only answers callers that arrived while its fetch was in
+flight, never later ones: coalescing must not turn into caching
+"""
+import copy
+import hashlib
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from django.core.cache import cache
+
+from .metrics import metrics
+from .paper_broker import is_paper_token
+
+# Result slot shared with the workers waiting for the fetch, long enough for them to poll it
+SLOT_TTL = 1  # seconds
+
+# A claim outlives any broker call (timeouts included), so a crashed worker can not block a read for long
+CLAIM_TTL = 10  # seconds
+
+# How long another worker's claimed read is awaited before fetching anyway
+SHARED_WAIT = 2.0  # seconds
+SHARED_POLL = 0.02  # seconds
+
+_CLAIM_KEY = "single_flight:claim:{key}"
+_SLOT_KEY = "single_flight:slot:{key}"
+
+metrics.describe('quicktrade_single_flight_total', 'counter',
+                 "Broker reads by resource and outcome (upstream, coalesced in process, shared across workers)")
+metrics.describe('quicktrade_single_flight_coalesced_ratio', 'gauge',
+                 "Share of broker reads answered without an upstream request, per resource")
+
+
+def account_key(*parts) -> str:
+    """Short stable key of an account's credentials, never the credentials themselves"""
+    return hashlib.sha1(":".join(str(part) for part in parts).encode('utf-8')).hexdigest()[:16]
+
+
+class _Call:
+    """One upstream read and the callers waiting for it"""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent identical reads, in this process and through the cache"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def do(self, resource: str, account: str, fetch: Callable[[], Any], detail: str = '',
+           shared: bool = True) -> Any:
+        """
+        Read through the single-flight layer
+
+        Args:
+            resource: Kind of read ('positions', 'orders', 'quotes'), used as metrics label
+            account: Account key (see account_key)
+            fetch: Upstream call, its result must pickle if shared
+            detail: What else identifies the read, e.g. the quoted symbols
+            shared: Coalesce with the other workers too; off for results
+                only this process can produce (paper accounts)
+
+        Returns:
+            The fetched result, a copy for every caller but the one that fetched
+
+        Raises:
+            Whatever fetch raised, for every caller that waited for it
+        """
+        key = f"{resource}:{account}:{account_key(detail) if detail else ''}"
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            self._count(resource, 'coalesced')
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            result = call.result = self._fetch(resource, key, fetch, shared)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call.waiters
+            call.done.set()
+        # The waiters copy the result while the caller may already change it
+        return copy.deepcopy(result) if waiters else result
+
+    def _fetch(self, resource: str, key: str, fetch: Callable[[], Any], shared: bool) -> Any:
+        if not shared:
+            self._count(resource, 'upstream')
+            return fetch()
+
+        claim_key = _CLAIM_KEY.format(key=key)
+        slot_key = _SLOT_KEY.format(key=key)
+        arrived = time.time()
+        deadline = time.monotonic() + SHARED_WAIT
+        claimed = cache.add(claim_key, True, CLAIM_TTL)
+        while not claimed:
+            # Another worker is fetching it, wait for a result it got after we arrived
+            time.sleep(SHARED_POLL)
+            slot = cache.get(slot_key)
+            if slot is not None and slot['finished'] >= arrived:
+                self._count(resource, 'shared')
+                return slot['result']
+            if time.monotonic() >= deadline:
+                self._count(resource, 'upstream')
+                return fetch()
+            # That fetch failed, or finished just before we arrived
+            claimed = cache.get(claim_key) is None and cache.add(claim_key, True, CLAIM_TTL)
+
+        try:
+            self._count(resource, 'upstream')
+            result = fetch()
+            cache.set(slot_key, {'result': result, 'finished': time.time()}, SLOT_TTL)
+            return result
+        finally:
+            cache.delete(claim_key)
+
+    def _count(self, resource: str, outcome: str):
+        metrics.inc('quicktrade_single_flight_total', {'resource': resource, 'outcome': outcome})
+        with self._lock:
+            counts = self._counts.setdefault(resource, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Reads per resource and outcome in this process"""
+        with self._lock:
+            return {resource: dict(counts) for resource, counts in self._counts.items()}
+
+
+def kite_read(kite, resource: str, fresh: bool = False):
+    """
+    kite.orders() or kite.positions() of the client's account through the
+    single-flight layer, or straight from Kite when `fresh` (exits must not
+    act on a read that started before them)
+    """
+    if fresh:
+        return getattr(kite, resource)()
+    # Paper books live in this process, another worker's result would be another book
+    return single_flight.do(resource, account_key(kite.api_key, kite.access_token), getattr(kite, resource),
+                            shared=not is_paper_token(kite.access_token))
+
+
+def _collect_ratios():
+    for resource, counts in single_flight.stats().items():
+        total = sum(counts.values())
+        saved = counts.get('coalesced', 0) + counts.get('shared', 0)
+        metrics.set('quicktrade_single_flight_coalesced_ratio', saved / total if total else 0.0,
+                    {'resource': resource})
+
+
+# Global instance
+single_flight = SingleFlight()
+
+metrics.add_collector(_collect_ratios)
@@ -0,0 +1,795 @@
+"""
+Server-side stop-loss / target monitor for QuickTradeApp
+Users attach stop-loss, target and trailing stop-loss levels to an open
+position. Every tick that reaches the LTP cache is checked against the
+armed triggers of its symbol, and a trigger that fires exits the open
+quantity, sliced at the freeze quantity. Symbols with armed triggers are
+quoted from Kite every SL_QUOTE_POLL_INTERVAL seconds when no request
+fetched their price in the meantime, so triggers fire with no dashboard
+open.
+
+Triggers are kept in heaps keyed by price, so a tick only looks at the
+triggers nearest the price:
+- Fixed levels sit in a heap ordered by level, the top is the next level
+  the price can reach.
+- Trailing stops that share a peak are pooled. When the price makes a new
+  high every pool below it merges into one (small into large), instead of
+  moving each stop. A pool fires through its smallest trail distance.
+
+Both kinds are written for a falling price. Levels hit from below (long
+targets, short stops) use the same books on negated prices.
+
+Any worker process arms, lists and cancels protections in the shared cache;
+one worker at a time holds a lease and evaluates them all, and a fired
+protection is claimed in the cache before its exit is sent, so a lease
+changing hands can not exit twice. Paper protections stay in the worker
+that armed them, like the paper books
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from .broker_clients import get_kite_client
+from .config import SL_QUOTE_POLL_INTERVAL
+from .instruments import get_index_spec
+from .ltp_cache import ltp_cache
+from .metrics import metrics
+from .order_idempotency import ORDER_TIMEOUT, make_order_tag, submit_with_tag
+from .order_slicer import not_placed_message, place_sliced_order, slice_quantity
+from .order_state import order_state
+from .paper_broker import is_paper_token
+from .rate_limiter import kite_order_limits
+from .shared_cache import atomic_cache, shared_lock
+from .symbol_codec import try_decode
+
+logger = logging.getLogger(__name__)
+
+# Instruments per Kite LTP call of the quote poller
+MAX_QUOTE_INSTRUMENTS = 500
+
+# How often every worker syncs with the shared protections, and how long the
+# evaluating worker's lease lasts without being renewed (seconds)
+SYNC_INTERVAL = 1
+OWNER_LEASE = 5
+
+# Armed and retired protections are kept for a trading day
+PROTECTION_TTL = 86400
+
+_ARMED_KEY = "sl_monitor:armed"
+_HISTORY_KEY = "sl_monitor:history:{user_id}"
+_OWNER_KEY = "sl_monitor:owner"
+
+STOP_LOSS = 'stop_loss'
+TARGET = 'target'
+TRAILING = 'trailing'
+
+ARMED = 'armed'
+FIRED = 'fired'
+CANCELLED = 'cancelled'
+
+metrics.describe('quicktrade_sl_triggers_armed', 'gauge', "Armed stop-loss / target triggers")
+metrics.describe('quicktrade_sl_triggers_fired_total', 'counter', "Stop-loss / target triggers fired by kind")
+metrics.describe('quicktrade_sl_exits_total', 'counter', "Exit orders sent by fired triggers by outcome")
+
+# Exits run here, never on the thread delivering the tick
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sl-exits")
+
+
+class Trigger:
+    """One armed level of a protection"""
+
+    __slots__ = ('protection', 'kind', 'level', 'trail', 'sign', 'seq', 'pool', 'active')
+
+    def __init__(self, protection: 'Protection', kind: str, sign: int, seq: int,
+                 level: Optional[float] = None, trail: Optional[float] = None):
+        self.protection = protection
+        self.kind = kind
+        self.level = level
+        self.trail = trail
+        self.sign = sign
+        self.seq = seq
+        self.pool = None
+        self.active = True
+
+    def current_level(self) -> float:
+        """Price at which the trigger fires right now"""
+        if self.pool is None:
+            return self.level
+        return self.sign * (self.pool.peak - self.trail)
+
+
+class Protection:
+    """Stop-loss, target and trailing levels attached to one position, one cancels the others"""
+
+    def __init__(self, account: Dict, position: Dict):
+        self.protection_id = uuid.uuid4().hex[:12]
+        self.user_id = account.get('user_id')
+        self.api_key = account.get('api_key')
+        self.access_token = account.get('access_token')
+        self.symbol = position['tradingsymbol']
+        self.exchange = position.get('exchange', 'NFO')
+        self.product = position.get('product', 'MIS')
+        self.quantity = int(position['quantity'])
+        self.triggers: List[Trigger] = []
+        self.status = ARMED
+        self.created_at = time.time()
+        self.fired_kind = None
+        self.fired_price = None
+        self.fired_at = None
+        self.order_ids = []
+        self.error = None
+        self.paper = is_paper_token(self.access_token)
+
+    def as_dict(self) -> Dict:
+        return {
+            'protection_id': self.protection_id,
+            'symbol': self.symbol,
+            'quantity': self.quantity,
+            'status': self.status,
+            'levels': {
+                trigger.kind: round(trigger.current_level(), 2) for trigger in self.triggers
+            },
+            'trail': next((trigger.trail for trigger in self.triggers if trigger.kind == TRAILING), None),
+            'created_at': self.created_at,
+            'fired_kind': self.fired_kind,
+            'fired_price': self.fired_price,
+            'fired_at': self.fired_at,
+            'order_id': self.order_ids[0] if self.order_ids else None,
+            'order_ids': self.order_ids,
+            'error': self.error,
+            'paper': self.paper,
+        }
+
+
+class _Pool:
+    """Trailing stops sharing one peak, in a heap by trail distance"""
+
+    __slots__ = ('peak', 'heap', 'version', 'merged')
+
+    def __init__(self, peak: float):
+        self.peak = peak
+        self.heap = []  # (trail, seq, trigger)
+        self.version = 0
+        self.merged = False
+
+
+class _FallingBook:
+    """
+    Triggers of one symbol that fire when the price falls to them
+
+    Prices are multiplied by sign on the way in, so sign -1 gives triggers
+    that fire when the price rises to them
+    """
+
+    def __init__(self, sign: int):
+        self.sign = sign
+        self._fixed = []  # (-level, seq, trigger), highest level on top
+        self._pools = []  # stack of pools, peaks falling towards the top
+        self._levels = []  # (-(peak - smallest trail), seq, pool, version)
+        self._seq = itertools.count()
+
+    def add_fixed(self, trigger: Trigger):
+        heapq.heappush(self._fixed, (-self.sign * trigger.level, trigger.seq, trigger))
+
+    def add_trailing(self, trigger: Trigger, peak: float):
+        pool = _Pool(self.sign * peak)
+        pool.heap.append((trigger.trail, trigger.seq, trigger))
+        trigger.pool = pool
+        self._push_pool(pool)
+
+    def _push_pool(self, pool: _Pool):
+        """Put a pool on the stack, merging the pools whose peak it reached"""
+        merging = [pool]
+        while self._pools and self._pools[-1].peak <= pool.peak:
+            merging.append(self._pools.pop())
+        if len(merging) > 1:
+            survivor = max(merging, key=lambda candidate: len(candidate.heap))
+            for other in merging:
+                if other is survivor:
+                    continue
+                for entry in other.heap:
+                    entry[2].pool = survivor
+                    heapq.heappush(survivor.heap, entry)
+                other.merged = True
+            survivor.peak = pool.peak
+            pool = survivor
+        self._pools.append(pool)
+        self._push_level(pool)
+
+    def _push_level(self, pool: _Pool):
+        while pool.heap and not pool.heap[0][2].active:
+            heapq.heappop(pool.heap)
+        pool.version += 1
+        if pool.heap:
+            heapq.heappush(self._levels, (-(pool.peak - pool.heap[0][0]), next(self._seq), pool, pool.version))
+
+    def on_price(self, price: float) -> List[Trigger]:
+        """Triggers reached by this price, removed from the book"""
+        x = self.sign * price
+        fired = []
+
+        fixed = self._fixed
+        while fixed and -fixed[0][0] >= x:
+            trigger = heapq.heappop(fixed)[2]
+            if trigger.active:
+                fired.append(trigger)
+
+        # A new peak drags every pool below it up to it
+        if self._pools and self._pools[-1].peak < x:
+            self._push_pool(_Pool(x))
+
+        levels = self._levels
+        while levels and -levels[0][0] >= x:
+            _, _, pool, version = heapq.heappop(levels)
+            if pool.merged or pool.version != version:
+                continue
+            while pool.heap and pool.peak - pool.heap[0][0] >= x:
+                trigger = heapq.heappop(pool.heap)[2]
+                if trigger.active:
+                    fired.append(trigger)
+            self._push_level(pool)
+        return fired
+
+    def __len__(self):
+        return len(self._fixed) + sum(len(pool.heap) for pool in self._pools)
+
+
+def _open_quantity(protection: Protection, kite) -> int:
+    """Net quantity of the protected position now, from the order state when it is fresh"""
+    state = None
+    if protection.user_id and not is_paper_token(protection.access_token):
+        state = order_state.get(protection.user_id)
+    positions = state.position_list()["net"] if state and state.is_fresh() else kite.positions()["net"]
+    return sum(int(pos["quantity"]) for pos in positions
+               if pos["tradingsymbol"] == protection.symbol and pos.get("exchange", protection.exchange) == protection.exchange
+               and pos.get("product", protection.product) == protection.product)
+
+
+def _submit_exit(protection: Protection) -> List[str]:
+    """
+    Market orders closing what is left of the protected quantity, sliced at the
+    freeze quantity and tagged so a timeout can not exit twice
+
+    Returns:
+        list: Order ids of the exit orders
+
+    Raises:
+        Exception: If the position is already closed or a slice was not placed
+    """
+    kite = get_kite_client(protection.api_key, protection.access_token, ORDER_TIMEOUT)
+    # The position may have been exited or reduced by hand since the levels were armed
+    open_quantity = _open_quantity(protection, kite)
+    if open_quantity * protection.quantity <= 0:
+        raise Exception(f"No open position in {protection.symbol}, exit not submitted")
+    quantity = min(abs(open_quantity), abs(protection.quantity))
+
+    contract = try_decode(protection.symbol)
+    if contract:
+        spec = get_index_spec(contract.index)
+        children = slice_quantity(quantity, spec['freeze_quantity'], spec['lot_size'])
+    else:
+        children = [quantity]
+
+    def submit(position, child_quantity):
+        return submit_with_tag(
+            kite,
+            make_order_tag(f"sl:{protection.protection_id}:{position}"),
+            variety="regular",
+            exchange=protection.exchange,
+            tradingsymbol=protection.symbol,
+            transaction_type="SELL" if protection.quantity > 0 else "BUY",
+            quantity=child_quantity,
+            product=protection.product,
+            order_type="MARKET",
+            validity="DAY"
+        )
+
+    result = place_sliced_order(submit, children, kite_order_limits.get(protection.api_key))
+    if not result['success']:
+        protection.order_ids = result['order_ids']
+        raise Exception(not_placed_message(result, 'exited'))
+    return result['order_ids']
+
+
+def _fetch_quotes(api_key: str, access_token: str, instruments: List[str]) -> Dict[str, float]:
+    """LTPs of exchange:tradingsymbol instruments from Kite"""
+    kite = get_kite_client(api_key, access_token)
+    prices = {}
+    for start in range(0, len(instruments), MAX_QUOTE_INSTRUMENTS):
+        quotes = kite.ltp(instruments[start:start + MAX_QUOTE_INSTRUMENTS])
+        prices.update({instrument: quote['last_price'] for instrument, quote in quotes.items()})
+    return prices
+
+
+def check_levels(position: Dict, stop_loss: Optional[float], target: Optional[float],
+                 trail: Optional[float], price: Optional[float]) -> Optional[float]:
+    """
+    Validate the levels asked for a position
+
+    Returns:
+        float: Price to trail from, the cached LTP when none is given
+
+    Raises:
+        ValueError: If no level is given or a level is on the wrong side of the price
+    """
+    quantity = int(position.get('quantity') or 0)
+    if quantity == 0:
+        raise ValueError(f"No open position in {position.get('tradingsymbol')}")
+    if stop_loss is None and target is None and trail is None:
+        raise ValueError("Give at least one of stop_loss, target or trail")
+    if trail is not None and trail <= 0:
+        raise ValueError("Trail must be greater than 0")
+
+    symbol = position['tradingsymbol']
+    price = price if price is not None else ltp_cache.get(symbol)
+    # Long positions are hurt by a falling price, short positions by a rising one
+    against = 1 if quantity > 0 else -1
+    if stop_loss is not None and target is not None and against * (target - stop_loss) <= 0:
+        raise ValueError("Target must be on the profit side of the stop-loss")
+    if price is not None:
+        if stop_loss is not None and against * (price - stop_loss) <= 0:
+            raise ValueError(f"Stop-loss {stop_loss} would fire right away at {price}")
+        if target is not None and against * (target - price) <= 0:
+            raise ValueError(f"Target {target} would fire right away at {price}")
+    if trail is not None and price is None:
+        raise ValueError(f"No price for {symbol} yet to trail from")
+    return price
+
+
+class StopLossMonitor:
+    """Armed protections of every account, evaluated on each LTP cache tick"""
+
+    def __init__(self, submit_exit: Callable[[Protection], List[str]] = _submit_exit, subscribe: bool = True,
+                 fetch_quotes: Callable[[str, str, List[str]], Dict[str, float]] = _fetch_quotes,
+                 poll_interval: float = SL_QUOTE_POLL_INTERVAL):
+        self.submit_exit = submit_exit
+        self.fetch_quotes = fetch_quotes
+        self.poll_interval = poll_interval
+        # Only a monitor listening to the LTP cache polls quotes into it
+        self._poll = subscribe and poll_interval > 0
+        self._poller: Optional[threading.Thread] = None
+        self._books: Dict[str, Dict[int, _FallingBook]] = {}
+        self._armed: Dict[tuple, Protection] = {}  # (user id, symbol) -> protection
+        self._armed_per_symbol: Dict[str, int] = {}
+        self._history: Dict[str, List[Protection]] = {}  # user id -> fired / cancelled, latest last
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        if subscribe:
+            ltp_cache.subscribe(self.on_tick)
+
+    def protect(self, account: Dict, position: Dict, stop_loss: Optional[float] = None,
+                target: Optional[float] = None, trail: Optional[float] = None,
+                price: Optional[float] = None) -> Protection:
+        """
+        Arm levels on a position, replacing the ones already armed on it
+
+        Args:
+            account: user_id, api_key and access_token of the account
+            position: Kite position row (tradingsymbol, exchange, product, quantity)
+            stop_loss: Exit when the price moves against the position to this level
+            target: Exit when the price moves in favour of the position to this level
+            trail: Trailing stop distance from the best price since arming
+            price: Current price, defaults to the cached LTP
+
+        Returns:
+            Protection: The armed protection
+
+        Raises:
+            ValueError: If no level is given or a level is on the wrong side of the price
+        """
+        price = check_levels(position, stop_loss, target, trail, price)
+        return self.arm(account, position, stop_loss, target, trail, price)
+
+    def arm(self, account: Dict, position: Dict, stop_loss: Optional[float] = None,
+            target: Optional[float] = None, trail: Optional[float] = None, price: Optional[float] = None,
+            protection_id: Optional[str] = None, created_at: Optional[float] = None) -> Protection:
+        """Arm levels already checked by check_levels, trailing from price; keeps a given id"""
+        protection = Protection(account, position)
+        protection.protection_id = protection_id or protection.protection_id
+        protection.created_at = created_at or protection.created_at
+        symbol = protection.symbol
+        against = 1 if protection.quantity > 0 else -1
+        with self._lock:
+            previous = self._armed.get((protection.user_id, symbol))
+            if previous:
+                self._retire(previous, CANCELLED)
+            books = self._books.setdefault(symbol, {1: _FallingBook(1), -1: _FallingBook(-1)})
+            if stop_loss is not None:
+                trigger = Trigger(protection, STOP_LOSS, against, next(self._seq), level=float(stop_loss))
+                books[against].add_fixed(trigger)
+                protection.triggers.append(trigger)
+            if target is not None:
+                trigger = Trigger(protection, TARGET, -against, next(self._seq), level=float(target))
+                books[-against].add_fixed(trigger)
+                protection.triggers.append(trigger)
+            if trail is not None:
+                trigger = Trigger(protection, TRAILING, against, next(self._seq), trail=float(trail))
+                books[against].add_trailing(trigger, float(price))
+                protection.triggers.append(trigger)
+            self._armed[(protection.user_id, symbol)] = protection
+            self._armed_per_symbol[symbol] = self._armed_per_symbol.get(symbol, 0) + 1
+            # Started on first use, so it runs in the worker process and not the preloading master
+            if self._poll and self._poller is None:
+                self._poller = threading.Thread(target=self._poll_quotes, name="sl-quotes", daemon=True)
+                self._poller.start()
+        return protection
+
+    def cancel(self, user_id: str, symbol: str, protection_id: Optional[str] = None) -> bool:
+        """Disarm the protection of a position (only if it has this id, when given), True if one was armed"""
+        with self._lock:
+            protection = self._armed.get((user_id, symbol))
+            if protection is None or protection_id not in (None, protection.protection_id):
+                return False
+            self._retire(protection, CANCELLED)
+            return True
+
+    def cancel_all(self, user_id: str) -> int:
+        """Disarm every protection of an account, returns how many were armed"""
+        with self._lock:
+            armed = [p for (owner, _), p in self._armed.items() if owner == user_id]
+            for protection in armed:
+                self._retire(protection, CANCELLED)
+            return len(armed)
+
+    def protections(self, user_id: str) -> List[Dict]:
+        """Armed protections of an account followed by its recently fired or cancelled ones"""
+        with self._lock:
+            armed = [p for (owner, _), p in self._armed.items() if owner == user_id]
+            return [p.as_dict() for p in armed + list(reversed(self._history.get(user_id, [])))]
+
+    def armed_count(self, paper_only: bool = False) -> int:
+        with self._lock:
+            return sum(len(p.triggers) for p in self._armed.values() if p.paper or not paper_only)
+
+    def _retire(self, protection: Protection, status: str):
+        """Deactivate every trigger of a protection (lock held), the heaps drop them lazily"""
+        protection.status = status
+        for trigger in protection.triggers:
+            trigger.active = False
+        del self._armed[(protection.user_id, protection.symbol)]
+        self._armed_per_symbol[protection.symbol] -= 1
+        if not self._armed_per_symbol[protection.symbol]:
+            # Nothing armed on the symbol, drop the books and their dead entries
+            del self._armed_per_symbol[protection.symbol]
+            self._books.pop(protection.symbol, None)
+        history = self._history.setdefault(protection.user_id, [])
+        history.append(protection)
+        del history[:-20]
+
+    def on_tick(self, symbol: str, ltp: float, timestamp: Optional[float] = None) -> List[Protection]:
+        """
+        Check a tick against the armed triggers of its symbol
+
+        Returns:
+            list: Protections that fired on this tick, their exits are submitted in the background
+        """
+        books = self._books.get(symbol)
+        if not books:
+            return []
+        fired = []
+        with self._lock:
+            for book in books.values():
+                for trigger in book.on_price(ltp):
+                    protection = trigger.protection
+                    if protection.status != ARMED:
+                        continue
+                    self._retire(protection, FIRED)
+                    protection.fired_kind = trigger.kind
+                    protection.fired_price = ltp
+                    protection.fired_at = timestamp or time.time()
+                    fired.append(protection)
+                    metrics.inc('quicktrade_sl_triggers_fired_total', {'kind': trigger.kind})
+
+        for protection in fired:
+            _executor.submit(self._exit, protection)
+        return fired
+
+    def poll_once(self) -> int:
+        """
+        Quote the armed symbols no request has priced within the poll interval
+        and feed them to the LTP cache, which evaluates their triggers
+
+        Returns:
+            int: Number of prices received
+        """
+        with self._lock:
+            armed = list(self._armed.values())
+        stale = {}
+        for protection in armed:
+            if ltp_cache.get(protection.symbol, max_age=self.poll_interval) is None:
+                stale[f"{protection.exchange}:{protection.symbol}"] = protection.symbol
+        if not stale:
+            return 0
+
+        # Quotes are market data, any live Kite session of an armed account can fetch them
+        credentials = dict.fromkeys((protection.api_key, protection.access_token) for protection in armed
+                                    if protection.api_key and protection.access_token
+                                    and not is_paper_token(protection.access_token))
+        last_error = None
+        for api_key, access_token in credentials:
+            try:
+                quotes = self.fetch_quotes(api_key, access_token, list(stale))
+            except Exception as e:
+                last_error = e
+                continue
+            ltp_cache.update_many({stale[instrument]: ltp for instrument, ltp in quotes.items() if instrument in stale})
+            return len(quotes)
+        if last_error is not None:
+            logger.warning("Quotes of %d armed symbols unavailable: %s", len(stale), last_error)
+        return 0
+
+    def _poll_quotes(self):
+        """Poller thread: keep the prices of armed symbols flowing"""
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll_once()
+            except Exception:
+                logger.exception("Stop-loss quote poll failed")
+
+    def _exit(self, protection: Protection):
+        try:
+            protection.order_ids = list(self.submit_exit(protection))
+            metrics.inc('quicktrade_sl_exits_total', {'outcome': 'success'})
+        except Exception as e:
+            protection.error = str(e)
+            metrics.inc('quicktrade_sl_exits_total', {'outcome': 'failure'})
+
+
+def _spec_dict(spec: Dict, status: str = ARMED) -> Dict:
+    """Protection.as_dict of a protection kept in the shared cache"""
+    against = 1 if spec['quantity'] > 0 else -1
+    levels = {kind: spec[field] for kind, field in ((STOP_LOSS, 'stop_loss'), (TARGET, 'target'))
+              if spec[field] is not None}
+    if spec['trail'] is not None:
+        levels[TRAILING] = round(spec['peak'] - against * spec['trail'], 2)
+    return {
+        'protection_id': spec['protection_id'],
+        'symbol': spec['symbol'],
+        'quantity': spec['quantity'],
+        'status': status,
+        'levels': levels,
+        'trail': spec['trail'],
+        'created_at': spec['created_at'],
+        'fired_kind': None,
+        'fired_price': None,
+        'fired_at': None,
+        'order_id': None,
+        'order_ids': [],
+        'error': None,
+        'paper': False,
+    }
+
+
+class SharedStopLossMonitor:
+    """
+    Protections of every worker process, kept in the shared cache and
+    evaluated by the StopLossMonitor of the worker holding the lease
+    """
+
+    def __init__(self, engine: Optional[StopLossMonitor] = None, sync_interval: float = SYNC_INTERVAL):
+        self.engine = engine or StopLossMonitor(submit_exit=self._exit)
+        self.sync_interval = sync_interval
+        self._loaded: Dict[str, Protection] = {}  # protection id -> armed in the engine
+        self._pid = None
+        self._token = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start syncing this worker process with the shared protections"""
+        with self._start_lock:
+            self._ensure_token()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sl-sync", daemon=True)
+                self._thread.start()
+
+    def _ensure_token(self):
+        """Lease token of this process; a forked worker gets its own and starts its own thread"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._token = f"{self._pid}:{uuid.uuid4().hex}"
+            self._thread = None
+
+    def protect(self, account: Dict, position: Dict, stop_loss: Optional[float] = None,
+                target: Optional[float] = None, trail: Optional[float] = None,
+                price: Optional[float] = None) -> Dict:
+        """
+        Arm levels on a position, replacing the ones already armed on it,
+        see StopLossMonitor.protect
+
+        Returns:
+            dict: The armed protection
+        """
+        if is_paper_token(account.get('access_token')):
+            return self.engine.protect(account, position, stop_loss, target, trail, price).as_dict()
+
+        price = check_levels(position, stop_loss, target, trail, price)
+        spec = {
+            'protection_id': uuid.uuid4().hex[:12],
+            'user_id': account.get('user_id'),
+            'api_key': account.get('api_key'),
+            'access_token': account.get('access_token'),
+            'symbol': position['tradingsymbol'],
+            'exchange': position.get('exchange', 'NFO'),
+            'product': position.get('product', 'MIS'),
+            'quantity': int(position['quantity']),
+            'stop_loss': stop_loss,
+            'target': target,
+            'trail': trail,
+            'peak': price,
+            'created_at': time.time(),
+        }
+        with shared_lock(_ARMED_KEY):
+            armed = self._armed()
+            for previous in [p for p in armed.values()
+                             if (p['user_id'], p['symbol']) == (spec['user_id'], spec['symbol'])]:
+                self._retire(armed, previous, CANCELLED)
+            armed[spec['protection_id']] = spec
+            atomic_cache.set(_ARMED_KEY, armed, PROTECTION_TTL)
+        self.start()
+        return _spec_dict(spec)
+
+    def cancel(self, user_id: str, symbol: str) -> bool:
+        """Disarm the protection of a position, True if one was armed"""
+        cancelled = self.engine.cancel(user_id, symbol) if self._has_paper(user_id) else False
+        with shared_lock(_ARMED_KEY):
+            armed = self._armed()
+            mine = [p for p in armed.values() if (p['user_id'], p['symbol']) == (user_id, symbol)]
+            for spec in mine:
+                self._retire(armed, spec, CANCELLED)
+            if mine:
+                atomic_cache.set(_ARMED_KEY, armed, PROTECTION_TTL)
+        return cancelled or bool(mine)
+
+    def cancel_all(self, user_id: str) -> int:
+        """Disarm every protection of an account, returns how many were armed"""
+        count = self.engine.cancel_all(user_id) if self._has_paper(user_id) else 0
+        with shared_lock(_ARMED_KEY):
+            armed = self._armed()
+            mine = [p for p in armed.values() if p['user_id'] == user_id]
+            for spec in mine:
+                self._retire(armed, spec, CANCELLED)
+            if mine:
+                atomic_cache.set(_ARMED_KEY, armed, PROTECTION_TTL)
+        return count + len(mine)
+
+    def protections(self, user_id: str) -> List[Dict]:
+        """Armed protections of an account followed by its recently fired or cancelled ones"""
+        self.start()
+        armed = [_spec_dict(spec) for spec in self._armed().values() if spec['user_id'] == user_id]
+        paper = [p for p in self.engine.protections(user_id) if p['paper']]
+        history = list(reversed(atomic_cache.get(_HISTORY_KEY.format(user_id=user_id)) or []))
+        return armed + paper + history
+
+    def armed_count(self) -> int:
+        shared = sum(len(_spec_dict(spec)['levels']) for spec in self._armed().values())
+        return shared + self.engine.armed_count(paper_only=True)
+
+    def sync(self) -> bool:
+        """
+        Renew (or take) the lease and load the shared protections into the
+        engine while this worker holds it, unload them when it does not
+
+        Returns:
+            bool: True if this worker evaluates the shared protections
+        """
+        self._ensure_token()
+        armed = self._armed()
+        owner = atomic_cache.get(_OWNER_KEY)
+        if owner == self._token and armed:
+            atomic_cache.set(_OWNER_KEY, self._token, OWNER_LEASE)
+            owning = True
+        elif owner == self._token:
+            atomic_cache.delete(_OWNER_KEY)
+            owning = False
+        else:
+            owning = bool(armed) and owner is None and atomic_cache.add(_OWNER_KEY, self._token, OWNER_LEASE)
+
+        wanted = armed if owning else {}
+        for protection_id in set(self._loaded) - set(wanted):
+            protection = self._loaded.pop(protection_id)
+            self.engine.cancel(protection.user_id, protection.symbol, protection_id)
+        for protection_id in set(wanted) - set(self._loaded):
+            spec = wanted[protection_id]
+            position = {'tradingsymbol': spec['symbol'], 'exchange': spec['exchange'],
+                        'product': spec['product'], 'quantity': spec['quantity']}
+            self._loaded[protection_id] = self.engine.arm(
+                spec, position, spec['stop_loss'], spec['target'], spec['trail'], spec['peak'],
+                protection_id=protection_id, created_at=spec['created_at'])
+        if owning:
+            self._save_peaks()
+        return owning
+
+    def _save_peaks(self):
+        """Write the best prices the trailing stops reached back, for the next owner and for listings"""
+        peaks = {}
+        for protection_id, protection in self._loaded.items():
+            for trigger in protection.triggers:
+                if trigger.kind == TRAILING and trigger.active:
+                    peaks[protection_id] = trigger.sign * trigger.pool.peak
+        armed = self._armed()
+        if all(armed.get(protection_id, {}).get('peak') == peak for protection_id, peak in peaks.items()):
+            return
+        with shared_lock(_ARMED_KEY):
+            armed = self._armed()
+            for protection_id, peak in peaks.items():
+                if protection_id in armed:
+                    armed[protection_id]['peak'] = peak
+            atomic_cache.set(_ARMED_KEY, armed, PROTECTION_TTL)
+
+    def _run(self):
+        """Sync thread of the worker process"""
+        while True:
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Stop-loss sync failed")
+            time.sleep(self.sync_interval)
+
+    def _exit(self, protection: Protection) -> List[str]:
+        """Engine exit: claim a shared protection so no other worker exits it too, then exit"""
+        if protection.paper:
+            return _submit_exit(protection)
+        fired = {
+            'status': FIRED,
+            'fired_kind': protection.fired_kind,
+            'fired_price': protection.fired_price,
+            'fired_at': protection.fired_at,
+        }
+        with shared_lock(_ARMED_KEY):
+            armed = self._armed()
+            spec = armed.get(protection.protection_id)
+            if spec is None:
+                logger.info("Protection %s was cancelled or fired elsewhere, exit not submitted",
+                            protection.protection_id)
+                return []
+            self._retire(armed, spec, FIRED, fired)
+            atomic_cache.set(_ARMED_KEY, armed, PROTECTION_TTL)
+        try:
+            order_ids = _submit_exit(protection)
+        except Exception as e:
+            self._update_history(protection, {'order_ids': protection.order_ids, 'error': str(e)})
+            raise
+        self._update_history(protection, {'order_ids': order_ids})
+        return order_ids
+
+    def _has_paper(self, user_id: str) -> bool:
+        return any(p['paper'] and p['status'] == ARMED for p in self.engine.protections(user_id))
+
+    @staticmethod
+    def _armed() -> Dict[str, Dict]:
+        return dict(atomic_cache.get(_ARMED_KEY) or {})
+
+    @staticmethod
+    def _retire(armed: Dict[str, Dict], spec: Dict, status: str, fields: Optional[Dict] = None):
+        """Move a protection from the armed ones to its account's history (shared lock held)"""
+        del armed[spec['protection_id']]
+        entry = {**_spec_dict(spec, status), **(fields or {})}
+        key = _HISTORY_KEY.format(user_id=spec['user_id'])
+        history = (atomic_cache.get(key) or []) + [entry]
+        atomic_cache.set(key, history[-20:], PROTECTION_TTL)
+
+    @staticmethod
+    def _update_history(protection: Protection, fields: Dict):
+        """Record the exit outcome of a fired protection"""
+        key = _HISTORY_KEY.format(user_id=protection.user_id)
+        with shared_lock(_ARMED_KEY):
+            history = atomic_cache.get(key) or []
+            for entry in history:
+                if entry['protection_id'] == protection.protection_id:
+                    entry.update(fields)
+                    entry['order_id'] = entry['order_ids'][0] if entry.get('order_ids') else None
+            atomic_cache.set(key, history, PROTECTION_TTL)
+
+
+# Global instance
+sl_monitor = SharedStopLossMonitor()
+
+metrics.add_collector(lambda: metrics.set('quicktrade_sl_triggers_armed', sl_monitor.armed_count()))
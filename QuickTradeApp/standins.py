@@ -0,0 +1,266 @@
+"""
+Local broker stand-ins for QuickTradeApp
+A small HTTP server that answers the Fyers and Kite endpoints the app
+reads, with injectable faults (latency, hangs, 5xx errors, dropped
+connections). The real SDKs are pointed at it, so breakers, timeouts and
+fallbacks are exercised end to end without touching the brokers
+"""
+import itertools
+import json
+import math
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from .broker_clients import fyers_clients, fyers_model, kite_clients, kite_connect
+
+
+class FaultPlan:
+    """Faults applied to every stand-in response, changeable while serving"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0,
+                 hang: bool = False, drop_rate: float = 0.0, spike_rate: float = 0.0,
+                 spike_latency: float = 0.0, upstream: Optional[str] = None, seed: Optional[int] = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hang = hang
+        self.drop_rate = drop_rate
+        self.spike_rate = spike_rate  # share of responses delayed by spike_latency instead
+        self.spike_latency = spike_latency
+        self.upstream = upstream  # 'fyers' or 'kite' to fault only one of them
+        self._random = random.Random(seed)
+
+    def update(self, **faults):
+        for name, value in faults.items():
+            if not hasattr(self, name) or name.startswith('_'):
+                raise ValueError(f"Unknown fault: {name}")
+            setattr(self, name, value)
+
+    def roll(self, rate: float) -> bool:
+        return rate > 0 and self._random.random() < rate
+
+    def applies_to(self, upstream: str) -> bool:
+        return self.upstream in (None, upstream)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "BrokerStandIn/1.0"
+
+    def log_message(self, format, *args):
+        pass  # Keep command output readable
+
+    def do_GET(self):
+        self.server.standin.handle(self)
+
+    def do_POST(self):
+        self.server.standin.handle(self)
+
+
+class _Server(ThreadingHTTPServer):
+    # Replay traffic opens many connections at once, the default backlog of 5 turns that into SYN retries
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class BrokerStandIn:
+    """Fault-injecting stand-in for the Fyers and Kite REST APIs"""
+
+    # Long enough to blow any guarded deadline
+    HANG_SECONDS = 10
+
+    def __init__(self, faults: Optional[FaultPlan] = None, prices: Optional[Dict[str, float]] = None,
+                 track_positions: bool = False, postback: Optional[Callable[[str, Dict], None]] = None):
+        self.faults = faults or FaultPlan()
+        self.prices = dict(prices or {'NSE:NIFTY50-INDEX': 22000.0, 'NSE:NIFTYBANK-INDEX': 48000.0,
+                                      'NSE:NIFTY 50': 22000.0, 'NSE:NIFTY BANK': 48000.0})
+        self.positions = []
+        # With track_positions, fills build net positions per account instead
+        self.track_positions = track_positions
+        self._account_positions: Dict[str, Dict[str, Dict]] = {}
+        # postback(access token, order) is called with every fill before the order call returns
+        self.postback = postback
+        self.orders = []
+        self.requests = 0
+        self._order_accounts: Dict[str, str] = {}  # order id -> Kite access token
+        self._order_ids = itertools.count(250000000000001)
+        self._orders_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'BrokerStandIn':
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.standin = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="broker-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _send(self, handler, status: int, body: Dict):
+        payload = json.dumps(body, default=str).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def handle(self, handler):
+        self.requests += 1
+        faults = self.faults
+        url = urlparse(handler.path)
+        is_kite = not url.path.startswith('/fyers')
+        if not faults.applies_to('kite' if is_kite else 'fyers'):
+            faults = FaultPlan()
+        if faults.hang:
+            time.sleep(self.HANG_SECONDS)
+        elif faults.roll(faults.spike_rate):
+            time.sleep(faults.spike_latency)
+        elif faults.latency:
+            time.sleep(faults.latency)
+
+        if faults.roll(faults.drop_rate):
+            handler.close_connection = True
+            handler.connection.shutdown(socket.SHUT_RDWR)
+            return
+        if faults.roll(faults.error_rate):
+            if is_kite:
+                return self._send(handler, 503, {'status': 'error', 'error_type': 'NetworkException',
+                                                 'message': 'Injected fault'})
+            return self._send(handler, 503, {'s': 'error', 'code': 503, 'message': 'Injected fault'})
+
+        query = parse_qs(url.query)
+        if handler.command == 'POST':
+            length = int(handler.headers.get('Content-Length') or 0)
+            query.update(parse_qs(handler.rfile.read(length).decode('utf-8')))
+        if is_kite:
+            account = handler.headers.get('Authorization', '').rpartition(':')[2]
+            return self._send(handler, 200, {'status': 'success', 'data': self._kite(url.path, query, account)})
+        return self._send(handler, 200, self._fyers(url.path, query))
+
+    def _kite(self, path: str, query: Dict, account: str = ''):
+        if path == '/portfolio/positions':
+            if self.track_positions:
+                with self._orders_lock:
+                    net = [dict(position) for position in self._account_positions.get(account, {}).values()
+                           if position['quantity']]
+                return {'net': net, 'day': []}
+            return {'net': self.positions, 'day': []}
+        if path == '/orders':
+            return [order for order in self.orders if self._order_accounts.get(order['order_id'], account) == account]
+        if path.startswith('/orders/'):
+            return {'order_id': self._fill(query, account)}
+        if path == '/user/profile':
+            return {'user_id': 'AB1234', 'user_name': 'Stand-in'}
+        if path in ('/quote/ltp', '/quote'):
+            return {symbol: {'last_price': self.prices.get(symbol, 100.0)} for symbol in query.get('i', [])}
+        return {}
+
+    def _fill(self, params: Dict, account: str) -> str:
+        """Fill a market order at the stand-in price of its symbol"""
+        value = lambda name: params.get(name, [None])[0]
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        quantity = int(value('quantity') or 0)
+        with self._orders_lock:
+            order_id = str(next(self._order_ids))
+            self._order_accounts[order_id] = account
+            self.orders.append({
+                'order_id': order_id,
+                'status': 'COMPLETE',
+                'tradingsymbol': value('tradingsymbol'),
+                'exchange': value('exchange'),
+                'transaction_type': value('transaction_type'),
+                'product': value('product'),
+                'order_type': value('order_type'),
+                'quantity': quantity,
+                'filled_quantity': quantity,
+                'average_price': self.prices.get(f"{value('exchange')}:{value('tradingsymbol')}", 100.0),
+                'tag': value('tag'),
+                'order_timestamp': now,
+                'exchange_timestamp': now,
+            })
+            if self.track_positions:
+                positions = self._account_positions.setdefault(account, {})
+                position = positions.setdefault(value('tradingsymbol'), {
+                    'tradingsymbol': value('tradingsymbol'), 'exchange': value('exchange'),
+                    'product': value('product'), 'quantity': 0, 'average_price': 0.0, 'last_price': 0.0,
+                    'pnl': 0.0, 'buy_quantity': 0, 'buy_value': 0.0, 'sell_quantity': 0, 'sell_value': 0.0,
+                    'multiplier': 1,
+                })
+                side = 'buy' if value('transaction_type') == 'BUY' else 'sell'
+                position[f'{side}_quantity'] += quantity
+                position[f'{side}_value'] += quantity * self.orders[-1]['average_price']
+                position['quantity'] = position['buy_quantity'] - position['sell_quantity']
+            order = dict(self.orders[-1])
+        if self.postback:
+            try:
+                self.postback(account, order)
+            except Exception:
+                pass  # Like Kite, a failed postback never fails the order
+        return order_id
+
+    def _fyers(self, path: str, query: Dict):
+        if path.endswith('/quotes'):
+            symbols = query.get('symbols', [''])[0].split(',')
+            return {'s': 'ok', 'code': 200, 'd': [
+                {'n': symbol, 's': 'ok', 'v': {'lp': self.prices.get(symbol, 100.0)}} for symbol in symbols if symbol
+            ]}
+        if path.endswith('/history'):
+            return self._history(query)
+        if path.endswith('/profile'):
+            return {'s': 'ok', 'code': 200, 'data': {'fy_id': 'XY1234'}}
+        return {'s': 'ok', 'code': 200, 'data': {}}
+
+    def _history(self, query: Dict):
+        """Deterministic candles around the stand-in price, one per resolution step"""
+        value = lambda name: query.get(name, [''])[0]
+        symbol = value('symbol')
+        length = 86400 if value('resolution') in ('D', '1D') else int(value('resolution') or 1) * 60
+        start = -(-int(value('range_from')) // length) * length
+        end = min(int(value('range_to')), int(time.time()))
+        base = self.prices.get(symbol, 100.0)
+        candles = []
+        for stamp in range(start, end + 1, length):
+            wave = base * (1 + 0.01 * math.sin(stamp / 7200))
+            candles.append([stamp, round(wave, 2), round(wave * 1.001, 2), round(wave * 0.999, 2),
+                            round(wave * (1 + 0.0005 * math.cos(stamp)), 2), 1000 + stamp % 997])
+        if not candles:
+            return {'s': 'no_data', 'code': 200, 'candles': []}
+        return {'s': 'ok', 'code': 200, 'candles': candles}
+
+    @contextmanager
+    def installed(self):
+        """Point the SDKs and the client pools at this stand-in"""
+        config = fyers_model().Config
+        previous_urls = (config.API, config.DATA_API)
+        previous_factories = (kite_clients.factory, fyers_clients.factory)
+        config.API = f"{self.url}/fyers/api/v3"
+        config.DATA_API = f"{self.url}/fyers/data"
+
+        def kite_factory(api_key, access_token, timeout=None):
+            kite = kite_connect()(api_key=api_key, root=self.url, timeout=timeout)
+            kite.set_access_token(access_token)
+            return kite
+
+        kite_clients.set_factory(kite_factory)
+        fyers_clients.set_factory(previous_factories[1])
+        try:
+            yield self
+        finally:
+            config.API, config.DATA_API = previous_urls
+            kite_clients.set_factory(previous_factories[0])
+            fyers_clients.set_factory(previous_factories[1])
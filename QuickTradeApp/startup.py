@@ -0,0 +1,92 @@
+"""
+Startup warm-up for QuickTradeApp
+Pays the one-off costs of the first request (URLconf and view imports,
+broker SDK imports, template compilation, reference data) ahead of time.
+Under gunicorn it runs once in the master before workers are forked
+"""
+import time
+from datetime import date, timedelta
+from typing import Dict
+
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+# Templates rendered on the hot paths
+WARM_TEMPLATES = ('base.html', 'zerodha_login.html', 'fyers_login.html', 'dashboard.html',
+                  'partials/portfolio_tables.html')
+
+
+def _ensure_cache_table():
+    """Create the shared cache tables if the build did not"""
+    from django.core.management import call_command
+    from django.db import connections
+
+    try:
+        call_command('createcachetable', verbosity=0)
+    finally:
+        # Under preload this runs in the master, workers must open their own connections
+        connections.close_all()
+
+
+def _prime_reference_data():
+    """Fill the contract spec and symbol codec caches for the coming expiries"""
+    from .instruments import INDEX_SPECS
+    from .symbol_codec import decode, encode, expiry_prefix
+
+    today = date.today()
+    for index in INDEX_SPECS:
+        for days in range(0, 35, 7):
+            expiry = today + timedelta(days=days)
+            expiry_prefix(index, expiry, "WEEKLY")
+            expiry_prefix(index, expiry, "MONTHLY")
+        decode(encode(index, today, 100 * 100, 'CE'))
+
+
+def _prime_numerics():
+    """Run the vectorized Greeks once so numpy dispatch is set up"""
+    import numpy as np
+    from .option_greeks import greeks, implied_volatility
+
+    spot = np.array([100.0])
+    strike = np.array([100.0])
+    years = np.array([0.05])
+    is_call = np.array([True])
+    sigma = implied_volatility(np.array([3.0]), spot, strike, years, is_call)
+    greeks(spot, strike, years, sigma, is_call)
+
+
+def _prime_broker_clients():
+    """Import the broker SDKs and build one throwaway client of each kind"""
+    from .broker_clients import kite_connect, fyers_model, preload_sdks
+
+    preload_sdks()
+    # Not pooled: clients made in the master must not share sockets with workers
+    kite_connect()(api_key="warmup")
+    fyers_model().FyersModel(client_id="WARMUP-100", token="warmup", is_async=False, log_path="")
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    Run every warm-up step, skipping steps that fail
+
+    Returns:
+        dict: Milliseconds spent per step (None if the step failed)
+    """
+    steps = (
+        ('cache_table', _ensure_cache_table),
+        ('urlconf', lambda: get_resolver().url_patterns),
+        ('broker_clients', _prime_broker_clients),
+        ('templates', lambda: [get_template(name) for name in WARM_TEMPLATES]),
+        ('reference_data', _prime_reference_data),
+        ('numerics', _prime_numerics),
+    )
+    timings = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+            timings[name] = round((time.perf_counter() - started) * 1000, 1)
+        except Exception:
+            # A cold path is slower, never fatal
+            timings[name] = None
+    return timings
@@ -0,0 +1,31 @@
+// Offset anchor links for the fixed navbar
+document.addEventListener('DOMContentLoaded', function() {
+  // Add offset for anchor links to account for fixed navbar
+  const navbarHeight = document.querySelector('.navbar').offsetHeight;
+
+  document.querySelectorAll('a[href^="#"]').forEach(anchor => {
+    anchor.addEventListener('click', function (e) {
+      e.preventDefault();
+
+      const targetId = this.getAttribute('href').substring(1);
+      if (!targetId) return;
+
+      const targetElement = document.getElementById(targetId);
+      if (!targetElement) return;
+
+      const offsetTop = targetElement.getBoundingClientRect().top + window.pageYOffset - navbarHeight - 20;
+
+      window.scrollTo({
+        top: offsetTop,
+        behavior: 'smooth'
+      });
+
+      // Update active state in navbar
+      document.querySelectorAll('.nav-link').forEach(navLink => {
+        navLink.classList.remove('active');
+      });
+
+      this.classList.add('active');
+    });
+  });
+});
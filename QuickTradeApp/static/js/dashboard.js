@@ -0,0 +1,1283 @@
+// Add new functions for quantity control
+function incrementQuantity(symbol) {
+    const input = document.getElementById(`${symbol}-quantity`);
+    input.value = parseInt(input.value) + 1;
+}
+
+function decrementQuantity(symbol) {
+    const input = document.getElementById(`${symbol}-quantity`);
+    const newValue = parseInt(input.value) - 1;
+    if (newValue >= 1) {
+        input.value = newValue;
+    }
+}
+
+// Enhanced Notification System
+function showNotification(type, title, message, duration = 5000, details = null) {
+    const container = document.querySelector('.notification-container');
+    const notification = document.createElement('div');
+    notification.className = `notification ${type}`;
+
+    let icon, color;
+    switch(type) {
+        case 'success':
+            icon = 'check-circle';
+            color = '#10b981';
+            break;
+        case 'error':
+            icon = 'exclamation-circle';
+            color = '#ef4444';
+            break;
+        case 'warning':
+            icon = 'exclamation-triangle';
+            color = '#f59e0b';
+            break;
+        case 'info':
+            icon = 'info-circle';
+            color = '#3b82f6';
+            break;
+        case 'loading':
+            icon = 'spinner fa-spin';
+            color = '#6366f1';
+            break;
+        default:
+            icon = 'info-circle';
+            color = '#6b7280';
+    }
+
+    const detailsHtml = details ? `
+        <div class="notification-details">
+            ${Object.entries(details).map(([key, value]) => 
+                `<div class="detail-item">
+                    <span class="detail-label">${key}:</span>
+                    <span class="detail-value">${value}</span>
+                </div>`
+            ).join('')}
+        </div>
+    ` : '';
+
+    notification.innerHTML = `
+        <div class="notification-icon" style="color: ${color}">
+            <i class="fas fa-${icon}"></i>
+        </div>
+        <div class="notification-content">
+            <div class="notification-title">${title}</div>
+            <div class="notification-message">${message}</div>
+            ${detailsHtml}
+        </div>
+        <div class="notification-actions">
+            <button class="notification-close" onclick="dismissNotification(this.parentElement.parentElement)">
+                <i class="fas fa-times"></i>
+            </button>
+        </div>
+    `;
+
+    container.appendChild(notification);
+
+    // Initialize drag events
+    let startX, startY, currentX, currentY;
+    let isDragging = false;
+    let initialTransform = '';
+    let lastX, lastY;
+    let velocityX = 0;
+    let velocityY = 0;
+    let lastTime = 0;
+
+    function handleDragStart(e) {
+        if (e.type === 'mousedown') {
+            startX = e.clientX;
+            startY = e.clientY;
+        } else {
+            startX = e.touches[0].clientX;
+            startY = e.touches[0].clientY;
+        }
+        isDragging = true;
+        initialTransform = notification.style.transform;
+        notification.classList.add('dragging');
+        lastX = startX;
+        lastY = startY;
+        lastTime = Date.now();
+    }
+
+    function handleDragMove(e) {
+        if (!isDragging) return;
+
+        e.preventDefault();
+
+        if (e.type === 'mousemove') {
+            currentX = e.clientX;
+            currentY = e.clientY;
+        } else {
+            currentX = e.touches[0].clientX;
+            currentY = e.touches[0].clientY;
+        }
+
+        const deltaX = currentX - startX;
+        const deltaY = currentY - startY;
+
+        // Calculate velocity
+        const currentTime = Date.now();
+        const timeDelta = currentTime - lastTime;
+        if (timeDelta > 0) {
+            velocityX = (currentX - lastX) / timeDelta;
+            velocityY = (currentY - lastY) / timeDelta;
+        }
+        lastX = currentX;
+        lastY = currentY;
+        lastTime = currentTime;
+
+        // Determine if the drag is more horizontal or vertical
+        if (Math.abs(deltaX) > Math.abs(deltaY)) {
+            // Horizontal drag
+            if (deltaX > 0) { // Drag right
+                notification.style.transform = `translateX(${deltaX}px)`;
+            }
+        } else {
+            // Vertical drag
+            if (deltaY < 0) { // Drag up
+                notification.style.transform = `translateY(${deltaY}px)`;
+            }
+        }
+    }
+
+    function handleDragEnd(e) {
+        if (!isDragging) return;
+
+        isDragging = false;
+        notification.classList.remove('dragging');
+
+        const deltaX = currentX - startX;
+        const deltaY = currentY - startY;
+
+        // Determine if the drag is more horizontal or vertical
+        if (Math.abs(deltaX) > Math.abs(deltaY)) {
+            // Horizontal drag
+            if (deltaX > 50 || velocityX > 0.5) { // Threshold or velocity
+                dismissNotification(notification, 'slideOut');
+            } else {
+                notification.style.transform = initialTransform;
+            }
+        } else {
+            // Vertical drag
+            if (deltaY < -50 || velocityY < -0.5) { // Threshold or velocity
+                dismissNotification(notification, 'slideUp');
+            } else {
+                notification.style.transform = initialTransform;
+            }
+        }
+    }
+
+    // Mouse events
+    notification.addEventListener('mousedown', handleDragStart);
+    document.addEventListener('mousemove', handleDragMove);
+    document.addEventListener('mouseup', handleDragEnd);
+
+    // Touch events
+    notification.addEventListener('touchstart', handleDragStart);
+    document.addEventListener('touchmove', handleDragMove, { passive: false });
+    document.addEventListener('touchend', handleDragEnd);
+
+    // Auto remove after duration (except for loading notifications)
+    if (type !== 'loading') {
+        setTimeout(() => {
+            dismissNotification(notification, 'slideOut');
+        }, duration);
+    }
+
+    return notification;
+}
+
+function dismissNotification(notification, animation = 'slideOut') {
+    notification.style.animation = `${animation} 0.3s ease-out forwards`;
+    setTimeout(() => notification.remove(), 300);
+}
+
+// Standardized Response Handler for all trading actions
+function handleTradingResponse(data, button, originalText, actionType, symbol = null) {
+    // Remove loading notification
+    if (window.currentLoadingNotification) {
+        dismissNotification(window.currentLoadingNotification);
+        window.currentLoadingNotification = null;
+    }
+
+    if (data.success) {
+        // Success response
+        const successMessages = {
+            'order': {
+                title: 'Order Placed Successfully! 🎉',
+                message: data.message || `${symbol} ${actionType} order has been executed`,
+                duration: 6000
+            },
+            'exit_all': {
+                title: 'All Positions Exited! ✅',
+                message: data.message || 'Successfully closed all open positions',
+                duration: 8000
+            },
+            'exit_position': {
+                title: 'Position Exited! ✅',
+                message: data.message || `Successfully exited ${symbol} position`,
+                duration: 6000
+            }
+        };
+
+        const config = successMessages[actionType];
+
+        // Show success notification
+        showNotification(
+            'success',
+            config.title,
+            config.message,
+            config.duration
+        );
+
+        // Restore original button text and immediately re-enable
+        button.innerHTML = originalText;
+        button.disabled = false;
+
+        // Handle post-success actions
+        if (actionType === 'order' || actionType === 'exit_position') {
+            // Refresh portfolio after a short delay
+            setTimeout(() => {
+                updatePortfolio();
+            }, 1000);
+        } else if (actionType === 'exit_all') {
+            // Refresh the page after a short delay
+            setTimeout(() => {
+                window.location.reload();
+            }, 3000);
+        }
+    } else {
+        // Error response - Check error code and show specific messages
+        let errorTitle, errorMessage, errorType = 'error';
+
+        // Get error code from response
+        const errorCode = data.error_code || 'UNKNOWN_ERROR';
+
+        // Define error messages based on error codes
+        const errorCodeMessages = {
+            'INSUFFICIENT_FUNDS': {
+                title: 'Insufficient Funds ❌',
+                message: 'Your account does not have sufficient funds to place this order',
+                type: 'warning',
+                suggestion: 'Please check your account balance and margin requirements'
+            },
+            'MARKET_CLOSED': {
+                title: 'Market Closed ❌',
+                message: 'Market is currently closed',
+                type: 'warning',
+                suggestion: 'Please try during market hours (9:15 AM - 3:30 PM IST)'
+            },
+            'INVALID_SYMBOL': {
+                title: 'Invalid Symbol ❌',
+                message: 'The trading symbol is invalid or not available',
+                type: 'error',
+                suggestion: 'The option contract may not be available or may have expired'
+            },
+            'TOKEN_EXPIRED': {
+                title: 'Session Expired ❌',
+                message: 'Your trading session has expired',
+                type: 'error',
+                suggestion: 'Please login again to continue trading'
+            },
+            'RATE_LIMIT': {
+                title: 'Rate Limit Exceeded ❌',
+                message: 'Too many requests. Please wait a moment',
+                type: 'warning',
+                suggestion: 'Please wait a few seconds before trying again'
+            },
+            'ORDER_REJECTED': {
+                title: 'Order Rejected ❌',
+                message: 'Order was rejected by the exchange',
+                type: 'error',
+                suggestion: 'Please check order parameters and try again'
+            },
+            'INSUFFICIENT_HOLDINGS': {
+                title: 'Insufficient Holdings ❌',
+                message: 'Insufficient holdings for this operation',
+                type: 'error',
+                suggestion: 'The position may have already been closed or modified'
+            },
+            'POSITION_CLOSED': {
+                title: 'Position Already Closed ❌',
+                message: 'Position is already closed',
+                type: 'warning',
+                suggestion: 'The position may have been closed by another order'
+            },
+            'ORDER_NOT_FOUND': {
+                title: 'Order Not Found ❌',
+                message: 'Order not found',
+                type: 'error',
+                suggestion: 'The order may have already been executed or cancelled'
+            },
+            'ORDER_STATUS_UNKNOWN': {
+                title: 'Order Status Unknown ⚠️',
+                message: 'The broker did not confirm whether the order was placed',
+                type: 'warning',
+                suggestion: 'Check the order book before placing it again'
+            },
+            'CIRCUIT_OPEN': {
+                title: 'Broker Unavailable ⚠️',
+                message: 'The broker is not responding, the order was not sent',
+                type: 'warning',
+                suggestion: 'Try again in a few seconds'
+            },
+            'UPSTREAM_TIMEOUT': {
+                title: 'Broker Timeout ⚠️',
+                message: 'The broker took too long to respond, the order was not sent',
+                type: 'warning',
+                suggestion: 'Try again in a few seconds'
+            },
+            'DUPLICATE_IN_PROGRESS': {
+                title: 'Order In Progress ⏳',
+                message: 'This order is still being placed',
+                type: 'warning',
+                suggestion: 'Wait for the current order to finish'
+            },
+            'KITE_API_ERROR': {
+                title: 'Trading Error ❌',
+                message: data.error || 'An error occurred while processing your request',
+                type: 'error',
+                suggestion: 'Please check your parameters and try again'
+            },
+            'UNKNOWN_ERROR': {
+                title: 'Unknown Error ❌',
+                message: data.error || 'An unexpected error occurred',
+                type: 'error',
+                suggestion: 'Please try again or contact support'
+            }
+        };
+
+        // Get error configuration based on error code
+        const errorConfig = errorCodeMessages[errorCode] || errorCodeMessages['UNKNOWN_ERROR'];
+
+        // Prepare detailed error information
+        let notificationDetails = null;
+
+        if (data.error_code || data.suggestion || data.details) {
+            notificationDetails = {};
+
+            if (data.error_code) {
+                notificationDetails['Error Code'] = data.error_code;
+            }
+
+            if (data.suggestion) {
+                notificationDetails['Suggestion'] = data.suggestion;
+            } else if (errorConfig.suggestion) {
+                notificationDetails['Suggestion'] = errorConfig.suggestion;
+            }
+
+            if (data.details) {
+                notificationDetails['Details'] = data.details;
+            }
+
+            // Add order info if available
+            if (data.order_info) {
+                notificationDetails['Order Info'] = JSON.stringify(data.order_info, null, 2);
+            }
+
+            // Add exit details if available (for exit_all)
+            if (data.exited_positions !== undefined && data.failed_positions !== undefined) {
+                notificationDetails['Exited Positions'] = data.exited_positions;
+                notificationDetails['Failed Positions'] = data.failed_positions;
+            }
+
+            // Add detailed results if available
+            if (data.details && Array.isArray(data.details)) {
+                const failedDetails = data.details.filter(d => d.status === 'failed');
+                if (failedDetails.length > 0) {
+                    notificationDetails['Failed Details'] = failedDetails.map(d => 
+                        `${d.symbol}: ${d.user_message || d.error_message}`
+                    ).join(', ');
+                }
+            }
+        }
+
+        // Show error notification with specific error type and message
+        showNotification(
+            errorConfig.type,
+            errorConfig.title,
+            errorConfig.message,
+            12000, // Longer duration for detailed errors
+            notificationDetails
+        );
+
+        // Restore original button text and immediately re-enable
+        button.innerHTML = originalText;
+        button.disabled = false;
+    }
+}
+
+// Standardized Error Handler for network errors
+function handleNetworkError(error, button, originalText, actionType) {
+    // Remove loading notification
+    if (window.currentLoadingNotification) {
+        dismissNotification(window.currentLoadingNotification);
+        window.currentLoadingNotification = null;
+    }
+
+    // Check if this is a network connectivity error or an API error
+    const isNetworkError = error.name === 'TypeError' && error.message.includes('fetch');
+    const isConnectionError = error.message.includes('Failed to fetch') || 
+                             error.message.includes('NetworkError') ||
+                             error.message.includes('ERR_NETWORK') ||
+                             error.message.includes('ERR_INTERNET_DISCONNECTED');
+
+    if (isNetworkError || isConnectionError) {
+        // This is a true network connectivity error
+        const errorMessages = {
+            'order': 'Failed to connect to the server. Please check your internet connection.',
+            'exit_all': 'Failed to connect to the server while exiting positions',
+            'exit_position': 'Failed to connect to the server'
+        };
+
+        showNotification(
+            'error',
+            'Network Error ❌',
+            errorMessages[actionType],
+            8000
+        );
+    } else if (error.name === 'APIError') {
+        // This is an API error with JSON response data
+        try {
+            const errorData = JSON.parse(error.message);
+
+            // Use the same error code handling as handleTradingResponse
+            const errorCode = errorData.error_code || 'UNKNOWN_ERROR';
+
+            // Define error messages based on error codes
+            const errorCodeMessages = {
+                'INSUFFICIENT_FUNDS': {
+                    title: 'Insufficient Funds ❌',
+                    message: 'Your account does not have sufficient funds to place this order',
+                    type: 'warning',
+                    suggestion: 'Please check your account balance and margin requirements'
+                },
+                'MARKET_CLOSED': {
+                    title: 'Market Closed ❌',
+                    message: 'Market is currently closed',
+                    type: 'warning',
+                    suggestion: 'Please try during market hours (9:15 AM - 3:30 PM IST)'
+                },
+                'INVALID_SYMBOL': {
+                    title: 'Invalid Symbol ❌',
+                    message: 'The trading symbol is invalid or not available',
+                    type: 'error',
+                    suggestion: 'The option contract may not be available or may have expired'
+                },
+                'TOKEN_EXPIRED': {
+                    title: 'Session Expired ❌',
+                    message: 'Your trading session has expired',
+                    type: 'error',
+                    suggestion: 'Please login again to continue trading'
+                },
+                'RATE_LIMIT': {
+                    title: 'Rate Limit Exceeded ❌',
+                    message: 'Too many requests. Please wait a moment',
+                    type: 'warning',
+                    suggestion: 'Please wait a few seconds before trying again'
+                },
+                'ORDER_REJECTED': {
+                    title: 'Order Rejected ❌',
+                    message: 'Order was rejected by the exchange',
+                    type: 'error',
+                    suggestion: 'Please check order parameters and try again'
+                },
+                'INSUFFICIENT_HOLDINGS': {
+                    title: 'Insufficient Holdings ❌',
+                    message: 'Insufficient holdings for this operation',
+                    type: 'error',
+                    suggestion: 'The position may have already been closed or modified'
+                },
+                'POSITION_CLOSED': {
+                    title: 'Position Already Closed ❌',
+                    message: 'Position is already closed',
+                    type: 'warning',
+                    suggestion: 'The position may have been closed by another order'
+                },
+                'ORDER_NOT_FOUND': {
+                    title: 'Order Not Found ❌',
+                    message: 'Order not found',
+                    type: 'error',
+                    suggestion: 'The order may have already been executed or cancelled'
+                },
+                'KITE_API_ERROR': {
+                    title: 'Trading Error ❌',
+                    message: errorData.error || 'An error occurred while processing your request',
+                    type: 'error',
+                    suggestion: 'Please check your parameters and try again'
+                },
+                'UNKNOWN_ERROR': {
+                    title: 'Unknown Error ❌',
+                    message: errorData.error || 'An unexpected error occurred',
+                    type: 'error',
+                    suggestion: 'Please try again or contact support'
+                }
+            };
+
+            const errorConfig = errorCodeMessages[errorCode] || errorCodeMessages['UNKNOWN_ERROR'];
+
+            // Prepare error details
+            let notificationDetails = null;
+            if (errorData.error || errorData.details || errorData.error_code || errorData.suggestion) {
+                notificationDetails = {};
+                if (errorData.error) notificationDetails['Error'] = errorData.error;
+                if (errorData.details) notificationDetails['Details'] = errorData.details;
+                if (errorData.error_code) notificationDetails['Error Code'] = errorData.error_code;
+                if (errorData.suggestion) notificationDetails['Suggestion'] = errorData.suggestion;
+            }
+
+            showNotification(
+                errorConfig.type,
+                errorConfig.title,
+                errorConfig.message,
+                12000,
+                notificationDetails
+            );
+
+        } catch (parseError) {
+            console.error('Failed to parse API error:', parseError);
+            // Fallback to generic error
+            showNotification(
+                'error',
+                'API Error ❌',
+                'An error occurred while processing your request',
+                10000,
+                { 'Error': error.message }
+            );
+        }
+    } else if (error.name === 'HTTPError') {
+        // This is an HTTP error without JSON data
+        const errorMessages = {
+            'order': 'Order placement failed',
+            'exit_all': 'Failed to exit positions',
+            'exit_position': 'Failed to exit position'
+        };
+
+        showNotification(
+            'error',
+            `${errorMessages[actionType]} ❌`,
+            error.message,
+            10000,
+            { 'Status': `${error.status} ${error.statusText}` }
+        );
+    } else {
+        // This might be an API error that was caught as a network error
+        // Try to extract error information from the error message
+        let errorDetails = null;
+        let errorCode = 'UNKNOWN_ERROR';
+        let userMessage = error.message;
+        let suggestion = 'Please try again or contact support';
+
+        // Check if the error message contains JSON-like data
+        if (error.message && (error.message.includes('{') || error.message.includes('error'))) {
+            try {
+                // Try to parse JSON from error message
+                const errorData = JSON.parse(error.message);
+
+                // Check if it contains error code
+                if (errorData.error_code) {
+                    errorCode = errorData.error_code;
+
+                    // Define error messages based on error codes (same as in handleTradingResponse)
+                    const errorCodeMessages = {
+                        'INSUFFICIENT_FUNDS': {
+                            title: 'Insufficient Funds ❌',
+                            message: 'Your account does not have sufficient funds to place this order',
+                            type: 'warning',
+                            suggestion: 'Please check your account balance and margin requirements'
+                        },
+                        'MARKET_CLOSED': {
+                            title: 'Market Closed ❌',
+                            message: 'Market is currently closed',
+                            type: 'warning',
+                            suggestion: 'Please try during market hours (9:15 AM - 3:30 PM IST)'
+                        },
+                        'INVALID_SYMBOL': {
+                            title: 'Invalid Symbol ❌',
+                            message: 'The trading symbol is invalid or not available',
+                            type: 'error',
+                            suggestion: 'The option contract may not be available or may have expired'
+                        },
+                        'TOKEN_EXPIRED': {
+                            title: 'Session Expired ❌',
+                            message: 'Your trading session has expired',
+                            type: 'error',
+                            suggestion: 'Please login again to continue trading'
+                        },
+                        'RATE_LIMIT': {
+                            title: 'Rate Limit Exceeded ❌',
+                            message: 'Too many requests. Please wait a moment',
+                            type: 'warning',
+                            suggestion: 'Please wait a few seconds before trying again'
+                        },
+                        'ORDER_REJECTED': {
+                            title: 'Order Rejected ❌',
+                            message: 'Order was rejected by the exchange',
+                            type: 'error',
+                            suggestion: 'Please check order parameters and try again'
+                        },
+                        'INSUFFICIENT_HOLDINGS': {
+                            title: 'Insufficient Holdings ❌',
+                            message: 'Insufficient holdings for this operation',
+                            type: 'error',
+                            suggestion: 'The position may have already been closed or modified'
+                        },
+                        'POSITION_CLOSED': {
+                            title: 'Position Already Closed ❌',
+                            message: 'Position is already closed',
+                            type: 'warning',
+                            suggestion: 'The position may have been closed by another order'
+                        },
+                        'ORDER_NOT_FOUND': {
+                            title: 'Order Not Found ❌',
+                            message: 'Order not found',
+                            type: 'error',
+                            suggestion: 'The order may have already been executed or cancelled'
+                        },
+                        'KITE_API_ERROR': {
+                            title: 'Trading Error ❌',
+                            message: errorData.error || 'An error occurred while processing your request',
+                            type: 'error',
+                            suggestion: 'Please check your parameters and try again'
+                        }
+                    };
+
+                    const errorConfig = errorCodeMessages[errorCode] || {
+                        title: 'Unknown Error ❌',
+                        message: errorData.error || 'An unexpected error occurred',
+                        type: 'error',
+                        suggestion: 'Please try again or contact support'
+                    };
+
+                    userMessage = errorConfig.message;
+                    suggestion = errorConfig.suggestion;
+                }
+
+                // Prepare error details
+                if (errorData.error || errorData.details) {
+                    errorDetails = {};
+                    if (errorData.error) errorDetails['Error'] = errorData.error;
+                    if (errorData.details) errorDetails['Details'] = errorData.details;
+                    if (errorData.error_code) errorDetails['Error Code'] = errorData.error_code;
+                    if (errorData.suggestion) errorDetails['Suggestion'] = errorData.suggestion;
+                }
+            } catch (e) {
+                // If parsing fails, use the raw error message
+                errorDetails = {
+                    'Error': error.message
+                };
+            }
+        } else {
+            // Use the error message as is
+            errorDetails = {
+                'Error': error.message
+            };
+        }
+
+        const errorMessages = {
+            'order': 'Order placement failed',
+            'exit_all': 'Failed to exit positions',
+            'exit_position': 'Failed to exit position'
+        };
+
+        showNotification(
+            'error',
+            `${errorMessages[actionType]} ❌`,
+            userMessage,
+            12000,
+            errorDetails
+        );
+    }
+
+    // Restore original button text and immediately re-enable
+    button.innerHTML = originalText;
+    button.disabled = false;
+}
+
+// Enhanced Order Placement Function
+// Idempotency keys of order attempts still waiting for a definite answer
+const pendingOrderKeys = {};
+
+// Whether actions fan out to the linked accounts (switch only shown when some are linked)
+function tradeLinkedAccounts() {
+    const toggle = document.getElementById('trade-linked');
+    return Boolean(toggle && toggle.checked);
+}
+
+// Orders of a paper session fill in the server's paper book, not at Kite
+function setPaperTrading(enabled) {
+    fetch('/paper_trading/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value
+        },
+        body: JSON.stringify({ enabled: enabled }),
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (!data.success) {
+            document.getElementById('paper-trading').checked = !enabled;
+            showNotification('error', 'Paper trading not switched', data.error, 5000, data.details);
+            return;
+        }
+        // Positions, orders and P&L all change book, so reload the page
+        window.location.reload();
+    })
+    .catch(error => {
+        console.error('Error switching paper trading:', error);
+        document.getElementById('paper-trading').checked = !enabled;
+        showNotification('error', 'Paper trading not switched', 'Could not reach the server');
+    });
+}
+
+function placeOrder(symbol, type) {
+    let quantity = 1;
+
+    if (symbol === 'NIFTY') {
+        quantity = document.getElementById('nifty-quantity').value;
+    } else if (symbol === 'BANKNIFTY') {
+        quantity = document.getElementById('banknifty-quantity').value;
+    }
+
+    // Track order placement
+    trackOrderPlacement(symbol, type, quantity);
+
+    // Show loading notification
+    window.currentLoadingNotification = showNotification(
+        'loading',
+        'Placing Order...',
+        `Processing ${symbol} ${type} order`,
+        0 // No auto-dismiss
+    );
+
+    // Disable the button during processing
+    const button = event.target;
+    const originalText = button.innerHTML;
+    button.disabled = true;
+    button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Processing...';
+
+    // Reuse the key of an attempt that never got an answer, so the
+    // server can tell a retry from a new order
+    const orderKey = `${symbol}:${type}:${quantity}:${tradeLinkedAccounts()}`;
+    if (!pendingOrderKeys[orderKey]) {
+        pendingOrderKeys[orderKey] = (window.crypto && crypto.randomUUID)
+            ? crypto.randomUUID()
+            : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+    }
+
+    // Send order to server
+    fetch('/place_order/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value
+        },
+        body: JSON.stringify({
+            index: symbol,
+            direction: type,
+            quantity: quantity,
+            client_order_id: pendingOrderKeys[orderKey],
+            linked: tradeLinkedAccounts()
+        }),
+    })
+    .then(response => {
+        // Any definite answer ends this attempt, except an unknown outcome
+        response.clone().json().then(body => {
+            if (body.error_code !== 'ORDER_STATUS_UNKNOWN') {
+                delete pendingOrderKeys[orderKey];
+            }
+        }).catch(() => {});
+        if (!response.ok) {
+            // Try to get the error response as JSON
+            return response.json().then(errorData => {
+                // Create a custom error with the JSON data
+                const customError = new Error();
+                customError.name = 'APIError';
+                customError.message = JSON.stringify(errorData);
+                customError.status = response.status;
+                customError.statusText = response.statusText;
+                throw customError;
+            }).catch(parseError => {
+                // If JSON parsing fails, create error with status info
+                const customError = new Error();
+                customError.name = 'HTTPError';
+                customError.message = `HTTP ${response.status}: ${response.statusText}`;
+                customError.status = response.status;
+                customError.statusText = response.statusText;
+                throw customError;
+            });
+        }
+        return response.json();
+    })
+    .then(data => {
+        handleTradingResponse(data, button, originalText, 'order', symbol);
+    })
+    .catch(error => {
+        console.error('Error placing order:', error);
+        handleNetworkError(error, button, originalText, 'order');
+    });
+}
+
+// Function to switch tabs
+function switchTab(tabName) {
+    // Hide all tab panes
+    document.querySelectorAll('.tab-pane').forEach(pane => {
+        pane.classList.remove('active');
+    });
+
+    // Show selected tab pane
+    document.getElementById(tabName + '-tab').classList.add('active');
+
+    // Update button states
+    document.querySelectorAll('.btn-group .btn').forEach(btn => {
+        btn.classList.remove('active');
+    });
+    event.target.classList.add('active');
+}
+
+// Enhanced Exit All Trades Function
+function exitAllTrades() {
+    // Show confirmation dialog
+    if (!confirm('Are you sure you want to exit ALL positions? This action cannot be undone.')) {
+        return;
+    }
+
+    // Track exit all positions
+    trackExitAllPositions();
+
+    // Show loading notification
+    window.currentLoadingNotification = showNotification(
+        'loading',
+        'Exiting All Positions...',
+        'Processing exit orders for all open positions',
+        0 // No auto-dismiss
+    );
+
+    // Disable the exit button during processing
+    const exitButton = document.querySelector('.exit-all-btn');
+    const originalText = exitButton.innerHTML;
+    exitButton.disabled = true;
+    exitButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Exiting...';
+
+    fetch('/exit_all/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value
+        },
+        body: JSON.stringify({
+            linked: tradeLinkedAccounts()
+        }),
+    })
+    .then(response => {
+        if (!response.ok) {
+            // Try to get the error response as JSON
+            return response.json().then(errorData => {
+                // Create a custom error with the JSON data
+                const customError = new Error();
+                customError.name = 'APIError';
+                customError.message = JSON.stringify(errorData);
+                customError.status = response.status;
+                customError.statusText = response.statusText;
+                throw customError;
+            }).catch(parseError => {
+                // If JSON parsing fails, create error with status info
+                const customError = new Error();
+                customError.name = 'HTTPError';
+                customError.message = `HTTP ${response.status}: ${response.statusText}`;
+                customError.status = response.status;
+                customError.statusText = response.statusText;
+                throw customError;
+            });
+        }
+        return response.json();
+    })
+    .then(data => {
+        handleTradingResponse(data, exitButton, originalText, 'exit_all');
+    })
+    .catch(error => {
+        console.error('Error exiting positions:', error);
+        handleNetworkError(error, exitButton, originalText, 'exit_all');
+    });
+}
+
+// Enhanced Function to exit position
+function exitPosition(symbol) {
+    if (!confirm(`Are you sure you want to exit position for ${symbol}?`)) {
+        return;
+    }
+
+    // Track position exit
+    trackPositionExit(symbol);
+
+    // Show loading notification
+    window.currentLoadingNotification = showNotification(
+        'loading',
+        'Exiting Position...',
+        `Processing exit order for ${symbol}`,
+        0 // No auto-dismiss
+    );
+
+    // Disable the exit button during processing
+    const button = event.target;
+    const originalText = button.innerHTML;
+    button.disabled = true;
+    button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Exiting...';
+
+    // Send exit request to server
+    fetch('/exit_position/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value
+        },
+        body: JSON.stringify({
+            symbol: symbol,
+            linked: tradeLinkedAccounts()
+        }),
+    })
+    .then(response => {
+        if (!response.ok) {
+            // Try to get the error response as JSON
+            return response.json().then(errorData => {
+                // Create a custom error with the JSON data
+                const customError = new Error();
+                customError.name = 'APIError';
+                customError.message = JSON.stringify(errorData);
+                customError.status = response.status;
+                customError.statusText = response.statusText;
+                throw customError;
+            }).catch(parseError => {
+                // If JSON parsing fails, create error with status info
+                const customError = new Error();
+                customError.name = 'HTTPError';
+                customError.message = `HTTP ${response.status}: ${response.statusText}`;
+                customError.status = response.status;
+                customError.statusText = response.statusText;
+                throw customError;
+            });
+        }
+        return response.json();
+    })
+    .then(data => {
+        handleTradingResponse(data, button, originalText, 'exit_position', symbol);
+    })
+    .catch(error => {
+        console.error('Error exiting position:', error);
+        handleNetworkError(error, button, originalText, 'exit_position');
+    });
+}
+
+// Arm server-side stop-loss / target / trailing levels on a position (all blank disarms it)
+function modifySL(symbol) {
+    const stopLoss = prompt(`Stop-loss price for ${symbol} (blank for none)`, '');
+    if (stopLoss === null) return;
+    const target = prompt(`Target price for ${symbol} (blank for none)`, '');
+    if (target === null) return;
+    const trail = prompt(`Trailing stop distance for ${symbol} (blank for none)`, '');
+    if (trail === null) return;
+
+    const disarm = !stopLoss.trim() && !target.trim() && !trail.trim();
+    fetch(disarm ? '/sl_monitor/cancel/' : '/sl_monitor/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value
+        },
+        body: JSON.stringify({
+            symbol: symbol,
+            stop_loss: stopLoss.trim() || null,
+            target: target.trim() || null,
+            trail: trail.trim() || null
+        }),
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (!data.success) {
+            showNotification('error', 'Stop-loss not set', data.error, 5000, data.details);
+        } else if (disarm) {
+            showNotification('info', 'Stop-loss removed',
+                data.cancelled ? `Levels on ${symbol} disarmed` : `No levels were armed on ${symbol}`);
+        } else {
+            const levels = Object.entries(data.protection.levels)
+                .map(([kind, level]) => `${kind.replace('_', ' ')} ₹${level}`)
+                .join(', ');
+            showNotification('success', 'Stop-loss armed', `${symbol}: ${levels}`);
+        }
+    })
+    .catch(error => {
+        console.error('Error setting stop-loss:', error);
+        showNotification('error', 'Stop-loss not set', 'Could not reach the server');
+    });
+}
+
+// User Profile Tooltip
+document.addEventListener('DOMContentLoaded', function() {
+    const userProfileTrigger = document.getElementById('userProfileTrigger');
+    const userProfileTooltip = document.getElementById('userProfileTooltip');
+    let tooltipTimeout;
+
+    if (userProfileTrigger && userProfileTooltip) {
+        function showTooltip() {
+            clearTimeout(tooltipTimeout);
+            userProfileTooltip.classList.add('show');
+        }
+
+        function hideTooltip() {
+            tooltipTimeout = setTimeout(() => {
+                userProfileTooltip.classList.remove('show');
+            }, 200);
+        }
+
+        userProfileTrigger.addEventListener('mouseenter', showTooltip);
+        userProfileTrigger.addEventListener('mouseleave', hideTooltip);
+        userProfileTooltip.addEventListener('mouseenter', () => clearTimeout(tooltipTimeout));
+        userProfileTooltip.addEventListener('mouseleave', hideTooltip);
+
+        // Close tooltip when clicking outside
+        document.addEventListener('click', (e) => {
+            if (!userProfileTrigger.contains(e.target) && !userProfileTooltip.contains(e.target)) {
+                userProfileTooltip.classList.remove('show');
+            }
+        });
+    }
+});
+
+// Function to update portfolio data
+function updatePortfolio() {
+    // Fetch only the portfolio tables, not the whole page
+    fetch('/dashboard/?partial=portfolio')
+        .then(response => response.text())
+        .then(html => {
+            const parser = new DOMParser();
+            const doc = parser.parseFromString(html, 'text/html');
+
+            // Update positions table
+            const newPositionsTable = doc.getElementById('positions-table');
+            if (newPositionsTable) {
+                document.getElementById('positions-table').innerHTML = newPositionsTable.innerHTML;
+            }
+
+            // Update orders table
+            const newOrdersTable = doc.getElementById('orders-table');
+            if (newOrdersTable) {
+                document.getElementById('orders-table').innerHTML = newOrdersTable.innerHTML;
+            }
+
+            // Update history table
+            const newHistoryTable = doc.getElementById('history-table');
+            if (newHistoryTable) {
+                document.getElementById('history-table').innerHTML = newHistoryTable.innerHTML;
+            }
+
+            // Show or hide the cached data notice
+            const newStaleNotice = doc.getElementById('portfolio-stale');
+            if (newStaleNotice) {
+                document.getElementById('portfolio-stale').className = newStaleNotice.className;
+            }
+
+            // Follow the market session and the poll intervals it calls for
+            const newMarketSession = doc.getElementById('market-session');
+            const marketSession = document.getElementById('market-session');
+            if (newMarketSession && marketSession) {
+                marketSession.replaceWith(newMarketSession);
+            }
+        })
+        .catch(error => console.error('Error updating portfolio:', error))
+        .finally(() => {
+            // Manual refreshes (after an order) restart the schedule instead of adding one
+            if (updateInterval) {
+                clearTimeout(updateInterval);
+                updateInterval = setTimeout(updatePortfolio, pollInterval('portfolioInterval', 30));
+            }
+        });
+}
+
+// Function to update live P&L from the server side MTM engine
+function updateMTM() {
+    fetch('/portfolio/mtm/')
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) return;
+
+            const formatINR = value => '₹' + Number(value).toFixed(2);
+
+            Object.entries(data.positions).forEach(([symbol, leg]) => {
+                const ltpCell = document.querySelector(`[data-mtm-ltp="${symbol}"]`);
+                if (ltpCell) {
+                    ltpCell.textContent = formatINR(leg.last_price);
+                }
+                const pnlCell = document.querySelector(`[data-mtm-pnl="${symbol}"]`);
+                if (pnlCell) {
+                    pnlCell.textContent = formatINR(leg.pnl);
+                    pnlCell.classList.toggle('text-success', leg.pnl > 0);
+                    pnlCell.classList.toggle('text-danger', leg.pnl <= 0);
+                }
+            });
+
+            const total = document.getElementById('mtm-total');
+            if (total) {
+                total.textContent = 'P&L ' + formatINR(data.total_pnl);
+                total.classList.toggle('bg-success', data.total_pnl > 0);
+                total.classList.toggle('bg-danger', data.total_pnl < 0);
+                total.classList.toggle('bg-secondary', data.total_pnl === 0);
+            }
+        })
+        .catch(error => console.error('Error updating P&L:', error));
+}
+
+// Function to update the risk panel: is the book long or short delta, and what can it lose
+function updateRisk() {
+    fetch('/portfolio/risk/')
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) return;
+
+            const panel = document.getElementById('risk-panel');
+            const container = document.getElementById('risk-underlyings');
+            if (!panel || !container) return;
+
+            const formatINR = value => '₹' + Number(value).toLocaleString('en-IN', {maximumFractionDigits: 0});
+            const open = Object.entries(data.underlyings).filter(([, risk]) => risk.open);
+            panel.classList.toggle('d-none', open.length === 0);
+            container.replaceChildren(...open.map(([index, risk]) => {
+                const block = document.createElement('div');
+                const biasClass = {LONG: 'bg-success', SHORT: 'bg-danger'}[risk.bias] || 'bg-secondary';
+                const delta = risk.delta_lots === null ? 'Δ n/a' : `Δ ${risk.delta_lots} lots`;
+                const maxLoss = risk.unlimited_loss ? 'Unlimited' : formatINR(-risk.max_loss);
+                const breakevens = risk.breakevens.length ? risk.breakevens.join(' / ') : '-';
+
+                const title = document.createElement('div');
+                title.className = 'fw-bold';
+                title.textContent = `${index} `;
+                const badge = document.createElement('span');
+                badge.className = `badge ${biasClass}`;
+                badge.textContent = `${risk.bias} ${delta}`;
+                title.appendChild(badge);
+
+                const details = document.createElement('small');
+                details.className = 'text-muted';
+                details.textContent = `Net ${risk.net_lots} lots · Premium at risk ${formatINR(risk.premium_at_risk)}`
+                    + ` · Max loss ${maxLoss} · BE ${breakevens}`;
+
+                block.append(title, details);
+                return block;
+            }));
+        })
+        .catch(error => console.error('Error updating risk:', error));
+}
+
+// Variable to store the update interval
+let updateInterval;
+let mtmInterval;
+
+// Poll interval in milliseconds hinted by the server for the current market session
+function pollInterval(name, fallbackSeconds) {
+    const marketSession = document.getElementById('market-session');
+    const seconds = marketSession ? Number(marketSession.dataset[name]) : NaN;
+    return (seconds > 0 ? seconds : fallbackSeconds) * 1000;
+}
+
+// Live P&L and risk, rescheduled after each round
+function updateLive() {
+    updateMTM();
+    updateRisk();
+    if (mtmInterval) {
+        mtmInterval = setTimeout(updateLive, pollInterval('liveInterval', 2));
+    }
+}
+
+// Function to start periodic updates
+function startUpdates() {
+    // Clear any existing timers
+    stopUpdates();
+
+    // Initial update, each poll schedules the next one at the interval the
+    // market session calls for (every 30 seconds while the market is open,
+    // once the next session starts when it is closed)
+    updateInterval = true;
+    updatePortfolio();
+
+    // Live P&L is repriced from cached LTPs, so it can refresh much faster
+    mtmInterval = true;
+    updateLive();
+}
+
+// Function to stop updates
+function stopUpdates() {
+    if (updateInterval) {
+        clearTimeout(updateInterval);
+        updateInterval = null;
+    }
+    if (mtmInterval) {
+        clearTimeout(mtmInterval);
+        mtmInterval = null;
+    }
+}
+
+// Start updates when page loads
+document.addEventListener('DOMContentLoaded', function() {
+    startUpdates();
+
+    // Stop updates when page is hidden
+    document.addEventListener('visibilitychange', function() {
+        if (document.hidden) {
+            stopUpdates();
+        } else {
+            startUpdates();
+        }
+    });
+});
+
+// Track page views
+gtag('event', 'page_view', {
+    page_title: 'Dashboard',
+    page_location: window.location.href
+});
+
+// Track order placement
+function trackOrderPlacement(index, direction, quantity) {
+    gtag('event', 'place_order', {
+        event_category: 'Trading',
+        event_label: `${index} ${direction}`,
+        value: quantity,
+        custom_parameter_1: index,
+        custom_parameter_2: direction,
+        custom_parameter_3: quantity
+    });
+}
+
+// Track position exit
+function trackPositionExit(symbol) {
+    gtag('event', 'exit_position', {
+        event_category: 'Trading',
+        event_label: symbol,
+        custom_parameter_1: symbol
+    });
+}
+
+// Track exit all positions
+function trackExitAllPositions() {
+    gtag('event', 'exit_all_positions', {
+        event_category: 'Trading',
+        event_label: 'Exit All'
+    });
+}
+
+// Track login events
+function trackLogin(provider) {
+    gtag('event', 'login', {
+        event_category: 'Authentication',
+        event_label: provider,
+        custom_parameter_1: provider
+    });
+}
+
+// Track logout events
+function trackLogout() {
+    gtag('event', 'logout', {
+        event_category: 'Authentication',
+        event_label: 'Logout'
+    });
+}
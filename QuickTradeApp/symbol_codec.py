@@ -0,0 +1,197 @@
+"""
+Option tradingsymbol codec for QuickTradeApp
+Encodes and decodes Kite index option symbols in both formats:
+
+    Monthly: <INDEX><YY><MMM><STRIKE><CE|PE>      e.g. NIFTY24JAN19500CE
+    Weekly:  <INDEX><YY><M><DD><STRIKE><CE|PE>    e.g. NIFTY2411519500CE
+
+NFO (NIFTY, BANKNIFTY) and BFO (SENSEX, BANKEX) contracts share the grammar.
+The monthly contract of a month is the expiry on the index's last expiry
+weekday of that month (instruments.INDEX_SPECS), moved to the trading day
+before when that day is an exchange holiday; it always takes the monthly form.
+"""
+import calendar
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import NamedTuple, Union
+
+from .instruments import expiry_weekday, get_index_spec
+from .market_clock import market_clock
+
+MONTH_NAMES = ('JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC')
+
+# Weekly month codes: 1-9, O, N, D
+MONTH_CODES = ('1', '2', '3', '4', '5', '6', '7', '8', '9', 'O', 'N', 'D')
+_MONTH_FROM_CODE = {code: month for month, code in enumerate(MONTH_CODES, start=1)}
+_MONTH_FROM_NAME = {name: month for month, name in enumerate(MONTH_NAMES, start=1)}
+
+_SYMBOL_RE = re.compile(
+    r'^(?P<index>[A-Z]+?)(?P<yy>\d{2})'
+    r'(?:(?P<mon>' + '|'.join(MONTH_NAMES) + r')|(?P<m>[1-9OND])(?P<dd>\d{2}))'
+    r'(?P<strike>\d+)(?P<type>CE|PE)$'
+)
+
+
+class OptionSymbol(NamedTuple):
+    """Decoded index option contract"""
+    index: str
+    expiry: date
+    strike: int
+    option_type: str
+    monthly: bool
+    exchange: str
+
+
+@lru_cache(maxsize=512)
+def monthly_expiry(index: str, year: int, month: int) -> date:
+    """
+    Expiry day of an index's monthly contract
+
+    Args:
+        index: Index name
+        year: Contract year
+        month: Contract month (1-12)
+
+    Returns:
+        date: Last expiry weekday of the month, or the trading day before it if that is a holiday
+    """
+    weekday = expiry_weekday(index, date(year, month, 1))
+    last_day = date(year, month, calendar.monthrange(year, month)[1])
+    expiry = last_day - timedelta(days=(last_day.weekday() - weekday) % 7)
+    while expiry.weekday() >= 5 or expiry in market_clock.holidays:
+        expiry -= timedelta(days=1)
+    return expiry
+
+
+def is_monthly_expiry(index: str, expiry: date) -> bool:
+    """True if the expiry is the monthly contract of its month"""
+    return expiry == monthly_expiry(index.upper(), expiry.year, expiry.month)
+
+
+def next_expiry(index: str, day: date, monthly: bool = False) -> date:
+    """
+    First expiry of an index on or after a day
+
+    Args:
+        index: Index name
+        day: Day to look from
+        monthly: Only consider monthly contracts
+
+    Returns:
+        date: Expiry day, the trading day before the expiry weekday when that is a holiday
+    """
+    index = index.upper()
+    if monthly:
+        expiry = monthly_expiry(index, day.year, day.month)
+        if expiry < day:
+            year, month = (day.year + 1, 1) if day.month == 12 else (day.year, day.month + 1)
+            expiry = monthly_expiry(index, year, month)
+        return expiry
+
+    # Day by day, the expiry weekday can change within the week looked at
+    scheduled = day
+    while True:
+        if scheduled.weekday() == expiry_weekday(index, scheduled):
+            expiry = scheduled
+            while expiry.weekday() >= 5 or expiry in market_clock.holidays:
+                expiry -= timedelta(days=1)
+            if expiry >= day:
+                return expiry
+        scheduled += timedelta(days=1)
+
+
+@lru_cache(maxsize=256)
+def expiry_prefix(index: str, expiry: Union[str, date], expiry_type: str = "WEEKLY") -> str:
+    """
+    Symbol prefix shared by every strike of an expiry, memoized per expiry
+
+    Args:
+        index: Index name
+        expiry: Expiry date or YYYY-MM-DD string as stored in the session
+        expiry_type: 'WEEKLY' or 'MONTHLY'; the monthly expiry of a month
+            takes the monthly form either way
+
+    Returns:
+        str: e.g. 'NIFTY24115' (weekly) or 'NIFTY24JAN' (monthly)
+    """
+    index = index.upper()
+    get_index_spec(index)
+    if isinstance(expiry, str):
+        expiry = datetime.strptime(expiry, "%Y-%m-%d").date()
+
+    year = f"{expiry.year % 100:02d}"
+    if expiry_type == "MONTHLY" or is_monthly_expiry(index, expiry):
+        return f"{index}{year}{MONTH_NAMES[expiry.month - 1]}"
+    return f"{index}{year}{MONTH_CODES[expiry.month - 1]}{expiry.day:02d}"
+
+
+def encode(index: str, expiry: Union[str, date], strike: int, option_type: str, expiry_type: str = "WEEKLY") -> str:
+    """
+    Build a tradingsymbol
+
+    Args:
+        index: Index name
+        expiry: Expiry date or YYYY-MM-DD string
+        strike: Strike price
+        option_type: 'CE' or 'PE'
+        expiry_type: 'WEEKLY' or 'MONTHLY'
+
+    Returns:
+        str: Kite tradingsymbol
+    """
+    if option_type not in ('CE', 'PE'):
+        raise ValueError(f"Invalid option type: {option_type}")
+    return f"{expiry_prefix(index, expiry, expiry_type)}{int(strike)}{option_type}"
+
+
+@lru_cache(maxsize=4096)
+def decode(tradingsymbol: str) -> OptionSymbol:
+    """
+    Parse a tradingsymbol back into its contract fields
+
+    Monthly symbols carry no day, their expiry is the monthly expiry of the index (see monthly_expiry).
+
+    Args:
+        tradingsymbol: Kite tradingsymbol
+
+    Returns:
+        OptionSymbol: Decoded contract
+
+    Raises:
+        ValueError: If the symbol is not an index option of a supported index
+    """
+    match = _SYMBOL_RE.match(tradingsymbol)
+    if not match:
+        raise ValueError(f"Not an index option symbol: {tradingsymbol}")
+
+    index = match.group('index')
+    spec = get_index_spec(index)
+    year = 2000 + int(match.group('yy'))
+
+    if match.group('mon'):
+        expiry = monthly_expiry(index, year, _MONTH_FROM_NAME[match.group('mon')])
+        monthly = True
+    else:
+        try:
+            expiry = date(year, _MONTH_FROM_CODE[match.group('m')], int(match.group('dd')))
+        except ValueError:
+            raise ValueError(f"Invalid expiry in symbol: {tradingsymbol}")
+        monthly = False
+
+    return OptionSymbol(
+        index=index,
+        expiry=expiry,
+        strike=int(match.group('strike')),
+        option_type=match.group('type'),
+        monthly=monthly,
+        exchange=spec['exchange'],
+    )
+
+
+def try_decode(tradingsymbol: str):
+    """Decode a symbol, returning None for anything that is not an index option"""
+    try:
+        return decode(tradingsymbol)
+    except ValueError:
+        return None
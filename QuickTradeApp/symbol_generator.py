@@ -1,13 +1,8 @@
-from datetime import datetime, timedelta, date
-import pytz
+from .instruments import get_index_spec
+from .symbol_codec import MONTH_CODES, encode
 
 def get_strike_price(ltp: float, index: str) -> int:
-    if index.upper() == 'NIFTY':
-        strike_interval = 50
-    elif index.upper() == 'BANKNIFTY':
-        strike_interval = 100
-    else:
-        raise ValueError(f"Invalid index: {index}")
+    strike_interval = get_index_spec(index)['strike_interval']
 
     strike = round(ltp / strike_interval) * strike_interval
     return int(strike)
@@ -18,16 +13,33 @@ def generate_trading_symbol(request, index: str, direction: str, ltp: float) ->
     
     Args:
         request: Django request object
-        index: Index name ('NIFTY' or 'BANKNIFTY')
+        index: Index name ('NIFTY', 'BANKNIFTY', 'SENSEX' or 'BANKEX')
         direction: 'CE' or 'PE'
         ltp: Last traded price
         
     Returns:
         str: Trading symbol in Fyers format
     """
-    if index.upper() not in ['NIFTY', 'BANKNIFTY']:
-        raise ValueError(f"Invalid index: {index}")
+    get_index_spec(index)
+    
+    # Get strike price
+    strike = get_strike_price(ltp, index)
+    
+    return generate_strike_symbol(request, index, direction, strike)
+
+def generate_strike_symbol(request, index: str, direction: str, strike: int) -> str:
+    """
+    Generate the trading symbol of a given strike in the session's expiry
+    
+    Args:
+        request: Django request object
+        index: Index name ('NIFTY', 'BANKNIFTY', 'SENSEX' or 'BANKEX')
+        direction: 'CE' or 'PE'
+        strike: Strike price
         
+    Returns:
+        str: Trading symbol in Fyers format
+    """
     # Get expiry date and type from session
     expiry_key = f"{index.lower()}_expiry_date"
     type_key = f"{index.lower()}_expiry_type"
@@ -37,27 +49,10 @@ def generate_trading_symbol(request, index: str, direction: str, ltp: float) ->
     
     if not expiry_str:
         raise ValueError(f"No expiry date found for {index}")
-        
-    expiry_date = datetime.strptime(expiry_str, "%Y-%m-%d").date()
-    
-    # Get strike price
-    strike = get_strike_price(ltp, index)
-    
-    # Get year in YY format
-    year = str(expiry_date.year)[-2:]
-    
-    # Generate symbol based on expiry type
-    if expiry_type == "MONTHLY":
-        # Monthly format: <INDEX><YY><MMM><STRIKE><CE|PE>
-        month = expiry_date.strftime("%b").upper()  # Gets first 3 letters of month
-        symbol = f"{index}{year}{month}{strike}{direction}"
-    else:
-        # Weekly format: <INDEX><YY><M><DD><STRIKE><CE|PE>
-        month_code = get_month_code(expiry_date.month)
-        day = expiry_date.strftime("%d")
-        symbol = f"{index}{year}{month_code}{day}{strike}{direction}"
     
-    return symbol
+    # The expiry prefix is memoized on the session string, so repeat orders
+    # skip date parsing and prefix formatting entirely
+    return encode(index, expiry_str, strike, direction, expiry_type)
 
 def get_month_code(month: int) -> str:
     """
@@ -69,13 +64,7 @@ def get_month_code(month: int) -> str:
     Returns:
         str: Month code (1-9, O, N, D)
     """
-    if 1 <= month <= 9:
-        return str(month)
-    elif month == 10:
-        return 'O'
-    elif month == 11:
-        return 'N'
-    elif month == 12:
-        return 'D'
+    if 1 <= month <= 12:
+        return MONTH_CODES[month - 1]
     else:
         raise ValueError(f"Invalid month number: {month}")
\ No newline at end of file
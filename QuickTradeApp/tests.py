@@ -0,0 +1,363 @@
+"""
+Tests for QuickTradeApp
+
+Run with: python manage.py test QuickTradeApp
+"""
+import json
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from importlib import import_module
+from pathlib import Path
+from unittest import mock
+
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from . import circuit_breaker, views
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, UpstreamTimeout
+from .instruments import INDEX_SPECS
+from .order_history import ORDERS, TRADES, order_history
+from .order_state import compute_postback_checksum, order_state, register_postback_account
+from .sl_monitor import StopLossMonitor
+from .symbol_codec import decode, encode, is_monthly_expiry, monthly_expiry, next_expiry
+
+# Listed monthly contracts and the day each expired (or expires)
+MONTHLY_CONTRACTS = (
+    ('NIFTY24DEC24000CE', date(2024, 12, 26)),      # last Thursday
+    ('NIFTY25SEP24800CE', date(2025, 9, 30)),       # last Tuesday since September 2025
+    ('NIFTY25OCT25000PE', date(2025, 10, 28)),
+    ('NIFTY26OCT24000CE', date(2026, 10, 27)),
+    ('NIFTY26MAR23000PE', date(2026, 3, 30)),       # Tuesday 31 March is a holiday
+    ('BANKNIFTY24APR48000CE', date(2024, 4, 24)),   # last Wednesday in 2024
+    ('BANKNIFTY25JUN56000CE', date(2025, 6, 26)),
+    ('BANKNIFTY25DEC59000PE', date(2025, 12, 30)),
+    ('SENSEX25JUN82000CE', date(2025, 6, 24)),      # last Tuesday until August 2025
+    ('SENSEX25OCT82000CE', date(2025, 10, 30)),     # last Thursday since September 2025
+    ('BANKEX25NOV65000PE', date(2025, 11, 27)),
+)
+
+# Listed weekly contracts
+WEEKLY_CONTRACTS = (
+    ('NIFTY25D0926000CE', date(2025, 12, 9)),
+    ('NIFTY26O1324000PE', date(2026, 10, 13)),
+    ('SENSEX25N0682000CE', date(2025, 11, 6)),
+)
+
+
+class SymbolCodecTests(TestCase):
+    def test_monthly_symbols_decode_to_their_expiry_day(self):
+        for symbol, expiry in MONTHLY_CONTRACTS:
+            with self.subTest(symbol=symbol):
+                contract = decode(symbol)
+                self.assertEqual(contract.expiry, expiry)
+                self.assertTrue(contract.monthly)
+
+    def test_weekly_symbols_decode_to_their_expiry_day(self):
+        for symbol, expiry in WEEKLY_CONTRACTS:
+            with self.subTest(symbol=symbol):
+                contract = decode(symbol)
+                self.assertEqual(contract.expiry, expiry)
+                self.assertFalse(contract.monthly)
+
+    def test_listed_symbols_encode_back_unchanged(self):
+        for symbol, expiry in MONTHLY_CONTRACTS + WEEKLY_CONTRACTS:
+            with self.subTest(symbol=symbol):
+                contract = decode(symbol)
+                self.assertEqual(encode(contract.index, expiry, contract.strike, contract.option_type), symbol)
+
+    def test_random_contracts_round_trip(self):
+        # decode(encode(x)) == x and encode(decode(s)) == s, both sides share the monthly rule
+        rng = random.Random(0)
+        for _ in range(5000):
+            index = rng.choice(list(INDEX_SPECS))
+            expiry_type = rng.choice(('WEEKLY', 'MONTHLY'))
+            expiry = date(2020, 1, 1) + timedelta(days=rng.randrange(0, 365 * 30))
+            if expiry_type == 'MONTHLY':
+                expiry = monthly_expiry(index, expiry.year, expiry.month)
+            elif is_monthly_expiry(index, expiry):
+                # That day's contract is the monthly one
+                expiry_type = 'MONTHLY'
+            strike = rng.randrange(1, 2000) * INDEX_SPECS[index]['strike_interval']
+            option_type = rng.choice(('CE', 'PE'))
+            symbol = encode(index, expiry, strike, option_type, expiry_type)
+            with self.subTest(symbol=symbol):
+                contract = decode(symbol)
+                self.assertEqual((contract.index, contract.expiry, contract.strike, contract.option_type, contract.monthly),
+                                 (index, expiry, strike, option_type, expiry_type == 'MONTHLY'))
+                self.assertEqual(encode(contract.index, contract.expiry, contract.strike, contract.option_type,
+                                        'MONTHLY' if contract.monthly else 'WEEKLY'), symbol)
+
+    def test_monthly_expiry_day_takes_the_monthly_form(self):
+        # The session stores the nearest expiry as WEEKLY unless it was detected as monthly
+        self.assertEqual(encode('NIFTY', date(2026, 10, 27), 24000, 'CE', 'WEEKLY'), 'NIFTY26OCT24000CE')
+        self.assertEqual(encode('NIFTY', '2026-10-27', 24000, 'CE', 'MONTHLY'), 'NIFTY26OCT24000CE')
+
+    def test_monthly_expiry_per_index(self):
+        self.assertEqual(monthly_expiry('NIFTY', 2026, 10), date(2026, 10, 27))
+        self.assertEqual(monthly_expiry('SENSEX', 2026, 10), date(2026, 10, 29))
+        self.assertTrue(is_monthly_expiry('NIFTY', date(2026, 10, 27)))
+        self.assertFalse(is_monthly_expiry('NIFTY', date(2026, 10, 29)))
+        self.assertTrue(is_monthly_expiry('sensex', date(2026, 10, 29)))
+
+    def test_next_expiry_from_a_day(self):
+        self.assertEqual(next_expiry('NIFTY', date(2026, 10, 14)), date(2026, 10, 19))  # Tuesday 20 October is a holiday
+        self.assertEqual(next_expiry('NIFTY', date(2026, 10, 19)), date(2026, 10, 19))
+        self.assertEqual(next_expiry('NIFTY', date(2026, 10, 20)), date(2026, 10, 27))
+        self.assertEqual(next_expiry('NIFTY', date(2026, 3, 31)), date(2026, 4, 7))
+        self.assertEqual(next_expiry('NIFTY', date(2025, 8, 29)), date(2025, 9, 2))     # weekday moved to Tuesday
+        self.assertEqual(next_expiry('SENSEX', date(2026, 10, 19)), date(2026, 10, 22))
+        self.assertEqual(next_expiry('BANKNIFTY', date(2026, 10, 28), monthly=True), date(2026, 11, 23))
+
+
+def _network_down():
+    raise requests.ConnectionError("connection refused")
+
+
+class CircuitBreakerTests(TestCase):
+    """Same scenarios as the fault_drill command, against a breaker of its own"""
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('test', {'quotes': 0.05})
+
+    def _open(self):
+        for _ in range(circuit_breaker.MIN_CALLS):
+            with self.assertRaises(requests.ConnectionError):
+                self.breaker.call('profile', _network_down)
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+
+    def _cool_off(self):
+        self.breaker._opened_at -= circuit_breaker.OPEN_DURATION
+        self.assertEqual(self.breaker.state, circuit_breaker.HALF_OPEN)
+
+    def test_network_failures_open_the_circuit(self):
+        self._open()
+        calls = []
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call('profile', calls.append, 1)
+        self.assertEqual(calls, [])
+
+    def test_api_errors_keep_the_circuit_closed(self):
+        for _ in range(circuit_breaker.MIN_CALLS * 2):
+            with self.assertRaises(ValueError):
+                self.breaker.call('profile', int, 'not a number')
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+
+    def test_half_open_trial_closes_the_circuit(self):
+        self._open()
+        self._cool_off()
+        self.assertEqual(self.breaker.call('profile', lambda: 'ok'), 'ok')
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+
+    def test_failed_trial_reopens_the_circuit(self):
+        self._open()
+        self._cool_off()
+        with self.assertRaises(requests.ConnectionError):
+            self.breaker.call('profile', _network_down)
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+
+    def test_half_open_lets_a_single_trial_through(self):
+        self._open()
+        self._cool_off()
+        release = threading.Event()
+        trial = threading.Thread(target=self.breaker.call, args=('profile', release.wait))
+        trial.start()
+        try:
+            while not self.breaker._trial_in_flight:
+                time.sleep(0.001)
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.call('profile', lambda: 'ok')
+        finally:
+            release.set()
+            trial.join()
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+
+    def test_hung_call_gives_up_at_the_deadline(self):
+        release = threading.Event()
+        started = time.monotonic()
+        with self.assertRaises(UpstreamTimeout):
+            self.breaker.call('quotes', release.wait)
+        self.assertLess(time.monotonic() - started, 1)
+        release.set()
+
+    def test_pool_of_stuck_threads_is_replaced(self):
+        release = threading.Event()
+        pool = self.breaker._executor
+        # Keep the circuit closed while every thread gets stuck
+        with mock.patch.object(circuit_breaker, 'MIN_CALLS', circuit_breaker.MAX_CONCURRENT_CALLS + 1):
+            try:
+                for _ in range(circuit_breaker.MAX_CONCURRENT_CALLS):
+                    with self.assertRaises(UpstreamTimeout):
+                        self.breaker.call('quotes', release.wait)
+                self.assertIsNot(self.breaker._executor, pool)
+                self.assertEqual(self.breaker.call('quotes', lambda: 'ok'), 'ok')
+            finally:
+                release.set()
+
+
+class MetricsViewTests(TestCase):
+    def test_anonymous_requests_are_refused(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+    def test_metrics_token_is_accepted(self):
+        with mock.patch.object(views, 'METRICS_TOKEN', 'scrape-token'):
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'quicktrade_circuit_state', response.content)
+
+    def test_staff_users_are_accepted(self):
+        self.client.force_login(User.objects.create(username='operator', is_staff=True))
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
+
+
+class StopLossMonitorTests(TestCase):
+    """Same check as the sl_monitor_drill command: trigger heaps against a brute-force evaluation"""
+
+    ACCOUNT = {'user_id': 'SL1', 'api_key': 'test', 'access_token': 'test'}
+
+    def setUp(self):
+        self.monitor = StopLossMonitor(submit_exit=lambda protection: ['test'], subscribe=False)
+
+    def _position(self, symbol, quantity):
+        return {'tradingsymbol': symbol, 'exchange': 'NFO', 'product': 'MIS', 'quantity': quantity}
+
+    def test_firings_match_brute_force(self):
+        rng = random.Random(42)
+        symbols = [f"NIFTY26OCT{22000 + 50 * n}CE" for n in range(4)]
+        prices = {symbol: 100.0 for symbol in symbols}
+
+        # [protection id, symbol, side, stop, target, trail, best price]
+        rules = []
+        for number in range(1000):
+            symbol = rng.choice(symbols)
+            quantity = rng.choice((75, -75))
+            against = 1 if quantity > 0 else -1
+            stop = target = trail = None
+            kinds = rng.choice(('stop', 'target', 'both', 'trail', 'all'))
+            if kinds in ('stop', 'both', 'all'):
+                stop = round(100 - against * rng.uniform(1, 30), 2)
+            if kinds in ('target', 'both', 'all'):
+                target = round(100 + against * rng.uniform(1, 30), 2)
+            if kinds in ('trail', 'all'):
+                trail = round(rng.uniform(1, 20), 2)
+            protection = self.monitor.protect(dict(self.ACCOUNT, user_id=f"U{number}"), self._position(symbol, quantity),
+                                              stop_loss=stop, target=target, trail=trail, price=100.0)
+            rules.append([protection.protection_id, symbol, against, stop, target, trail, 100.0])
+
+        for tick in range(5000):
+            symbol = rng.choice(symbols)
+            price = prices[symbol] = round(max(prices[symbol] * (1 + rng.gauss(0, 0.004)), 0.05), 2)
+            fired = {protection.protection_id for protection in self.monitor.on_tick(symbol, price, tick)}
+
+            expected, remaining = set(), []
+            for rule in rules:
+                protection_id, rule_symbol, against, stop, target, trail, best = rule
+                if rule_symbol != symbol:
+                    remaining.append(rule)
+                    continue
+                best = rule[6] = max(best, price) if against > 0 else min(best, price)
+                if ((stop is not None and against * (price - stop) <= 0)
+                        or (target is not None and against * (target - price) <= 0)
+                        or (trail is not None and against * (price - (best - against * trail)) <= 0)):
+                    expected.add(protection_id)
+                else:
+                    remaining.append(rule)
+            rules = remaining
+            self.assertEqual(fired, expected, f"tick {tick} {symbol} @ {price}")
+        self.assertEqual(self.monitor.armed_count(), sum(1 for rule in rules for level in rule[3:6] if level is not None))
+
+    def test_levels_on_the_wrong_side_are_refused(self):
+        position = self._position('NIFTY26OCT24000CE', 75)
+        with self.assertRaises(ValueError):
+            self.monitor.protect(self.ACCOUNT, position, stop_loss=105, price=100)
+        with self.assertRaises(ValueError):
+            self.monitor.protect(self.ACCOUNT, position, target=95, price=100)
+        with self.assertRaises(ValueError):
+            self.monitor.protect(self.ACCOUNT, self._position('NIFTY26OCT24000CE', -75), stop_loss=95, price=100)
+
+    def test_cancelled_protection_does_not_fire(self):
+        self.monitor.protect(self.ACCOUNT, self._position('NIFTY26OCT24000CE', 75), stop_loss=90, price=100)
+        self.assertTrue(self.monitor.cancel('SL1', 'NIFTY26OCT24000CE'))
+        self.assertEqual(self.monitor.on_tick('NIFTY26OCT24000CE', 80), [])
+        self.assertEqual(self.monitor.armed_count(), 0)
+
+    def test_new_levels_replace_the_armed_ones(self):
+        position = self._position('NIFTY26OCT24000CE', 75)
+        self.monitor.protect(self.ACCOUNT, position, stop_loss=90, price=100)
+        self.monitor.protect(self.ACCOUNT, position, stop_loss=80, price=100)
+        self.assertEqual(self.monitor.on_tick('NIFTY26OCT24000CE', 85), [])
+        self.assertEqual(len(self.monitor.on_tick('NIFTY26OCT24000CE', 79)), 1)
+
+
+class PostbackTests(TestCase):
+    """Same flow as the replay_postbacks command: signed postbacks through /kite/postback/"""
+
+    SECRET = 'postback-secret'
+
+    def setUp(self):
+        # Order state lives on in the process, every test gets its own account
+        self.user_id = f"PB{self._testMethodName[-12:]}"
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        register_postback_account(self.user_id, session, self.SECRET)
+        session.save()
+        history_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(history_dir.cleanup)
+        patcher = mock.patch.object(order_history, 'storage_dir', Path(history_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _postback(self, order_id, status, filled, average, secret=SECRET, **fields):
+        payload = dict({
+            'user_id': self.user_id, 'order_id': order_id, 'status': status,
+            'order_timestamp': '2026-10-19 10:15:00', 'tradingsymbol': 'NIFTY26OCT24000CE', 'exchange': 'NFO',
+            'product': 'MIS', 'transaction_type': 'BUY', 'quantity': 150,
+            'filled_quantity': filled, 'average_price': average,
+        }, **fields)
+        payload['checksum'] = compute_postback_checksum(order_id, payload['order_timestamp'], secret)
+        return self.client.post('/kite/postback/', data=json.dumps(payload), content_type='application/json', secure=True)
+
+    def _position(self):
+        return order_state.get(self.user_id).position_list()['net'][0]
+
+    def test_replayed_postbacks_apply_each_fill_once(self):
+        self.assertEqual(self._postback('O1', 'OPEN', 75, 100.0).status_code, 200)
+        self.assertEqual(self._postback('O1', 'OPEN', 75, 100.0).status_code, 200)
+        self.assertEqual(self._postback('O1', 'COMPLETE', 150, 101.0).status_code, 200)
+        self.assertEqual(self._postback('O1', 'COMPLETE', 150, 101.0).status_code, 200)
+        position = self._position()
+        self.assertEqual(position['quantity'], 150)
+        self.assertAlmostEqual(position['average_price'], 101.0)
+        self.assertEqual(order_state.get(self.user_id).orders['O1']['status'], 'COMPLETE')
+
+    def test_final_order_is_recorded_in_the_history_once(self):
+        self._postback('O2', 'COMPLETE', 150, 100.0)
+        self._postback('O2', 'COMPLETE', 150, 100.0)
+        order_history.flush()
+        # The day files themselves, rows() would hide a duplicate
+        for kind in (ORDERS, TRADES):
+            with open(order_history._day_file(self.user_id, '2026-10-19', kind), encoding='utf-8') as f:
+                self.assertEqual(len(f.readlines()), 1)
+
+    def test_exit_fill_closes_the_position(self):
+        self._postback('O3', 'COMPLETE', 150, 100.0)
+        self._postback('O4', 'COMPLETE', 150, 110.0, transaction_type='SELL')
+        position = self._position()
+        self.assertEqual(position['quantity'], 0)
+        self.assertAlmostEqual(position['pnl'], 1500.0)
+
+    def test_bad_checksum_is_refused(self):
+        self.assertEqual(self._postback('O5', 'COMPLETE', 150, 100.0, secret='wrong').status_code, 403)
+        self.assertEqual(order_state.get(self.user_id).orders, {})
+
+    def test_unknown_account_is_refused(self):
+        self.user_id = 'NOSESSION'
+        self.assertEqual(self._postback('O6', 'COMPLETE', 150, 100.0).status_code, 403)
+
+    def test_non_object_body_is_refused(self):
+        response = self.client.post('/kite/postback/', data='[]', content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 400)
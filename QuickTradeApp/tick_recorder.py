@@ -0,0 +1,395 @@
+"""
+Tick recorder for QuickTradeApp
+Every quote the app fetches (index LTPs, option quotes, option chain
+snapshots) is appended as a fixed-width record to a memory-mapped segment
+file, so a session can be analysed or replayed afterwards.
+
+Layout: data/ticks/<YYYY-MM-DD>/<writer>/<segment>.bin, one writer directory
+per process. A segment is a 64 byte header followed by preallocated records;
+the header count is bumped only after the records are written, so readers in
+other processes can tail a segment while it grows. Full segments are sealed
+with an index by instrument next to them. Days roll over at midnight IST and
+only the last RETENTION_DAYS days are kept. Instrument ids are shared by all
+days and writers (data/ticks/instruments.json), so a batch can straddle
+midnight.
+
+Batches are written with one vectorized copy per column, no Python object
+is created per tick
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from .config import TICK_RECORDER
+from .metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows, new instrument ids are then registered without a file lock
+    fcntl = None
+
+# Records per segment file (48 bytes each, the file is created sparse)
+SEGMENT_RECORDS = 1 << 20
+
+# Days of ticks kept on disk
+RETENTION_DAYS = 5
+
+# Daily rollover at midnight IST
+IST_OFFSET = 19800  # seconds
+
+MAGIC = b'QTTICK01'
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('record_size', '<u4'),
+    ('reserved', '<u4'),
+    ('capacity', '<u8'),
+    ('count', '<u8'),
+    ('sealed', '<u8'),
+    ('padding', 'V24'),
+])
+
+RECORD_DTYPE = np.dtype([
+    ('ts', '<f8'),
+    ('ltp', '<f8'),
+    ('bid', '<f8'),
+    ('ask', '<f8'),
+    ('volume', '<i8'),
+    ('instrument', '<u4'),
+    ('flags', '<u4'),  # Reserved
+])
+
+INDEX_SUFFIX = '.idx.npz'
+
+metrics.describe('quicktrade_ticks_recorded_total', 'counter', "Ticks appended to the tick recorder")
+metrics.describe('quicktrade_ticks_dropped_total', 'counter', "Ticks the tick recorder failed to write")
+
+
+def tick_day(timestamp: float) -> str:
+    """IST trading day of an epoch time as YYYY-MM-DD"""
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp + IST_OFFSET))
+
+
+def _next_midnight(timestamp: float) -> float:
+    return (timestamp + IST_OFFSET) // 86400 * 86400 + 86400 - IST_OFFSET
+
+
+class _Segment:
+    """One segment file mapped for writing"""
+
+    def __init__(self, path: Path, capacity: int):
+        self.path = path
+        size = HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize
+        with open(path, 'xb') as f:
+            f.truncate(size)
+        self._header_map = np.memmap(path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        self._records_map = np.memmap(path, dtype=RECORD_DTYPE, mode='r+', offset=HEADER_DTYPE.itemsize,
+                                      shape=(capacity,))
+        # Plain array views of the mappings, slicing a memmap costs more than the copy
+        self.header = self._header_map.view(np.ndarray)
+        self.records = self._records_map.view(np.ndarray)
+        self.header['magic'] = MAGIC
+        self.header['record_size'] = RECORD_DTYPE.itemsize
+        self.header['capacity'] = capacity
+        self.capacity = capacity
+        self.count = 0
+
+    def publish(self, count: int):
+        """Make records up to count visible to readers"""
+        self.count = count
+        self.header['count'] = count
+
+    def seal(self):
+        """Write the instrument index and mark the segment complete"""
+        instruments = self.records['instrument'][:self.count]
+        order = np.argsort(instruments, kind='stable')
+        ids, starts, counts = np.unique(instruments[order], return_index=True, return_counts=True)
+        np.savez(str(self.path) + INDEX_SUFFIX, instruments=ids, starts=starts, counts=counts, order=order)
+        self.header['sealed'] = 1
+        self._records_map.flush()
+        self._header_map.flush()
+
+
+class _InstrumentIds:
+    """Symbol <-> id table shared by the writers of every process"""
+
+    def __init__(self, storage_dir: Path):
+        self.path = storage_dir / "instruments.json"
+        self.lock_path = storage_dir / "instruments.lock"
+        self.ids: Dict[str, int] = {}
+        self.symbols: Dict[int, str] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.ids = json.load(f)
+        except (OSError, ValueError):
+            self.ids = {}
+        self.symbols = {number: symbol for symbol, number in self.ids.items()}
+
+    def get(self, symbol: str) -> int:
+        number = self.ids.get(symbol)
+        if number is not None:
+            return number
+        with open(self.lock_path, 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process may have registered it meanwhile
+            self._load()
+            if symbol not in self.ids:
+                self.ids[symbol] = len(self.ids)
+                temporary = self.path.with_suffix(f".{os.getpid()}.tmp")
+                with open(temporary, 'w', encoding='utf-8') as f:
+                    json.dump(self.ids, f)
+                os.replace(temporary, self.path)
+                self.symbols[self.ids[symbol]] = symbol
+        return self.ids[symbol]
+
+
+class TickRecorder:
+    """Appends tick batches to the segment files of this process"""
+
+    def __init__(self, storage_dir: str = "data/ticks", segment_records: int = SEGMENT_RECORDS,
+                 retention_days: int = RETENTION_DAYS, writer: Optional[str] = None):
+        self.storage_dir = Path(storage_dir)
+        self.segment_records = segment_records
+        self.retention_days = retention_days
+        # The process id is only known once a day is opened: the global recorder
+        # is created in the preloading master, before the workers are forked
+        self._writer = writer
+        self.writer = writer
+        self._lock = threading.Lock()
+        self._day = None
+        self._day_ends = 0.0
+        self._ids = None
+        self._segment = None
+        self._segment_number = 0
+
+    def _open_day(self, timestamp: float):
+        """Seal the running segment and start the day of timestamp"""
+        if self._segment is not None:
+            self._segment.seal()
+            self._segment = None
+        self._day = tick_day(timestamp)
+        self._day_ends = _next_midnight(timestamp)
+        self.writer = self._writer or f"{os.getpid()}"
+        day_dir = self.storage_dir / self._day
+        (day_dir / self.writer).mkdir(parents=True, exist_ok=True)
+        if self._ids is None:
+            self._ids = _InstrumentIds(self.storage_dir)
+        self._segment_number = len(list((day_dir / self.writer).glob('*.bin')))
+        self._drop_old_days()
+
+    def _drop_old_days(self):
+        days = sorted(path for path in self.storage_dir.iterdir() if path.is_dir())
+        for path in days[:-self.retention_days]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _writable_segment(self) -> _Segment:
+        segment = self._segment
+        if segment is not None and segment.count < segment.capacity:
+            return segment
+        if segment is not None:
+            segment.seal()
+        path = self.storage_dir / self._day / self.writer / f"{self._segment_number:05d}.bin"
+        self._segment_number += 1
+        self._segment = _Segment(path, self.segment_records)
+        return self._segment
+
+    def instrument_ids(self, symbols: Sequence[str], timestamp: Optional[float] = None) -> np.ndarray:
+        """Ids of symbols, registering new ones (opens the day of timestamp, defaults to now)"""
+        with self._lock:
+            timestamp = timestamp or time.time()
+            if self._day is None or timestamp >= self._day_ends:
+                self._open_day(timestamp)
+            get = self._ids.get
+            return np.fromiter((get(symbol) for symbol in symbols), dtype=np.uint32, count=len(symbols))
+
+    def append(self, instruments: np.ndarray, ltp: np.ndarray, volume=0, bid=np.nan, ask=np.nan,
+               timestamp=None) -> int:
+        """
+        Append a batch of ticks
+
+        Args:
+            instruments: Ids from instrument_ids
+            ltp: Prices, one per instrument
+            volume, bid, ask: Arrays or one value for the whole batch
+            timestamp: Epoch seconds, an array (non-decreasing) or one value, defaults to now
+
+        Returns:
+            int: Records written
+        """
+        total = len(ltp)
+        if not total:
+            return 0
+        timestamp = time.time() if timestamp is None else timestamp
+        stamps = timestamp if isinstance(timestamp, np.ndarray) else None
+        first = float(timestamp[0] if stamps is not None else timestamp)
+        columns = [(field, values, isinstance(values, np.ndarray)) for field, values in (
+            ('ts', timestamp), ('ltp', ltp), ('volume', volume), ('bid', bid), ('ask', ask), ('instrument', instruments)
+        )]
+        with self._lock:
+            if self._day is None or first >= self._day_ends:
+                self._open_day(first)
+
+            written = 0
+            while written < total:
+                segment = self._writable_segment()
+                size = min(segment.capacity - segment.count, total - written)
+                if stamps is not None:
+                    # Never let a batch run past midnight into the wrong day
+                    size = min(size, int(np.searchsorted(stamps[written:], self._day_ends)) or size)
+                end = written + size
+                block = segment.records[segment.count:segment.count + size]
+                for field, values, is_array in columns:
+                    block[field] = values[written:end] if is_array else values
+                segment.publish(segment.count + size)
+                written = end
+                if stamps is not None and written < total and stamps[written] >= self._day_ends:
+                    self._open_day(float(stamps[written]))
+
+        metrics.inc('quicktrade_ticks_recorded_total', value=total)
+        return total
+
+    def record(self, symbols: Sequence[str], ltp, volume=0, bid=np.nan, ask=np.nan,
+               timestamp: Optional[float] = None) -> int:
+        """Append ticks by symbol, the ticks of a batch share one timestamp"""
+        timestamp = timestamp or time.time()
+        ids = self.instrument_ids(symbols, timestamp)
+        as_array = lambda values: np.asarray(values, dtype=np.float64) if isinstance(values, (list, tuple)) else values
+        return self.append(ids, as_array(ltp), as_array(volume), as_array(bid), as_array(ask), timestamp)
+
+    def after_fork(self):
+        """In a forked child: drop the parent's segment, the next append opens one of this process"""
+        self._lock = threading.Lock()
+        self._segment = None
+        self._day = None
+        self._ids = None
+
+    def close(self):
+        """Seal the running segment, the next append opens the storage directory again"""
+        with self._lock:
+            if self._segment is not None:
+                self._segment.seal()
+                self._segment = None
+            self._day = None
+            self._ids = None
+
+
+class TickReader:
+    """Reads and tails recorded ticks, from this or any other process"""
+
+    def __init__(self, storage_dir: str = "data/ticks"):
+        self.storage_dir = Path(storage_dir)
+
+    def days(self) -> List[str]:
+        if not self.storage_dir.exists():
+            return []
+        return sorted(path.name for path in self.storage_dir.iterdir() if path.is_dir())
+
+    def symbols(self) -> Dict[int, str]:
+        """Instrument id -> symbol"""
+        return _InstrumentIds(self.storage_dir).symbols
+
+    def segments(self, day: str) -> List[Path]:
+        return sorted((self.storage_dir / day).glob('*/*.bin'))
+
+    @staticmethod
+    def _open(path: Path):
+        header = np.memmap(path, dtype=HEADER_DTYPE, mode='r', shape=(1,))
+        if header['magic'][0] != MAGIC:
+            raise ValueError(f"Not a tick segment: {path}")
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize,
+                            shape=(int(header['capacity'][0]),))
+        return header, records
+
+    def read(self, day: str, symbol: Optional[str] = None) -> np.ndarray:
+        """
+        Ticks of a day in time order, optionally of one symbol only
+
+        Sealed segments are read through their instrument index, the ones
+        still being written are scanned
+        """
+        instrument = None
+        if symbol is not None:
+            instrument = {name: number for number, name in self.symbols().items()}.get(symbol)
+            if instrument is None:
+                return np.empty(0, dtype=RECORD_DTYPE)
+
+        parts = []
+        for path in self.segments(day):
+            header, records = self._open(path)
+            count = int(header['count'][0])
+            records = records[:count]
+            if instrument is None:
+                parts.append(records)
+            elif header['sealed'][0]:
+                index = np.load(str(path) + INDEX_SUFFIX)
+                position = np.searchsorted(index['instruments'], instrument)
+                if position < len(index['instruments']) and index['instruments'][position] == instrument:
+                    start = index['starts'][position]
+                    rows = index['order'][start:start + index['counts'][position]]
+                    parts.append(records[np.sort(rows)])
+            else:
+                parts.append(records[records['instrument'] == instrument])
+
+        if not parts:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        ticks = np.concatenate(parts)
+        return ticks[np.argsort(ticks['ts'], kind='stable')]
+
+    def tail(self, day: Optional[str] = None, poll_interval: float = 0.2,
+             stop: Optional[threading.Event] = None) -> Iterator[np.ndarray]:
+        """
+        Follow the segments of a day as they grow, yielding each new block of records
+
+        Args:
+            day: YYYY-MM-DD, defaults to today
+            poll_interval: Seconds between checks for new records
+            stop: Event that ends the generator when set
+        """
+        day = day or tick_day(time.time())
+        positions: Dict[Path, int] = {}
+        opened = {}
+        while stop is None or not stop.is_set():
+            grew = False
+            for path in self.segments(day):
+                if path not in opened:
+                    try:
+                        opened[path] = self._open(path)
+                    except (OSError, ValueError):
+                        continue  # Still being created
+                header, records = opened[path]
+                seen = positions.get(path, 0)
+                count = int(header['count'][0])
+                if count > seen:
+                    positions[path] = count
+                    grew = True
+                    yield records[seen:count]
+            if not grew:
+                time.sleep(poll_interval)
+
+
+# Global instance
+tick_recorder = TickRecorder()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=tick_recorder.after_fork)
+
+
+def record_ticks(symbols: Sequence[str], ltp, volume=0, bid=np.nan, ask=np.nan,
+                 timestamp: Optional[float] = None):
+    """Record fetched quotes if the recorder is enabled, never raising into the caller"""
+    if not TICK_RECORDER or not len(symbols):
+        return
+    try:
+        tick_recorder.record(symbols, ltp, volume, bid, ask, timestamp)
+    except Exception:
+        metrics.inc('quicktrade_ticks_dropped_total', value=len(symbols))
@@ -10,8 +10,22 @@ urlpatterns = [
     path('fyers/callback/', views.fyers_callback, name='fyers_callback'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('logout/', views.logout, name='logout'),
+    path('linked_accounts/', views.linked_accounts, name='linked_accounts'),  # Linked accounts for fan-out orders
+    path('linked_accounts/unlink/', views.unlink_linked_account, name='unlink_linked_account'),
     path('place_order/', views.place_order, name='place_order'),  # Place order endpoint
+    path('basket_order/', views.basket_order, name='basket_order'),  # Multi-leg basket order endpoint
     path('exit_all/', views.exit_all, name='exit_all'),  # Exit all positions endpoint
     path('exit_position/', views.exit_position, name='exit_position'),  # Exit specific position endpoint
+    path('sl_monitor/', views.sl_monitor_view, name='sl_monitor'),  # Server-side stop-loss / target levels
+    path('sl_monitor/cancel/', views.sl_monitor_cancel, name='sl_monitor_cancel'),
     path('get_index_price/', views.get_index_price, name='get_index_price'),  # Get index price endpoint
+    path('paper_trading/', views.paper_trading, name='paper_trading'),  # Paper trading mode and account
+    path('kite/postback/', views.kite_postback, name='kite_postback'),  # Kite order postback receiver
+    path('portfolio/mtm/', views.portfolio_mtm, name='portfolio_mtm'),  # Live P&L endpoint
+    path('portfolio/risk/', views.portfolio_risk, name='portfolio_risk'),  # Delta, exposure and max loss per index
+    path('option_chain/', views.option_chain, name='option_chain'),  # Option chain with IV and Greeks
+    path('candles/', views.candles, name='candles'),  # Cached OHLCV candles for charts
+    path('execution_stats/', views.execution_stats, name='execution_stats'),  # Latency and slippage rollups
+    path('history/export/', views.history_export, name='history_export'),  # Order / trade history as CSV or Parquet
+    path('metrics/', views.metrics_view, name='metrics'),  # Prometheus metrics (circuit breakers)
 ]
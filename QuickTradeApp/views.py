@@ -1,14 +1,42 @@
+import hmac
 import json
+import logging
+import time
+import uuid
+from datetime import date, datetime
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.views.decorators.http import require_http_methods
 from .auth.zerodha_auth import ZerodhaAuth
 from .auth.fyers_auth import FyersAuth
 from .kite_trade import KiteApp
+from .broker_clients import get_kite_client
 from functools import wraps
-from .fyers_utils import get_ltp, get_market_data_simple, FyersService, get_next_expiry_sdk
-from .config import FYERS_REDIRECT_URL, ZERODHA_REDIRECT_URL, GOOGLE_ANALYTICS_ID
+from .fyers_utils import get_ltp, get_market_data_simple, FyersService, get_next_expiry_sdk, get_option_quotes
+from .mtm import mtm_engines
+from .risk import risk_books
+from .option_chain import get_option_chain
+from .candle_store import candle_store, DEFAULT_LOOKBACK_DAYS, MAX_LOOKBACK_DAYS
+from .instruments import get_index_spec
+from .basket_orders import strategy_legs
+from .execution_stats import OrderTimeline, execution_tracker, IST
+from .order_idempotency import idempotency_table, find_orders_by_tags, make_order_tag
+from .order_history import (FIELDS as HISTORY_FIELDS, MAX_EXPORT_DAYS, ORDERS, order_history, parquet_available,
+                            stream_csv, stream_parquet)
+from .circuit_breaker import is_upstream_unavailable
+from .linked_accounts import (PENDING_LINK_KEY, MAX_LOT_MULTIPLIER, get_linked_accounts,
+                              fan_out_accounts, link_account, unlink_account)
+from .metrics import metrics
+from .ltp_cache import ltp_cache
+from .sl_monitor import sl_monitor
+from .margin_cache import is_insufficient_funds, margin_cache
+from .market_clock import market_clock
+from .paper_broker import PAPER_SESSION_KEY, is_paper_session, paper_broker, paper_token, session_account_id, trading_access_token
+from .order_state import order_state, register_postback_account, verify_postback, RECONCILE_INTERVAL
+from .config import FYERS_REDIRECT_URL, ZERODHA_REDIRECT_URL, GOOGLE_ANALYTICS_ID, METRICS_TOKEN
+
+logger = logging.getLogger(__name__)
 
 def is_authenticated(request):
     """Check if user is authenticated with both Zerodha and Fyers"""
@@ -47,8 +75,10 @@ def is_authenticated(request):
             
             return True
             
-        except Exception:
-            return False
+        except Exception as e:
+            # An unreachable broker says nothing about the token, keep the
+            # session so pages can degrade to cached data
+            return is_upstream_unavailable(e)
             
     except Exception:
         return False
@@ -131,27 +161,21 @@ def zerodha_login(request):
                         request.session['zerodha_redirect_uri'] = ZERODHA_REDIRECT_URL
                     except Exception as e:
                         # If session storage fails, continue without it
-                        import logging
-                        logger = logging.getLogger(__name__)
-                        logger.warning(f"Session storage failed: {str(e)}")
+                        logger.warning("Session storage failed: %s", e)
                     
                     return redirect(login_url)
                 else:
                     return render(request, 'zerodha_login.html', {'error': 'Failed to generate login URL'})
             except Exception as e:
                 # Log the specific error for debugging
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f"Zerodha login error: {str(e)}", exc_info=True)
+                logger.error("Zerodha login error: %s", e, exc_info=True)
                 return render(request, 'zerodha_login.html', {'error': 'Failed to connect to Zerodha. Please check your credentials.'})
         
         # GET request - show login form with redirect URL
         return render(request, 'zerodha_login.html', {'ZERODHA_REDIRECT_URL': ZERODHA_REDIRECT_URL})
     except Exception as e:
         # Catch any other errors
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.error(f"Unexpected error in zerodha_login: {str(e)}", exc_info=True)
+        logger.error("Unexpected error in zerodha_login: %s", e, exc_info=True)
         return render(request, 'zerodha_login.html', {'error': 'An unexpected error occurred. Please try again.'})
 
 @require_http_methods(["GET"])
@@ -160,6 +184,10 @@ def zerodha_callback(request):
     request_token = request.GET.get('request_token')
     if not request_token:
         return redirect('zerodha_login')
+
+    # A linked account logging in keeps the primary session
+    if request.session.get(PENDING_LINK_KEY):
+        return _complete_account_link(request, request_token)
     
     # Get stored credentials
     api_key = request.session.get('api_key')
@@ -177,6 +205,9 @@ def zerodha_callback(request):
         if data and 'access_token' in data:
             # Store access token in session
             request.session['access_token'] = data['access_token']
+            request.session['zerodha_user_id'] = data.get('user_id')
+            # Allow postbacks for this account to be verified
+            register_postback_account(data.get('user_id'), request.session, api_secret)
             # Redirect to Fyers login
             return redirect('fyers_login')
     except Exception:
@@ -186,6 +217,64 @@ def zerodha_callback(request):
     
     return redirect('zerodha_login')
 
+def _complete_account_link(request, request_token):
+    """Store the account that just logged in as a linked account"""
+    pending = request.session.pop(PENDING_LINK_KEY)
+    try:
+        zerodha = ZerodhaAuth(pending['api_key'], pending['api_secret'])
+        data = zerodha.generate_session(request_token)
+        link_account(request.session, data.get('user_id'), pending['api_key'],
+                     data['access_token'], pending['multiplier'])
+        register_postback_account(data.get('user_id'), request.session, pending['api_secret'])
+    except ValueError as e:
+        return render(request, 'linked_accounts.html', _linked_accounts_context(request, str(e)))
+    except Exception as e:
+        return render(request, 'linked_accounts.html',
+                      _linked_accounts_context(request, f'Failed to link account: {str(e)}'))
+    return redirect('linked_accounts')
+
+def _linked_accounts_context(request, error=None):
+    return {
+        'linked_accounts': get_linked_accounts(request.session),
+        'max_multiplier': MAX_LOT_MULTIPLIER,
+        'error': error,
+    }
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def linked_accounts(request):
+    """List linked accounts and start the Kite login of a new one"""
+    if request.method == "POST":
+        api_key = request.POST.get('api_key')
+        api_secret = request.POST.get('api_secret')
+        try:
+            multiplier = int(request.POST.get('multiplier') or 1)
+        except ValueError:
+            multiplier = 0
+
+        if not api_key or not api_secret:
+            return render(request, 'linked_accounts.html',
+                          _linked_accounts_context(request, 'API Key and Secret are required'))
+        if not 1 <= multiplier <= MAX_LOT_MULTIPLIER:
+            return render(request, 'linked_accounts.html',
+                          _linked_accounts_context(request, f'Lot multiplier must be between 1 and {MAX_LOT_MULTIPLIER}'))
+
+        # The Kite callback picks this up instead of replacing the primary login
+        request.session[PENDING_LINK_KEY] = {
+            'api_key': api_key,
+            'api_secret': api_secret,
+            'multiplier': multiplier,
+        }
+        return redirect(ZerodhaAuth(api_key, api_secret).get_login_url())
+
+    return render(request, 'linked_accounts.html', _linked_accounts_context(request))
+
+@require_http_methods(["POST"])
+def unlink_linked_account(request):
+    """Remove a linked account from this session"""
+    unlink_account(request.session, request.POST.get('user_id'))
+    return redirect('linked_accounts')
+
 @require_http_methods(["GET", "POST"])
 def fyers_login(request):
     """Handle Fyers login form display and submission"""
@@ -303,6 +392,18 @@ def dashboard(request):
         
         # Get portfolio data
         portfolio = kite.get_portfolio()
+        # Keep the margin snapshot warm so the next order is checked locally
+        margin_cache.snapshot(kite.kite)
+
+        # The dashboard poll only needs the portfolio tables
+        if request.GET.get('partial') == 'portfolio':
+            return render(request, 'partials/portfolio_tables.html', {
+                'positions': portfolio['positions'],
+                'orders': portfolio['orders'],
+                'history': portfolio['history'],
+                'stale': portfolio['stale'],
+                'market': market_clock.poll_hint(),
+            })
         
         # Get market data including expiry dates using FyersService
         market_data = get_market_data_simple(request)
@@ -356,7 +457,11 @@ def dashboard(request):
             'orders': portfolio['orders'],
             'history': portfolio['history'],
             'expiry_dates': expiry_dates,
-            'index_prices': market_data.get('prices', {})
+            'index_prices': market_data.get('prices', {}),
+            'stale': portfolio['stale'] or market_data.get('stale', False),
+            'linked_accounts': get_linked_accounts(request.session),
+            'paper_trading': is_paper_session(request.session),
+            'market': market_clock.poll_hint(),
         })
     except Exception as e:
         return render(request, 'QuickTradeApp/error.html', {'error': str(e)})
@@ -364,6 +469,7 @@ def dashboard(request):
 @require_http_methods(["GET"])
 def logout(request):
     """Handle logout"""
+    mtm_engines.drop(_sl_owner(request))
     request.session.flush()
     return redirect('login')
 
@@ -404,11 +510,117 @@ def fyers_auth_redirect(request):
     except Exception as e:
         return redirect('/login/?error=Authentication failed')
 
+def _linked_response(result, message):
+    """
+    Response payload and status of a linked account fan-out
+
+    Returns:
+        tuple: (payload, status)
+    """
+    total = len(result['accounts'])
+    payload = {
+        'success': result['success'],
+        'accounts': result['accounts'],
+        'order_ids': [order_id for account in result['accounts']
+                      for order_id in account.get('order_ids') or [account.get('order_id')] if order_id],
+        'ack_spread_ms': result['ack_spread_ms'],
+        'fill_spread_ms': result['fill_spread_ms'],
+    }
+    if result['success']:
+        payload['message'] = f"{message} in {result['succeeded_accounts']} of {total} accounts"
+        if result['ack_spread_ms'] is not None:
+            payload['message'] += f" within {result['ack_spread_ms']:.0f}ms"
+        return payload, 200
+    failed = [account for account in result['accounts'] if account['status'] == 'failed']
+    payload.update({
+        'error': f"{len(failed)} of {total} accounts failed",
+        'error_code': 'PARTIAL_FAILURE',
+        'suggestion': 'Check the failed accounts before retrying them',
+        'details': '; '.join(f"{account['user_id']}: {account.get('error')}" for account in failed),
+    })
+    if any(account.get('unknown_quantity') for account in failed):
+        payload.update({
+            'error_code': 'ORDER_STATUS_UNKNOWN',
+            'suggestion': 'Check your orders before placing it again, retrying this request is safe',
+        })
+    return payload, 400
+
+def _find_sent_orders(request, kite, tags):
+    """
+    Look up the orders an earlier request sent, one order book read per account
+
+    Args:
+        tags: [user_id, tag] pairs from the idempotency entry, user_id None
+            for the session's own account
+
+    Returns:
+        tuple: (order ids found, True if any order book could not be read)
+    """
+    accounts = {account['user_id']: account for account in fan_out_accounts(request.session)}
+    by_account = {}
+    for user_id, tag in tags:
+        by_account.setdefault(user_id, []).append(tag)
+
+    order_ids, lookup_failed = [], False
+    for user_id, account_tags in by_account.items():
+        try:
+            if user_id is None:
+                client = kite.kite
+            else:
+                account = accounts[user_id]
+                client = get_kite_client(account['api_key'], account['access_token'])
+            order_ids.extend(find_orders_by_tags(client, account_tags).values())
+        except Exception:
+            lookup_failed = True
+    return order_ids, lookup_failed
+
+def _resolve_duplicate_order(request, kite, api_key, idempotency_key, previous):
+    """
+    Answer a repeated order request from the outcome of the first one
+
+    Returns:
+        JsonResponse: Response for the duplicate, or None if the order
+        should be placed (the earlier attempt is known not to exist)
+    """
+    state = previous.get('state')
+    if state == idempotency_table.DONE:
+        return JsonResponse({**previous['response'], 'duplicate': True})
+
+    if state == idempotency_table.UNKNOWN:
+        # The earlier attempt timed out, the order books of every account it sent to decide
+        tags = previous.get('tags') or [[None, make_order_tag(idempotency_key)]]
+        order_ids, lookup_failed = _find_sent_orders(request, kite, tags)
+
+        if order_ids:
+            response = {
+                'success': True,
+                'order_id': order_ids[0],
+                'order_ids': order_ids,
+                'message': 'Order was placed by the earlier attempt'
+            }
+            idempotency_table.complete(api_key, idempotency_key, response)
+            return JsonResponse({**response, 'duplicate': True})
+
+        if not lookup_failed:
+            idempotency_table.release(api_key, idempotency_key)
+            if idempotency_table.begin(api_key, idempotency_key)[0]:
+                return None
+
+    return JsonResponse({
+        'success': False,
+        'error': 'This order is already being placed',
+        'error_code': 'DUPLICATE_IN_PROGRESS',
+        'suggestion': 'Wait for the first request to finish and check your orders'
+    }, status=409)
+
 @ensure_csrf_cookie
 def place_order(request):
     """Place an order for the given index and direction"""
     if request.method != 'POST':
         return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+
+    # Execution timeline starts the moment the click reaches us
+    timeline = OrderTimeline()
         
     try:
         # Get parameters from request
@@ -428,22 +640,19 @@ def place_order(request):
             }, status=400)
             
         # Calculate actual quantity based on lot size
-        lot_sizes = {
-            'NIFTY': 75,
-            'BANKNIFTY': 30
-        }
-        lot_size = lot_sizes.get(index.upper())
-        if not lot_size:
+        try:
+            spec = get_index_spec(index)
+        except ValueError:
             return JsonResponse({
                 'error': 'Invalid index',
                 'details': f'Unknown index: {index}'
             }, status=400)
             
-        actual_quantity = user_quantity * lot_size
+        actual_quantity = user_quantity * spec['lot_size']
             
         # Check authentication
         api_key = request.session.get('api_key')
-        access_token = request.session.get('access_token')
+        access_token = trading_access_token(request.session)
         fyers_client_id = request.session.get('fyers_client_id')
         fyers_access_token = request.session.get('fyers_access_token')
         
@@ -465,7 +674,8 @@ def place_order(request):
         try:
             kite = KiteApp(
                 api_key=api_key,
-                access_token=access_token
+                access_token=access_token,
+                user_id=request.session.get('zerodha_user_id')
             )
         except Exception as e:
             return JsonResponse({
@@ -473,21 +683,102 @@ def place_order(request):
                 'details': str(e)
             }, status=500)
             
+        # The same click retried (double submit, network retry) must not place twice
+        idempotency_key = str(data.get('client_order_id') or uuid.uuid4().hex)
+        is_new, previous = idempotency_table.begin(api_key, idempotency_key)
+        if not is_new:
+            duplicate_response = _resolve_duplicate_order(request, kite, api_key, idempotency_key, previous)
+            if duplicate_response:
+                return duplicate_response
+
+        def finish(payload, status=200, tags=None):
+            """Record the outcome for duplicates of this request and respond"""
+            if payload.get('error_code') == 'ORDER_STATUS_UNKNOWN':
+                # Orders may exist beyond those we know of, duplicates look them all up
+                idempotency_table.mark_unknown(api_key, idempotency_key, tags)
+            elif payload.get('order_id') or payload.get('order_ids'):
+                idempotency_table.complete(api_key, idempotency_key, payload)
+            else:
+                idempotency_table.release(api_key, idempotency_key)
+            return JsonResponse(payload, status=status)
+
         # Place the order
         try:
+            # One click buys in every linked account
+            if data.get('linked') and get_linked_accounts(request.session):
+                result = kite.place_linked_order(
+                    request=request,
+                    accounts=fan_out_accounts(request.session),
+                    index=index,
+                    direction=direction,
+                    lots=user_quantity,
+                    timeline=timeline,
+                    idempotency_key=idempotency_key
+                )
+                return finish(*_linked_response(result, f'Order placed for {user_quantity} lots'),
+                              tags=[[account['user_id'], tag] for account in result['accounts']
+                                    for tag in account.get('tags', [])])
+
+            # Orders above the exchange freeze limit go out as child orders
+            if actual_quantity > spec['freeze_quantity']:
+                result = kite.place_sliced_order(
+                    request=request,
+                    index=index,
+                    direction=direction,
+                    quantity=actual_quantity,
+                    timeline=timeline,
+                    idempotency_key=idempotency_key
+                )
+                response = {
+                    'success': result['success'],
+                    'order_id': result['order_ids'][0] if result['order_ids'] else None,
+                    'parent_id': result['parent_id'],
+                    'slices': result['children'],
+                    'filled_quantity': result['filled_quantity'],
+                    'average_price': result['average_price'],
+                }
+                tags = [[None, child['tag']] for child in result['children'] if child.get('tag')]
+                if result['success']:
+                    response['message'] = f'Order placed successfully for {user_quantity} lots in {len(result["children"])} slices'
+                    return finish(response)
+                if result['unknown_quantity']:
+                    response.update({
+                        'error': f'{result["unknown_quantity"]} of {actual_quantity} quantity could not be confirmed',
+                        'error_code': 'ORDER_STATUS_UNKNOWN',
+                        'suggestion': 'Check your orders before placing it again, retrying this request is safe',
+                    })
+                    return finish(response, 400, tags)
+                response.update({
+                    'error': f'{result["failed_quantity"]} of {actual_quantity} quantity failed to place',
+                    'error_code': 'PARTIAL_FAILURE',
+                    'suggestion': 'Check the open position before retrying the remaining quantity',
+                })
+                return finish(response, 400, tags)
+
             order_id = kite.place_order(
                 request=request,
                 index=index,
                 direction=direction,
-                quantity=actual_quantity
+                quantity=actual_quantity,
+                timeline=timeline,
+                idempotency_key=idempotency_key
             )
-            return JsonResponse({
+            return finish({
                 'success': True,
                 'order_id': order_id,
                 'message': f'Order placed successfully for {user_quantity} lots'
             })
         except Exception as e:
             error_message = str(e)
+
+            # Quotes come before submission, so an unavailable broker means nothing was sent
+            if is_upstream_unavailable(e):
+                return finish({
+                    'success': False,
+                    'error': error_message,
+                    'error_code': e.error_code,
+                    'suggestion': 'The market data feed is not responding, try again shortly'
+                }, 503)
             
             # Check if this is a detailed Kite error
             if error_message.startswith('KITE_ERROR:'):
@@ -499,7 +790,7 @@ def place_order(request):
                     suggestion = parts[3]
                     original_error = parts[4]
                     
-                    return JsonResponse({
+                    return finish({
                         'success': False,
                         'error': user_message,
                         'error_code': error_code,
@@ -511,21 +802,21 @@ def place_order(request):
                             'quantity': user_quantity,
                             'actual_quantity': actual_quantity
                         }
-                    }, status=400)
+                    }, 400)
                 else:
                     # Fallback if parsing fails
-                    return JsonResponse({
+                    return finish({
                         'success': False,
                         'error': 'Order placement failed',
                         'details': error_message
-                    }, status=500)
+                    }, 500)
             else:
                 # Handle other types of errors
-                return JsonResponse({
+                return finish({
                     'success': False,
                     'error': 'Failed to place order',
                     'details': error_message
-                }, status=500)
+                }, 500)
                 
     except json.JSONDecodeError as e:
         return JsonResponse({
@@ -537,13 +828,125 @@ def place_order(request):
             'details': str(e)
         }, status=500)
 
+@require_http_methods(["POST"])
+def basket_order(request):
+    """Place a multi-leg basket (straddle, strangle, spreads) off one underlying quote"""
+    timeline = OrderTimeline()
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+
+    index = str(data.get('index', '')).upper()
+    try:
+        get_index_spec(index)
+        if data.get('strategy'):
+            legs = strategy_legs(data['strategy'], int(data.get('lots', 1)),
+                                 int(data.get('width', 1)), str(data.get('side', 'BUY')).upper())
+        else:
+            legs = data.get('legs') or []
+    except (TypeError, ValueError) as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid basket',
+            'details': str(e)
+        }, status=400)
+
+    try:
+        kite = KiteApp(request=request)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated with Zerodha',
+            'details': str(e)
+        }, status=401)
+
+    api_key = request.session.get('api_key')
+    idempotency_key = str(data.get('client_order_id') or uuid.uuid4().hex)
+    is_new, previous = idempotency_table.begin(api_key, idempotency_key)
+    if not is_new:
+        duplicate_response = _resolve_duplicate_order(request, kite, api_key, idempotency_key, previous)
+        if duplicate_response:
+            return duplicate_response
+
+    try:
+        result = kite.place_basket_order(
+            request=request,
+            index=index,
+            legs=legs,
+            rollback=bool(data.get('rollback', False)),
+            hedge_first=bool(data.get('hedge_first', True)),
+            timeline=timeline,
+            idempotency_key=idempotency_key
+        )
+    except ValueError as e:
+        idempotency_table.release(api_key, idempotency_key)
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid basket',
+            'details': str(e)
+        }, status=400)
+    except Exception as e:
+        idempotency_table.release(api_key, idempotency_key)
+        if is_upstream_unavailable(e):
+            return JsonResponse({
+                'success': False,
+                'error': str(e),
+                'error_code': e.error_code,
+                'suggestion': 'The market data feed is not responding, try again shortly'
+            }, status=503)
+        return JsonResponse({
+            'success': False,
+            'error': 'Failed to place basket',
+            'details': str(e)
+        }, status=500)
+
+    if any(leg.get('unknown_quantity') for leg in result['legs']):
+        idempotency_table.mark_unknown(api_key, idempotency_key,
+                                       [[None, tag] for leg in result['legs'] for tag in leg.get('tags', [])])
+    elif any(leg.get('order_ids') for leg in result['legs']):
+        idempotency_table.complete(api_key, idempotency_key, result)
+    else:
+        idempotency_table.release(api_key, idempotency_key)
+
+    if result['success']:
+        result['message'] = f"Basket placed: {len(result['legs'])} legs"
+        if result['ack_skew_ms'] is not None:
+            result['message'] += f" within {result['ack_skew_ms']:.0f}ms"
+        return JsonResponse(result)
+
+    failed = [leg for leg in result['legs'] if leg['status'] != 'success']
+    result.update({
+        'error': f"{len(failed)} of {len(result['legs'])} legs were not placed"
+                 + (", placed legs were rolled back" if result['rolled_back'] else ""),
+        'error_code': 'PARTIAL_FAILURE',
+        'suggestion': 'Check the open positions of this basket before retrying',
+        'details': '; '.join(f"{leg['side']} {leg['trading_symbol']}: {leg.get('error', leg['status'])}"
+                             for leg in failed),
+    })
+    return JsonResponse(result, status=400)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def exit_all(request):
     """Handle exiting all positions"""
     try:
+        kite = KiteApp(request=request)
+
+        # Exit every linked account at once
+        data = json.loads(request.body or b'{}')
+        if data.get('linked') and get_linked_accounts(request.session):
+            payload, status = _linked_response(kite.exit_all_linked(fan_out_accounts(request.session)),
+                                               'Exited all positions')
+            sl_monitor.cancel_all(_sl_owner(request))
+            return JsonResponse(payload, status=status)
+
         # Exit all positions using KiteApp
-        result = KiteApp(request=request).exit_all_positions()
+        result = kite.exit_all_positions()
+        sl_monitor.cancel_all(_sl_owner(request))
 
         if result['success']:
             return JsonResponse({
@@ -614,6 +1017,21 @@ def get_index_price(request):
                 'price': price
             })
         except Exception as e:
+            if is_upstream_unavailable(e):
+                # Serve the last known price instead of waiting on Fyers
+                cached_price = ltp_cache.get(index)
+                if cached_price is not None:
+                    return JsonResponse({
+                        'status': 'success',
+                        'index': index,
+                        'price': cached_price,
+                        'stale': True
+                    })
+                return JsonResponse({
+                    'status': 'error',
+                    'error_code': e.error_code,
+                    'message': f'Failed to get {index} price: {str(e)}'
+                }, status=503)
             return JsonResponse({
                 'status': 'error',
                 'message': f'Failed to get {index} price: {str(e)}'
@@ -641,7 +1059,7 @@ def exit_position(request):
             
         # Check authentication
         api_key = request.session.get('api_key')
-        access_token = request.session.get('access_token')
+        access_token = trading_access_token(request.session)
         
         if not api_key or not access_token:
             return JsonResponse({
@@ -654,7 +1072,8 @@ def exit_position(request):
         try:
             kite = KiteApp(
                 api_key=api_key,
-                access_token=access_token
+                access_token=access_token,
+                user_id=request.session.get('zerodha_user_id')
             )
         except Exception as e:
             return JsonResponse({
@@ -665,11 +1084,22 @@ def exit_position(request):
             
         # Exit the position
         try:
-            order_id = kite.exit_position(symbol)
+            # Exit it in every linked account holding it
+            if data.get('linked') and get_linked_accounts(request.session):
+                payload, status = _linked_response(
+                    kite.exit_position_linked(fan_out_accounts(request.session), symbol),
+                    f'Exited {symbol}'
+                )
+                sl_monitor.cancel(_sl_owner(request), symbol)
+                return JsonResponse(payload, status=status)
+
+            order_ids = kite.exit_position(symbol)
+            sl_monitor.cancel(_sl_owner(request), symbol)
             
             return JsonResponse({
                 'success': True,
-                'order_id': order_id,
+                'order_id': order_ids[0],
+                'order_ids': order_ids,
                 'message': f'Successfully exited position for {symbol}'
             })
             
@@ -716,3 +1146,457 @@ def exit_position(request):
             'error': 'An unexpected error occurred',
             'details': str(e)
         }, status=500)
+
+
+def _sl_owner(request):
+    """Account key of the stop-loss monitor and the MTM engines, paper accounts apart from real ones"""
+    owner = session_account_id(request.session)
+    return paper_token(owner) if is_paper_session(request.session) else owner
+
+
+def _optional_price(data, field):
+    value = data.get(field)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number")
+
+
+@require_http_methods(["GET", "POST"])
+def sl_monitor_view(request):
+    """List the armed stop-loss / target levels, or arm them on an open position"""
+    if not request.session.get('api_key') or not request.session.get('access_token'):
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated with Zerodha',
+            'details': 'Please login with Zerodha first'
+        }, status=401)
+
+    if request.method == 'GET':
+        return JsonResponse({'success': True, 'protections': sl_monitor.protections(_sl_owner(request))})
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+
+    symbol = data.get('symbol')
+    if not symbol:
+        return JsonResponse({
+            'success': False,
+            'error': 'Symbol is required'
+        }, status=400)
+
+    try:
+        levels = {field: _optional_price(data, field) for field in ('stop_loss', 'target', 'trail')}
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    try:
+        kite = KiteApp(request=request)
+        position = next((p for p in kite._net_positions() if p['tradingsymbol'] == symbol and p['quantity'] != 0), None)
+        if position is None:
+            return JsonResponse({
+                'success': False,
+                'error': f'No open position found for {symbol}'
+            }, status=400)
+
+        account = {
+            'user_id': _sl_owner(request),
+            'api_key': request.session.get('api_key'),
+            'access_token': trading_access_token(request.session),
+        }
+        protection = sl_monitor.protect(account, position, **levels)
+        return JsonResponse({'success': True, 'protection': protection})
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'Failed to arm stop-loss',
+            'details': str(e)
+        }, status=500)
+
+
+@require_http_methods(["POST"])
+def sl_monitor_cancel(request):
+    """Disarm the stop-loss / target levels of a position"""
+    if not request.session.get('api_key') or not request.session.get('access_token'):
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated with Zerodha',
+            'details': 'Please login with Zerodha first'
+        }, status=401)
+
+    try:
+        symbol = json.loads(request.body).get('symbol')
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    if not symbol:
+        return JsonResponse({
+            'success': False,
+            'error': 'Symbol is required'
+        }, status=400)
+    return JsonResponse({'success': True, 'cancelled': sl_monitor.cancel(_sl_owner(request), symbol)})
+
+
+@require_http_methods(["GET", "POST"])
+def paper_trading(request):
+    """Paper trading mode of the session and its paper account, switched on or off or reset with POST"""
+    if not request.session.get('api_key') or not request.session.get('access_token'):
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated with Zerodha',
+            'details': 'Please login with Zerodha first'
+        }, status=401)
+
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body or b'{}')
+        except json.JSONDecodeError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Invalid JSON in request body'
+            }, status=400)
+        if data.get('reset'):
+            paper_broker.reset(session_account_id(request.session))
+        if 'enabled' in data:
+            request.session[PAPER_SESSION_KEY] = bool(data['enabled'])
+
+    return JsonResponse({
+        'success': True,
+        'enabled': is_paper_session(request.session),
+        'account': paper_broker.summary(session_account_id(request.session)),
+    })
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def kite_postback(request):
+    """Receive Kite order postbacks and apply them to the order state"""
+    try:
+        payload = json.loads(request.body)
+    except json.JSONDecodeError as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({
+            'success': False,
+            'error': 'Postback must be a JSON object'
+        }, status=400)
+
+    if not verify_postback(payload):
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid postback checksum'
+        }, status=403)
+
+    try:
+        order_state.apply_postback(payload)
+        execution_tracker.on_order_update(payload)
+        if payload.get('status') == 'REJECTED' and is_insufficient_funds(payload.get('status_message')):
+            margin_cache.broker_rejected_user(payload.get('user_id'), payload.get('status_message'))
+        return JsonResponse({'success': True})
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'Failed to apply postback',
+            'details': str(e)
+        }, status=400)
+
+
+@require_http_methods(["GET"])
+def portfolio_mtm(request):
+    """Live mark-to-market P&L repriced from the LTP cache"""
+    try:
+        kite = KiteApp(request=request)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated with Zerodha',
+            'details': str(e)
+        }, status=401)
+
+    try:
+        engine = mtm_engines.get(_sl_owner(request))
+
+        # Reload quantities only when the positions snapshot itself changed
+        state = kite.account_state()
+        version = state.version if state else int(time.time() // RECONCILE_INTERVAL)
+        if engine.source_version != version:
+            engine.load_snapshot(kite.positions().get('net', []), version)
+
+        # One batched quote call reprices every open leg through the LTP cache
+        legs = engine.open_legs()
+        # Outside the sessions prices only need fetching once
+        if legs and (market_clock.is_active() or any(ltp_cache.get(leg['tradingsymbol']) is None for leg in legs)):
+            try:
+                get_option_quotes(request, legs)
+            except Exception:
+                pass  # Serve the last known prices
+
+        return JsonResponse({'success': True, **engine.snapshot()})
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'Failed to compute P&L',
+            'details': str(e)
+        }, status=500)
+
+
+@require_http_methods(["GET"])
+def portfolio_risk(request):
+    """Net quantity, premium at risk, delta exposure, breakevens and max loss per underlying"""
+    try:
+        kite = KiteApp(request=request)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated with Zerodha',
+            'details': str(e)
+        }, status=401)
+
+    try:
+        book = risk_books.get(_sl_owner(request))
+
+        # Reload the legs only when the positions snapshot itself changed,
+        # leg prices follow the LTP cache (the MTM poll quotes open legs)
+        state = kite.account_state()
+        version = state.version if state else int(time.time() // RECONCILE_INTERVAL)
+        if book.source_version != version:
+            book.load_snapshot(kite.positions().get('net', []), version)
+
+        # Delta needs the spot of every underlying held
+        for index in book.missing_spots():
+            try:
+                get_ltp(request, index)
+            except Exception:
+                pass  # Reported as an unknown delta
+
+        return JsonResponse({'success': True, **book.summary()})
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'Failed to compute risk',
+            'details': str(e)
+        }, status=500)
+
+
+@require_http_methods(["GET"])
+def option_chain(request):
+    """Option chain of an index with IV and Greeks for every strike"""
+    try:
+        index = request.GET.get('index', '').upper()
+        if not index:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Index parameter is required'
+            }, status=400)
+
+        expiry = request.GET.get('expiry') or None
+        try:
+            strikecount = max(1, min(int(request.GET.get('strikecount', 25)), 50))
+        except ValueError:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'strikecount must be a number'
+            }, status=400)
+
+        try:
+            chain = get_option_chain(request, index, expiry, strikecount)
+        except ValueError as e:
+            return JsonResponse({
+                'status': 'error',
+                'message': str(e)
+            }, status=400)
+
+        return JsonResponse({
+            'status': 'success',
+            'chain': chain
+        })
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Failed to get option chain: {str(e)}'
+        }, status=500)
+
+
+@require_http_methods(["GET"])
+def candles(request):
+    """OHLCV candles of an index or option for charts, served from the candle cache"""
+    try:
+        symbol = request.GET.get('symbol', '').upper()
+        if not symbol:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Symbol parameter is required'
+            }, status=400)
+
+        interval = request.GET.get('interval', '5').upper()
+        if interval not in DEFAULT_LOOKBACK_DAYS:
+            return JsonResponse({
+                'status': 'error',
+                'message': f"interval must be one of {', '.join(DEFAULT_LOOKBACK_DAYS)}"
+            }, status=400)
+        try:
+            days = int(request.GET.get('days', DEFAULT_LOOKBACK_DAYS[interval]))
+        except ValueError:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'days must be a number'
+            }, status=400)
+        days = max(1, min(days, MAX_LOOKBACK_DAYS[interval]))
+
+        try:
+            columns = candle_store.get(request, symbol, interval, time.time() - days * 86400)
+        except ValueError as e:
+            return JsonResponse({
+                'status': 'error',
+                'message': str(e)
+            }, status=400)
+        except Exception as e:
+            if is_upstream_unavailable(e):
+                return JsonResponse({
+                    'status': 'error',
+                    'error_code': e.error_code,
+                    'message': f'Failed to get {symbol} candles: {str(e)}'
+                }, status=503)
+            raise
+
+        return JsonResponse({
+            'status': 'success',
+            'symbol': symbol,
+            'interval': interval,
+            'candles': {name: column.tolist() for name, column in columns.items()}
+        })
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Failed to get candles: {str(e)}'
+        }, status=500)
+
+
+@require_http_methods(["GET"])
+def execution_stats(request):
+    """Per-day click-to-fill latency and slippage percentiles of the session's account"""
+    if not request.session.get('api_key') or not request.session.get('access_token'):
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated with Zerodha'
+        }, status=401)
+
+    account = session_account_id(request.session)
+    day = request.GET.get('date') or datetime.now(IST).strftime('%Y-%m-%d')
+    try:
+        datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'error': 'date must be in YYYY-MM-DD format'
+        }, status=400)
+
+    try:
+        # Orders whose postback never arrived get their fill from the order history
+        try:
+            kite = KiteApp(request=request)
+            completed = [order['order_id'] for order in kite.orders() if order.get('status') == 'COMPLETE']
+            execution_tracker.resolve_from_history(kite.kite, completed)
+        except Exception:
+            pass  # Serve what has already been recorded
+
+        response = {
+            'success': True,
+            'rollup': execution_tracker.daily_rollup(account, day)
+        }
+        if request.GET.get('records') == '1':
+            response['records'] = execution_tracker.records(account, day)
+        return JsonResponse(response)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': 'Failed to compute execution stats',
+            'details': str(e)
+        }, status=500)
+
+
+@require_http_methods(["GET"])
+def history_export(request):
+    """Order or trade history of the session's account for a date range, streamed as CSV or Parquet"""
+    account = _sl_owner(request)
+    if not account or not request.session.get('access_token'):
+        return JsonResponse({
+            'success': False,
+            'error': 'Not authenticated with Zerodha'
+        }, status=401)
+
+    kind = request.GET.get('kind') or ORDERS
+    export_format = request.GET.get('format') or 'csv'
+    if kind not in HISTORY_FIELDS or export_format not in ('csv', 'parquet'):
+        return JsonResponse({
+            'success': False,
+            'error': 'kind must be orders or trades and format csv or parquet'
+        }, status=400)
+
+    today = datetime.now(IST).date()
+    try:
+        end = date.fromisoformat(request.GET.get('to') or today.isoformat())
+        start = date.fromisoformat(request.GET.get('from') or end.isoformat())
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'error': 'from and to must be in YYYY-MM-DD format'
+        }, status=400)
+    if start > end or (end - start).days >= MAX_EXPORT_DAYS:
+        return JsonResponse({
+            'success': False,
+            'error': f'from must not be after to, and the range at most {MAX_EXPORT_DAYS} days'
+        }, status=400)
+
+    if export_format == 'parquet' and not parquet_available():
+        return JsonResponse({
+            'success': False,
+            'error': 'Parquet export is not available on this server',
+            'error_code': 'FORMAT_UNAVAILABLE',
+            'suggestion': 'Export as CSV, or install pyarrow on the server'
+        }, status=501)
+
+    if end >= today:
+        # Today's orders that completed since the last reconciliation are recorded now
+        try:
+            KiteApp(request=request).account_state()
+        except Exception:
+            pass  # Export what has already been recorded
+        order_history.flush()
+
+    chunks = order_history.chunks(account, kind, start, end)
+    if export_format == 'parquet':
+        response = StreamingHttpResponse(stream_parquet(kind, chunks), content_type='application/vnd.apache.parquet')
+    else:
+        response = StreamingHttpResponse(stream_csv(kind, chunks), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="quicktrade-{kind}-{start}-{end}.{export_format}"'
+    return response
+
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """Process metrics (breaker state, upstream calls) in the Prometheus text format, for staff or METRICS_TOKEN"""
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(METRICS_TOKEN) and hmac.compare_digest(authorization.encode('utf-8'),
+                                                          f"Bearer {METRICS_TOKEN}".encode('utf-8'))
+    if not token_ok and not request.user.is_staff:
+        return JsonResponse({
+            'success': False,
+            'error': 'Not allowed to read metrics',
+            'details': 'Sign in as a staff user or send the METRICS_TOKEN as a bearer token'
+        }, status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
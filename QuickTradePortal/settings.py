@@ -48,6 +48,7 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'QuickTradeApp.lanes.RequestLaneMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -81,6 +82,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Seconds a write waits for another process's write (the cache tables are written by every worker)
+            'timeout': 20,
+        },
     }
 }
 
@@ -135,15 +140,85 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Session settings - Using cache-based sessions (more reliable on Render)
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
-SESSION_CACHE_ALIAS = 'default'
+SESSION_CACHE_ALIAS = 'atomic'
 SESSION_COOKIE_AGE = 86400  # 24 hours
 
-# Cache configuration for sessions
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Caches shared by all worker processes (see QuickTradeApp/shared_cache.py).
+# 'default' holds reusable reads (single-flight slots, chains), where a write
+# lost to a racing worker only costs a miss. 'atomic' holds what must be exact
+# across workers: sessions, the order idempotency table, order state snapshots
+# and shared locks. Tables in the SQLite database (created by build.sh, or
+# `python manage.py createcachetable`), or Redis when REDIS_URL is set (needs
+# the redis package)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+        'atomic': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'KEY_PREFIX': 'atomic',
+        },
     }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'quicktrade_cache',
+            'OPTIONS': {
+                'MAX_ENTRIES': 100000,
+            },
+        },
+        'atomic': {
+            'BACKEND': 'QuickTradeApp.shared_cache.SharedDatabaseCache',
+            'LOCATION': 'quicktrade_atomic',
+            'OPTIONS': {
+                # Culling drops random keys, idempotency keys and sessions must not be among them
+                'MAX_ENTRIES': 100000,
+            },
+        },
+    }
+
+# Logging: JSON lines to stderr, broker calls to the audit files under data/audit/.
+# QuickTradeApp moves these handlers behind a queue written by a background thread
+# (QuickTradeApp/log_pipeline.py), so requests never wait on log I/O
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'QuickTradeApp.log_pipeline.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+        'broker_audit': {
+            '()': 'QuickTradeApp.broker_audit.AuditFileHandler',
+            'formatter': 'json',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.environ.get('LOG_LEVEL', 'INFO'),
+    },
+    'loggers': {
+        # Django's own records go through the root handler too, instead of Django's plain text ones
+        'django': {
+            'handlers': [],
+            'level': 'INFO',
+            'propagate': True,
+        },
+        'quicktrade.audit': {
+            'handlers': ['broker_audit'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 
 # Security settings for production
@@ -6,5 +6,8 @@ pip install -r requirements.txt
 
 python manage.py collectstatic --no-input
 
+# Cache tables shared by the worker processes (sessions, order idempotency, single-flight reads)
+python manage.py createcachetable
+
 # Create data directory for JSON storage
 mkdir -p data 
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+Gunicorn settings for QuickTradePortal (picked up automatically from the working directory)
+
+By default the app is loaded and warmed up once in the master, then frozen
+out of the garbage collector so forked workers share those pages
+copy-on-write and serve their first request warm. Set QUICKTRADE_PRELOAD=0
+to load the app in every worker instead (workers then warm up after fork).
+Bind address and worker count still come from PORT and WEB_CONCURRENCY.
+
+Workers serve requests on GUNICORN_THREADS threads each; the request lanes
+(QuickTradeApp/lanes.py) cap the threads polls can take so order requests
+always find a free one.
+"""
+import gc
+import os
+
+preload_app = os.environ.get('QUICKTRADE_PRELOAD', '1') != '0'
+
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '12'))
+
+
+def when_ready(server):
+    """Master is up, workers are not forked yet"""
+    if not preload_app:
+        return
+    from QuickTradeApp.startup import warm_up
+    server.log.info("Warm-up (ms): %s", warm_up())
+    # Objects alive now are never collected, so GC passes in the workers
+    # don't write to (and un-share) the master's pages
+    gc.collect()
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Worker is up: join the stop-loss evaluation, and warm up if it loaded the app itself"""
+    from QuickTradeApp.sl_monitor import sl_monitor
+    sl_monitor.start()
+    if preload_app:
+        return
+    from QuickTradeApp.startup import warm_up
+    worker.log.info("Warm-up (ms): %s", warm_up())